@@ -392,6 +392,10 @@ pub fn make_rpc(func_name: &str, input: String) -> String {
   else {
     url = String::from("http://router.fission.svc.cluster.local.:80/");
   }
+  // Set when the function runs under the local router emulator (test/harness).
+  if let Ok(router_url) = env::var("router-url") {
+    url = router_url;
+  }
   url.push_str(func_name);
 
   let mut input_to_be_sent = (&input).as_bytes();
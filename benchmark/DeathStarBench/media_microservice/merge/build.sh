@@ -10,21 +10,20 @@ CALLER=${ARGS[1]}
 FUNCTREE=${ARGS[2]}
 
 function merge_fission {
-  rm -rf temp && mkdir temp
+  # temp is kept between builds, so build_helper.py only stages crates that changed
+  mkdir -p temp
   ./build_helper.py $FUNCTREE
-  cp -r ../FissionRPC temp
-  cp -r ../DbInterface temp
-  mv temp/FissionRPC temp/OpenFaaSRPC
   cp merge.sh temp
+  cp ../../../merge_lib.sh temp
   cp merge_tree.py temp
   cp $FUNCTREE temp/funcTree
   cp rm_redundant_bc.py temp
   echo "$CALLER-merged" > temp/metadata.txt
-  sudo docker build --no-cache -t $USERNAME/mm-$CALLER-merged:latest \
+  sudo DOCKER_BUILDKIT=1 docker build --no-cache -t $USERNAME/mm-$CALLER-merged:latest \
     -f $DOCKERFILE_DIR/Dockerfile.fission \
     --build-arg USERNAME=$USERNAME \
+    --build-arg LLC_JOBS=${LLC_JOBS:-1} \
     temp
-  rm -rf temp
   sudo docker system prune -f
   sudo docker push $USERNAME/mm-$CALLER-merged:latest
 }
@@ -2,6 +2,10 @@
 import os
 import sys 
 
+# the crate staging is shared with benchmark/merge_pipeline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from merge_pipeline.staging import RUNTIME_CRATES, stage_crates
+
 def read_func_info(funcTree):
   f = open(funcTree, 'r')
   Lines = f.readlines()
@@ -13,9 +17,13 @@ def read_func_info(funcTree):
       if func not in funcs:
         funcs[func] = 1 
   print(funcs)
+  pairs = []
   for f in funcs.keys():
-    cmd = "cp -r ../functions/"+f+"/template/rust/function/ temp/"+f
-    os.system(cmd)
+    pairs.append(("../functions/"+f+"/template/rust/function", "temp/"+f))
+  # temp is kept between builds: drop what an earlier build staged or produced there
+  pairs += [("../"+src, "temp/"+name) for src, name in RUNTIME_CRATES]
+  staged = stage_crates(pairs, prune="temp")
+  print("staged "+str(staged)+" crates, "+str(len(pairs)-staged)+" up to date")
 def main():
   if len(sys.argv) < 2:
     print("usage: ./build_helper.py <funcTree file>")
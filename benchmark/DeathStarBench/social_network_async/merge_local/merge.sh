@@ -4,6 +4,10 @@ RUST_LIB=/users/zyuxuan/.rustup/toolchains/1.78-x86_64-unknown-linux-gnu/lib
 #RUST_LIB=/users/zyuxuan/.rustup/toolchains/stable-x86_64-unknown-linux-gnu/lib
 C_LIB=/lib/x86_64-linux-gnu
 WORK_DIR=target/x86_64-unknown-linux-gnu/release/deps
+# wrap_shared_lib and codegen live in benchmark/merge_lib.sh (copied next to merge.sh for image builds)
+MERGE_LIB=$(dirname $0)/merge_lib.sh
+[ -f $MERGE_LIB ] || MERGE_LIB=$(dirname $0)/../../../merge_lib.sh
+source $MERGE_LIB
 
 RUST_LIBRUSTC_PATH=$(ls $RUST_LIB/librustc_driver-*.so)
 RUST_LIBRUSTC_NAME=$(basename $RUST_LIBRUSTC_PATH)
@@ -96,32 +100,33 @@ function merge_existing {
 
 
 
-function wrap_shared_lib {
-  git clone https://github.com/yugr/Implib.so.git
-  cd Implib.so && ./implib-gen.py $RUST_LIBRUSTC_PATH 2>/dev/null \
-  && gcc -c *.S && gcc -c *.c && rm *.S *.c \
-  && ./implib-gen.py $C_LIB/libcrypto.so.1.1 2>/dev/null \
-  && gcc -c *.S && gcc -c *.c && rm *.S *.c \
-  && ./implib-gen.py $C_LIB/libssl.so.1.1 2>/dev/null \
-  && gcc -c *.S && gcc -c *.c && rm *.S *.c 
-
-  cd .. && cp Implib.so/*.o .  && rm -rf Implib.so
-}
+# the shared libraries that wrap_shared_lib wraps
+IMPLIB_LIBS="$RUST_LIBRUSTC_PATH $C_LIB/libcrypto.so.1.1 $C_LIB/libssl.so.1.1"
 
 
-function link {
+function link_ir {
   CALLER_FUNC=${ARGS[1]}
   $LLVM_DIR/llvm-link $WORK_DIR/*.bc -o lib_with_debug_info.bc
   $LLVM_DIR/opt lib_with_debug_info.bc -strip-debug -o lib.bc
   $LLVM_DIR/opt lib.bc -passes=strip-dead-prototypes -o func.bc
   $LLVM_DIR/opt func.bc -passes=remove-redundant -o function.bc
-  $LLVM_DIR/llc -filetype=obj -O3 --function-sections --data-sections function.bc -o function.o
-  wrap_shared_lib
+}
+
+
+function link_binary {
   #gcc -no-pie -flto -Wl,--strip-debug -Wl,--gc-sections -Wl,--as-needed -L$RUST_LIB *.o -o function $LINKER_FLAGS
   gcc -no-pie -flto -Wl,--strip-debug -Wl,--gc-sections -Wl,--as-needed *.o -o function $LINKER_FLAGS
 }
 
 
+function link {
+  link_ir || return 1
+  codegen || return 1
+  wrap_shared_lib || return 1
+  link_binary
+}
+
+
 function clean {
   for i in $(seq 1 $(($NUM_ARGS-1)) );
   do
@@ -158,10 +163,24 @@ remove_redundant_files)
 link)
     link
     ;;
+link_ir)
+    link_ir
+    ;;
+codegen)
+    codegen
+    ;;
+wrap_shared_lib)
+    wrap_shared_lib
+    ;;
+link_binary)
+    link_binary
+    ;;
 clean)
     clean
     ;;
 esac
+# the block comment below would otherwise reset the exit status to 0
+exit $?
 
 <<'###BLOCK-COMMENT'
 
@@ -1,6 +1,21 @@
-import sys
+import argparse
+import hashlib
 import json
 import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Function binaries are compiled in one cargo workspace per app under BUILD_DIR. Its target
+# directory is kept between runs, and the registry lives in a Docker volume, so only what
+# changed is recompiled and crates are downloaded once.
+BUILD_DIR = "build"
+HASHES = os.path.join("func_bin", ".hashes.json")
+REGISTRY_VOLUME = "quilt-cargo-registry"
+RUNTIME_CRATES = [("FissionRPC", "OpenFaaSRPC"), ("DbInterface", "DbInterface")]
 
 def check_and_create_directory():
   current_directory = os.getcwd()
@@ -12,35 +27,160 @@ def check_and_create_directory():
   else:
     print(f"Directory '{directory_name}' already exists.")
 
-def main(dir_name, file_path):
+def read_workflow(file_path):
+  with open(file_path, 'r') as file:
+    return [line.strip() for line in file if line.strip()]
+
+def crate_dir(app_dir, func_name):
+  return os.path.join(app_dir, "functions", func_name, "template", "rust", "function")
+
+def hash_tree(digest, path):
+  for root, dirs, files in os.walk(path):
+    dirs[:] = sorted(d for d in dirs if d != "target")
+    for name in sorted(files):
+      file_path = os.path.join(root, name)
+      digest.update(os.path.relpath(file_path, path).encode() + b"\0")
+      with open(file_path, 'rb') as f:
+        digest.update(f.read())
+
+def source_hash(app_dir, func_name, toolchain):
+  """Hash of everything a function binary is built from: its crate, the runtime crates and the toolchain."""
+  digest = hashlib.sha256(toolchain.encode())
+  hash_tree(digest, crate_dir(app_dir, func_name))
+  for src, _ in RUNTIME_CRATES:
+    if os.path.isdir(os.path.join(app_dir, src)):
+      hash_tree(digest, os.path.join(app_dir, src))
+  return digest.hexdigest()
+
+def has_own_profile(app_dir, func_name):
+  # Cargo ignores the [profile] of workspace members, so these crates are built on their own.
+  with open(os.path.join(crate_dir(app_dir, func_name), "Cargo.toml")) as f:
+    return any(line.startswith("[profile") for line in f)
+
+def stage(app_dir, funcs, dest, workspace):
+  for func_name in funcs:
+    shutil.rmtree(os.path.join(dest, func_name), ignore_errors=True)
+    shutil.copytree(crate_dir(app_dir, func_name), os.path.join(dest, func_name))
+  for src, name in RUNTIME_CRATES:
+    shutil.rmtree(os.path.join(dest, name), ignore_errors=True)
+    if os.path.isdir(os.path.join(app_dir, src)):
+      shutil.copytree(os.path.join(app_dir, src), os.path.join(dest, name))
+  if workspace:
+    with open(os.path.join(dest, "Cargo.toml"), "w") as f:
+      members = ", ".join(f'"{func_name}"' for func_name in funcs)
+      f.write(f"[workspace]\nmembers = [{members}]\nresolver = \"2\"\n")
+
+def cargo(build_dir, unit, manifest, target, jobs, image, docker):
+  """Runs one cargo build, on the host or in the rust-env image, yielding its JSON messages."""
+  args = ["cargo", "build", "--release", "-j", str(jobs), "--manifest-path", manifest,
+          "--message-format=json-render-diagnostics"]
+  if image is None:
+    env = dict(os.environ, CARGO_TARGET_DIR=os.path.join(build_dir, target))
+    proc = subprocess.Popen([a if a != manifest else os.path.join(build_dir, manifest) for a in args],
+                            stdout=subprocess.PIPE, text=True, env=env)
+  else:
+    script = " ".join(args) + f"; s=$?; chown -R {os.getuid()}:{os.getgid()} /home/rust/build; exit $s"
+    proc = subprocess.Popen(docker + ["run", "--rm", "-v", f"{os.path.abspath(build_dir)}:/home/rust/build",
+                                      "-v", f"{REGISTRY_VOLUME}:/root/.cargo/registry",
+                                      "-e", f"CARGO_TARGET_DIR=/home/rust/build/{target}",
+                                      "-w", "/home/rust/build", image, "sh", "-c", script],
+                            stdout=subprocess.PIPE, text=True)
+  for line in proc.stdout:
+    if line.startswith("{"):
+      yield json.loads(line)
+  if proc.wait() != 0:
+    raise RuntimeError(f"cargo build of {unit} failed with status {proc.returncode}")
+
+def build_unit(build_dir, unit, manifest, target, funcs, jobs, image, docker, start, ready):
+  try:
+    for message in cargo(build_dir, unit, manifest, target, jobs, image, docker):
+      name = message.get("target", {}).get("name")
+      if message.get("reason") == "compiler-artifact" and name in funcs and "bin" in message["target"]["kind"]:
+        ready[name] = (time.time() - start, os.path.join(build_dir, target, "release", name))
+  except RuntimeError as e:
+    print(f"Error: {e}")
+
+def install(func_name, binary):
+  # Same as the end of `build.sh fission_b`: tag the binary with its name and make it runnable.
+  metadata = f"func_bin/{func_name}.metadata"
+  with open(metadata, "w") as f:
+    f.write(func_name + "\n")
+  try:
+    subprocess.run(["objcopy", "--add-section", f".metadata={metadata}", binary, f"func_bin/{func_name}"], check=True)
+  finally:
+    os.remove(metadata)
+  os.chmod(f"func_bin/{func_name}", 0o777)
+
+def main(dir_name, file_path, jobs=None, local=False, force=False, docker="sudo docker"):
   check_and_create_directory()
   real_dirname = "../"+dir_name
   try:
-    with open(file_path, 'r') as file:
-      entry_func=""
-      for line in file:
-        func_name = line.strip()
-        if entry_func == "":
-          entry_func = func_name
-        sub_dir = real_dirname + "/functions/" + func_name
-        cmd = sub_dir + "/build.sh fission_b"
-        os.system(cmd) 
-        cmd = "mv "+func_name+" func_bin/"
-        os.system(cmd)
-      cmd = "cp func_bin/"+entry_func+" func_bin/userfunc"
-      os.system(cmd)
-      cmd = "sudo chown root:root func_bin/userfunc"
-      os.system(cmd)
-   
+    funcs = read_workflow(file_path)
   except FileNotFoundError:
     print(f"Error: The file {file_path} was not found.")
-  except Exception as e:
-    print(f"An error occurred: {e}")
+    return 1
+  entry_func = funcs[0]
+  jobs = jobs or os.cpu_count()
+  image = None if local else f"{os.environ.get('DOCKER_USER', '')}/rust-env:latest"
+  toolchain = "host" if local else image
+
+  hashes = {}
+  if os.path.exists(HASHES):
+    with open(HASHES) as f:
+      hashes = json.load(f)
+  current = {func_name: source_hash(real_dirname, func_name, toolchain) for func_name in funcs}
+  stale = [func_name for func_name in funcs
+           if force or hashes.get(func_name) != current[func_name] or not os.path.exists(f"func_bin/{func_name}")]
+
+  build_dir = os.path.join(BUILD_DIR, dir_name)
+  shared = [func_name for func_name in stale if not has_own_profile(real_dirname, func_name)]
+  units = []
+  if shared:
+    stage(real_dirname, shared, os.path.join(build_dir, "workspace"), workspace=True)
+    units.append(("workspace", "workspace/Cargo.toml", "target", shared))
+  for func_name in stale:
+    if func_name not in shared:
+      stage(real_dirname, [func_name], os.path.join(build_dir, "standalone"), workspace=False)
+      units.append((func_name, f"standalone/{func_name}/Cargo.toml", f"target-{func_name}", [func_name]))
+
+  start = time.time()
+  ready = {}
+  with ThreadPoolExecutor(max_workers=max(len(units), 1)) as pool:
+    for unit, manifest, target, unit_funcs in units:
+      pool.submit(build_unit, build_dir, unit, manifest, target, unit_funcs, jobs, image, shlex.split(docker),
+                  start, ready)
+
+  failed = []
+  for func_name in stale:
+    if func_name not in ready:
+      failed.append(func_name)
+      continue
+    install(func_name, ready[func_name][1])
+    hashes[func_name] = current[func_name]
+  with open(HASHES, "w") as f:
+    json.dump(hashes, f, indent=2)
+
+  if entry_func not in failed:
+    shutil.copy(f"func_bin/{entry_func}", "func_bin/userfunc")
+    os.system("sudo chown root:root func_bin/userfunc")
+
+  print(f"\n{'function':<40} {'status':<8} {'ready after (s)':>15}")
+  for func_name in funcs:
+    status = "cached" if func_name not in stale else "failed" if func_name in failed else "built"
+    seconds = f"{ready[func_name][0]:.1f}" if func_name in ready else "-"
+    print(f"{func_name:<40} {status:<8} {seconds:>15}")
+  print(f"{len(stale) - len(failed)} built, {len(funcs) - len(stale)} cached, {len(failed)} failed "
+        f"in {time.time() - start:.1f}s")
+  return 1 if failed else 0
 
 if __name__ == "__main__":
-  if len(sys.argv) != 3:
-    print("Usage: python gen_func.py social_network compose-post")
-  else:
-    dir_name = sys.argv[1]
-    file_path = "workflows/"+sys.argv[2]
-    main(dir_name, file_path)
+  parser = argparse.ArgumentParser(description="Build the function binaries of a workflow into func_bin.",
+                                   usage="python gen_func.py social_network compose-post")
+  parser.add_argument("dir_name", help="app directory, e.g. social_network")
+  parser.add_argument("workflow", help="workflow file under workflows/, e.g. compose-post")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="parallel compile jobs (default: one per CPU)")
+  parser.add_argument("--local", action="store_true", help="build with the host's cargo instead of the rust-env image")
+  parser.add_argument("--force", action="store_true", help="rebuild functions whose sources did not change")
+  parser.add_argument("--docker", default="sudo docker", help="docker command")
+  args = parser.parse_args()
+  sys.exit(main(args.dir_name, "workflows/"+args.workflow, args.jobs, args.local, args.force, args.docker))
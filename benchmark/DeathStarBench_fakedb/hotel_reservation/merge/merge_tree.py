@@ -1,8 +1,29 @@
 #!/usr/bin/env python3
 import os
 import sys 
+import time
 import json
 
+def link_steps(entry_func):
+  # the sub-steps of `merge.sh link`, run one by one to report how long each takes
+  # the first step that fails stops the link, and merge_tree.py exits with an error
+  timings = []
+  status = 0
+  for step in ["link_ir", "codegen", "wrap_shared_lib", "link_binary"]:
+    cmd = "./merge.sh "+step+" "+entry_func
+    print(cmd)
+    start = time.time()
+    status = os.system(cmd)
+    timings.append((step, time.time() - start))
+    if status != 0:
+      print("[link] "+step+" failed")
+      break
+  for step, seconds in timings:
+    print("[link] "+step+": "+"%.2f" % seconds+"s")
+  if status != 0:
+    sys.exit(1)
+
+
 def compile_to_bitcode(f_name):
   f = open(f_name, 'r')
   Lines = f.readlines()
@@ -98,9 +119,7 @@ def link(f_name):
     if len(words) > 0:
       entry_func = words[0]
   # link
-  cmd = "./merge.sh link " + entry_func
-  print(cmd)
-  os.system(cmd)
+  link_steps(entry_func)
 
 
 def clean(f_name):
@@ -3,6 +3,10 @@ import os
 import sys 
 import json
 
+# the crate staging is shared with benchmark/merge_pipeline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from merge_pipeline.staging import RUNTIME_CRATES, stage_crates
+
 def read_func_info(json_file, funcTree):
   f = open(funcTree, 'r')
   Lines = f.readlines()
@@ -14,12 +18,17 @@ def read_func_info(json_file, funcTree):
       if func not in funcs:
         funcs[func] = 1 
   print(funcs)
+  pairs = []
   with open(json_file) as json_file:
     func_info = json.load(json_file)
     for item in func_info:
       if item['function_name'] in funcs:
-        cmd = "cp -r ../cluster-"+str(item['cluster_id'])+"/"+item['function_name']+"/template/rust/function/ temp/"+item['function_name']
-        os.system(cmd)
+        src = "../cluster-"+str(item['cluster_id'])+"/"+item['function_name']+"/template/rust/function"
+        pairs.append((src, "temp/"+item['function_name']))
+  # temp is kept between builds: drop what an earlier build staged or produced there
+  pairs += [("../"+src, "temp/"+name) for src, name in RUNTIME_CRATES]
+  staged = stage_crates(pairs, prune="temp")
+  print("staged "+str(staged)+" crates, "+str(len(pairs)-staged)+" up to date")
 def main():
   if len(sys.argv) < 3:
     print("usage: ./build_helper.py <json file> <funcTree file>")
@@ -1,10 +1,35 @@
 #!/usr/bin/env python3
 import os
 import sys 
+import time
 import json
 import subprocess
 from multiprocessing import Pool
 
+# the crate staging is shared with benchmark/merge_pipeline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from merge_pipeline.staging import stage_crates
+
+def link_steps(entry_func):
+  # the sub-steps of `merge.sh link`, run one by one to report how long each takes
+  # the first step that fails stops the link, and merge_tree.py exits with an error
+  timings = []
+  status = 0
+  for step in ["link_ir", "codegen", "wrap_shared_lib", "link_binary"]:
+    cmd = "./merge.sh "+step+" "+entry_func
+    print(cmd)
+    start = time.time()
+    status = os.system(cmd)
+    timings.append((step, time.time() - start))
+    if status != 0:
+      print("[link] "+step+" failed")
+      break
+  for step, seconds in timings:
+    print("[link] "+step+": "+"%.2f" % seconds+"s")
+  if status != 0:
+    sys.exit(1)
+
+
 def run_command(cmd):
   process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
   stdout, stderr = process.communicate()
@@ -24,12 +49,15 @@ def move_functions(json_file):
       if func not in funcs:
         funcs[func] = 1 
   print(funcs)
+  pairs = []
   with open(json_file) as json_file:
     func_info = json.load(json_file)
     for item in func_info:
       if item['function_name'] in funcs:
-        cmd = "cp -r ../cluster-"+str(item['cluster_id'])+"/"+item['function_name']+"/template/rust/function "+item['function_name']
-        os.system(cmd)
+        src = "../cluster-"+str(item['cluster_id'])+"/"+item['function_name']+"/template/rust/function"
+        pairs.append((src, item['function_name']))
+  staged = stage_crates(pairs)
+  print("staged "+str(staged)+" functions, "+str(len(pairs)-staged)+" up to date")
 
 
 
@@ -117,9 +145,7 @@ def merge(f_name):
     else:
       cmd = "./merge.sh merge_existing "+entry_func+" "+callee+" "+caller
   # link
-  cmd = "./merge.sh link " + entry_func
-  print(cmd)
-  os.system(cmd)
+  link_steps(entry_func)
 
 
 
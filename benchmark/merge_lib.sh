@@ -0,0 +1,71 @@
+#!/bin/bash
+# Link-step functions shared by the per-app merge.sh scripts, which source this file.
+# They use LLVM_DIR and WORK_DIR of the sourcing script. build.sh copies it next to
+# merge.sh into the build context of image builds.
+
+IMPLIB_CACHE=${IMPLIB_CACHE:-$HOME/.cache/quilt/implib}
+
+
+# generates Implib.so wrappers for the shared libraries in IMPLIB_LIBS; the wrapper
+# objects are cached in IMPLIB_CACHE under the hash of the wrapped libraries
+function wrap_shared_lib {
+  LIBS=$IMPLIB_LIBS
+  KEY=$(cat $LIBS | sha256sum | cut -c1-16)
+  if [ -d $IMPLIB_CACHE/$KEY ]; then
+    cp $IMPLIB_CACHE/$KEY/*.o .
+    return
+  fi
+  git clone https://github.com/yugr/Implib.so.git && cd Implib.so || return 1
+  OK=1
+  for LIB in $LIBS; do
+    ./implib-gen.py $LIB 2>/dev/null && gcc -c *.S && gcc -c *.c && rm *.S *.c || OK=0
+  done
+  cd .. && cp Implib.so/*.o .
+  if [ $OK = 1 ]; then
+    mkdir -p $IMPLIB_CACHE && TMP=$(mktemp -d -p $IMPLIB_CACHE) && cp Implib.so/*.o $TMP \
+      && (mv -T $TMP $IMPLIB_CACHE/$KEY 2>/dev/null || rm -rf $TMP)
+  fi
+  rm -rf Implib.so
+}
+
+
+# LLC_JOBS > 1 splits the module with llvm-split and runs llc on the parts in parallel
+function codegen {
+  LLC_JOBS=${LLC_JOBS:-1}
+  rm -f function.o function.part*
+  if [ "$LLC_JOBS" -gt 1 ]; then
+    $LLVM_DIR/llvm-split -j $LLC_JOBS function.bc -o function.part
+    PIDS=()
+    for i in $(seq 0 $(($LLC_JOBS-1))); do
+      $LLVM_DIR/llc -filetype=obj -O3 --function-sections --data-sections function.part$i -o function.part$i.o &
+      PIDS+=($!)
+    done
+    for PID in ${PIDS[@]}; do
+      wait $PID || return 1
+    done
+    for i in $(seq 0 $(($LLC_JOBS-1))); do
+      rm function.part$i
+    done
+  else
+    $LLVM_DIR/llc -filetype=obj -O3 --function-sections --data-sections function.bc -o function.o
+  fi
+}
+
+
+# runs llc on every module in WORK_DIR instead of one linked function.bc,
+# LLC_JOBS modules at a time (merge_local_async)
+function codegen_modules {
+  LLC_JOBS=${LLC_JOBS:-1}
+  PIDS=()
+  for FILE in $WORK_DIR/*.bc; do
+    $LLVM_DIR/llc -filetype=obj -O3 --function-sections --data-sections $FILE -o ${FILE%.bc}.o &
+    PIDS+=($!)
+    while [ $(jobs -rp | wc -l) -ge $LLC_JOBS ]; do
+      wait -n
+    done
+  done
+  for PID in ${PIDS[@]}; do
+    wait $PID || return 1
+  done
+  mv $WORK_DIR/*.o .
+}
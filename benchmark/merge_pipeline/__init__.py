@@ -0,0 +1,14 @@
+"""
+Unified merge pipeline for Quilt workflows.
+
+One implementation of the compile / merge / link steps that used to be copied
+into every `merge*` directory as `merge_tree.py`, `merge.sh`,
+`rm_redundant_bc.py` and `build_helper.py`.
+"""
+from .functree import FuncTree
+from .strategies import (MergeStrategy, STRATEGIES, get_strategy, infer_strategy, infer_cargo_toolchain,
+                         infer_std_features)
+from .toolchain import Toolchain, Workspace, ImplibCache
+from .staging import stage_functions, stage_runtime_crates
+from .batch import SharedCompile, run_batch, write_manifest, read_manifest, workspace_name
+from .build import BuildJob, BuildResult, Builder, check_unique, jobs_from_manifest, stage_build_context
@@ -0,0 +1,120 @@
+import argparse
+import os
+import sys
+
+from .batch import read_manifest, run_batch
+from .build import Builder, BuildJob, jobs_from_manifest
+from .functree import FuncTree
+from .strategies import STRATEGIES, get_strategy
+from .toolchain import Toolchain, Workspace
+
+
+def run_step(args):
+    """Runs a single pipeline step in the current directory (drop-in for `merge_tree.py <step> funcTree`)."""
+    tree = FuncTree.from_file(args.funcTree)
+    ws = Workspace(os.getcwd(), toolchain=Toolchain(codegen_jobs=args.codegen_jobs), app_dir=args.app_dir,
+                   cargo_toolchain=args.cargo_toolchain, std_features=args.std_features)
+    getattr(tree, args.step)(get_strategy(args.strategy), ws)
+    for step, seconds in ws.timings:
+        print(f"[{args.step}] {step}: {seconds:.2f}s")
+
+
+def run_build(args):
+    jobs = [BuildJob(path, strategy=args.strategy) for path in args.funcTrees]
+    if args.manifest:
+        jobs += jobs_from_manifest(args.manifest)
+    if args.cargo_toolchain:
+        for job in jobs:
+            job.cargo_toolchain = args.cargo_toolchain
+    if args.std_features is not None:
+        for job in jobs:
+            job.std_features = args.std_features
+    if not jobs:
+        print("Nothing to build: pass funcTree files or --manifest.")
+        return 1
+    builder = Builder(user=args.user, workers=args.jobs, build_root=args.build_root,
+                      push=args.push, docker=args.docker, toolchain=Toolchain(codegen_jobs=args.codegen_jobs))
+    try:
+        results = builder.build_batch(jobs) if args.batch else builder.build(jobs)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    print(f"\n{'='*25} Build Summary {'='*25}")
+    for res in results:
+        status = "OK" if res.ok else f"FAILED ({res.error})"
+        print(f"{res.job.app_name}/{res.job.tree.name} [{res.job.strategy.name}]: {status} in {res.duration:.1f}s")
+        if res.ok:
+            print(f"  -> {res.target}")
+        for step, seconds in res.timings:
+            print(f"     {step}: {seconds:.2f}s")
+    return 0 if all(r.ok for r in results) else 1
+
+
+def run_batch_manifest(args):
+    """Builds the workflows of a staged batch context (runs inside the compiler image)."""
+    jobs = read_manifest(args.manifest)
+    builder = Builder(workers=args.jobs, build_root=args.build_root)
+    failed = 0
+    for job, binary, timings, error in run_batch(jobs, builder.build_root, builder.toolchain, builder.implib_cache,
+                                                 builder.workers, out_dir=os.path.abspath(args.out)):
+        if error is not None:
+            failed += 1
+            print(f"{job.image_name}: FAILED ({error})")
+            continue
+        print(f"{job.image_name}: {binary}")
+        for step, seconds in timings:
+            print(f"     {step}: {seconds:.2f}s")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m merge_pipeline",
+                                     description="Compile, merge and link Quilt workflows.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for step in ("compile", "merge", "link", "clean"):
+        p = sub.add_parser(step, help=f"run the {step} step on a funcTree in the current directory")
+        p.add_argument("funcTree")
+        p.add_argument("--strategy", default="sync", choices=sorted(STRATEGIES))
+        p.add_argument("--app-dir", default=None, help="app directory with FissionRPC/DbInterface (local strategies)")
+        p.add_argument("--codegen-jobs", type=int, default=None,
+                       help="partitions llc compiles in parallel (default: $QUILT_CODEGEN_JOBS or 1)")
+        p.add_argument("--cargo-toolchain", default=None, help="rustup toolchain, e.g. +nightly (default: the strategy's)")
+        p.add_argument("--std-features", default=None,
+                       help="-Z build-std-features, e.g. optimize_for_size, '' for none (default: the strategy's)")
+        p.set_defaults(func=run_step, step=step)
+
+    p = sub.add_parser("build", help="build merged images for many funcTrees at once")
+    p.add_argument("funcTrees", nargs="*", help="funcTree files, e.g. DeathStarBench_fakedb/*/merge/funcTrees/*")
+    p.add_argument("--manifest", default=None, help="merge plan manifest written by merge_solver/export_plan.py")
+    p.add_argument("--strategy", default=None, choices=sorted(STRATEGIES),
+                   help="override the strategy inferred from each funcTree's merge directory")
+    p.add_argument("-j", "--jobs", type=int, default=None, help="number of workflows built concurrently")
+    p.add_argument("--user", default=None, help="Docker Hub user (default: $DOCKER_USER)")
+    p.add_argument("--build-root", default="build", help="directory for workspaces and shared caches")
+    p.add_argument("--push", action="store_true")
+    p.add_argument("--docker", default="sudo docker")
+    p.add_argument("--codegen-jobs", type=int, default=None,
+                   help="partitions llc compiles in parallel in every link (default: $QUILT_CODEGEN_JOBS or 1)")
+    p.add_argument("--cargo-toolchain", default=None,
+                   help="rustup toolchain, e.g. +nightly (default: the one of each app's legacy merge.sh)")
+    p.add_argument("--std-features", default=None,
+                   help="-Z build-std-features, '' for none (default: the ones of each app's legacy merge.sh)")
+    p.add_argument("--batch", action="store_true",
+                   help="compile the functions shared by the funcTrees once, then merge and link each workflow")
+    p.set_defaults(func=run_build)
+
+    p = sub.add_parser("batch-run", help="build the workflows of a batch manifest (used by build --batch)")
+    p.add_argument("manifest")
+    p.add_argument("-j", "--jobs", type=int, default=None)
+    p.add_argument("--out", default="out", help="where each workflow's userfunc binary is written")
+    p.add_argument("--build-root", default="build")
+    p.set_defaults(func=run_batch_manifest)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
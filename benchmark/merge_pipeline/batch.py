@@ -0,0 +1,315 @@
+import collections
+import json
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .functree import FuncTree
+from .staging import RUNTIME_CRATES, link_or_copy, reset_workspace, stage_functions, stage_runtime_crates
+from .strategies import get_strategy
+from .toolchain import Workspace
+
+BENCHMARK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def app_id_of(app_dir):
+    """
+    Identifies an app by its path relative to `benchmark/`, e.g. `DeathStarBench_fakedb/social_network`,
+    since several suites have an app of the same name. Apps outside `benchmark/` keep their absolute path.
+    """
+    path = os.path.abspath(app_dir)
+    rel = os.path.relpath(path, BENCHMARK_DIR)
+    return path if rel.split(os.sep)[0] == os.pardir else rel
+
+
+def _flat(app_id):
+    return app_id.strip(os.sep).replace(os.sep, "-")
+
+
+def workspace_name(job):
+    """
+    The name of a job's workspace under the build root: its app (see `app_id_of`),
+    funcTree, strategy and rustup toolchain.
+
+    Trees are told apart by name rather than by entry function, since several
+    funcTrees of an app may start at the same function.
+    """
+    return "-".join([_flat(job.app_id), job.tree.name or job.caller, job.strategy.name,
+                     job.cargo_toolchain or "default"])
+
+
+def group_key(job):
+    """The jobs that share one compile in `run_batch`: same app, strategy, rustup toolchain and std features."""
+    return job.app_id, job.strategy.name, job.cargo_toolchain, job.std_features
+
+
+def shared_workspace_name(job):
+    """The name of the workspace of the shared compile of a job's group (see `group_key`)."""
+    return "-".join([_flat(job.app_id), job.strategy.name, job.cargo_toolchain or "default", "shared"])
+
+
+def context_app_dir(base_dir, app_id):
+    """Where a batch context holds the crates of an app."""
+    return os.path.join(base_dir, "apps", app_id.lstrip(os.sep))
+
+
+def workspace_config(strategy, cargo_toolchain, std_features, toolchain):
+    """What a persistent workspace is staged for; one staged for anything else is started afresh."""
+    return {"strategy": strategy.name, "cargo_toolchain": cargo_toolchain, "std_features": std_features,
+            "llvm_dir": toolchain.llvm_dir, "rust_lib": toolchain.rust_lib, "c_lib": toolchain.c_lib}
+
+
+def staged_crates(functions):
+    """The crates a workspace for `functions` keeps between builds."""
+    return list(functions) + [name for _, name in RUNTIME_CRATES]
+
+
+def crate_of(module):
+    """The crate name of a bitcode module in deps, e.g. `serde_json` for `serde_json-0a1b2c.bc`."""
+    return module.split(".")[0].rsplit("-", 1)[0]
+
+
+def dependency_closures(unit_graph, functions):
+    """
+    Maps each function to the crate names its binary is built from (its own included),
+    following the dependencies in cargo's unit graph (see `MergeStrategy.unit_graph`).
+    """
+    units = unit_graph["units"]
+    closures = {}
+    for func in functions:
+        stack = [i for i, unit in enumerate(units)
+                 if unit["target"]["name"] == func and "bin" in unit["target"]["kind"]]
+        seen = set(stack)
+        while stack:
+            for dep in units[stack.pop()]["dependencies"]:
+                if dep["index"] not in seen:
+                    seen.add(dep["index"])
+                    stack.append(dep["index"])
+        closures[func] = {units[i]["target"]["name"].replace("-", "_") for i in seen}
+    return closures
+
+
+class SharedCompile:
+    """
+    Compiles the union of the functions of several funcTrees once.
+
+    All trees must belong to the same app and strategy, since they share the
+    RPC crates and the compiler flags. The resulting deps directory is then
+    forked into one workspace per tree with `fork`, which leaves out the
+    bitcode that only other trees need, so that `llvm-link` in the link step
+    reads no more modules than in a per-tree build.
+    """
+
+    def __init__(self, path, trees, strategy, toolchain, implib_cache=None, app_dir=None, log=print,
+                 cargo_toolchain=None, std_features=None):
+        self.trees = list(trees)
+        self.strategy = strategy
+        # Each workspace gets its own target dir, even if the image sets CARGO_TARGET_DIR.
+        self.workspace = Workspace(path, toolchain=toolchain, app_dir=app_dir, implib_cache=implib_cache,
+                                   target_dir=os.path.join(path, "target"), log=log,
+                                   cargo_toolchain=cargo_toolchain, std_features=std_features)
+
+        # A synthetic tree rooted at a placeholder whose members are the union of all functions.
+        functions = []
+        for tree in self.trees:
+            functions += [f for f in tree.functions if f not in functions]
+        self.functions = functions
+        self.closures = None
+
+    def cargo_workspace(self):
+        members = ", ".join(f'"{f}"' for f in self.functions)
+        return "[workspace]\n" + f"members = [{members}]"
+
+    def compile(self):
+        ws = self.workspace
+        # Image builds normally get the runtime crates from the Docker context; here they are staged too.
+        if ws.app_dir:
+            stage_runtime_crates(ws.app_dir, ws.path)
+        union = _UnionTree(self.functions, self.cargo_workspace())
+        ws.timed("compile", self.strategy.compile, union, ws)
+        try:
+            graph = ws.timed("unit-graph", self.strategy.unit_graph, ws)
+            self.closures = dependency_closures(graph, self.functions)
+        except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+            # Forks then keep every dependency; they link more modules but the same binary.
+            ws.log(f"No unit graph ({e}); forks keep the dependencies of all trees.")
+
+    def fork(self, tree, path):
+        """
+        Creates a workspace for `tree` whose deps hold the shared bitcode minus
+        the entry modules of functions that are not part of `tree`, and minus the
+        crates that only those functions depend on (if the unit graph is known).
+        Crates that no function depends on, like the allocator shim in
+        `function_keep.bc` and anything the unit graph does not name, are kept.
+        Modules are matched by crate name, so a second version of a crate
+        that the tree needs is kept as well.
+
+        Bitcode is hardlinked when possible. The merge steps only ever replace
+        files, so the shared copy is never modified.
+        """
+        shared = self.workspace
+        ws = Workspace(path, toolchain=shared.toolchain, app_dir=shared.app_dir, implib_cache=shared.implib_cache,
+                       target_dir=os.path.join(path, "target"), log=shared.log)
+        os.makedirs(ws.deps_dir, exist_ok=True)
+
+        foreign = set()
+        for func in self.functions:
+            if func not in tree.functions:
+                foreign.add(os.path.basename(self.strategy.find_ir(shared, func)))
+        unused = set()
+        if self.closures is not None:
+            needed = set().union(*(self.closures[f] for f in tree.functions))
+            unused = set().union(*(c for f, c in self.closures.items() if f not in tree.functions)) - needed
+
+        modules = [name for name in os.listdir(shared.deps_dir) if name.endswith(".bc")]
+        kept = [name for name in modules if name not in foreign and crate_of(name) not in unused]
+        for name in kept:
+            link_or_copy(os.path.join(shared.deps_dir, name), os.path.join(ws.deps_dir, name))
+        ws.log(f"{tree.name or tree.entry}: {len(kept)} of {len(modules)} shared modules")
+        return ws
+
+
+class _UnionTree:
+    """Just enough of a FuncTree for `MergeStrategy.compile` on a union of functions."""
+
+    def __init__(self, functions, cargo_toml):
+        self.functions = functions
+        self._cargo_toml = cargo_toml
+
+    def cargo_workspace(self):
+        return self._cargo_toml
+
+
+def run_batch(jobs, build_root, toolchain, implib_cache, workers=None, out_dir=None, log=print):
+    """
+    Builds a batch of workflows with one compile per group of jobs (see `group_key`).
+
+    1. The union of the functions of each group is compiled once.
+    2. The Implib wrappers are generated once through the shared cache.
+    3. Every workflow is merged and linked concurrently in its own fork.
+
+    Args:
+        jobs (list): `BuildJob`-like objects with `tree`, `strategy`, `app_dir`, `app_id`, `caller`
+                     `cargo_toolchain` and `std_features`.
+        build_root (str): Directory for the shared and per-workflow workspaces.
+        out_dir (str, optional): If set, each binary is written with its metadata section
+                                 to `out_dir/<image name>/userfunc`.
+
+    Returns:
+        list: `(job, binary path or None, timings, error or None)` in input order.
+    """
+    os.makedirs(build_root, exist_ok=True)
+    groups = collections.OrderedDict()
+    for job in jobs:
+        groups.setdefault(group_key(job), []).append(job)
+
+    def compile_group(key):
+        _, strategy_name, cargo_toolchain, std_features = key
+        app_dir = groups[key][0].app_dir
+        path = os.path.join(build_root, shared_workspace_name(groups[key][0]))
+        strategy = get_strategy(strategy_name)
+        shared = SharedCompile(path, [j.tree for j in groups[key]], strategy,
+                               toolchain, implib_cache=implib_cache, app_dir=app_dir, log=log,
+                               cargo_toolchain=cargo_toolchain, std_features=std_features)
+        reset_workspace(path, workspace_config(strategy, cargo_toolchain, std_features, toolchain),
+                        staged_crates(shared.functions))
+        stage_functions(app_dir, shared.functions, path)
+        shared.compile()
+        return shared
+
+    def merge_and_link(item):
+        job, shared = item
+        start = time.time()
+        if isinstance(shared, Exception):
+            return job, None, [], shared
+        try:
+            path = os.path.join(build_root, workspace_name(job))
+            # A fork holds only build output (hardlinked bitcode), so nothing in it is reused.
+            shutil.rmtree(path, ignore_errors=True)
+            ws = shared.fork(job.tree, path)
+            ws.timings.extend(shared.workspace.timings)
+            ws.timed("merge", job.tree.merge, job.strategy, ws)
+            ws.timed("link", job.tree.link, job.strategy, ws)
+            binary = ws.join("function")
+            if out_dir:
+                # Same as the last step of Dockerfile.fission.
+                dest = os.path.join(out_dir, job.image_name)
+                os.makedirs(dest, exist_ok=True)
+                with open(os.path.join(dest, "metadata.txt"), "w") as f:
+                    f.write(f"{job.caller}-merged\n")
+                subprocess.run(["objcopy", "--add-section", f".metadata={dest}/metadata.txt",
+                                binary, os.path.join(dest, "userfunc")], check=True)
+                binary = os.path.join(dest, "userfunc")
+            ws.timings.append(("total", time.time() - start))
+            return job, binary, ws.timings, None
+        except Exception as e:
+            return job, None, [], e
+
+    workers = workers or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        compiled = {}
+        for key, fut in [(k, pool.submit(compile_group, k)) for k in groups]:
+            try:
+                compiled[key] = fut.result()
+            except Exception as e:
+                compiled[key] = e
+
+        # All groups that share a strategy need the same wrappers: build them once up front.
+        for key, shared in compiled.items():
+            if not isinstance(shared, Exception) and implib_cache is not None:
+                libs = toolchain.shared_libraries(shared.strategy.implib_libraries)
+                implib_cache.objects(libs, log=log)
+
+        items = [(job, compiled[group_key(job)]) for job in jobs]
+        return list(pool.map(merge_and_link, items))
+
+
+def write_manifest(jobs, path, tree_dir="funcTrees"):
+    """
+    Writes a batch manifest and the funcTrees it refers to next to it.
+
+    Each entry names the funcTree (relative to the manifest), the app (see
+    `app_id_of`), the strategy, the entry function and the image name.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    os.makedirs(os.path.join(base, tree_dir), exist_ok=True)
+    entries = []
+    for i, job in enumerate(jobs):
+        rel = os.path.join(tree_dir, f"{i:03d}.{job.tree.name or job.caller}")
+        with open(os.path.join(base, rel), "w") as f:
+            f.write(job.tree.dumps())
+        entries.append({
+            "funcTree": rel,
+            "app": job.app_id,
+            "strategy": job.strategy.name,
+            "caller": job.caller,
+            "image": job.image_name,
+            "cargo_toolchain": job.cargo_toolchain,
+            "std_features": job.std_features,
+        })
+    with open(path, "w") as f:
+        json.dump({"workflows": entries}, f, indent=2)
+
+
+class ManifestJob:
+    """A build job read back from a manifest inside a staged batch context."""
+
+    def __init__(self, entry, base_dir):
+        self.tree = FuncTree.from_file(os.path.join(base_dir, entry["funcTree"]))
+        self.strategy = get_strategy(entry["strategy"])
+        self.app_id = entry["app"]
+        self.app_name = os.path.basename(self.app_id)
+        self.app_dir = context_app_dir(base_dir, self.app_id)
+        self.caller = entry.get("caller", self.tree.entry)
+        self.image_name = entry.get("image", self.caller)
+        self.cargo_toolchain = entry.get("cargo_toolchain")
+        self.std_features = entry.get("std_features")
+
+
+def read_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        data = json.load(f)
+    return [ManifestJob(entry, base) for entry in data["workflows"]]
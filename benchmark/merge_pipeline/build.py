@@ -0,0 +1,328 @@
+import glob
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .batch import (run_batch, write_manifest, workspace_name, workspace_config, staged_crates, app_id_of,
+                    context_app_dir, group_key, shared_workspace_name)
+from .functree import FuncTree
+from .staging import reset_workspace, stage_functions, stage_runtime_crates
+from .strategies import get_strategy, infer_strategy, infer_cargo_toolchain, infer_std_features
+from .toolchain import Toolchain, Workspace, ImplibCache
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(PACKAGE_DIR))
+DOCKERFILE = os.path.join(REPO_ROOT, "dockerfiles", "LLVM", "Dockerfile.pipeline")
+USERFUNC_DOCKERFILE = os.path.join(REPO_ROOT, "dockerfiles", "LLVM", "Dockerfile.userfunc")
+
+# Files the fission-env image needs from the compiler image (see Dockerfile.fission).
+RUNTIME_FILES = ["/usr/bin/readelf", "/usr/lib/x86_64-linux-gnu/libctf-nobfd.so.0"]
+
+# Image name prefixes used by the per-app build.sh scripts.
+APP_PREFIXES = {
+    "social_network": "sn",
+    "media_microservice": "mm",
+    "hotel_reservation": "hr",
+}
+
+
+class BuildJob:
+    """
+    One merged image to build: a funcTree file plus the app and strategy it belongs to.
+
+    The app directory and strategy are derived from where the funcTree lives,
+    e.g. `DeathStarBench_fakedb/social_network_async/merge/funcTrees/funcTree.compose_post`
+    is built from the `social_network_async` functions with the async strategy.
+    Unless given, the rustup toolchain and std features are the ones the app's
+    legacy `merge.sh` for that strategy uses.
+    """
+
+    def __init__(self, tree_path, strategy=None, app_dir=None, caller=None, cargo_toolchain=None,
+                 std_features=None):
+        self.tree_path = os.path.abspath(tree_path)
+        self.tree = FuncTree.from_file(self.tree_path)
+
+        merge_dir = os.path.dirname(self.tree_path)
+        if os.path.basename(merge_dir) == "funcTrees":
+            merge_dir = os.path.dirname(merge_dir)
+        self.app_dir = os.path.abspath(app_dir) if app_dir else os.path.dirname(merge_dir)
+        self.strategy = get_strategy(strategy) if isinstance(strategy, str) else (strategy or infer_strategy(merge_dir))
+        self.caller = caller or self.tree.entry
+        self.cargo_toolchain = cargo_toolchain or self._legacy(merge_dir, infer_cargo_toolchain)
+        self.std_features = std_features if std_features is not None else self._legacy(merge_dir, infer_std_features)
+
+    def __repr__(self):
+        return f"BuildJob({self.app_name}/{self.tree.name}, {self.strategy.name})"
+
+    def _legacy(self, merge_dir, infer):
+        """What `infer` reads from the first legacy merge directory of the app with this job's strategy."""
+        for candidate in [merge_dir] + sorted(glob.glob(os.path.join(self.app_dir, "merge*"))):
+            if infer_strategy(candidate) is self.strategy:
+                value = infer(candidate)
+                if value is not None:
+                    return value
+        return None
+
+    @property
+    def app_name(self):
+        return os.path.basename(self.app_dir)
+
+    @property
+    def app_id(self):
+        return app_id_of(self.app_dir)
+
+    @property
+    def image_prefix(self):
+        base = self.app_name[:-len("_async")] if self.app_name.endswith("_async") else self.app_name
+        return APP_PREFIXES.get(base, base)
+
+    @property
+    def image_name(self):
+        suffix = "-async-merged" if self.strategy.is_async else "-merged"
+        return f"{self.image_prefix}-{self.caller}{suffix}"
+
+    def image_tag(self, user):
+        return f"{user}/{self.image_name}:latest"
+
+
+def jobs_from_manifest(path):
+    """
+    Reads the `BuildJob`s of a merge plan manifest (see `merge_solver/export_plan.py`).
+
+    Paths in the manifest are relative to it. Entries without a strategy get the
+    one inferred from their app directory.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        data = json.load(f)
+    jobs = []
+    for entry in data["workflows"]:
+        app_dir = os.path.join(base, entry["app_dir"]) if "app_dir" in entry else None
+        strategy = entry.get("strategy")
+        if strategy is None and app_dir:
+            strategy = infer_strategy(os.path.join(app_dir, "merge"))
+        jobs.append(BuildJob(os.path.join(base, entry["funcTree"]), strategy=strategy,
+                             app_dir=app_dir, caller=entry.get("caller"),
+                             cargo_toolchain=entry.get("cargo_toolchain"),
+                             std_features=entry.get("std_features")))
+    return jobs
+
+
+def check_unique(jobs):
+    """
+    Rejects jobs that would overwrite each other's results.
+
+    Two jobs clash if they build the same funcTree of an app with the same strategy
+    and rustup toolchain (they would share a workspace), if two groups of a batch
+    would compile in the same shared workspace, or if two image builds get the same
+    image name, which follows the entry function (e.g. two funcTrees that both start
+    at `search-handler`).
+
+    Raises:
+        ValueError: Naming the funcTrees or apps of the first clash found.
+    """
+    workspaces, shared, images = {}, {}, {}
+    for job in jobs:
+        name = workspace_name(job)
+        other = workspaces.setdefault(name, job)
+        if other is not job:
+            if other.tree_path == job.tree_path:
+                raise ValueError(f"{job.tree_path} is built twice with the {job.strategy.name} strategy")
+            raise ValueError(f"{other.tree_path} and {job.tree_path} would share the workspace '{name}'")
+        name = shared_workspace_name(job)
+        other = shared.setdefault(name, job)
+        if group_key(other) != group_key(job):
+            raise ValueError(f"{other.app_dir} and {job.app_dir} would share the workspace '{name}'")
+        if job.strategy.local:
+            continue
+        other = images.setdefault(job.image_name, job)
+        if other is not job:
+            raise ValueError(f"{other.tree_path} and {job.tree_path} would both be built as image "
+                             f"'{job.image_name}'; build them in separate runs")
+
+
+def stage_build_context(job, dest):
+    """
+    Lays out a Docker build context equivalent to the `temp` dir of `build.sh merge_fission`.
+    Crates already staged in `dest` by an earlier build are left as they are.
+    """
+    stage_functions(job.app_dir, job.tree.functions, dest)
+    stage_runtime_crates(job.app_dir, dest)
+    shutil.rmtree(os.path.join(dest, "merge_pipeline"), ignore_errors=True)
+    shutil.copytree(PACKAGE_DIR, os.path.join(dest, "merge_pipeline"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+    with open(os.path.join(dest, "funcTree"), "w") as f:
+        f.write(job.tree.dumps())
+    with open(os.path.join(dest, "metadata.txt"), "w") as f:
+        f.write(f"{job.caller}-merged\n")
+
+
+class BuildResult:
+    def __init__(self, job, target, duration, error=None, timings=None):
+        self.job = job
+        self.target = target
+        self.duration = duration
+        self.error = error
+        self.timings = timings or []
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class Builder:
+    """
+    Builds many merged workflows in one invocation.
+
+    All jobs share one worker pool and one Implib wrapper cache. Image builds
+    (non-local strategies) run `docker build` on a staged context per job;
+    local strategies run the pipeline directly on the host in `build_root`.
+    Contexts and workspaces persist in `build_root` (see `staging.reset_workspace`),
+    so a rebuild only stages the crates that changed.
+
+    Args:
+        user (str): Docker Hub user used to tag images (defaults to $DOCKER_USER).
+        workers (int): Number of workflows built concurrently.
+        build_root (str): Where local workspaces and the shared caches live.
+        push (bool): Push images after a successful build.
+        docker (str): Docker command, e.g. 'sudo docker'.
+    """
+
+    def __init__(self, user=None, workers=None, build_root="build", push=False, docker="sudo docker",
+                 toolchain=None, log=print):
+        self.user = user or os.environ.get("DOCKER_USER", "")
+        self.workers = workers or os.cpu_count()
+        self.build_root = os.path.abspath(build_root)
+        self.push = push
+        self.docker = shlex.split(docker)
+        self.toolchain = toolchain or Toolchain()
+        self.implib_cache = ImplibCache(os.path.join(self.build_root, "implib-cache"))
+        self.log = log
+
+    def build_image(self, job):
+        tag = job.image_tag(self.user)
+        context = os.path.join(self.build_root, workspace_name(job))
+        reset_workspace(context, self._config(job), staged_crates(job.tree.functions))
+        stage_build_context(job, context)
+        subprocess.run(self.docker + ["build", "--no-cache", "-t", tag,
+                                      "--build-arg", f"USERNAME={self.user}",
+                                      "--build-arg", f"STRATEGY={job.strategy.name}",
+                                      "--build-arg", f"QUILT_CODEGEN_JOBS={self.toolchain.codegen_jobs}",
+                                      "--build-arg", f"CARGO_TOOLCHAIN={job.cargo_toolchain or ''}",
+                                      "--build-arg", f"STD_FEATURES={job.std_features or ''}",
+                                      "-f", DOCKERFILE, context], check=True)
+        if self.push:
+            subprocess.run(self.docker + ["push", tag], check=True)
+        return tag, []
+
+    def _config(self, job):
+        return workspace_config(job.strategy, job.cargo_toolchain, job.std_features, self.toolchain)
+
+    def build_local(self, job):
+        path = os.path.join(self.build_root, workspace_name(job))
+        reset_workspace(path, self._config(job), staged_crates(job.tree.functions))
+        stage_functions(job.app_dir, job.tree.functions, path)
+        ws = Workspace(path, toolchain=self.toolchain, app_dir=job.app_dir,
+                       implib_cache=self.implib_cache, log=self.log, cargo_toolchain=job.cargo_toolchain,
+                       std_features=job.std_features)
+        for step in ("compile", "merge", "link"):
+            ws.timed(step, getattr(job.tree, step), job.strategy, ws)
+        return os.path.join(path, "function"), ws.timings
+
+    def _run(self, job):
+        start = time.time()
+        try:
+            target, timings = self.build_local(job) if job.strategy.local else self.build_image(job)
+            return BuildResult(job, target, time.time() - start, timings=timings)
+        except Exception as e:
+            return BuildResult(job, None, time.time() - start, error=e)
+
+    def build(self, jobs):
+        """Builds all jobs concurrently and returns their `BuildResult`s in input order."""
+        check_unique(jobs)
+        os.makedirs(self.build_root, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(self._run, jobs))
+
+    def build_batch(self, jobs):
+        """
+        Builds all jobs in one pass with a shared compile stage (see `batch.run_batch`).
+
+        Local strategies run on the host. Image strategies run the whole batch in
+        a single container of the compiler image, then wrap each binary into its
+        fission-env image; these final builds only copy a file and run concurrently.
+        """
+        check_unique(jobs)
+        os.makedirs(self.build_root, exist_ok=True)
+        local = [j for j in jobs if j.strategy.local]
+        images = [j for j in jobs if not j.strategy.local]
+        results = {}
+
+        if local:
+            for job, binary, timings, error in run_batch(local, self.build_root, self.toolchain,
+                                                         self.implib_cache, self.workers, log=self.log):
+                results[id(job)] = BuildResult(job, binary, dict(timings).get("total", 0.0), error, timings)
+
+        if images:
+            start = time.time()
+            context = tempfile.mkdtemp(prefix="batch-", dir=self.build_root)
+            try:
+                error = None
+                try:
+                    self._compile_images_in_container(images, context)
+                except subprocess.CalledProcessError as e:
+                    error = e
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    for res in pool.map(lambda j: self._package_image(j, context, error, start), images):
+                        results[id(res.job)] = res
+            finally:
+                shutil.rmtree(context, ignore_errors=True)
+
+        return [results[id(j)] for j in jobs]
+
+    def _compile_images_in_container(self, jobs, context):
+        apps = {}
+        for job in jobs:
+            app_dir, funcs = apps.setdefault(job.app_id, (job.app_dir, []))
+            funcs += [f for f in job.tree.functions if f not in funcs]
+        for app_id, (app_dir, funcs) in apps.items():
+            dest = context_app_dir(context, app_id)
+            for func in funcs:
+                crate = os.path.join("functions", func, "template", "rust", "function")
+                shutil.copytree(os.path.join(app_dir, crate), os.path.join(dest, crate))
+            for crate in ("FissionRPC", "DbInterface"):
+                shutil.copytree(os.path.join(app_dir, crate), os.path.join(dest, crate))
+        shutil.copytree(PACKAGE_DIR, os.path.join(context, "merge_pipeline"),
+                        ignore=shutil.ignore_patterns("__pycache__"))
+        write_manifest(jobs, os.path.join(context, "manifest.json"))
+
+        script = (f"python3 -m merge_pipeline batch-run manifest.json -j {self.workers} --out out; s=$?; "
+                  f"mkdir -p out/_runtime && cp {' '.join(RUNTIME_FILES)} out/_runtime/; "
+                  f"chown -R {os.getuid()}:{os.getgid()} /home/rust/batch; exit $s")
+        subprocess.run(self.docker + ["run", "--rm", "-v", f"{context}:/home/rust/batch",
+                                      "-e", f"QUILT_CODEGEN_JOBS={self.toolchain.codegen_jobs}",
+                                      "-w", "/home/rust/batch", f"{self.user}/llvm-19:latest",
+                                      "sh", "-c", script], check=True)
+
+    def _package_image(self, job, context, error, start):
+        userfunc = os.path.join(context, "out", job.image_name, "userfunc")
+        if error is None and not os.path.exists(userfunc):
+            error = FileNotFoundError(f"batch build produced no binary for {job.image_name}")
+        if error is not None:
+            return BuildResult(job, None, time.time() - start, error)
+        tag = job.image_tag(self.user)
+        try:
+            subprocess.run(self.docker + ["build", "-t", tag,
+                                          "--build-arg", f"USERNAME={self.user}",
+                                          "--build-arg", f"IMAGE={job.image_name}",
+                                          "-f", USERFUNC_DOCKERFILE, os.path.join(context, "out")], check=True)
+            if self.push:
+                subprocess.run(self.docker + ["push", tag], check=True)
+        except subprocess.CalledProcessError as e:
+            return BuildResult(job, None, time.time() - start, e)
+        return BuildResult(job, tag, time.time() - start)
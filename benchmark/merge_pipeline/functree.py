@@ -0,0 +1,103 @@
+import os
+
+
+class FuncTree:
+    """
+    A parsed funcTree file.
+
+    A funcTree lists one `caller callee` edge per line. The caller on the first
+    line is the entry function of the workflow: every other function is merged
+    into its bitcode and the merged binary is named after it. This replaces the
+    ad-hoc parsing loop that every copy of `merge_tree.py` carried around.
+
+    The actual compile/merge/link work is delegated to a `MergeStrategy`, so the
+    same tree can be built with the sync, async, local or LTO variant.
+    """
+
+    def __init__(self, edges, name=None):
+        if not edges:
+            raise ValueError("funcTree has no edges.")
+        self.edges = [tuple(e) for e in edges]
+        self.name = name
+        self.entry = self.edges[0][0]
+
+        # Functions in first-seen order. This is the order the original scripts
+        # used for the Cargo workspace members and for renaming callees.
+        self.functions = []
+        seen = set()
+        for caller, callee in self.edges:
+            for func in (caller, callee):
+                if func not in seen:
+                    seen.add(func)
+                    self.functions.append(func)
+
+    @classmethod
+    def parse(cls, text, name=None):
+        """Parses the contents of a funcTree file."""
+        edges = []
+        for lineno, line in enumerate(text.splitlines(), start=1):
+            words = line.split()
+            if not words:
+                continue
+            if len(words) != 2:
+                raise ValueError(f"{name or 'funcTree'}:{lineno}: expected 'caller callee', got {line.strip()!r}")
+            edges.append((words[0], words[1]))
+        return cls(edges, name=name)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r') as f:
+            return cls.parse(f.read(), name=os.path.basename(path))
+
+    def __repr__(self):
+        return f"FuncTree({self.name or self.entry!r}, {len(self.functions)} functions)"
+
+    @property
+    def callees(self):
+        """All functions except the entry, in first-seen order."""
+        return [f for f in self.functions if f != self.entry]
+
+    def merge_plan(self):
+        """
+        Yields the sequence of bitcode merge operations for this tree.
+
+        Each item is `(op, caller, callee)`. The first time a callee is seen its
+        bitcode is linked into the entry module ('merge'); afterwards only the
+        call site in `caller` is rewired ('merge_existing').
+        """
+        merged = {self.entry}
+        for caller, callee in self.edges:
+            if callee not in merged:
+                merged.add(callee)
+                yield 'merge', caller, callee
+            else:
+                yield 'merge_existing', caller, callee
+
+    def cargo_workspace(self):
+        """Returns the Cargo.toml that builds every function of the tree as one workspace."""
+        members = ", ".join(f'"{f}"' for f in self.functions)
+        return "[workspace]\n" + f"members = [{members}]"
+
+    def dumps(self):
+        """Serializes the tree back to the funcTree file format."""
+        return "".join(f"{caller} {callee}\n" for caller, callee in self.edges)
+
+    # --- Build steps, delegated to a strategy ---
+
+    def compile(self, strategy, workspace):
+        return strategy.compile(self, workspace)
+
+    def merge(self, strategy, workspace):
+        return strategy.merge(self, workspace)
+
+    def link(self, strategy, workspace):
+        return strategy.link(self, workspace)
+
+    def clean(self, strategy, workspace):
+        return strategy.clean(self, workspace)
+
+    def build(self, strategy, workspace):
+        """Runs compile, merge and link back to back."""
+        self.compile(strategy, workspace)
+        self.merge(strategy, workspace)
+        self.link(strategy, workspace)
@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# Build output of crates that were also built in place; it is never needed in a workspace.
+IGNORE = shutil.ignore_patterns("target")
+
+# The function crates depend on `../OpenFaaSRPC`, so FissionRPC is staged under that name.
+RUNTIME_CRATES = [("FissionRPC", "OpenFaaSRPC"), ("DbInterface", "DbInterface")]
+
+# What a persistent workspace was last prepared for (see `reset_workspace`).
+STAMP = ".quilt-workspace.json"
+
+
+def link_or_copy(src, dst):
+    """Hardlinks `src` to `dst`, or copies it where that fails (e.g. across file systems)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _up_to_date(src, dst):
+    """Whether `dst` holds the same files as `src`: hardlinks of them, or copies with the same size and mtime."""
+    if not os.path.isdir(dst):
+        return False
+    for root, dirs, files in os.walk(src):
+        dirs[:] = [d for d in dirs if d != "target"]
+        staged = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(staged) or set(os.listdir(staged)) != set(dirs) | set(files):
+            return False
+        for name in files:
+            a, b = os.stat(os.path.join(root, name)), os.stat(os.path.join(staged, name))
+            if (a.st_dev, a.st_ino) != (b.st_dev, b.st_ino) and (a.st_size, a.st_mtime_ns) != (b.st_size, b.st_mtime_ns):
+                return False
+    return True
+
+
+def stage_tree(src, dst):
+    """
+    Stages the crate `src` at `dst` with hardlinks instead of copies, unless `dst` already holds it.
+
+    The crates are only read by cargo and Docker, so sharing inodes with the sources is safe.
+    An editor that replaces a source file gives it a new inode, so it is staged again.
+
+    Returns:
+        bool: Whether anything was staged.
+    """
+    if _up_to_date(src, dst):
+        return False
+    shutil.rmtree(dst, ignore_errors=True)
+    shutil.copytree(src, dst, copy_function=link_or_copy, ignore=IGNORE)
+    return True
+
+
+def _remove_except(path, keep):
+    """Removes every entry of the directory `path` whose name is not in `keep`."""
+    for name in os.listdir(path):
+        if name in keep:
+            continue
+        entry = os.path.join(path, name)
+        if os.path.isdir(entry) and not os.path.islink(entry):
+            shutil.rmtree(entry)
+        else:
+            os.remove(entry)
+
+
+def reset_workspace(path, config, crates):
+    """
+    Prepares the persistent workspace at `path` to be staged into for a build with `config`.
+
+    Workspaces are kept between builds so that `stage_tree` skips the crates that did
+    not change. Everything but the staged `crates` is removed, since the merge step
+    rewrites cargo's bitcode in place and build output must not be reused. If `config`
+    (a JSON-serializable dict, e.g. the strategy and toolchain) differs from the last
+    build's, the whole workspace is removed.
+    """
+    stamp = os.path.join(path, STAMP)
+    try:
+        with open(stamp) as f:
+            same = json.load(f) == config
+    except (FileNotFoundError, ValueError):
+        same = False
+    if not same:
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    _remove_except(path, set(crates) | {STAMP})
+    with open(stamp, "w") as f:
+        json.dump(config, f)
+
+
+def stage_functions(app_dir, functions, dest, workers=8):
+    """
+    Stages the Rust crate of each function at `dest/<function>` (was `build_helper.py`),
+    `workers` at a time.
+
+    Returns:
+        list: The functions that were staged (the others were up to date).
+    """
+    sources = {}
+    for func in functions:
+        src = os.path.join(app_dir, "functions", func, "template", "rust", "function")
+        if not os.path.isdir(src):
+            raise FileNotFoundError(f"Function '{func}' not found in {app_dir}/functions")
+        sources[func] = src
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        staged = pool.map(lambda func: stage_tree(sources[func], os.path.join(dest, func)), sources)
+        return [func for func, changed in zip(sources, list(staged)) if changed]
+
+
+def stage_runtime_crates(app_dir, dest):
+    """Stages the RPC and DB crates of an app next to the function crates (see `RUNTIME_CRATES`)."""
+    for src, name in RUNTIME_CRATES:
+        stage_tree(os.path.join(app_dir, src), os.path.join(dest, name))
+
+
+def stage_crates(pairs, prune=None, workers=8):
+    """
+    Stages each `(src, dst)` crate with `stage_tree`, `workers` at a time. This is
+    the staging of the legacy `build_helper.py` and `merge_local*/merge_tree.py` scripts.
+
+    Args:
+        prune (str, optional): A directory kept between builds (the `temp` context of
+                               `build.sh`) from which everything but the staged crates
+                               is removed first.
+
+    Returns:
+        int: How many crates were staged (the others were up to date).
+    """
+    if prune is not None:
+        _remove_except(prune, {os.path.relpath(dst, prune) for _, dst in pairs})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(lambda pair: stage_tree(*pair), pairs))
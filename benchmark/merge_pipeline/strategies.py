@@ -0,0 +1,317 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from .staging import stage_runtime_crates
+from .toolchain import TARGET_TRIPLE, LINKER_FLAGS, generate_implib_wrappers
+
+RUSTFLAGS = "-C save-temps -Zlocation-detail=none -Zfmt-debug=none --emit=llvm-bc"
+# The rustup toolchain of the (uncommented) cargo command in a legacy merge.sh.
+CARGO_TOOLCHAIN_RE = re.compile(r"^[^#\n]*\bcargo\s+(\+\S+)", re.MULTILINE)
+# The std features of its (uncommented) `-Z build-std-features` option.
+STD_FEATURES_RE = re.compile(r'^[^#\n]*-Z\s+build-std-features="?([\w,-]+)', re.MULTILINE)
+
+
+class MergeStrategy:
+    """
+    One variant of the merge pipeline.
+
+    The per-app `merge.sh` copies differ in a handful of knobs: which LLVM pass
+    plugin is used (`merge-rust-func` for sync calls, `merge-rust-func-async`
+    for async calls), which toolchain and Implib libraries the local builds use,
+    and whether the LTO-optimized bitcode produced by rustc is kept. This class
+    implements the `merge.sh` steps once and exposes those knobs as attributes.
+
+    Args:
+        name (str): Identifier used on the command line.
+        is_async (bool): Use the async merge pass.
+        local (bool): Build on the host instead of inside the compiler image.
+        lto (bool): Keep rustc's `.after-restriction.bc` LTO modules.
+    """
+
+    def __init__(self, name, is_async=False, local=False, lto=False):
+        self.name = name
+        self.is_async = is_async
+        self.local = local
+        self.lto = lto
+
+    def __repr__(self):
+        return f"MergeStrategy({self.name!r})"
+
+    # --- Knobs derived from the variant ---
+
+    @property
+    def pass_name(self):
+        return "merge-rust-func-async" if self.is_async else "merge-rust-func"
+
+    def _flag(self, flag):
+        # The async pass suffixes its options with 'rra', the sync pass with 'rr'.
+        return f"-{flag}-{'rra' if self.is_async else 'rr'}"
+
+    @property
+    def cargo_toolchain(self):
+        """The default rustup toolchain; a `Workspace` can override it (see `infer_cargo_toolchain`)."""
+        return "+nightly" if self.local else "+nightly-2024-12-19"
+
+    @property
+    def std_features(self):
+        """The default `-Z build-std-features`; a `Workspace` can override it (see `infer_std_features`)."""
+        return "optimize_for_size" if self.local else ""
+
+    @property
+    def implib_libraries(self):
+        libs = ["rustc_driver", "libcrypto.so.1.1", "libssl.so.1.1"]
+        if not self.local:
+            libs.append("libcurl.so.4.6.0")
+        return libs
+
+    @property
+    def linker(self):
+        return "clang" if self.local else "gcc"
+
+    # --- Helpers ---
+
+    def find_ir(self, workspace, func):
+        """Finds the bitcode module of `func` in the cargo deps directory."""
+        prefix = func.replace("-", "_") + "-"
+        for path in workspace.glob(prefix + "*.bc"):
+            # Skip the per-CGU temporaries (e.g. `name-hash.name.xxx-cgu.0.rcgu.bc`).
+            if os.path.basename(path).count(".") == 1:
+                return path
+        raise FileNotFoundError(f"No bitcode for '{func}' in {workspace.deps_dir}")
+
+    def opt(self, workspace, *args):
+        workspace.run([workspace.toolchain.tool("opt")] + list(args))
+
+    # --- Pipeline steps ---
+
+    def compile(self, tree, workspace):
+        """Builds every function of the tree to bitcode as one cargo workspace."""
+        if self.local and workspace.app_dir:
+            stage_runtime_crates(workspace.app_dir, workspace.path)
+        with open(workspace.join("Cargo.toml"), "w") as f:
+            f.write(tree.cargo_workspace())
+
+        args, env = self.cargo_command(workspace)
+        workspace.timed("cargo", workspace.run, args, env)
+        workspace.timed("remove_redundant", self.remove_redundant, workspace)
+
+    def cargo_command(self, workspace):
+        """The cargo command and environment that build the workspace's crates to bitcode."""
+        args = ["cargo", workspace.cargo_toolchain or self.cargo_toolchain, "build", "--release",
+                "-Z", "build-std=std,panic_abort", "--target", TARGET_TRIPLE]
+        features = self.std_features if workspace.std_features is None else workspace.std_features
+        if features:
+            args[-2:-2] = ["-Z", f"build-std-features={features}"]
+        return args, {"RUSTFLAGS": RUSTFLAGS, "CARGO_TARGET_DIR": workspace.target_dir}
+
+    def unit_graph(self, workspace):
+        """
+        Returns cargo's unit graph of the compile step (`--unit-graph`, without building):
+        every crate it compiles, with the indices of the units it depends on.
+        """
+        args, env = self.cargo_command(workspace)
+        return json.loads(workspace.run(args + ["--unit-graph", "-Z", "unstable-options"], env, capture=True))
+
+    def remove_redundant(self, workspace):
+        """Drops everything in deps that is not needed for merging (was `rm_redundant_bc.py`)."""
+        for pattern in ["panic_abort-*", "*no-opt*", "*.d", "*.o", "*.rlib", "*.rmeta"]:
+            workspace.remove(pattern)
+
+        deps = workspace.deps_dir
+        nm = workspace.toolchain.tool("llvm-nm")
+        # The module that defines the global allocator shim must survive the cleanup.
+        for path in workspace.glob("*.bc" if self.lto else "*.rcgu.bc"):
+            out = subprocess.run([nm, path], capture_output=True, text=True).stdout
+            for line in out.splitlines():
+                words = line.split()
+                if len(words) > 2 and words[2] == "__rust_alloc" and words[1] == "T":
+                    os.replace(path, os.path.join(deps, "function_keep.bc"))
+                    break
+        workspace.remove("*.rcgu.bc")
+        workspace.remove("*.rcgu.o")
+
+        if self.lto:
+            # Replace each crate's bitcode with its LTO-optimized module.
+            lto_modules = workspace.glob("*.after-restriction.bc")
+            if lto_modules:
+                workspace.remove("function-*.bc")
+                for path in lto_modules:
+                    name = os.path.basename(path).split(".")[0] + ".bc"
+                    os.replace(path, os.path.join(deps, name))
+
+    def merge(self, tree, workspace):
+        """Renames the entry and callee symbols, then merges callees into the entry module."""
+        entry_ir = self.find_ir(workspace, tree.entry)
+        out = workspace.join("caller.bc")
+        self.opt(workspace, entry_ir, f"-passes={self.pass_name}",
+                 self._flag("rename-caller"), f"{self._flag('caller-name')}={tree.entry}", "-o", out)
+        # Bitcode is only ever replaced, never written in place, so workspaces may hardlink it.
+        os.replace(out, entry_ir)
+
+        for func in tree.callees:
+            ir = self.find_ir(workspace, func)
+            out = workspace.join("callee.bc")
+            self.opt(workspace, ir, f"-passes={self.pass_name}",
+                     self._flag("rename-callee"), f"{self._flag('callee-name')}={func}", "-o", out)
+            os.replace(out, ir)
+
+        for op, caller, callee in tree.merge_plan():
+            if op == "merge":
+                self.merge_callee(workspace, tree.entry, callee, caller)
+            else:
+                self.merge_existing(workspace, tree.entry, callee, caller)
+
+    def merge_callee(self, workspace, entry, callee, caller):
+        entry_ir = self.find_ir(workspace, entry)
+        callee_ir = self.find_ir(workspace, callee)
+        workspace.run([workspace.toolchain.tool("llvm-link"), entry_ir, callee_ir, "-o", "caller_and_callee.bc"])
+        self.opt(workspace, "caller_and_callee.bc", "-strip-debug", "-o", "caller_and_callee_nodebug.bc")
+        self.opt(workspace, "caller_and_callee_nodebug.bc", f"-passes={self.pass_name}",
+                 self._flag("merge-callee"), f"{self._flag('callee-name')}={callee}",
+                 f"{self._flag('caller-name')}={caller}", "-o", "merged.bc")
+        os.remove(callee_ir)
+        os.replace(workspace.join("merged.bc"), entry_ir)
+
+    def merge_existing(self, workspace, entry, callee, caller):
+        entry_ir = self.find_ir(workspace, entry)
+        self.opt(workspace, entry_ir, f"-passes={self.pass_name}", self._flag("merge-existing"),
+                 f"{self._flag('caller-name')}={caller}", f"{self._flag('callee-name')}={callee}",
+                 "-o", "merged.bc")
+        os.replace(workspace.join("merged.bc"), entry_ir)
+
+    def link(self, tree, workspace):
+        """Links all remaining bitcode into one module and produces the `function` binary."""
+        tc = workspace.toolchain
+        modules = workspace.glob("*.bc")
+        workspace.timed("llvm-link", workspace.run,
+                        [tc.tool("llvm-link")] + modules + ["-o", "lib_with_debug_info.bc"])
+        workspace.timed("strip-debug", self.opt, workspace, "lib_with_debug_info.bc", "-strip-debug", "-o", "lib.bc")
+        workspace.timed("strip-dead-prototypes", self.opt, workspace,
+                        "lib.bc", "-passes=strip-dead-prototypes", "-o", "func.bc")
+        workspace.timed("remove-redundant", self.opt, workspace, "func.bc", "-passes=remove-redundant", "-o", "function.bc")
+        # The IR is already optimized, so splitting it only parallelizes code generation.
+        workspace.remove("function*.o", workspace.path)
+        parts = workspace.timed("llvm-split", self.split, workspace) if tc.codegen_jobs > 1 else None
+        workspace.timed("llc", self.codegen, workspace, parts)
+        workspace.timed("wrap_shared_lib", self.wrap_shared_lib, workspace)
+        objects = sorted(f for f in os.listdir(workspace.path) if f.endswith(".o"))
+        workspace.timed("ld", workspace.run,
+                        [self.linker, "-no-pie", "-flto", "-Wl,--strip-debug", "-Wl,--gc-sections",
+                         "-Wl,--as-needed"] + objects + ["-o", "function"] + LINKER_FLAGS)
+
+    def split(self, workspace):
+        """
+        Splits `function.bc` into `codegen_jobs` partitions with `llvm-split` (locals used across
+        partitions are externalized) and returns their names.
+        """
+        tc = workspace.toolchain
+        workspace.run([tc.tool("llvm-split"), "-j", str(tc.codegen_jobs), "function.bc", "-o", "function.part"])
+        return [f"function.part{i}" for i in range(tc.codegen_jobs)]
+
+    def codegen(self, workspace, parts=None):
+        """Compiles `function.bc`, or its partitions in parallel, to object code."""
+        llc = [workspace.toolchain.tool("llc"), "-filetype=obj", "-O3", "--function-sections", "--data-sections"]
+        if not parts:
+            workspace.run(llc + ["function.bc", "-o", "function.o"])
+            return
+        with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+            list(pool.map(lambda part: workspace.run(llc + [part, "-o", f"{part}.o"]), parts))
+        for part in parts:
+            os.remove(workspace.join(part))
+
+    def wrap_shared_lib(self, workspace):
+        """Puts the Implib.so wrapper objects for the shared libraries into the workspace."""
+        libraries = workspace.toolchain.shared_libraries(self.implib_libraries)
+        if workspace.implib_cache is not None:
+            for obj in workspace.implib_cache.objects(libraries, log=workspace.log):
+                shutil.copy(obj, workspace.path)
+        else:
+            generate_implib_wrappers(libraries, workspace.path, log=workspace.log)
+
+    def clean(self, tree, workspace):
+        for name in tree.functions + ["function", "Implib.so", "target", "DbInterface", "OpenFaaSRPC"]:
+            path = workspace.join(name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        for pattern in ["*.o", "*.bc", "*.ll", "*.txt", "Cargo.*"]:
+            workspace.remove(pattern, workspace.path)
+
+
+STRATEGIES = {
+    "sync": MergeStrategy("sync"),
+    "async": MergeStrategy("async", is_async=True),
+    "local": MergeStrategy("local", local=True),
+    "local_async": MergeStrategy("local_async", is_async=True, local=True),
+    "lto": MergeStrategy("lto", local=True, lto=True),
+    "lto_async": MergeStrategy("lto_async", is_async=True, local=True, lto=True),
+}
+
+
+def get_strategy(name):
+    try:
+        return STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f"Unknown merge strategy '{name}'. Choose from: {', '.join(STRATEGIES)}")
+
+
+def infer_strategy(merge_dir):
+    """
+    Picks the strategy that the legacy scripts in `merge_dir` implement.
+
+    `.../social_network_async/merge` -> async, `.../hotel_reservation/merge_local` -> lto, etc.
+    """
+    merge_dir = os.path.abspath(merge_dir)
+    variant = os.path.basename(merge_dir)
+    app = os.path.basename(os.path.dirname(merge_dir))
+    is_async = app.endswith("_async") or variant.endswith("_async")
+    if variant.startswith("merge_local"):
+        # merge_local directories keep rustc's LTO modules; merge_local_async ones do not.
+        name = "local_async" if variant == "merge_local_async" else ("lto_async" if is_async else "lto")
+    else:
+        name = "async" if is_async else "sync"
+    return STRATEGIES[name]
+
+
+def infer_cargo_toolchain(merge_dir):
+    """
+    Reads the rustup toolchain (e.g. `+nightly-2024-12-19`) that the legacy `merge.sh`
+    in `merge_dir` builds with. The copies differ per app variant: the `merge_local*`
+    scripts of DeathStarBench_fakedb use `+nightly`, all others pin a nightly.
+
+    Returns:
+        str: The toolchain, or None if `merge_dir` has no `merge.sh` that names one.
+    """
+    try:
+        with open(os.path.join(merge_dir, "merge.sh")) as f:
+            match = CARGO_TOOLCHAIN_RE.search(f.read())
+    except FileNotFoundError:
+        return None
+    return match.group(1) if match else None
+
+
+def infer_std_features(merge_dir):
+    """
+    Reads the `-Z build-std-features` that the legacy `merge.sh` in `merge_dir` builds
+    std with. The copies differ per app variant: most `merge_local` scripts and
+    DeathStarBench's `media_microservice_async/merge` use `optimize_for_size`, the
+    others (including the fakedb `social_network*/merge_local` and `merge_local_async`
+    scripts, which comment it out) none.
+
+    Returns:
+        str: The features ("" for none), or None if `merge_dir` has no `merge.sh` with a cargo command.
+    """
+    try:
+        with open(os.path.join(merge_dir, "merge.sh")) as f:
+            script = f.read()
+    except FileNotFoundError:
+        return None
+    if not CARGO_TOOLCHAIN_RE.search(script):
+        return None
+    match = STD_FEATURES_RE.search(script)
+    return match.group(1) if match else ""
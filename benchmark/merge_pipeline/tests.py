@@ -0,0 +1,367 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from merge_pipeline import (FuncTree, STRATEGIES, get_strategy, infer_strategy, infer_cargo_toolchain, infer_std_features,
+                            Toolchain, Workspace, stage_functions, BuildJob, Builder, check_unique,
+                            jobs_from_manifest, workspace_name, write_manifest, read_manifest, SharedCompile)
+from merge_pipeline.batch import dependency_closures, shared_workspace_name
+from merge_pipeline.staging import stage_tree, stage_crates, reset_workspace, _up_to_date
+
+BENCHMARK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOTEL_LOCAL = os.path.join(BENCHMARK_DIR, "DeathStarBench_fakedb", "hotel_reservation", "merge_local")
+
+
+class RecordingWorkspace(Workspace):
+    """A workspace that records commands instead of running them, and creates the file each one writes."""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, log=lambda *args: None, target_dir=os.path.join(path, "target"), **kwargs)
+        self.commands = []
+        self.output = ""
+        os.makedirs(self.deps_dir)
+
+    def run(self, args, env=None, capture=False):
+        self.commands.append((list(args), env))
+        if "-o" in args:
+            open(os.path.join(self.path, args[args.index("-o") + 1]), "w").close()
+        return self.output if capture else None
+
+    def flags(self):
+        """The merge pass option of every `opt` run, e.g. `-rename-caller-rr`."""
+        return [a for args, _ in self.commands for a in args
+                if a.startswith(("-rename-", "-merge-")) and "=" not in a]
+
+
+class TestMergePipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, path, text=""):
+        path = os.path.join(self.tmp, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def _app(self, name, functions):
+        """Creates an app directory with a crate per function."""
+        for func in functions:
+            crate = os.path.join(name, "functions", func, "template", "rust", "function")
+            self._write(os.path.join(crate, "Cargo.toml"), f'[package]\nname = "{func}"\n')
+            self._write(os.path.join(crate, "src", "main.rs"), "fn main() {}\n")
+            self._write(os.path.join(crate, "target", "release", "stale"), "build output")
+        return os.path.join(self.tmp, name)
+
+    def test_functree_parse(self):
+        print("\n--- Running Test: FuncTree Parsing ---")
+        tree = FuncTree.parse("a b\n\na c\nb  c\n", name="funcTree.a")
+        self.assertEqual(tree.entry, "a")
+        self.assertEqual(tree.functions, ["a", "b", "c"])
+        self.assertEqual(tree.callees, ["b", "c"])
+        self.assertEqual(tree.dumps(), "a b\na c\nb c\n")
+        self.assertEqual(FuncTree.parse(tree.dumps()).edges, tree.edges)
+        self.assertEqual(tree.cargo_workspace(), '[workspace]\nmembers = ["a", "b", "c"]')
+
+        with self.assertRaisesRegex(ValueError, "funcTree.x:2"):
+            FuncTree.parse("a b\na b c\n", name="funcTree.x")
+        with self.assertRaises(ValueError):
+            FuncTree.parse("\n")
+
+    def test_functree_merge_plan(self):
+        """
+        Tests that a callee is merged into the entry the first time it is seen and only
+        rewired afterwards, and that the entry itself is never merged.
+        """
+        print("\n--- Running Test: FuncTree Merge Plan ---")
+        tree = FuncTree.parse("a b\nb c\na c\nc a\n")
+        self.assertEqual(list(tree.merge_plan()), [('merge', 'a', 'b'), ('merge', 'b', 'c'),
+                                                   ('merge_existing', 'a', 'c'), ('merge_existing', 'c', 'a')])
+
+    def test_strategy_inference(self):
+        print("\n--- Running Test: Strategy and Toolchain Inference ---")
+        fakedb = os.path.join(BENCHMARK_DIR, "DeathStarBench_fakedb")
+        cases = [("social_network/merge", "sync", "+nightly-2024-12-19", ""),
+                 ("social_network_async/merge", "async", "+nightly-2024-12-19", ""),
+                 ("hotel_reservation/merge_async", "async", "+nightly-2024-12-19", ""),
+                 ("hotel_reservation/merge_local", "lto", "+nightly", "optimize_for_size"),
+                 ("hotel_reservation/merge_local_async", "local_async", "+nightly", ""),
+                 ("social_network_async/merge_local", "lto_async", "+nightly", "")]
+        for merge_dir, strategy, toolchain, features in cases:
+            path = os.path.join(fakedb, merge_dir)
+            self.assertIs(infer_strategy(path), STRATEGIES[strategy])
+            self.assertEqual(infer_cargo_toolchain(path), toolchain)
+            self.assertEqual(infer_std_features(path), features)
+        mm_async = os.path.join(BENCHMARK_DIR, "DeathStarBench", "media_microservice_async", "merge")
+        self.assertEqual(infer_std_features(mm_async), "optimize_for_size")
+        self.assertEqual(BuildJob(os.path.join(fakedb, "social_network", "merge_local", "funcTrees",
+                                               "funcTree.compose_post")).std_features, "")
+        self.assertEqual(infer_cargo_toolchain(os.path.join(BENCHMARK_DIR, "DeathStarBench", "social_network",
+                                                            "merge_local")), "+nightly-2024-12-19")
+        # A commented-out cargo command does not count.
+        self._write("m/merge.sh", "#  cargo +old build\n  cargo +nightly-2030-01-01 build\n")
+        self.assertEqual(infer_cargo_toolchain(os.path.join(self.tmp, "m")), "+nightly-2030-01-01")
+        self.assertIsNone(infer_cargo_toolchain(self.tmp))
+        with self.assertRaises(ValueError):
+            get_strategy("fast")
+
+    def test_stage_functions(self):
+        """
+        Tests that crates are staged as hardlinks without their build output, that
+        staging again skips them, and that a replaced source file is staged again.
+        """
+        print("\n--- Running Test: Staging Function Crates ---")
+        app = self._app("app", ["f", "g"])
+        dest = os.path.join(self.tmp, "ws")
+        self.assertEqual(stage_functions(app, ["f", "g"], dest), ["f", "g"])
+        src = os.path.join(app, "functions", "f", "template", "rust", "function")
+        self.assertTrue(os.path.samefile(os.path.join(src, "src", "main.rs"), os.path.join(dest, "f", "src", "main.rs")))
+        self.assertFalse(os.path.exists(os.path.join(dest, "f", "target")))
+        self.assertEqual(stage_functions(app, ["f", "g"], dest), [])
+
+        # Editors replace files rather than writing them in place.
+        self._write("new.rs", "fn main() { println!(); }\n")
+        os.replace(os.path.join(self.tmp, "new.rs"), os.path.join(src, "src", "main.rs"))
+        self.assertEqual(stage_functions(app, ["f", "g"], dest), ["f"])
+        with open(os.path.join(dest, "f", "src", "main.rs")) as f:
+            self.assertIn("println", f.read())
+
+        with self.assertRaises(FileNotFoundError):
+            stage_functions(app, ["h"], dest)
+
+    def test_up_to_date_with_copies(self):
+        print("\n--- Running Test: Staged Copies Are Up To Date ---")
+        app = self._app("app", ["f"])
+        src = os.path.join(app, "functions", "f", "template", "rust", "function")
+        dest = os.path.join(self.tmp, "copy")
+        # Across file systems the crate is copied; copy2 keeps the mtime.
+        shutil.copytree(src, dest, ignore=shutil.ignore_patterns("target"))
+        self.assertTrue(_up_to_date(src, dest))
+        self.assertFalse(stage_tree(src, dest))
+        self._write(os.path.join(dest, "extra.rs"))
+        self.assertFalse(_up_to_date(src, dest))
+        self.assertTrue(stage_tree(src, dest))
+        self.assertFalse(os.path.exists(os.path.join(dest, "extra.rs")))
+
+    def test_reset_workspace(self):
+        """
+        Tests that a workspace reused with the same config keeps its staged crates but
+        no build output, and that a different config starts from an empty workspace.
+        """
+        print("\n--- Running Test: Persistent Workspaces ---")
+        app = self._app("app", ["f", "g"])
+        ws = os.path.join(self.tmp, "ws")
+        config = {"strategy": "lto", "cargo_toolchain": "+nightly"}
+        reset_workspace(ws, config, ["f", "g", "OpenFaaSRPC"])
+        self.assertEqual(stage_functions(app, ["f", "g"], ws), ["f", "g"])
+        for output in ["target/release/deps/f-01.bc", "function", "Cargo.toml", "old/src/main.rs"]:
+            self._write(os.path.join("ws", output))
+
+        reset_workspace(ws, config, ["f", "OpenFaaSRPC"])
+        self.assertEqual(sorted(os.listdir(ws)), [".quilt-workspace.json", "f"])
+        self.assertEqual(stage_functions(app, ["f"], ws), [])
+
+        reset_workspace(ws, dict(config, cargo_toolchain="+nightly-2024-12-19"), ["f", "OpenFaaSRPC"])
+        self.assertEqual(stage_functions(app, ["f"], ws), ["f"])
+
+        # The legacy build_helper.py prunes its temp context the same way.
+        temp = os.path.join(self.tmp, "temp")
+        pairs = [(os.path.join(app, "functions", f, "template", "rust", "function"), os.path.join(temp, f))
+                 for f in ("f", "g")]
+        self._write(os.path.join("temp", "function.o"))
+        self.assertEqual(stage_crates(pairs, prune=temp), 2)
+        self.assertEqual(stage_crates(pairs[:1], prune=temp), 0)
+        self.assertEqual(os.listdir(temp), ["f"])
+
+    def test_strategy_compile_command(self):
+        print("\n--- Running Test: Cargo Command per Strategy ---")
+        tree = FuncTree.parse("a b\n")
+        ws = RecordingWorkspace(os.path.join(self.tmp, "sync"))
+        get_strategy("sync").compile(tree, ws)
+        args, env = ws.commands[0]
+        self.assertEqual(args[:3], ["cargo", "+nightly-2024-12-19", "build"])
+        self.assertNotIn("build-std-features=optimize_for_size", args)
+        self.assertEqual(env["CARGO_TARGET_DIR"], ws.target_dir)
+        self.assertIn("--emit=llvm-bc", env["RUSTFLAGS"])
+        with open(ws.join("Cargo.toml")) as f:
+            self.assertEqual(f.read(), tree.cargo_workspace())
+
+        ws = RecordingWorkspace(os.path.join(self.tmp, "lto"), cargo_toolchain="+nightly")
+        get_strategy("lto").compile(tree, ws)
+        args, _ = ws.commands[0]
+        self.assertEqual(args[1], "+nightly")
+        self.assertEqual(args[-3:], ["build-std-features=optimize_for_size", "--target", "x86_64-unknown-linux-gnu"])
+        # The std features of the app's merge.sh override the strategy's, in both directions.
+        ws = RecordingWorkspace(os.path.join(self.tmp, "lto-plain"), std_features="")
+        get_strategy("lto").compile(tree, ws)
+        self.assertFalse([a for a in ws.commands[0][0] if a.startswith("build-std-features")])
+        ws = RecordingWorkspace(os.path.join(self.tmp, "sync-small"), std_features="optimize_for_size")
+        get_strategy("sync").compile(tree, ws)
+        self.assertIn("build-std-features=optimize_for_size", ws.commands[0][0])
+
+    def test_strategy_merge_commands(self):
+        """
+        Tests the `opt`/`llvm-link` sequence of the merge step, that the async strategy
+        uses the async pass, and that merged callees leave the deps directory.
+        """
+        print("\n--- Running Test: Merge Commands per Strategy ---")
+        tree = FuncTree.parse("a b\na c\nb c\n")
+        for name, suffix in [("sync", "rr"), ("async", "rra")]:
+            ws = RecordingWorkspace(os.path.join(self.tmp, name), toolchain=Toolchain(llvm_dir="/llvm/bin"))
+            for module in ["a-11.bc", "b_x-22.bc", "b-33.bc", "c-44.bc", "a-11.a.5f-cgu.0.rcgu.bc"]:
+                open(os.path.join(ws.deps_dir, module), "w").close()
+            strategy = get_strategy(name)
+            self.assertEqual(strategy.find_ir(ws, "b"), os.path.join(ws.deps_dir, "b-33.bc"))
+            strategy.merge(tree, ws)
+
+            self.assertEqual(ws.flags(), [f"-rename-caller-{suffix}", f"-rename-callee-{suffix}",
+                                          f"-rename-callee-{suffix}", f"-merge-callee-{suffix}",
+                                          f"-merge-callee-{suffix}", f"-merge-existing-{suffix}"])
+            self.assertTrue(all(args[0].startswith("/llvm/bin/") for args, _ in ws.commands))
+            self.assertIn(f"-passes={strategy.pass_name}", ws.commands[0][0])
+            self.assertIn(f"-caller-name-{suffix}=b", ws.commands[-1][0])
+            self.assertIn(f"-callee-name-{suffix}=c", ws.commands[-1][0])
+            self.assertEqual(sorted(os.listdir(ws.deps_dir)), ["a-11.a.5f-cgu.0.rcgu.bc", "a-11.bc", "b_x-22.bc"])
+
+    def test_strategy_split_codegen(self):
+        print("\n--- Running Test: Split Code Generation ---")
+        ws = RecordingWorkspace(self.tmp, toolchain=Toolchain(llvm_dir="/llvm/bin", codegen_jobs=3))
+        strategy = get_strategy("sync")
+        parts = strategy.split(ws)
+        self.assertEqual(parts, ["function.part0", "function.part1", "function.part2"])
+        self.assertEqual(ws.commands[0][0], ["/llvm/bin/llvm-split", "-j", "3", "function.bc", "-o", "function.part"])
+        for part in parts:
+            open(ws.join(part), "w").close()
+        strategy.codegen(ws, parts)
+        self.assertEqual(sorted(args[-3] for args, _ in ws.commands[1:]), parts)
+        self.assertTrue(all(os.path.exists(ws.join(f"{part}.o")) and not os.path.exists(ws.join(part))
+                            for part in parts))
+
+        ws = RecordingWorkspace(os.path.join(self.tmp, "single"))
+        strategy.codegen(ws)
+        self.assertEqual(ws.commands[0][0][-3:], ["function.bc", "-o", "function.o"])
+
+    def _unit(self, name, kind, deps):
+        return {"target": {"name": name, "kind": [kind]}, "dependencies": [{"index": i} for i in deps]}
+
+    def test_fork_prunes_to_dependency_closure(self):
+        """
+        Tests that a fork of the shared compile leaves out the crates that only other
+        trees depend on, and keeps the shared ones and those no function depends on.
+        """
+        print("\n--- Running Test: Batch Fork Keeps the Tree's Dependencies ---")
+        # Units as in `cargo build --unit-graph`: bins a, b, c and their libraries.
+        units = [self._unit("a", "bin", [3, 4]), self._unit("b", "bin", [4, 5]), self._unit("c", "bin", [3, 6]),
+                 self._unit("serde", "lib", []), self._unit("OpenFaaSRPC", "lib", [7]),
+                 self._unit("memcache", "lib", [7]), self._unit("redis", "lib", [7]), self._unit("std", "lib", [])]
+        graph = {"version": 1, "units": units, "roots": [0, 1, 2]}
+        ws = RecordingWorkspace(os.path.join(self.tmp, "graph"))
+        ws.output = json.dumps(graph)
+        self.assertEqual(get_strategy("sync").unit_graph(ws), graph)
+        self.assertEqual(ws.commands[0][0][-3:], ["--unit-graph", "-Z", "unstable-options"])
+
+        trees = [FuncTree.parse("a b\n", name="t1"), FuncTree.parse("c a\n", name="t2")]
+        shared = SharedCompile(os.path.join(self.tmp, "shared"), trees, get_strategy("sync"), Toolchain(),
+                               log=lambda *args: None)
+        os.makedirs(shared.workspace.deps_dir)
+        for crate in ["a", "b", "c", "serde", "OpenFaaSRPC", "memcache", "redis", "std"]:
+            open(os.path.join(shared.workspace.deps_dir, f"{crate}-0123.bc"), "w").close()
+        open(os.path.join(shared.workspace.deps_dir, "function_keep.bc"), "w").close()
+        open(os.path.join(shared.workspace.deps_dir, "serde-0123.d"), "w").close()
+
+        # Without the unit graph, only the other trees' entry modules are left out.
+        ws = shared.fork(trees[0], os.path.join(self.tmp, "t1-all"))
+        self.assertEqual(len(os.listdir(ws.deps_dir)), 8)
+        self.assertNotIn("c-0123.bc", os.listdir(ws.deps_dir))
+
+        shared.closures = dependency_closures(graph, shared.functions)
+        self.assertEqual(shared.closures["b"], {"b", "OpenFaaSRPC", "memcache", "std"})
+        for tree, dropped in zip(trees, [{"c", "redis"}, {"b", "memcache"}]):
+            ws = shared.fork(tree, os.path.join(self.tmp, tree.name))
+            kept = {name[:-len("-0123.bc")] for name in os.listdir(ws.deps_dir) if name != "function_keep.bc"}
+            self.assertEqual(kept, {"a", "b", "c", "serde", "OpenFaaSRPC", "memcache", "redis", "std"} - dropped)
+            self.assertIn("function_keep.bc", os.listdir(ws.deps_dir))
+            self.assertTrue(os.path.samefile(os.path.join(ws.deps_dir, "a-0123.bc"),
+                                             os.path.join(shared.workspace.deps_dir, "a-0123.bc")))
+
+    def test_jobs_from_manifest(self):
+        """
+        Tests that manifest entries resolve their paths relative to the manifest, infer
+        the strategy and toolchain from the app, and survive the batch manifest round trip.
+        """
+        print("\n--- Running Test: Jobs From a Merge Plan Manifest ---")
+        self._app("social_network_async", ["a", "b"])
+        self._write("social_network_async/merge/merge.sh", "cargo +nightly-2030-01-01 build\n")
+        self._write("plan/funcTrees/funcTree.a", "a b\n")
+        self._write("plan/funcTrees/funcTree.b", "b a\n")
+        manifest = self._write("plan/manifest.json", json.dumps({"workflows": [
+            {"funcTree": "funcTrees/funcTree.a", "caller": "a", "app_dir": "../social_network_async"},
+            {"funcTree": "funcTrees/funcTree.b", "app_dir": "../social_network_async", "strategy": "sync",
+             "cargo_toolchain": "+stable"}]}))
+        first, second = jobs_from_manifest(manifest)
+
+        self.assertEqual(first.app_dir, os.path.join(self.tmp, "social_network_async"))
+        self.assertEqual(first.tree.functions, ["a", "b"])
+        self.assertEqual((first.strategy.name, first.caller, first.cargo_toolchain), ("async", "a", "+nightly-2030-01-01"))
+        self.assertEqual(first.image_name, "sn-a-async-merged")
+        self.assertEqual((second.strategy.name, second.caller, second.cargo_toolchain), ("sync", "b", "+stable"))
+        self.assertEqual(second.image_tag("me"), "me/sn-b-merged:latest")
+
+        path = os.path.join(self.tmp, "batch", "manifest.json")
+        write_manifest([first, second], path)
+        for job, read in zip([first, second], read_manifest(path)):
+            self.assertEqual(read.tree.edges, job.tree.edges)
+            self.assertEqual((read.strategy, read.caller, read.image_name, read.cargo_toolchain, read.std_features),
+                             (job.strategy, job.caller, job.image_name, job.cargo_toolchain, job.std_features))
+            self.assertEqual(read.app_id, job.app_id)
+            self.assertEqual(read.app_dir, os.path.join(self.tmp, "batch", "apps", job.app_id.lstrip(os.sep)))
+        self.assertEqual(BuildJob(os.path.join(HOTEL_LOCAL, "funcTrees", "funcTree.search_handler")).app_id,
+                         os.path.join("DeathStarBench_fakedb", "hotel_reservation"))
+
+    def test_duplicate_callers(self):
+        """
+        Tests that funcTrees with the same entry function get separate workspaces, and
+        that jobs that would build the same image or share a workspace are rejected.
+        """
+        print("\n--- Running Test: FuncTrees With the Same Entry Function ---")
+        trees = [os.path.join(HOTEL_LOCAL, "funcTrees", name) for name in ("funcTree.search_handler",
+                                                                          "funcTree.search_nearby")]
+        local = [BuildJob(path) for path in trees]
+        self.assertEqual({job.caller for job in local}, {"search-handler"})
+        self.assertNotEqual(workspace_name(local[0]), workspace_name(local[1]))
+        check_unique(local)
+        # The same funcTree with a second strategy gets its own workspace too.
+        check_unique(local + [BuildJob(trees[0], strategy="local_async")])
+
+        images = [BuildJob(path, strategy="sync") for path in trees]
+        with self.assertRaisesRegex(ValueError, "hr-search-handler-merged"):
+            check_unique(images)
+        with self.assertRaisesRegex(ValueError, "twice"):
+            check_unique([local[0], BuildJob(trees[0])])
+        # Apps of the same name in two suites, and the same funcTree with two rustup toolchains, do not clash.
+        suites = [BuildJob(os.path.join(BENCHMARK_DIR, suite, "social_network", "merge", "funcTrees",
+                                        "funcTree.compose_post"), strategy="lto")
+                  for suite in ("DeathStarBench", "DeathStarBench_fakedb")]
+        self.assertNotEqual(shared_workspace_name(suites[0]), shared_workspace_name(suites[1]))
+        check_unique(suites + [BuildJob(suites[0].tree_path, strategy="lto", cargo_toolchain="+stable")])
+        # Names that still collide are rejected.
+        with self.assertRaisesRegex(ValueError, "would share the workspace"):
+            check_unique([BuildJob(self._write(f"{app}/merge_local/funcTrees/funcTree.x", "x y\n"), strategy="lto")
+                          for app in ("a-b/c", "a/b-c")])
+        # Nothing is built when the jobs clash.
+        with self.assertRaises(ValueError):
+            Builder(build_root=os.path.join(self.tmp, "build")).build(images)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "build")))
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
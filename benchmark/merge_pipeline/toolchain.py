@@ -0,0 +1,169 @@
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# Defaults match the llvm-19 compiler image (dockerfiles/LLVM/llvm-19).
+# Every path can be overridden through the environment for local builds.
+DEFAULT_LLVM_DIR = "/llvm/bin"
+DEFAULT_RUST_LIB = "/root/.rustup/toolchains/1.78-x86_64-unknown-linux-gnu/lib"
+DEFAULT_C_LIB = "/lib/x86_64-linux-gnu"
+IMPLIB_REPO = "https://github.com/yugr/Implib.so.git"
+
+TARGET_TRIPLE = "x86_64-unknown-linux-gnu"
+LINKER_FLAGS = ["-lm", "-lz", "-ldl", "-lpthread"]
+
+
+class Toolchain:
+    """
+    Locations of the compiler tools used by the merge pipeline.
+
+    This is the Python counterpart of the variable block at the top of every
+    `merge.sh` (LLVM_DIR, RUST_LIB, C_LIB). Unlike the shell scripts, the
+    paths are not hardcoded per checkout: they default to the compiler image
+    layout and can be overridden with QUILT_LLVM_DIR, QUILT_RUST_LIB and
+    QUILT_C_LIB. `codegen_jobs` (QUILT_CODEGEN_JOBS, like LLC_JOBS of
+    `merge.sh`) is the number of partitions `llc` runs on in parallel.
+    """
+
+    def __init__(self, llvm_dir=None, rust_lib=None, c_lib=None, codegen_jobs=None):
+        self.llvm_dir = llvm_dir or os.environ.get("QUILT_LLVM_DIR", DEFAULT_LLVM_DIR)
+        self.rust_lib = rust_lib or os.environ.get("QUILT_RUST_LIB", DEFAULT_RUST_LIB)
+        self.c_lib = c_lib or os.environ.get("QUILT_C_LIB", DEFAULT_C_LIB)
+        self.codegen_jobs = codegen_jobs or int(os.environ.get("QUILT_CODEGEN_JOBS", 1))
+
+    def tool(self, name):
+        return os.path.join(self.llvm_dir, name)
+
+    @property
+    def librustc_driver(self):
+        matches = sorted(glob.glob(os.path.join(self.rust_lib, "librustc_driver-*.so")))
+        if not matches:
+            raise FileNotFoundError(f"librustc_driver-*.so not found in {self.rust_lib}")
+        return matches[0]
+
+    def shared_libraries(self, names):
+        """Resolves library names ('rustc_driver' or a file in C_LIB) to absolute paths."""
+        return [self.librustc_driver if n == "rustc_driver" else os.path.join(self.c_lib, n) for n in names]
+
+
+class Workspace:
+    """
+    A directory in which one funcTree is compiled, merged and linked.
+
+    All commands run with the workspace as their working directory and fail
+    loudly: a failing `opt` no longer goes unnoticed the way it did behind
+    `os.system`. The wall-clock time of every step is kept in `timings`.
+    `cargo_toolchain` (e.g. `+nightly`) overrides the strategy's rustup toolchain, and
+    `std_features` (e.g. `optimize_for_size`, or "" for none) its std features.
+    """
+
+    def __init__(self, path, toolchain=None, app_dir=None, implib_cache=None, target_dir=None, log=print,
+                 cargo_toolchain=None, std_features=None):
+        self.path = os.path.abspath(path)
+        self.target_dir = target_dir or os.environ.get("CARGO_TARGET_DIR", os.path.join(self.path, "target"))
+        self.toolchain = toolchain or Toolchain()
+        self.app_dir = app_dir
+        self.implib_cache = implib_cache
+        self.cargo_toolchain = cargo_toolchain
+        self.std_features = std_features
+        self.log = log
+        self.timings = []
+
+    @property
+    def deps_dir(self):
+        return os.path.join(self.target_dir, TARGET_TRIPLE, "release", "deps")
+
+    def join(self, *parts):
+        return os.path.join(self.path, *parts)
+
+    def run(self, args, env=None, capture=False):
+        """Runs a command in the workspace; with `capture`, returns its standard output."""
+        self.log(" ".join(args))
+        full_env = None
+        if env:
+            full_env = dict(os.environ)
+            full_env.update(env)
+        result = subprocess.run(args, cwd=self.path, env=full_env, check=True,
+                                stdout=subprocess.PIPE if capture else None, text=capture)
+        return result.stdout
+
+    def timed(self, step, fn, *args):
+        start = time.time()
+        try:
+            return fn(*args)
+        finally:
+            self.timings.append((step, time.time() - start))
+
+    def glob(self, pattern, directory=None):
+        return sorted(glob.glob(os.path.join(directory or self.deps_dir, pattern)))
+
+    def remove(self, pattern, directory=None):
+        for path in self.glob(pattern, directory):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+
+class ImplibCache:
+    """
+    Caches the Implib.so wrapper objects for a set of shared libraries.
+
+    `wrap_shared_lib` in `merge.sh` cloned Implib.so and regenerated the same
+    wrappers on every link. With a cache shared by all workspaces, the wrappers
+    are generated once per library set and then only copied. Entries are keyed
+    by the contents of the libraries, so an upgraded library gets new wrappers.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self._lock = threading.Lock()
+        self._hashes = {}
+
+    def _hash(self, library):
+        st = os.stat(library)
+        key = (library, st.st_size, st.st_mtime_ns)
+        if key not in self._hashes:
+            digest = hashlib.sha256()
+            with open(library, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            self._hashes[key] = digest.hexdigest()
+        return self._hashes[key]
+
+    def _key(self, libraries):
+        digest = hashlib.sha256("".join(self._hash(lib) for lib in libraries).encode()).hexdigest()[:16]
+        return "-".join(os.path.basename(lib).split(".so")[0] for lib in libraries) + "-" + digest
+
+    def objects(self, libraries, log=print):
+        """Returns the wrapper object files for `libraries`, generating them on first use."""
+        with self._lock:
+            entry = os.path.join(self.cache_dir, self._key(libraries))
+            if not os.path.isdir(entry):
+                os.makedirs(self.cache_dir, exist_ok=True)
+                staging = tempfile.mkdtemp(dir=self.cache_dir)
+                generate_implib_wrappers(libraries, staging, log=log)
+                os.replace(staging, entry)
+        return sorted(glob.glob(os.path.join(entry, "*.o")))
+
+
+def generate_implib_wrappers(libraries, out_dir, log=print):
+    """Clones Implib.so and compiles a wrapper object for each shared library into `out_dir`."""
+    implib = os.path.join(out_dir, "Implib.so")
+    log(f"git clone {IMPLIB_REPO}")
+    subprocess.run(["git", "clone", "-q", IMPLIB_REPO, implib], check=True)
+    for lib in libraries:
+        subprocess.run(["./implib-gen.py", lib], cwd=implib, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        sources = glob.glob(os.path.join(implib, "*.S")) + glob.glob(os.path.join(implib, "*.c"))
+        for src in sources:
+            subprocess.run(["gcc", "-c", os.path.basename(src)], cwd=implib, check=True)
+            os.remove(src)
+    for obj in glob.glob(os.path.join(implib, "*.o")):
+        shutil.move(obj, out_dir)
+    shutil.rmtree(implib)
@@ -0,0 +1,266 @@
+import argparse
+import collections
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import gurobipy as gp
+from gurobipy import GRB
+
+from ilp import build_subgraph_model, _telemetry_callback
+from telemetry import SolverTrace
+from workflow_graph import as_workflow_graph
+
+# One point of a capacity sweep. `cost` is the total weight of cross-container calls (None if the
+# point is infeasible), `R` the opened roots, `bound` the lower bound proven by the solver (equal to
+# `cost` unless the time limit was hit) and `runtime` the Gurobi solve time in seconds.
+SweepPoint = collections.namedtuple('SweepPoint', ['M', 'C', 'cost', 'R', 'assignment', 'status', 'bound', 'runtime'])
+
+
+class CapacitySweepModel:
+    """
+    One root selection ILP that is re-solved for different container capacities.
+
+    Root selection and subgraph construction are solved jointly: every candidate
+    root is an optional root of the ILP (see `ilp.build_subgraph_model`), so the
+    model does not depend on M and C except through the right-hand sides of the
+    capacity constraints. `solve` only changes those and re-optimizes, starting
+    from the solution of the previous point.
+
+    The model holds a Gurobi environment; call `close` (or use the object as a
+    context manager) to free it.
+    """
+
+    def __init__(self, graph, N, root_node, all_nodes, full_reachable_from, candidate_roots=None, max_k=None,
+                 mip_gap=0.0, mip_focus=0, num_threads=1):
+        """
+        Args:
+            graph (nx.DiGraph or WorkflowGraph): The workflow's call graph.
+            N (int): The number of workflow invocations the call weights were counted over.
+            root_node, all_nodes, full_reachable_from: Pre-processed graph data (see `rdag.preprocess_graph`).
+            candidate_roots (iterable, optional): The nodes that may be opened as roots besides
+                                                  `root_node`. Defaults to all nodes, as for the
+                                                  Optimal strategy.
+            max_k (int, optional): The maximum number of roots, including `root_node`.
+            mip_gap, mip_focus, num_threads: Parameters for the Gurobi solver.
+        """
+        wg = as_workflow_graph(graph, N)
+        if candidate_roots is None:
+            candidate_roots = all_nodes
+        start = time.time()
+        self.env = gp.Env(empty=True)
+        self.env.setParam('LogToConsole', 0)
+        self.env.start()
+        self.env_s = time.time() - start
+
+        start = time.time()
+        self.model = gp.Model("CapacitySweep_ILP", env=self.env)
+        self.model.setParam(GRB.Param.Threads, num_threads)
+        if mip_gap > 0:
+            self.model.setParam(GRB.Param.MIPGap, mip_gap)
+        if mip_focus > 0:
+            self.model.setParam(GRB.Param.MIPFocus, mip_focus)
+        # Build for unbounded capacity; `solve` sets the right-hand sides of each point.
+        self.formulation = build_subgraph_model(
+            self.model, wg, {root_node}, GRB.INFINITY, GRB.INFINITY, all_nodes, full_reachable_from,
+            optional_roots=set(candidate_roots) - {root_node}, max_roots=max_k)
+        self.model.update()
+        self.build_s = time.time() - start
+        self._start = None
+
+    def solve(self, M, C, time_limit=None, trace=None):
+        """
+        Solves the ILP for container capacity (M, C).
+
+        The previous solution is the MIP start. Points are cheapest to re-solve in order
+        of increasing capacity: a solution for smaller containers is also feasible for
+        larger ones, so each start is a valid incumbent (Gurobi discards a start that is not).
+
+        Returns:
+            SweepPoint
+        """
+        model, formulation = self.model, self.formulation
+        formulation.set_capacity(M, C)
+        model.setParam(GRB.Param.TimeLimit, time_limit if time_limit is not None else GRB.INFINITY)
+        variables = model.getVars()
+        if self._start is not None:
+            model.setAttr('Start', variables, self._start)
+
+        start = time.time()
+        incumbents, presolve = [], [0.0]
+        if trace is None:
+            model.optimize()
+        else:
+            model.optimize(_telemetry_callback(incumbents, presolve))
+
+        status = model.Status
+        cost = R = assignment = bound = None
+        if model.SolCount > 0:
+            cost, bound = model.ObjVal, model.ObjBound
+            R = formulation.opened_roots(model)
+            assignment = formulation.assignment(model)
+            self._start = model.getAttr('X', variables)
+            if status not in [GRB.OPTIMAL, GRB.SUBOPTIMAL, GRB.TIME_LIMIT]:
+                status = GRB.SUBOPTIMAL
+
+        if trace is not None:
+            trace.add('ilp', start, time.time() - start, cat='ilp', M=M, C=C,
+                      roots=sorted(R, key=str) if R else [], status=status, objective=cost,
+                      env_s=0.0, build_s=0.0, presolve_s=presolve[0], solve_s=max(model.Runtime - presolve[0], 0.0),
+                      node_count=int(model.NodeCount), mip_gap=model.MIPGap if model.SolCount > 0 else None,
+                      num_vars=model.NumVars, num_constrs=model.NumConstrs, incumbents=incumbents)
+        return SweepPoint(M, C, cost, R, assignment, status, bound, model.Runtime)
+
+    def close(self):
+        self.model.dispose()
+        self.env.dispose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _sweep_chunk(args):
+    """Builds one model and solves a run of points with it. Runs in a worker process, or inline."""
+    graph, N, root_node, all_nodes, full_reachable_from, model_args, points, time_limit, trace_enabled = args
+    trace = SolverTrace() if trace_enabled else None
+    start = time.time()
+    with CapacitySweepModel(graph, N, root_node, all_nodes, full_reachable_from, **model_args) as sweep:
+        if trace is not None:
+            trace.add('sweep_build', start, sweep.env_s + sweep.build_s, env_s=sweep.env_s, build_s=sweep.build_s,
+                      num_vars=sweep.model.NumVars, num_constrs=sweep.model.NumConstrs)
+        results = [sweep.solve(M, C, time_limit, trace) for M, C in points]
+    return results, trace.events if trace else None
+
+
+def capacity_sweep(graph, capacities, N, root_node, all_nodes, predecessors, full_reachable_from,
+                   candidate_roots=None, max_k=None, ilp_time_limit=None, ilp_mip_gap=0.0, ilp_mip_focus=0,
+                   num_threads=1, trace=None):
+    """
+    Solves the merge problem for many container capacities and returns cost against capacity.
+
+    Instead of one `run_root_selection_strategy` per capacity, which builds and solves
+    a new ILP for every root set it tries, the sweep builds a single joint ILP (see
+    `CapacitySweepModel`) and re-solves it for each point after changing only the
+    capacity constraints. Points are solved in order of increasing capacity, each
+    warm-started from the solution of the previous one.
+
+    With `num_threads > 1`, the ordered points are split into contiguous runs that are
+    swept in parallel by worker processes, each building its own model and solving with
+    one Gurobi thread. With one thread, one model is swept in the calling process.
+
+    Args:
+        graph (nx.DiGraph or WorkflowGraph): The workflow's call graph.
+        capacities (iterable): `(M, C)` pairs.
+        N (int): The number of workflow invocations the call weights were counted over.
+        root_node, all_nodes, predecessors, full_reachable_from: Pre-processed graph data.
+        candidate_roots (iterable, optional): The nodes that may be opened as roots besides
+                                              `root_node` (e.g. a heuristic candidate pool).
+                                              Defaults to all nodes.
+        max_k (int, optional): The maximum number of roots, including `root_node`.
+        ilp_time_limit, ilp_mip_gap, ilp_mip_focus: Parameters for the Gurobi solver. The time
+                                                    limit applies to each point.
+        num_threads (int): Number of parallel worker processes (or Gurobi threads for one model).
+        trace (SolverTrace, optional): Records each model build (`sweep_build`) and every point's
+                                       solve as an `ilp` event with its `M` and `C`.
+
+    Returns:
+        list: A `SweepPoint` per capacity pair, in the order of `capacities`.
+    """
+    capacities = [(float(M), float(C)) for M, C in capacities]
+    if not capacities:
+        return []
+    graph = as_workflow_graph(graph, N)
+    order = sorted(range(len(capacities)), key=lambda i: capacities[i])
+    ordered = [capacities[i] for i in order]
+
+    workers = max(1, min(num_threads, len(ordered)))
+    model_args = {'candidate_roots': candidate_roots, 'max_k': max_k, 'mip_gap': ilp_mip_gap,
+                  'mip_focus': ilp_mip_focus, 'num_threads': num_threads if workers == 1 else 1}
+    # Contiguous runs, so that each worker's warm starts come from neighbouring points.
+    bounds = [len(ordered) * w // workers for w in range(workers + 1)]
+    chunks = [(graph, N, root_node, all_nodes, full_reachable_from, model_args,
+               ordered[bounds[w]:bounds[w + 1]], ilp_time_limit, trace is not None)
+              for w in range(workers)]
+
+    if workers == 1:
+        outcomes = [_sweep_chunk(chunks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(_sweep_chunk, chunks))
+
+    results = [None] * len(capacities)
+    solved = (point for points, _ in outcomes for point in points)
+    for i, point in zip(order, solved):
+        results[i] = point
+    if trace is not None:
+        for _, events in outcomes:
+            trace.extend(events)
+    return results
+
+
+def pareto_front(points):
+    """
+    The points of a sweep that no other point beats: no point has at most the same
+    memory and CPU and a lower cost, or the same cost with less memory or CPU.
+    Beyond the last of them, more capacity no longer reduces cross-container calls.
+
+    Returns:
+        list: The feasible, non-dominated `SweepPoint`s, by increasing (M, C).
+    """
+    feasible = [p for p in points if p.cost is not None]
+
+    def dominates(q, p):
+        return (q.M <= p.M and q.C <= p.C and q.cost <= p.cost + 1e-9
+                and (q.M < p.M or q.C < p.C or q.cost < p.cost - 1e-9))
+
+    front = [p for p in feasible if not any(dominates(q, p) for q in feasible)]
+    return sorted(front, key=lambda p: (p.M, p.C))
+
+
+if __name__ == "__main__":
+    from export_plan import load_graph
+    from rdag import preprocess_graph
+
+    parser = argparse.ArgumentParser(description="Cost of the best merge plan against container capacity.")
+    parser.add_argument("graph", help="call graph in networkx node-link JSON (nodes with m/c, edges with weight/type)")
+    parser.add_argument("--M", type=float, nargs="+", required=True, help="memory capacities to sweep")
+    parser.add_argument("--C", type=float, nargs="+", required=True,
+                        help="CPU capacities to sweep (one per --M value, or a single value for all)")
+    parser.add_argument("--N", type=int, default=None,
+                        help="number of workflow invocations in the profile (default: from the graph file, else 1)")
+    parser.add_argument("--max-k", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=None, help="Gurobi time limit per point in seconds")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--out", default=None, help="write the frontier here as JSON")
+    args = parser.parse_args()
+
+    if len(args.C) == 1:
+        args.C = args.C * len(args.M)
+    if len(args.C) != len(args.M):
+        parser.error("--C takes one value per --M value, or a single value")
+
+    G, N = load_graph(args.graph)
+    if args.N is not None:
+        N = args.N
+    root, all_nodes, preds, reach = preprocess_graph(G)
+    start = time.time()
+    points = capacity_sweep(G, zip(args.M, args.C), N, root, all_nodes, preds, reach, max_k=args.max_k,
+                            ilp_time_limit=args.time_limit, num_threads=args.threads)
+    elapsed = time.time() - start
+
+    front = {(p.M, p.C) for p in pareto_front(points)}
+    print(f"{'M':>10} {'C':>10} {'cost':>12} {'roots':>6} {'pareto':>7}")
+    for p in points:
+        cost = f"{p.cost:.4f}" if p.cost is not None else "infeasible"
+        roots = len(p.R) if p.R else 0
+        print(f"{p.M:>10g} {p.C:>10g} {cost:>12} {roots:>6} {'*' if (p.M, p.C) in front else '':>7}")
+    print(f"Swept {len(points)} capacities in {elapsed:.2f}s")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump([{'M': p.M, 'C': p.C, 'cost': p.cost, 'bound': p.bound,
+                        'roots': sorted(map(str, p.R)) if p.R else None, 'pareto': (p.M, p.C) in front}
+                       for p in points], f, indent=2)
@@ -8,6 +8,7 @@ from weighted_degree import select_weighted_degree_candidates
 from downstream_impact import select_downstream_candidate_roots
 from rdag import generate_async_rdag, preprocess_graph
 from ilp import print_solution_details
+from telemetry import span
 
 try:
     REC_LIMIT = 5000
@@ -25,11 +26,14 @@ def run_comparison(name, graph, M, C, N, max_k,
                    optimal_max_combinations_threshold,
                    heuristic_strategy_mode,
                    # Parallelism control
-                   num_threads):
+                   num_threads,
+                   # Telemetry
+                   trace=None):
     """
     Runs a full comparison between the Baseline, Optimal, Downstream Impact, and
     Weighted Degree strategies for a given graph and set of constraints.
     This function orchestrates the execution of each strategy and prints a summary.
+    If a `SolverTrace` is given, preprocessing, each strategy and every ILP are recorded in it.
     """
     print(f"\n{'='*25} Running Comparison: {name} {'='*25}")
     print(f"Nodes: {len(graph)}, Edges: {len(graph.edges)}")
@@ -44,7 +48,8 @@ def run_comparison(name, graph, M, C, N, max_k,
 
     # --- Pre-computation Step ---
     start_preprocess = time.time()
-    preprocess_res = preprocess_graph(graph)
+    with span(trace, 'preprocess', nodes=len(graph)):
+        preprocess_res = preprocess_graph(graph)
     if preprocess_res is None: return
     root, nodes, preds, reach = preprocess_res
     print(f"Preprocessing Time: {time.time() - start_preprocess:.2f}s")
@@ -72,7 +77,8 @@ def run_comparison(name, graph, M, C, N, max_k,
             candidate_selector_fn=None, # None means all nodes are candidates
             max_combinations_threshold=optimal_max_combinations_threshold,
             ilp_time_limit=time_limit_optimal,
-            num_threads=num_threads
+            num_threads=num_threads,
+            trace=trace
         )
         results["Optimal"] = (opt_res, time.time() - start_opt)
     else:
@@ -96,7 +102,8 @@ def run_comparison(name, graph, M, C, N, max_k,
         ilp_time_limit=time_limit_approx,
         ilp_mip_gap=ilp_mip_gap_approx,
         ilp_mip_focus=1,
-        num_threads=num_threads
+        num_threads=num_threads,
+        trace=trace
     )
     results["Downstream Impact"] = (ds_res, time.time() - start_ds)
 
@@ -114,7 +121,8 @@ def run_comparison(name, graph, M, C, N, max_k,
         ilp_time_limit=time_limit_approx,
         ilp_mip_gap=ilp_mip_gap_approx,
         ilp_mip_focus=1,
-        num_threads=num_threads
+        num_threads=num_threads,
+        trace=trace
     )
     results["Weighted Degree"] = (wd_res, time.time() - start_wd)
 
@@ -0,0 +1,217 @@
+import argparse
+import collections
+import json
+import os
+
+import networkx as nx
+
+# Manifest format shared with `benchmark/merge_pipeline` (see `merge_pipeline.batch.write_manifest`).
+MANIFEST_NAME = "manifest.json"
+
+
+def subgraphs_from_assignment(best_assignment):
+    """
+    Groups a solver assignment `{(i, r): 1}` by root.
+
+    Returns:
+        dict: root -> set of functions in the subgraph rooted there. A function
+              that was cloned appears in the set of every subgraph it was assigned to.
+    """
+    subgraphs = collections.defaultdict(set)
+    for (i, r), assigned in best_assignment.items():
+        if assigned == 1:
+            subgraphs[r].add(i)
+    return subgraphs
+
+
+def subgraph_edges(graph, root, nodes):
+    """
+    Lists the internal edges of the subgraph rooted at `root` in funcTree order.
+
+    The funcTree format requires the entry function to be the caller on the
+    first line, and a caller to be merged before its own callees are rewired
+    (`merge_existing`). A breadth-first traversal from the root over the edges
+    that stay inside `nodes` satisfies both. Edges to other roots are RPC calls
+    and are not part of the tree.
+
+    Args:
+        graph (nx.DiGraph): The workflow's call graph.
+        root: The root of the subgraph.
+        nodes (set): All functions assigned to the subgraph (including the root).
+
+    Returns:
+        list: `(caller, callee)` edges.
+    """
+    edges = []
+    visited = {root}
+    queue = collections.deque([root])
+    while queue:
+        u = queue.popleft()
+        for v in sorted(graph.successors(u), key=str):
+            if v not in nodes:
+                continue
+            edges.append((u, v))
+            if v not in visited:
+                visited.add(v)
+                queue.append(v)
+
+    unreachable = set(nodes) - visited
+    if unreachable:
+        raise ValueError(f"Subgraph rooted at {root} is not connected: {sorted(unreachable, key=str)} "
+                         f"cannot be reached from the root.")
+    return edges
+
+
+def export_merge_plan(graph, best_R, best_assignment, out_dir, app_dir=None, strategy=None,
+                      tree_dir="funcTrees"):
+    """
+    Writes one funcTree file per subgraph root and a build manifest for them.
+
+    This turns a solver result into the inputs of the merge pipeline, so that a
+    plan can go from the profiler to images without hand-written funcTrees.
+    Each funcTree is named `funcTree.<root>` like the hand-written ones under
+    `benchmark/*/*/merge/funcTrees`. A subgraph that only contains its root has
+    nothing to merge: it is deployed as the original function and listed under
+    `standalone` in the manifest instead of getting a funcTree.
+
+    Node names must be the function names of the app (e.g. `compose-post`).
+
+    Args:
+        graph (nx.DiGraph): The workflow's call graph the solver ran on.
+        best_R (set): The selected roots.
+        best_assignment (dict): The solver assignment `{(i, r): 1}`.
+        out_dir (str): Where the manifest and the funcTree directory are written.
+        app_dir (str, optional): App directory with the `functions` of the workflow, e.g.
+                                 `benchmark/DeathStarBench_fakedb/social_network`. Stored
+                                 relative to the manifest.
+        strategy (str, optional): Merge strategy (`sync`, `async`, ...). If omitted, the
+                                  builder infers it from the app directory.
+        tree_dir (str): Subdirectory of `out_dir` for the funcTree files.
+
+    Returns:
+        dict: The manifest that was written to `out_dir/manifest.json`.
+    """
+    subgraphs = subgraphs_from_assignment(best_assignment)
+    os.makedirs(os.path.join(out_dir, tree_dir), exist_ok=True)
+
+    workflows = []
+    standalone = []
+    for r in sorted(best_R, key=str):
+        nodes = subgraphs.get(r, {r})
+        edges = subgraph_edges(graph, r, nodes)
+        if not edges:
+            standalone.append(str(r))
+            continue
+
+        rel = os.path.join(tree_dir, f"funcTree.{r}")
+        with open(os.path.join(out_dir, rel), "w") as f:
+            f.write("".join(f"{u} {v}\n" for u, v in edges))
+
+        entry = {"funcTree": rel, "caller": str(r)}
+        if app_dir:
+            entry["app"] = os.path.basename(os.path.abspath(app_dir))
+            entry["app_dir"] = os.path.relpath(os.path.abspath(app_dir), os.path.abspath(out_dir))
+        if strategy:
+            entry["strategy"] = strategy
+        # Cloned functions are merged into every subgraph that contains them.
+        entry["cloned"] = sorted((str(i) for i in nodes if sum(i in s for s in subgraphs.values()) > 1))
+        workflows.append(entry)
+
+    manifest = {"workflows": workflows, "standalone": standalone}
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_merge_plan(manifest_path):
+    """
+    Reads a plan written by `export_merge_plan` back into a solver assignment.
+
+    Returns:
+        dict: The assignment `{(i, r): 1}` of every function in every funcTree, and of
+              every standalone root to itself.
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    out_dir = os.path.dirname(manifest_path)
+    assignment = {(r, r): 1 for r in manifest["standalone"]}
+    for entry in manifest["workflows"]:
+        root = entry["caller"]
+        assignment[root, root] = 1
+        with open(os.path.join(out_dir, entry["funcTree"])) as f:
+            for line in f:
+                for i in line.split():
+                    assignment[i, root] = 1
+    return assignment
+
+
+def load_graph(path):
+    """
+    Reads a call graph in networkx node-link JSON (as written by `trace_ingest.py`).
+
+    Returns:
+        tuple: `(graph, N)`, where N is the invocation count stored with the graph (1 if absent).
+    """
+    with open(path) as f:
+        data = json.load(f)
+    # Node-link JSON; the edge list key is 'links' or 'edges' depending on the networkx version.
+    G = nx.DiGraph()
+    for node in data["nodes"]:
+        G.add_node(node["id"], **{k: v for k, v in node.items() if k != "id"})
+    for link in data.get("links", data.get("edges", [])):
+        G.add_edge(link["source"], link["target"], **{k: v for k, v in link.items() if k not in ("source", "target")})
+    return G, data.get("graph", {}).get("N") or 1
+
+
+if __name__ == "__main__":
+    from rdag import preprocess_graph
+    from root_selector import run_root_selection_strategy
+    from downstream_impact import select_downstream_candidate_roots
+    from telemetry import SolverTrace, span
+
+    parser = argparse.ArgumentParser(description="Solve the merge problem for a workflow and write funcTrees for it.")
+    parser.add_argument("graph", help="call graph in networkx node-link JSON (nodes with m/c, edges with weight/type)")
+    parser.add_argument("--M", type=float, required=True, help="memory capacity per container")
+    parser.add_argument("--C", type=float, required=True, help="CPU capacity per container")
+    parser.add_argument("--N", type=int, default=None,
+                        help="number of workflow invocations in the profile (default: from the graph file, else 1)")
+    parser.add_argument("--max-k", type=int, default=8)
+    parser.add_argument("--app-dir", default=None)
+    parser.add_argument("--strategy", default=None, help="merge strategy recorded in the manifest")
+    parser.add_argument("--out", default="merge_plan")
+    parser.add_argument("--size-weight", type=float, default=0.0,
+                        help="charge per unit of merged code size (node attribute 'size'), in call weight")
+    parser.add_argument("--cold-start-weight", type=float, default=0.0,
+                        help="charge per unit of replica cold-start cost (node attribute 'cold_start'), in call weight")
+    parser.add_argument("--objective", choices=["calls", "latency"], default="calls",
+                        help="minimize the weight of remote calls, or the expected end-to-end latency")
+    parser.add_argument("--rpc-latency", type=float, default=1.0,
+                        help="RPC overhead in ms of calls without a measured 'rpc_latency' (latency objective)")
+    parser.add_argument("--trace", default=None,
+                        help="write solver telemetry here (.jsonl for JSON lines, otherwise Chrome trace JSON)")
+    args = parser.parse_args()
+
+    G, N = load_graph(args.graph)
+    if args.N is None:
+        args.N = N
+
+    trace = SolverTrace() if args.trace else None
+    with span(trace, 'preprocess', nodes=len(G)):
+        root, all_nodes, preds, reach = preprocess_graph(G)
+    selector_args = {'num_candidates': min(15, len(all_nodes)), 'M': args.M, 'C': args.C, 'N': args.N,
+                     'beta': 0.3, 'gamma': 0.35, 'delta': 0.35}
+    cost, R, assignment, _ = run_root_selection_strategy(
+        "Downstream Impact", G, args.M, args.C, args.N, root, all_nodes, preds, reach, args.max_k,
+        candidate_selector_fn=select_downstream_candidate_roots, selector_args=selector_args,
+        strategy_mode='combinatorial' if len(all_nodes) <= 10 else 'greedy_refine', trace=trace,
+        objective_weights={'size_weight': args.size_weight, 'cold_start_weight': args.cold_start_weight},
+        objective=args.objective, rpc_latency=args.rpc_latency)
+    if trace is not None:
+        trace.write(args.trace)
+        print(json.dumps(trace.summary(), indent=2))
+    if assignment is None:
+        raise SystemExit("No feasible merge plan found.")
+
+    manifest = export_merge_plan(G, R, assignment, args.out, app_dir=args.app_dir, strategy=args.strategy)
+    print(f"Cost {cost}: wrote {len(manifest['workflows'])} funcTrees to {args.out} "
+          f"({len(manifest['standalone'])} standalone functions)")
@@ -1,13 +1,18 @@
 import gurobipy as gp
 from gurobipy import GRB
 import collections
-import math
+import time
+import numpy as np
+from workflow_graph import as_workflow_graph
 
 # A small constant to prevent division-by-zero errors in floating-point calculations.
 EPSILON = 1e-9
 
 def solve_subgraph_construction(graph, R_set, M, C, N, all_nodes, predecessors, full_reachable_from,
-                                time_limit=None, mip_gap=0.0, mip_focus=0, num_threads=1):
+                                time_limit=None, mip_gap=0.0, mip_focus=0, num_threads=1, warm_start=None,
+                                trace=None, info=None, optional_roots=(), max_roots=None, entries=(),
+                                memory_weight=0.0, size_weight=0.0, cold_start_weight=0.0,
+                                objective='calls', rpc_latency=1.0):
     """
     Solves the subgraph construction problem for a given set of candidate roots (R_set)
     using an Integer Linear Program (ILP).
@@ -17,159 +22,115 @@ def solve_subgraph_construction(graph, R_set, M, C, N, all_nodes, predecessors,
     to one or more subgraphs, each rooted at a node in R_set, to minimize the total
     weight of inter-subgraph calls while respecting resource constraints.
 
+    Cloning a function only costs capacity in that formulation. The optional weights
+    below also charge for what clones and bigger merged binaries cost in production:
+    deployed memory, image bytes (the `size` node attribute) and replica startup time
+    (the `cold_start` node attribute). Each weight converts its unit into call weight,
+    and the returned cost includes the charges.
+
     Args:
-        graph (nx.DiGraph): The workflow's call graph.
+        graph (nx.DiGraph or WorkflowGraph): The workflow's call graph. An nx.DiGraph is
+                                             converted on every call, so callers that solve
+                                             many ILPs on one graph should convert it once.
         R_set (set): The set of nodes chosen to be roots of the subgraphs.
         M (float): The maximum memory capacity per container.
         C (float): The maximum CPU capacity per container.
         N (int): The total number of times the workflow was invoked (for async cost calculation).
         all_nodes (list): A list of all nodes in the graph.
-        predecessors (dict): A mapping of each node to its predecessors.
+        predecessors (dict): A mapping of each node to its predecessors. Unused: the
+                             predecessors are read from the graph's own arrays.
         full_reachable_from (dict): A mapping showing which nodes are reachable from any other node.
         time_limit (float, optional): Gurobi solver time limit in seconds.
         mip_gap (float, optional): Gurobi solver MIP gap tolerance.
         mip_focus (int, optional): Gurobi solver MIP focus setting.
         num_threads (int, optional): Number of threads for the Gurobi solver.
+        warm_start (dict, optional): A previous assignment `{(i, r): 1}` used as the MIP start.
+                                     Entries for roots outside R_set are ignored; if the start
+                                     is infeasible for the new graph, Gurobi discards it.
+        trace (SolverTrace, optional): If given, the solve is recorded as an `ilp` event with the
+                                       Gurobi environment start time, the model build time, the
+                                       presolve and solve time, node count, MIP gap and the
+                                       incumbents reported by a Gurobi callback (see `telemetry.py`).
+        info (dict, optional): If given, filled with the `bound` proven by the solver (the objective
+                               for an optimal solution, a lower bound if the time limit was hit)
+                               and the Gurobi `runtime`. With `optional_roots` or `entries`, also
+                               `remote_roots`: the roots that are called across containers.
+        optional_roots (iterable, optional): Roots the solver may open in addition to R_set (see
+                                             `build_subgraph_model`). An optional root `r` was opened
+                                             if the assignment contains `(r, r)`.
+        max_roots (int, optional): The maximum number of opened roots, including R_set.
+        entries (iterable, optional): Roots that always get a subgraph (like R_set), but that their
+                                      callers may clone instead of calling across containers.
+        memory_weight (float, optional): If positive, the objective also charges this much per unit
+                                         of memory deployed over all subgraphs (counting clones and
+                                         async instances), so that cloning is only chosen if the
+                                         calls it saves are worth the memory.
+        size_weight (float, optional): Charge per unit of code `size` over all subgraphs. A subgraph's
+                                       merged binary holds the code of all its members, so every
+                                       clone adds its size to the total image bytes.
+        cold_start_weight (float, optional): Charge per unit of `cold_start` over all subgraphs. A
+                                             replica of a subgraph initializes all its members when
+                                             it starts, so its cold start grows with every member.
+        objective (str, optional): 'calls' (the default) or 'latency', which minimizes the expected
+                                   end-to-end latency instead (see `build_subgraph_model`).
+        rpc_latency (float, optional): For the latency objective, the RPC overhead of calls that
+                                       have no measured `rpc_latency` edge attribute.
 
     Returns:
         tuple: A tuple containing the solver status, the final objective cost, and the
                solution assignment dictionary.
     """
 
+    start = time.time()
+
     # Create a silent Gurobi environment to prevent solver logs from printing to the console.
     with gp.Env(empty=True) as env:
         env.setParam('LogToConsole', 0)
         env.start()
+        env_ready = time.time()
 
         # Create the model within the silent environment.
         with gp.Model("SubgraphConstruction_ILP_Async", env=env) as model:
 
             # --- Configure Solver Parameters ---
             model.setParam(GRB.Param.Threads, num_threads)
-            if time_limit:
+            if time_limit is not None:
                 model.setParam(GRB.Param.TimeLimit, time_limit)
             if mip_gap > 0:
                 model.setParam(GRB.Param.MIPGap, mip_gap)
             if mip_focus > 0:
                 model.setParam(GRB.Param.MIPFocus, mip_focus)
 
-            # --- Decision Variables (Appendix A.2) ---
-
-            # Filter for roots in R_set that actually exist in the graph.
-            valid_roots_in_R = {r for r in R_set if r in graph and r in full_reachable_from}
+            wg = as_workflow_graph(graph, N)
+            formulation = build_subgraph_model(model, wg, R_set, M, C, all_nodes, full_reachable_from,
+                                               optional_roots=optional_roots, max_roots=max_roots, entries=entries,
+                                               objective=objective, rpc_latency=rpc_latency)
 
             # If R_set is specified but contains no valid roots, the problem is ill-defined.
-            if not valid_roots_in_R and R_set:
+            if formulation is None:
                 return GRB.INFEASIBLE, None, None
 
-            # y[i, r]: A binary variable that is 1 if function 'i' is assigned to the
-            # subgraph rooted at 'r', and 0 otherwise.
-            # We only create variables where node 'i' is reachable from root 'r'.
-            y_indices = []
-            for r_ in valid_roots_in_R:
-                for i in full_reachable_from.get(r_, set()):
-                    y_indices.append((i, r_))
-            y = model.addVars(y_indices, vtype=GRB.BINARY, name="y")
-
-            # z[u, v, r]: An auxiliary binary variable for each asynchronous edge (u, v).
-            # This variable will be forced to 1 if and only if both 'u' and 'v' are
-            # assigned to the subgraph rooted at 'r'. This is used to model the
-            # non-linear resource penalty for internal asynchronous calls.
-            async_edges = [(u, v) for u, v, d in graph.edges(data=True) if d.get('type') == 'async']
-            z_indices = [(u, v, r) for u, v in async_edges for r in valid_roots_in_R if (u,r) in y and (v,r) in y]
-            z = model.addVars(z_indices, vtype=GRB.BINARY, name="z")
-
-            # --- Objective Function (Appendix A.3) ---
-            # The goal is to minimize the sum of weights of all cross-graph edges.
-            # The paper formulates this by maximizing the "savings" from internalizing edges.
-            # An edge (i, j) where j is a root is "saved" (not a cross-edge) if node i is
-            # also assigned to the subgraph of j (i.e., y[i, j] = 1).
-
-            # Calculate the total potential cost, assuming every edge pointing to a root is a cross-edge.
-            total_potential_cost = sum(graph.edges[i, j]['weight']
-                                       for i, j in graph.edges() if j in valid_roots_in_R)
-
-            # Calculate the total "savings" by summing the weights of edges (i,j) that are internalized.
-            cost_savings = gp.quicksum(graph.edges[i, j]['weight'] * y[i, j]
-                                       for i, j in graph.edges()
-                                       if j in valid_roots_in_R and (i, j) in y)
-
-            # Minimize: (Total Potential Cost) - (Total Savings)
-            model.setObjective(total_potential_cost - cost_savings, GRB.MINIMIZE)
-
-            # --- Constraints (Appendix A.4) ---
-
-            # Constraint 1: Root Inclusion
-            # Every chosen root 'r' must belong to its own subgraph.
-            for r_ in valid_roots_in_R:
-                model.addConstr(y[r_, r_] == 1, name=f"RootInclude_{r_}")
-
-            # Constraint 2: Node Coverage
-            # Every function 'i' in the workflow must be assigned to at least one subgraph.
-            # The use of >= 1 allows for non-disjoint partitions, meaning a function can be
-            # duplicated (cloned) into multiple merged subgraphs if it is optimal to do so.
-            for i in all_nodes:
-                model.addConstr(gp.quicksum(y[i, r_] for r_ in valid_roots_in_R if (i, r_) in y) >= 1, name=f"NodeCover_{i}")
-
-            # Constraint 3: Connectivity
-            # If a function 'i' is in subgraph G_r, at least one of its direct
-            # predecessors must also be in G_r. This ensures subgraphs are connected.
-            for r_ in valid_roots_in_R:
-                for i in full_reachable_from.get(r_, set()):
-                    if i == r_:
-                        continue
-
-                    preds_i = predecessors.get(i, [])
-                    # Only add the constraint if there's at least one predecessor that *can* be in G_r
-                    if any((j, r_) in y for j in preds_i):
-                         model.addConstr(y[i, r_] <= gp.quicksum(y[j, r_] for j in preds_i if (j, r_) in y), name=f"Connect_{i}_{r_}")
-                    # If i has no predecessors that can be in G_r, it cannot be in G_r itself (unless it's the root).
-                    elif (i, r_) in y:
-                         model.addConstr(y[i, r_] == 0, name=f"Connect_ForceZero_{i}_{r_}")
-
-            # Constraint 4: Cross-Edge Rule
-            # If an edge (i, j) exists and 'j' is NOT a root, then the edge must be internal.
-            # This means if 'i' is in subgraph G_r, 'j' must also be in G_r.
-            for i, j in graph.edges():
-                if j not in valid_roots_in_R:
-                    for r_ in valid_roots_in_R:
-                        if (i, r_) in y and (j, r_) in y:
-                            model.addConstr(y[i, r_] <= y[j, r_], name=f"CrossRule_{i}_{j}_{r_}")
-
-            # Constraints 5 & 6: Memory and CPU Capacity
-            # The total resource usage of each subgraph must not exceed container limits.
-            for r_ in valid_roots_in_R:
-                # Sum of baseline resource requirements for all functions included in the subgraph.
-                mem_sum = gp.quicksum(graph.nodes[i]['m'] * y[i, r_] for i, rr in y.keys() if rr == r_)
-                cpu_sum = gp.quicksum(graph.nodes[i]['c'] * y[i, r_] for i, rr in y.keys() if rr == r_)
-
-                # Calculate the additional resource penalty for internal asynchronous calls.
-                # alpha_uv = ceil(w_uv / N) represents the peak number of concurrent instances of v
-                # called by u. The penalty adds the resource cost for the additional (alpha_uv - 1) instances.
-                async_mem_penalty = gp.quicksum(
-                    z[u, v, r_] * graph.nodes[v]['m'] * (math.ceil(graph.edges[u, v]['weight'] / N) - 1)
-                    for u, v, rr in z.keys()
-                    if rr == r_ and math.ceil(graph.edges[u, v]['weight'] / N) > 1
-                )
-                async_cpu_penalty = gp.quicksum(
-                    z[u, v, r_] * graph.nodes[v]['c'] * (math.ceil(graph.edges[u, v]['weight'] / N) - 1)
-                    for u, v, rr in z.keys()
-                    if rr == r_ and math.ceil(graph.edges[u, v]['weight'] / N) > 1
-                )
-
-                model.addConstr(mem_sum + async_mem_penalty <= M, name=f"CapacityM_{r_}")
-                model.addConstr(cpu_sum + async_cpu_penalty <= C, name=f"CapacityC_{r_}")
-
-            # Constraint 7: Auxiliary Variable Linearization
-            # These three constraints force z[u,v,r] to be 1 if and only if y[u,r] and y[v,r] are both 1.
-            # This is a standard ILP technique to model the logical AND operation (z = y_u AND y_v).
-            for u, v, r_ in z.keys():
-                model.addConstr(z[u, v, r_] <= y[u, r_], name=f"z_lin1_{u}_{v}_{r_}")
-                model.addConstr(z[u, v, r_] <= y[v, r_], name=f"z_lin2_{u}_{v}_{r_}")
-                model.addConstr(z[u, v, r_] >= y[u, r_] + y[v, r_] - 1, name=f"z_lin3_{u}_{v}_{r_}")
+            if memory_weight > 0 or size_weight > 0 or cold_start_weight > 0:
+                expr = formulation.cost
+                if memory_weight > 0:
+                    expr = expr + memory_weight * gp.quicksum(mem for mem, _ in formulation.usage.values())
+                if size_weight > 0 or cold_start_weight > 0:
+                    expr = expr + formulation.member_sum(size_weight * wg.size + cold_start_weight * wg.cold_start)
+                model.setObjective(expr, GRB.MINIMIZE)
+
+            # Seed the search with a previous solution (e.g., the plan that is currently deployed).
+            if warm_start:
+                labels = wg.labels
+                for (i, r_), var in formulation.y.items():
+                    var.Start = 1 if warm_start.get((labels[i], labels[r_])) == 1 else 0
 
             # --- Solve ---
-            model.optimize()
+            if trace is None:
+                model.optimize()
+            else:
+                build_s = time.time() - env_ready
+                incumbents, presolve = [], [0.0]
+                model.optimize(_telemetry_callback(incumbents, presolve))
 
             # --- Process and Return Results ---
             status = model.Status
@@ -180,14 +141,348 @@ def solve_subgraph_construction(graph, R_set, M, C, N, all_nodes, predecessors,
             if model.SolCount > 0:
                 objective_value = model.ObjVal
                 # Create a simple dictionary representing the final assignment.
-                assignment = {(i, r): 1 for (i, r), var in y.items() if var.X > 0.9}
+                assignment = formulation.assignment(model)
                 # Ensure status reflects that a usable (even if not proven optimal) solution was found.
                 if status not in [GRB.OPTIMAL, GRB.SUBOPTIMAL, GRB.TIME_LIMIT]:
                     status = GRB.SUBOPTIMAL
 
+            if info is not None:
+                info['bound'] = model.ObjBound if model.SolCount > 0 else None
+                info['runtime'] = model.Runtime
+                if formulation.x and model.SolCount > 0:
+                    info['remote_roots'] = formulation.remote_roots(model)
+
+            if trace is not None:
+                trace.add('ilp', start, time.time() - start, cat='ilp',
+                          roots=sorted((wg.labels[r] for r in formulation.roots), key=str), status=status, objective=objective_value,
+                          env_s=env_ready - start, build_s=build_s, presolve_s=presolve[0], solve_s=max(model.Runtime - presolve[0], 0.0),
+                          node_count=int(model.NodeCount), mip_gap=model.MIPGap if model.SolCount > 0 else None,
+                          num_vars=model.NumVars, num_constrs=model.NumConstrs, incumbents=incumbents)
+
             return status, objective_value, assignment
 
 
+class SubgraphModel(collections.namedtuple('SubgraphModel', ['y', 'z', 'x', 'roots', 'capacity', 'usage', 'cost', 'labels'])):
+    """
+    The variables and capacity constraints that `build_subgraph_model` added to a model.
+
+    Fields:
+        y, z (tupledict): The assignment and async-pair variables, keyed by node and edge ids.
+        x (tupledict): `x[r]` is 1 if calls into the optional root or entry `r` are cross-container
+                       calls, i.e. an optional root is opened or an entry is not cloned into its callers.
+        roots (list): Ids of all roots that may hold a subgraph (fixed, entries and optional).
+        capacity (dict): root id -> `(memory constraint, CPU constraint)`; their RHS are M and C.
+        usage (dict): root id -> `(memory, CPU)` of its subgraph as linear expressions (the left-hand
+                      sides of the capacity constraints), for objectives that charge for resources.
+        cost (gp.LinExpr): The weight of cross-subgraph calls, the model's objective.
+        labels (tuple): Node labels by id.
+    """
+
+    def assignment(self, model):
+        """The solution of `model` as `{(node, root): 1}` over node labels."""
+        labels = self.labels
+        return {(labels[i], labels[r]): 1 for (i, r), x in model.getAttr('X', self.y).items() if x > 0.9}
+
+    def opened_roots(self, model):
+        """The roots that hold a subgraph in the solution of `model`."""
+        own = model.getAttr('X', [self.y[r, r] for r in self.roots])
+        return {self.labels[r] for r, x in zip(self.roots, own) if x > 0.5}
+
+    def remote_roots(self, model):
+        """The roots that are called across containers in the solution of `model`."""
+        remote = {r for r, x in model.getAttr('X', self.x).items() if x > 0.5} if self.x else set()
+        return {self.labels[r] for r in self.roots if r not in self.x or r in remote}
+
+    def member_sum(self, per_node):
+        """
+        `sum(per_node[i])` over the members `i` of every subgraph, as a linear expression.
+        A function cloned into several subgraphs counts once per subgraph.
+        """
+        keys = list(self.y.keys())
+        return gp.LinExpr([per_node[i] for i, _ in keys], [self.y[k] for k in keys])
+
+    def set_capacity(self, M, C):
+        """Changes the container capacity without rebuilding the model."""
+        for mem, cpu in self.capacity.values():
+            mem.RHS = M
+            cpu.RHS = C
+
+
+def build_subgraph_model(model, wg, R_set, M, C, all_nodes, full_reachable_from, optional_roots=(), max_roots=None,
+                         entries=(), objective='calls', rpc_latency=1.0):
+    """
+    Adds the variables, objective and constraints of the subgraph construction ILP to `model`.
+
+    With `optional_roots`, root selection becomes part of the ILP: each optional root `r`
+    gets a binary `x[r]`, its subgraph may only be non-empty if `x[r] = 1`, and calls into
+    it are cross-container calls only if it is opened. `entries` are roots that always
+    get a subgraph, e.g. the entry functions of several workflows solved together; calls
+    into an entry from inside another subgraph are either cross-container calls (`x[r] = 1`)
+    or the entry is cloned into the caller's subgraph. Without either, this is exactly the
+    model of `solve_subgraph_construction` for the roots in `R_set`.
+
+    Args:
+        model (gp.Model): An empty model.
+        wg (WorkflowGraph): The call graph, with `alpha` computed for the invocation count.
+        R_set (set): Roots that are always opened (typically the workflow's entry function).
+        M, C (float): Container capacity; change it later with `SubgraphModel.set_capacity`.
+        all_nodes, full_reachable_from: Pre-processed graph data.
+        optional_roots (iterable): Roots the solver may open or leave closed.
+        max_roots (int, optional): The maximum number of opened roots, including `R_set` and `entries`.
+        entries (iterable): Roots that are always opened but may also be cloned into their callers.
+        objective (str): 'calls' minimizes the weight of cross-subgraph calls (the paper's objective).
+                         'latency' minimizes the expected end-to-end latency of an invocation of the
+                         workflow: every call into a root pays its RPC overhead (`rpc_latency` edge
+                         attribute), sync calls add up along a path weighted by calls per invocation,
+                         and concurrent async calls count as their longest branch (see
+                         `WorkflowGraph.expected_latency`).
+        rpc_latency (float): RPC overhead of calls without a measured `rpc_latency`.
+
+    Returns:
+        SubgraphModel, or None if `R_set` is not empty but none of its roots are in the graph.
+    """
+    labels, src, dst = wg.labels, wg.src, wg.dst
+
+    # --- Decision Variables (Appendix A.2) ---
+    # Variables and constraints are indexed by the integer node ids of the
+    # WorkflowGraph; the assignment is translated back to node labels at the end.
+
+    # Filter for roots in R_set that actually exist in the graph.
+    valid_roots_in_R = {r for r in R_set if r in wg and r in full_reachable_from}
+    if not valid_roots_in_R and R_set:
+        return None
+    valid_entries = {wg.index[r] for r in entries
+                     if r in wg and r in full_reachable_from and r not in valid_roots_in_R}
+    optional = {wg.index[r] for r in optional_roots
+                if r in wg and r in full_reachable_from and r not in valid_roots_in_R} - valid_entries
+
+    roots = sorted({wg.index[r] for r in valid_roots_in_R} | valid_entries | optional)
+    root_pos = np.full(len(labels), -1, dtype=np.int64)
+    root_pos[roots] = np.arange(len(roots))
+    is_root = root_pos >= 0
+    # Roots with an x variable: calls into them are only cross-container calls if x = 1.
+    is_optional = np.zeros(len(labels), dtype=bool)
+    is_optional[list(optional | valid_entries)] = True
+
+    # reachable[i, k]: node i is reachable from the k-th root.
+    reachable = np.zeros((len(labels), len(roots)), dtype=bool)
+    for k, r_ in enumerate(roots):
+        reachable[wg.ids(full_reachable_from.get(labels[r_], set())), k] = True
+
+    # y[i, r]: A binary variable that is 1 if function 'i' is assigned to the
+    # subgraph rooted at 'r', and 0 otherwise.
+    # We only create variables where node 'i' is reachable from root 'r'.
+    y_indices = [(i, roots[k]) for k in range(len(roots)) for i in np.flatnonzero(reachable[:, k]).tolist()]
+    y = model.addVars(y_indices, vtype=GRB.BINARY, name="y")
+
+    # x[r]: 1 if the optional root 'r' is opened, or if the entry 'r' is called across containers.
+    x = model.addVars(sorted(optional | valid_entries), vtype=GRB.BINARY, name="x")
+
+    # z[e, r]: An auxiliary binary variable for each asynchronous edge e = (u, v).
+    # This variable will be forced to 1 if and only if both 'u' and 'v' are
+    # assigned to the subgraph rooted at 'r'. This is used to model the
+    # non-linear resource penalty for internal asynchronous calls.
+    async_edges = np.flatnonzero(wg.is_async)
+    z_edge, z_root = np.nonzero(reachable[src[async_edges]] & reachable[dst[async_edges]])
+    z_indices = list(zip(async_edges[z_edge].tolist(), [roots[k] for k in z_root.tolist()]))
+    z = model.addVars(z_indices, vtype=GRB.BINARY, name="z")
+
+    # --- Objective Function (Appendix A.3) ---
+    # The goal is to minimize the sum of weights of all cross-graph edges.
+    # The paper formulates this by maximizing the "savings" from internalizing edges.
+    # An edge (i, j) where j is a root is "saved" (not a cross-edge) if node i is
+    # also assigned to the subgraph of j (i.e., y[i, j] = 1).
+
+    # Calculate the total potential cost, assuming every edge pointing to a root is a cross-edge.
+    # Edges into an optional root or an entry only count if x is 1.
+    into_root = np.flatnonzero(is_root[dst])
+    into_fixed = into_root[~is_optional[dst[into_root]]]
+    into_optional = into_root[is_optional[dst[into_root]]]
+    total_potential_cost = float(wg.weight[into_fixed].sum())
+    if len(into_optional):
+        total_potential_cost = total_potential_cost + gp.LinExpr(
+            wg.weight[into_optional].tolist(), [x[j] for j in dst[into_optional].tolist()])
+
+    # Calculate the total "savings" by summing the weights of edges (i,j) that are internalized.
+    saved = into_root[reachable[src[into_root], root_pos[dst[into_root]]]]
+    cost_savings = gp.LinExpr(wg.weight[saved].tolist(),
+                              [y[i, j] for i, j in zip(src[saved].tolist(), dst[saved].tolist())])
+
+    # Minimize: (Total Potential Cost) - (Total Savings)
+    cost = total_potential_cost - cost_savings
+    if objective == 'latency':
+        cost = _latency_objective(model, wg, roots, x, rpc_latency)
+    elif objective != 'calls':
+        raise ValueError(f"Unknown objective: {objective}")
+    model.setObjective(cost, GRB.MINIMIZE)
+
+    # --- Constraints (Appendix A.4) ---
+
+    # Constraint 1: Root Inclusion
+    # Every chosen root 'r' must belong to its own subgraph. An optional root belongs to its
+    # own subgraph if it is opened; if it is not, Constraint 3 keeps its subgraph empty.
+    for r_ in roots:
+        if r_ in optional:
+            model.addConstr(y[r_, r_] == x[r_], name=f"RootInclude_{r_}")
+        else:
+            model.addConstr(y[r_, r_] == 1, name=f"RootInclude_{r_}")
+    if max_roots is not None and optional:
+        model.addConstr(gp.quicksum(x[r_] for r_ in optional) <= max_roots - len(valid_roots_in_R) - len(valid_entries),
+                        name="MaxRoots")
+
+    # Constraint 2: Node Coverage
+    # Every function 'i' in the workflow must be assigned to at least one subgraph.
+    # The use of >= 1 allows for non-disjoint partitions, meaning a function can be
+    # duplicated (cloned) into multiple merged subgraphs if it is optimal to do so.
+    reachable_rows = reachable.tolist()
+    for i in wg.ids(all_nodes).tolist():
+        model.addConstr(gp.quicksum(y[i, r_] for r_, ok in zip(roots, reachable_rows[i]) if ok) >= 1,
+                        name=f"NodeCover_{i}")
+
+    # Constraint 3: Connectivity
+    # If a function 'i' is in subgraph G_r, at least one of its direct
+    # predecessors must also be in G_r. This ensures subgraphs are connected.
+    pred_ids, in_ptr = wg.src[wg.in_edges].tolist(), wg.in_ptr.tolist()
+    for k, r_ in enumerate(roots):
+        for i in np.flatnonzero(reachable[:, k]).tolist():
+            if i == r_:
+                continue
+
+            preds_i = [j for j in pred_ids[in_ptr[i]:in_ptr[i + 1]] if reachable_rows[j][k]]
+            # Only add the constraint if there's at least one predecessor that *can* be in G_r
+            if preds_i:
+                 model.addConstr(y[i, r_] <= gp.quicksum(y[j, r_] for j in preds_i), name=f"Connect_{i}_{r_}")
+            # If i has no predecessors that can be in G_r, it cannot be in G_r itself (unless it's the root).
+            else:
+                 model.addConstr(y[i, r_] == 0, name=f"Connect_ForceZero_{i}_{r_}")
+
+    # Constraint 4: Cross-Edge Rule
+    # If an edge (i, j) exists and 'j' is NOT a root, then the edge must be internal.
+    # This means if 'i' is in subgraph G_r, 'j' must also be in G_r. If 'j' is an
+    # optional root or an entry, the rule only applies while x[j] is 0.
+    into_non_root = np.flatnonzero(~is_root[dst] | is_optional[dst])
+    cross_edge, cross_root = np.nonzero(reachable[src[into_non_root]] & reachable[dst[into_non_root]])
+    for e, k in zip(into_non_root[cross_edge].tolist(), cross_root.tolist()):
+        i, j, r_ = int(src[e]), int(dst[e]), roots[k]
+        if j in x:
+            model.addConstr(y[i, r_] <= y[j, r_] + x[j], name=f"CrossRule_{i}_{j}_{r_}")
+        else:
+            model.addConstr(y[i, r_] <= y[j, r_], name=f"CrossRule_{i}_{j}_{r_}")
+
+    # Constraints 5 & 6: Memory and CPU Capacity
+    # The total resource usage of each subgraph must not exceed container limits.
+    z_edges = async_edges[z_edge]
+    # alpha_uv = ceil(w_uv / N) represents the peak number of concurrent instances of v
+    # called by u. The penalty adds the resource cost for the additional (alpha_uv - 1) instances.
+    z_extra = wg.alpha[z_edges] - 1
+    capacity, usage = {}, {}
+    for k, r_ in enumerate(roots):
+        # Sum of baseline resource requirements for all functions included in the subgraph.
+        members = np.flatnonzero(reachable[:, k])
+        y_r = [y[i, r_] for i in members.tolist()]
+        mem_sum = gp.LinExpr(wg.m[members].tolist(), y_r)
+        cpu_sum = gp.LinExpr(wg.c[members].tolist(), y_r)
+
+        # Calculate the additional resource penalty for internal asynchronous calls.
+        penalized = np.flatnonzero((z_root == k) & (z_extra > 0))
+        z_r = [z[e, r_] for e in z_edges[penalized].tolist()]
+        callees = dst[z_edges[penalized]]
+        async_mem_penalty = gp.LinExpr((wg.m[callees] * z_extra[penalized]).tolist(), z_r)
+        async_cpu_penalty = gp.LinExpr((wg.c[callees] * z_extra[penalized]).tolist(), z_r)
+
+        usage[r_] = (mem_sum + async_mem_penalty, cpu_sum + async_cpu_penalty)
+        capacity[r_] = (model.addConstr(usage[r_][0] <= M, name=f"CapacityM_{r_}"),
+                        model.addConstr(usage[r_][1] <= C, name=f"CapacityC_{r_}"))
+
+    # Constraint 7: Auxiliary Variable Linearization
+    # These three constraints force z[u,v,r] to be 1 if and only if y[u,r] and y[v,r] are both 1.
+    # This is a standard ILP technique to model the logical AND operation (z = y_u AND y_v).
+    for e, r_ in z.keys():
+        u, v = int(src[e]), int(dst[e])
+        model.addConstr(z[e, r_] <= y[u, r_], name=f"z_lin1_{u}_{v}_{r_}")
+        model.addConstr(z[e, r_] <= y[v, r_], name=f"z_lin2_{u}_{v}_{r_}")
+        model.addConstr(z[e, r_] >= y[u, r_] + y[v, r_] - 1, name=f"z_lin3_{u}_{v}_{r_}")
+
+    return SubgraphModel(y, z, x, roots, capacity, usage, cost, labels)
+
+
+def _latency_objective(model, wg, roots, x, rpc_latency):
+    """
+    Adds L[u] >= the expected latency of an invocation of u (as in `WorkflowGraph.expected_latency`)
+    for every node, and returns the latency of the workflow's entry functions as the objective.
+    A call into a root is remote, or, for an optional root or entry, remote if x is 1.
+    """
+    V = len(wg)
+    L = model.addVars(V, lb=0.0, name="L")
+    remote = {r_: x[r_] if r_ in x else 1 for r_ in roots}
+    hop = wg.hop_latency(rpc_latency).tolist()
+    per_call = wg.calls_per_invocation().tolist()
+    out_ptr, dst, is_async = wg.out_ptr.tolist(), wg.dst.tolist(), wg.is_async.tolist()
+    latency = wg.latency.tolist()
+
+    for u in range(V):
+        expr = gp.LinExpr(latency[u])
+        async_edges = []
+        for e in range(out_ptr[u], out_ptr[u + 1]):
+            v = dst[e]
+            if is_async[e]:
+                async_edges.append(e)
+                continue
+            # Sync calls run one after another: each adds its callee's latency and, if remote, the hop.
+            expr.add(L[v], per_call[e])
+            if v in remote:
+                expr.add(remote[v] * (per_call[e] * hop[e]))
+        if async_edges:
+            # Async calls run concurrently: the invocation waits for the longest branch.
+            longest = model.addVar(lb=0.0, name=f"AsyncMax_{u}")
+            for e in async_edges:
+                v = dst[e]
+                model.addConstr(longest >= L[v] + (remote[v] * hop[e] if v in remote else 0),
+                                name=f"AsyncBranch_{u}_{v}")
+            expr.add(longest)
+        model.addConstr(L[u] >= expr, name=f"Latency_{u}")
+
+    sources = np.flatnonzero(np.diff(wg.in_ptr) == 0).tolist()
+    return gp.quicksum(L[s] for s in sources)
+
+
+def objective_charge(graph, subgraphs, memory_weight=0.0, size_weight=0.0, cold_start_weight=0.0):
+    """
+    The resource charges that `solve_subgraph_construction` adds to the cost of a plan, for
+    evaluating a plan without solving (see `planner.plan_cost`).
+
+    Args:
+        graph (WorkflowGraph): The call graph, with `alpha` computed for the invocation count.
+        subgraphs (dict): root -> set of the functions in its subgraph.
+        memory_weight, size_weight, cold_start_weight (float): As for `solve_subgraph_construction`.
+
+    Returns:
+        float: The weighted deployed memory, code size and cold-start cost of all subgraphs.
+    """
+    charge = 0.0
+    for nodes in subgraphs.values():
+        mask = graph.mask(i for i in nodes if i in graph)
+        if memory_weight:
+            charge += memory_weight * graph.resource_usage(mask)[0]
+        charge += size_weight * graph.size[mask].sum() + cold_start_weight * graph.cold_start[mask].sum()
+    return float(charge)
+
+
+def _telemetry_callback(incumbents, presolve):
+    """
+    A Gurobi callback that records the runtime at the end of presolve (in `presolve[0]`)
+    and every new incumbent as `{'t', 'objective', 'bound'}` (in `incumbents`).
+    """
+    def callback(model, where):
+        if where == GRB.Callback.PRESOLVE:
+            presolve[0] = model.cbGet(GRB.Callback.RUNTIME)
+        elif where == GRB.Callback.MIPSOL:
+            incumbents.append({'t': model.cbGet(GRB.Callback.RUNTIME),
+                               'objective': model.cbGet(GRB.Callback.MIPSOL_OBJ),
+                               'bound': model.cbGet(GRB.Callback.MIPSOL_OBJBND)})
+    return callback
+
+
 def print_solution_details(graph, M, C, N, best_R, best_assignment):
     """
     Prints a summary of the ILP solution, including the composition of each
@@ -203,6 +498,7 @@ def print_solution_details(graph, M, C, N, best_R, best_assignment):
         return
 
     print(f"Selected Roots (R): {best_R}")
+    wg = as_workflow_graph(graph, N)
 
     # Reconstruct the subgraphs from the 'y' variable assignments.
     subgraphs = collections.defaultdict(set)
@@ -212,29 +508,19 @@ def print_solution_details(graph, M, C, N, best_R, best_assignment):
 
     print("\nSubgraphs:")
     valid_caps = True
+    # Merged binary sizes are only shown if the graph has code sizes.
+    show_size = bool(wg.size.any() or wg.cold_start.any())
+    total_size = 0.0
     # Iterate through the selected roots to print details for each subgraph.
     for r in sorted(list(best_R), key=lambda x: str(x)):
         nodes_in_subgraph = subgraphs.get(r, set())
         if not nodes_in_subgraph:
             continue
 
-        # Recalculate the resource usage for validation purposes.
+        # Recalculate the resource usage (including the additive penalty for any
+        # internal async calls) for validation purposes.
         # This logic mirrors the capacity constraints in the ILP.
-        m_base = sum(graph.nodes[i]['m'] for i in nodes_in_subgraph)
-        c_base = sum(graph.nodes[i]['c'] for i in nodes_in_subgraph)
-
-        # Recalculate the additive penalty for any internal async calls.
-        async_penalty_m = 0
-        async_penalty_c = 0
-        for u, v, data in graph.edges(data=True):
-            if data.get('type') == 'async' and u in nodes_in_subgraph and v in nodes_in_subgraph:
-                alpha_uv = math.ceil(data.get('weight', 0) / N)
-                if alpha_uv > 1:
-                    async_penalty_m += graph.nodes[v]['m'] * (alpha_uv - 1)
-                    async_penalty_c += graph.nodes[v]['c'] * (alpha_uv - 1)
-
-        m_total = m_base + async_penalty_m
-        c_total = c_base + async_penalty_c
+        m_total, c_total = wg.resource_usage(wg.mask(nodes_in_subgraph))
 
         print(f"  Subgraph rooted at {r}:")
         if len(nodes_in_subgraph) < 50:
@@ -248,8 +534,18 @@ def print_solution_details(graph, M, C, N, best_R, best_assignment):
         print(f"    Memory: {m_total:.1f} <= {M:.1f} {'OK' if m_ok else 'VIOLATED!'}")
         print(f"    CPU:    {c_total:.1f} <= {C:.1f} {'OK' if c_ok else 'VIOLATED!'}")
 
+        if show_size:
+            # The merged binary holds the code of every member, including clones.
+            mask = wg.mask(nodes_in_subgraph)
+            size, cold_start = float(wg.size[mask].sum()), float(wg.cold_start[mask].sum())
+            total_size += size
+            print(f"    Binary size: {size:.1f} (largest function {float(wg.size[mask].max()):.1f}), "
+                  f"cold start: {cold_start:.2f}")
+
         if not m_ok or not c_ok:
             valid_caps = False
 
     print("\nValidation Summary:")
     print(f"  Capacity OK: {valid_caps}")
+    if show_size:
+        print(f"  Total image size: {total_size:.1f} (code size of all functions: {float(wg.size.sum()):.1f})")
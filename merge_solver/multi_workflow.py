@@ -0,0 +1,236 @@
+import argparse
+import collections
+import math
+import os
+
+import numpy as np
+
+from ilp import solve_subgraph_construction
+from rdag import compute_reachability, find_root
+from workflow_graph import WorkflowGraph
+
+# A workflow to deploy: its call graph (weights are call counts over `N` invocations, as built
+# by `trace_ingest.py`), its invocation rate (e.g. requests per second) and its entry function.
+# `N` defaults to `graph.graph['N']` and `entry` to `graph.graph['entry']` or the graph's root.
+Workflow = collections.namedtuple('Workflow', ['name', 'graph', 'rate', 'N', 'entry'], defaults=(1.0, None, None))
+
+# The result of `solve_workflows`. `call_cost` is the rate of cross-container calls and `memory`
+# the memory deployed over all containers; `objective` is `call_cost + memory_weight * memory`
+# (plus the code size and cold-start charges, if they are weighted).
+# `R` are the roots of the containers; an entry in `R` may also be cloned into its callers.
+# `workflows` maps each workflow name to the rate of its cross-container calls (`calls`) and the
+# roots of the containers it runs in (`containers`).
+MultiWorkflowPlan = collections.namedtuple(
+    'MultiWorkflowPlan', ['objective', 'call_cost', 'memory', 'R', 'assignment', 'status', 'workflows', 'graph'])
+
+
+def _entry(workflow):
+    G = workflow.graph
+    return workflow.entry if workflow.entry is not None else G.graph.get('entry') or find_root(G)
+
+
+def _invocations(workflow):
+    N = workflow.N if workflow.N is not None else workflow.graph.graph.get('N') or 1
+    if N <= 0:
+        raise ValueError(f"Workflow {workflow.name}: N must be positive, got {N}.")
+    return N
+
+
+def union_graph(workflows):
+    """
+    Merges the call graphs of several workflows into one graph over their functions.
+
+    Functions with the same name are the same function: they are deployed once and
+    the containers that hold them serve every workflow that calls them. In the union:
+
+    - the edge weight is the rate of the call over all workflows, `sum(weight / N * rate)`
+    - `alpha` (concurrent instances of the callee per call) is the largest `ceil(weight / N)`
+      of any workflow, and the edge is async if it is async in any workflow
+    - `m`, `c`, `size` and `cold_start` are the largest of any workflow's profile of the function
+
+    Returns:
+        tuple: `(graph, entries)`: a WorkflowGraph (with N=1, its `alpha` set as above) and
+               the entry function of each workflow, by name.
+
+    Raises:
+        ValueError: If the union of the call graphs has a cycle.
+    """
+    m, c, size, cold_start = {}, {}, {}, {}
+    rate, alpha, is_async = collections.defaultdict(float), collections.defaultdict(int), collections.defaultdict(bool)
+    entries = {}
+    for w in workflows:
+        G, N = w.graph, _invocations(w)
+        entries[w.name] = _entry(w)
+        for n, d in G.nodes(data=True):
+            m[n] = max(m.get(n, 0), d.get('m', 0))
+            c[n] = max(c.get(n, 0), d.get('c', 0))
+            size[n] = max(size.get(n, 0), d.get('size', 0))
+            cold_start[n] = max(cold_start.get(n, 0), d.get('cold_start', 0))
+        for u, v, d in G.edges(data=True):
+            weight = d.get('weight', 1.0)
+            rate[u, v] += weight / N * w.rate
+            alpha[u, v] = max(alpha[u, v], math.ceil(weight / N))
+            is_async[u, v] |= d.get('type') == 'async'
+
+    labels = list(m)
+    index = {n: i for i, n in enumerate(labels)}
+    edges = list(rate)
+    graph = WorkflowGraph(labels, [m[n] for n in labels], [c[n] for n in labels],
+                          [index[u] for u, _ in edges], [index[v] for _, v in edges],
+                          [rate[e] for e in edges], [is_async[e] for e in edges], N=1,
+                          size=[size[n] for n in labels], cold_start=[cold_start[n] for n in labels])
+    graph.topological_order()  # raises on a cycle
+
+    arrays = graph.arrays()
+    arrays['alpha'] = np.array([alpha[labels[u], labels[v]] for u, v in zip(graph.src.tolist(), graph.dst.tolist())],
+                               dtype=np.int64)
+    return WorkflowGraph.from_arrays(labels, arrays, 1), entries
+
+
+def solve_workflows(workflows, M, C, memory_weight=0.0, candidate_roots=None, max_k=None,
+                    time_limit=None, mip_gap=0.0, num_threads=1, trace=None, size_weight=0.0, cold_start_weight=0.0):
+    """
+    Decides the merged containers of several workflows jointly.
+
+    Solving one workflow at a time gives every workflow its own containers, so a function
+    that several workflows call (e.g. `text-service` in `compose-post` and in `text-service`'s
+    own workflow) is built into an image per workflow. Here the workflows are solved as one
+    ILP over `union_graph(workflows)`: every workflow's entry is a root, any other function
+    may be opened as a root, and a container rooted at a shared function is deployed once
+    and called by all workflows that use it.
+
+    The objective is the rate of cross-container calls over all workflows plus
+    `memory_weight` times the memory deployed over all containers (a function cloned
+    into several containers counts in each). `memory_weight` converts memory into call
+    rate: with calls per second and MiB, 0.1 means that deploying 10 MiB more is worth
+    saving one call per second. With 0, memory is free and functions are cloned wherever
+    that saves calls, as in the single-workflow solver.
+
+    Args:
+        workflows (list): `Workflow`s.
+        M, C (float): Container capacity.
+        memory_weight (float): Cost of a unit of deployed memory, in call rate.
+        candidate_roots (iterable, optional): The functions that may be opened as roots besides
+                                              the entries. Defaults to all functions.
+        max_k (int, optional): The maximum number of containers.
+        time_limit, mip_gap, num_threads: Parameters for the Gurobi solver.
+        trace (SolverTrace, optional): Records the ILP (see `telemetry.py`).
+        size_weight, cold_start_weight (float): Charges for code size and cold starts, added to the
+                                                objective (see `solve_subgraph_construction`).
+
+    Returns:
+        MultiWorkflowPlan, or None if there is no feasible plan.
+    """
+    graph, entries = union_graph(workflows)
+    all_nodes = list(graph.labels)
+    full_reachable_from = compute_reachability(graph.to_networkx(), all_nodes)
+    candidates = all_nodes if candidate_roots is None else candidate_roots
+
+    info = {}
+    status, objective, assignment = solve_subgraph_construction(
+        graph, set(), M, C, graph.N, all_nodes, None, full_reachable_from,
+        time_limit=time_limit, mip_gap=mip_gap, num_threads=num_threads, trace=trace, info=info,
+        optional_roots=set(candidates), max_roots=max_k, entries=set(entries.values()), memory_weight=memory_weight,
+        size_weight=size_weight, cold_start_weight=cold_start_weight)
+    if assignment is None:
+        return None
+
+    R = {r for i, r in assignment if i == r}
+    remote = info['remote_roots']
+    call_cost, memory = plan_usage(graph, remote, assignment)
+
+    per_workflow = {}
+    for w in workflows:
+        N = _invocations(w)
+        calls = sum(d.get('weight', 1.0) / N * w.rate for _, v, d in w.graph.edges(data=True) if v in remote)
+        per_workflow[w.name] = {'calls': calls, 'containers': R & set(w.graph.nodes())}
+
+    return MultiWorkflowPlan(objective, call_cost, memory, R, assignment, status, per_workflow, graph)
+
+
+def plan_usage(graph, remote_roots, assignment):
+    """
+    The rate of cross-container calls and the memory deployed by a plan on `graph`.
+
+    Args:
+        graph (WorkflowGraph): The union graph (see `union_graph`).
+        remote_roots (set): The roots whose callers call them across containers.
+        assignment (dict): The solver assignment `{(i, r): 1}`.
+
+    Returns:
+        tuple: `(call_cost, memory)`.
+    """
+    members = collections.defaultdict(set)
+    for (i, r), assigned in assignment.items():
+        if assigned == 1:
+            members[r].add(i)
+    into_remote = graph.mask(remote_roots)[graph.dst]
+    call_cost = float(graph.weight[into_remote].sum())
+    memory = sum(graph.resource_usage(graph.mask(nodes))[0] for nodes in members.values())
+    return call_cost, memory
+
+
+def solve_separately(workflows, M, C, memory_weight=0.0, **kwargs):
+    """
+    Solves each workflow on its own with the objective of `solve_workflows`, for comparison.
+
+    Every workflow deploys its own containers, so the deployed memory is the sum over
+    the workflows and functions shared by several workflows count once per workflow.
+
+    Returns:
+        tuple: `(call_cost, memory, plans)`, with the plan of each workflow by name, or
+               None if some workflow has no feasible plan.
+    """
+    plans = {}
+    for w in workflows:
+        plan = solve_workflows([w], M, C, memory_weight, **kwargs)
+        if plan is None:
+            return None
+        plans[w.name] = plan
+    return (sum(p.call_cost for p in plans.values()), sum(p.memory for p in plans.values()), plans)
+
+
+if __name__ == "__main__":
+    from export_plan import export_merge_plan, load_graph
+
+    parser = argparse.ArgumentParser(description="Solve the merge problem for several workflows that share functions.")
+    parser.add_argument("workflows", nargs="+", metavar="GRAPH[:RATE]",
+                        help="call graph of each workflow in node-link JSON, optionally with its "
+                             "invocation rate (default 1), e.g. compose_post.json:120")
+    parser.add_argument("--M", type=float, required=True, help="memory capacity per container")
+    parser.add_argument("--C", type=float, required=True, help="CPU capacity per container")
+    parser.add_argument("--memory-weight", type=float, default=0.0,
+                        help="cost of a unit of deployed memory, in cross-container calls per unit of rate")
+    parser.add_argument("--max-k", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=None)
+    parser.add_argument("--app-dir", default=None)
+    parser.add_argument("--strategy", default=None, help="merge strategy recorded in the manifest")
+    parser.add_argument("--out", default=None, help="export the joint plan here (export_plan.py format)")
+    args = parser.parse_args()
+
+    workflows = []
+    for spec in args.workflows:
+        path, _, rate = spec.rpartition(":") if ":" in spec else (spec, "", "")
+        G, N = load_graph(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        workflows.append(Workflow(name, G, float(rate) if rate else 1.0, N))
+
+    options = dict(max_k=args.max_k, time_limit=args.time_limit)
+    plan = solve_workflows(workflows, args.M, args.C, args.memory_weight, **options)
+    if plan is None:
+        raise SystemExit("No feasible joint merge plan found.")
+    separate = solve_separately(workflows, args.M, args.C, args.memory_weight, **options)
+
+    print(f"Joint:    {len(plan.R)} containers, {plan.call_cost:.2f} remote calls, {plan.memory:.1f} memory")
+    if separate is not None:
+        call_cost, memory, plans = separate
+        print(f"Separate: {sum(len(p.R) for p in plans.values())} containers, "
+              f"{call_cost:.2f} remote calls, {memory:.1f} memory")
+    for name, usage in plan.workflows.items():
+        print(f"  {name}: {usage['calls']:.2f} remote calls, containers {sorted(usage['containers'], key=str)}")
+
+    if args.out:
+        manifest = export_merge_plan(plan.graph.to_networkx(), plan.R, plan.assignment, args.out,
+                                     app_dir=args.app_dir, strategy=args.strategy)
+        print(f"Wrote {len(manifest['workflows'])} funcTrees to {args.out} "
+              f"({len(manifest['standalone'])} standalone functions)")
@@ -0,0 +1,434 @@
+import argparse
+import collections
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from ilp import EPSILON, objective_charge
+from rdag import preprocess_graph
+from root_selector import run_root_selection_strategy
+from downstream_impact import select_downstream_candidate_roots
+from trace_ingest import (CallGraphBuilder, call_graph, median_ms, assign_resources, iter_otlp_spans,
+                          spans_from_request, load_function_metrics)
+from export_plan import subgraphs_from_assignment, export_merge_plan
+from workflow_graph import as_workflow_graph
+
+# Spans are timestamped in nanoseconds.
+NS = 10**9
+
+
+class SlidingWindowGraph:
+    """
+    Call counts over the last `window` seconds of spans, in `bucket`-second buckets.
+
+    Each bucket aggregates its traces with a `CallGraphBuilder`. Buckets older
+    than the window are dropped as a whole, so the memory use is bounded by the
+    number of buckets. Time is taken from the spans themselves, which makes a
+    recorded trace file replay exactly like the live stream it was recorded from.
+    """
+
+    def __init__(self, window=600, bucket=60, max_open_traces=10000):
+        self.window_ns = int(window * NS)
+        self.bucket_ns = int(bucket * NS)
+        self.max_open_traces = max_open_traces
+        self.buckets = collections.deque()
+        self.now = 0
+
+    def add(self, span):
+        """Adds a span. Returns True if it opened a new bucket."""
+        self.now = max(self.now, span.start)
+        # Spans of a trace that is still open go to the bucket that holds the rest of it.
+        for _, builder in reversed(self.buckets):
+            if builder.is_open(span.trace_id):
+                builder.add(span)
+                return False
+
+        idx = span.start // self.bucket_ns
+        opened = not self.buckets or idx > self.buckets[-1][0]
+        if opened:
+            # Traces of the bucket before the previous one are complete by now.
+            if len(self.buckets) > 1:
+                self.buckets[-2][1].finish()
+            self.buckets.append((idx, CallGraphBuilder(max_open_traces=self.max_open_traces)))
+            oldest = idx - self.window_ns // self.bucket_ns
+            while self.buckets and self.buckets[0][0] <= oldest:
+                self.buckets.popleft()
+        self.buckets[-1][1].add(span)
+        return opened
+
+    def finish(self):
+        for _, builder in self.buckets:
+            builder.finish()
+
+    def graph(self, entry=None):
+        """The call graph of the completed traces in the window (see `trace_ingest.call_graph`)."""
+        calls, async_calls, entries = collections.Counter(), collections.Counter(), collections.Counter()
+        self_time, rpc_time = {}, {}
+        for _, builder in self.buckets:
+            calls.update(builder.calls)
+            async_calls.update(builder.async_calls)
+            entries.update(builder.entries)
+            for merged, reservoirs in [(self_time, builder.self_time), (rpc_time, builder.rpc_time)]:
+                for key, r in reservoirs.items():
+                    merged[key] = merged[key].merge(r) if key in merged else r
+        return call_graph(calls, async_calls, entries, entry=entry,
+                          latency=median_ms(self_time), rpc_latency=median_ms(rpc_time))
+
+
+def weight_drift(old, new):
+    """
+    How much the call graph changed between two plans.
+
+    Weights are compared per invocation (`weight / N`), since the window holds a
+    different number of invocations each time. The result is the largest relative
+    change of any edge rate or node resource. It is infinite if the set of
+    functions or calls changed, or if the fan-out `ceil(weight / N)` of an async
+    edge changed, since that changes the capacity constraints of the ILP.
+    """
+    if set(old.nodes()) != set(new.nodes()) or set(old.edges()) != set(new.edges()):
+        return math.inf
+    n_old, n_new = max(old.graph.get('N', 1), 1), max(new.graph.get('N', 1), 1)
+    drift = 0.0
+    for u, v, d in new.edges(data=True):
+        o = old.edges[u, v]
+        if d.get('type') != o.get('type'):
+            return math.inf
+        if d.get('type') == 'async' and math.ceil(d['weight'] / n_new) != math.ceil(o['weight'] / n_old):
+            return math.inf
+        rate_old, rate_new = o['weight'] / n_old, d['weight'] / n_new
+        drift = max(drift, abs(rate_new - rate_old) / max(rate_old, EPSILON))
+    for n, d in new.nodes(data=True):
+        for key in ('m', 'c'):
+            drift = max(drift, abs(d.get(key, 0) - old.nodes[n].get(key, 0)) / max(old.nodes[n].get(key, 0), EPSILON))
+    return drift
+
+
+def plan_cost(graph, R, assignment, M, C, N, objective_weights=None, objective='calls', rpc_latency=1.0):
+    """
+    Cost of an existing plan on a (possibly changed) graph, without re-solving.
+
+    This mirrors the ILP: the total weight of calls into a root from outside its
+    subgraph (or, for `objective='latency'`, the expected latency of the entry
+    functions; see `WorkflowGraph.expected_latency`), plus the resource charges
+    of `objective_weights` (see `ilp.objective_charge`). Returns None if the plan
+    no longer fits: a function is not covered, a call crosses into a non-root,
+    or a subgraph exceeds M or C.
+    """
+    if R is None or assignment is None:
+        return None
+    graph = as_workflow_graph(graph, N)
+    subgraphs = subgraphs_from_assignment(assignment)
+    covered = set().union(*subgraphs.values()) if subgraphs else set()
+    if any(n not in covered for n in graph.labels):
+        return None
+
+    src, dst = graph.src, graph.dst
+    is_root = graph.mask(r for r in R if r in graph)
+    internal = np.zeros(graph.num_edges, dtype=bool)
+    for r, nodes in subgraphs.items():
+        mask = graph.mask(i for i in nodes if i in graph)
+        if np.any(mask[src] & ~mask[dst] & ~is_root[dst]):
+            return None
+        if r in graph:
+            internal |= (dst == graph.index[r]) & mask[src]
+        m, c = graph.resource_usage(mask)
+        if m > M + EPSILON or c > C + EPSILON:
+            return None
+    charge = objective_charge(graph, subgraphs, **(objective_weights or {}))
+    if objective == 'latency':
+        sources = np.diff(graph.in_ptr) == 0
+        return float(graph.expected_latency(is_root, rpc_latency)[sources].sum()) + charge
+    return float(graph.weight[is_root[dst] & ~internal].sum()) + charge
+
+
+class PlannerMetrics:
+    """Counters and gauges of the planner, exported as JSON or in the Prometheus text format."""
+
+    def __init__(self):
+        self.checks = 0
+        self.solves = 0
+        self.plans_emitted = 0
+        self.last_drift = 0.0
+        self.last_plan_latency = 0.0
+        self.total_plan_latency = 0.0
+        self.last_cost = None
+        self.deployed_cost = None
+        self.last_improvement = 0.0
+        self._lock = threading.Lock()
+
+    def as_dict(self):
+        with self._lock:
+            return {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+
+    def as_prometheus(self):
+        lines = []
+        for key, value in self.as_dict().items():
+            if value is None:
+                continue
+            kind = "counter" if key in ("checks", "solves", "plans_emitted", "total_plan_latency") else "gauge"
+            value = float(value) if not math.isinf(value) else "+Inf"
+            lines += [f"# TYPE quilt_planner_{key} {kind}", f"quilt_planner_{key} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics, port):
+    """Serves `metrics` on http://0.0.0.0:<port>/metrics from a background thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, ctype = json.dumps(metrics.as_dict()).encode(), "application/json"
+            else:
+                body, ctype = metrics.as_prometheus().encode(), "text/plain; version=0.0.4"
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Planner:
+    """
+    Re-solves the merge problem as call weights drift.
+
+    Spans are fed into a sliding window. On every `check`, the window's call
+    graph is compared with the graph the last solve ran on; if it drifted by
+    more than `drift_threshold` (see `weight_drift`), the root selection is
+    re-run with the previous solution as a warm start. The new plan is only
+    emitted (passed to `on_plan`) if it improves the cost of the deployed plan,
+    evaluated on the current graph, by at least `min_improvement` (relative), or
+    if the deployed plan no longer fits, since every new plan means a rebuild.
+
+    Args:
+        M, C (float): Container capacities, in the units of the metrics.
+        metrics (dict): function -> {'m', 'c'} (see `trace_ingest.load_function_metrics`).
+        default_m, default_c (float, optional): Resources of functions without metrics.
+        entry (str, optional): Entry function of the workflow (default: most frequent trace root).
+        window, bucket (float): Sliding window and bucket length in seconds.
+        drift_threshold (float): Relative drift that triggers a re-solve.
+        min_improvement (float): Relative cost improvement required to emit a plan.
+        on_plan (callable, optional): Called with each emitted plan.
+        solver_args (dict, optional): Extra arguments for `run_root_selection_strategy`.
+    """
+
+    def __init__(self, M, C, metrics=None, default_m=None, default_c=None, entry=None,
+                 window=600, bucket=60, drift_threshold=0.2, min_improvement=0.05,
+                 max_k=8, num_candidates=15, on_plan=None, solver_args=None, max_open_traces=10000):
+        self.M, self.C = M, C
+        self.resources = metrics or {}
+        self.default_m, self.default_c = default_m, default_c
+        self.entry = entry
+        self.window = SlidingWindowGraph(window, bucket, max_open_traces)
+        self.drift_threshold = drift_threshold
+        self.min_improvement = min_improvement
+        self.max_k = max_k
+        self.num_candidates = num_candidates
+        self.on_plan = on_plan
+        self.solver_args = solver_args or {}
+        self.metrics = PlannerMetrics()
+        self.history = []
+
+        self.solved_graph = None        # The graph of the last solve.
+        self.solution = (None, None)    # Warm start: (R, assignment) of the last solve.
+        self.deployed = (None, None)    # The last emitted plan.
+        self.version = 0
+
+    def update_resources(self, metrics):
+        self.resources = metrics
+
+    def add(self, span):
+        """Adds a span; returns True if it started a new window bucket (a good time to `check`)."""
+        return self.window.add(span)
+
+    def current_graph(self):
+        if self.entry is not None and not any(b.entries.get(self.entry) for _, b in self.window.buckets):
+            # No trace in the window is rooted at the entry yet.
+            return None
+        G = self.window.graph(entry=self.entry)
+        if G.number_of_edges() == 0:
+            return None
+        assign_resources(G, self.resources, self.default_m, self.default_c)
+        return G
+
+    def check(self):
+        """Re-plans if the window drifted. Returns the emitted plan, or None."""
+        self.metrics.checks += 1
+        G = self.current_graph()
+        if G is None or G.graph.get('N', 0) == 0:
+            return None
+
+        drift = math.inf if self.solved_graph is None else weight_drift(self.solved_graph, G)
+        self.metrics.last_drift = drift
+        if drift <= self.drift_threshold:
+            return None
+        return self.replan(G)
+
+    def solve(self, G):
+        N = G.graph['N']
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        selector_args = {'num_candidates': min(self.num_candidates, len(all_nodes)), 'M': self.M, 'C': self.C,
+                         'N': N, 'beta': 0.3, 'gamma': 0.35, 'delta': 0.35}
+        args = dict(candidate_selector_fn=select_downstream_candidate_roots, selector_args=selector_args,
+                    strategy_mode='combinatorial' if len(all_nodes) <= 10 else 'greedy_refine')
+        args.update(self.solver_args)
+        R, assignment = self.solution
+        cost, R, assignment, _ = run_root_selection_strategy(
+            "Re-plan", G, self.M, self.C, N, root, all_nodes, preds, reach, self.max_k,
+            initial_R=R, initial_assignment=assignment, **args)
+        return cost, R, assignment
+
+    def replan(self, G):
+        start = time.time()
+        cost, R, assignment = self.solve(G)
+        latency = time.time() - start
+
+        m = self.metrics
+        with m._lock:
+            m.solves += 1
+            m.last_plan_latency = latency
+            m.total_plan_latency += latency
+            m.last_cost = cost
+        self.solved_graph = G
+        if assignment is None:
+            self.history.append({'time': self.window.now / NS, 'latency': latency, 'cost': None, 'emitted': False})
+            return None
+        self.solution = (R, assignment)
+
+        deployed_cost = plan_cost(G, *self.deployed, self.M, self.C, G.graph['N'],
+                                  self.solver_args.get('objective_weights'),
+                                  self.solver_args.get('objective', 'calls'), self.solver_args.get('rpc_latency', 1.0))
+        if deployed_cost is None:
+            improvement = math.inf
+        elif deployed_cost > 0:
+            improvement = (deployed_cost - cost) / deployed_cost
+        else:
+            improvement = 0.0
+        with m._lock:
+            m.deployed_cost = deployed_cost
+            m.last_improvement = improvement
+
+        emit = improvement >= self.min_improvement
+        self.history.append({'time': self.window.now / NS, 'latency': latency, 'cost': cost,
+                             'deployed_cost': deployed_cost, 'emitted': emit})
+        if not emit:
+            return None
+
+        self.version += 1
+        self.deployed = (R, assignment)
+        m.plans_emitted += 1
+        plan = {'version': self.version, 'R': R, 'assignment': assignment, 'cost': cost,
+                'deployed_cost': deployed_cost, 'graph': G}
+        if self.on_plan:
+            self.on_plan(plan)
+        return plan
+
+    def replay(self, spans):
+        """
+        Feeds recorded spans, checking for drift whenever a window bucket completes.
+
+        Returns:
+            list: The emitted plans, in order.
+        """
+        plans = []
+        for span in spans:
+            if self.add(span):
+                plan = self.check()
+                if plan:
+                    plans.append(plan)
+        self.window.finish()
+        plan = self.check()
+        if plan:
+            plans.append(plan)
+        return plans
+
+
+class DirectoryTailer:
+    """
+    Follows OTLP JSON files that a collector's file exporter keeps appending to.
+
+    Only complete lines are consumed; a partially written line is re-read on the
+    next poll. New files in the directory are picked up as they appear.
+    """
+
+    def __init__(self, directory, function_attr="faas.name"):
+        self.directory = directory
+        self.function_attr = function_attr
+        self.offsets = {}
+
+    def poll(self):
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".json") or not os.path.isfile(path):
+                continue
+            with open(path, "r") as f:
+                f.seek(self.offsets.get(path, 0))
+                while True:
+                    line = f.readline()
+                    if not line.endswith("\n"):
+                        break
+                    self.offsets[path] = f.tell()
+                    if line.strip():
+                        yield from spans_from_request(json.loads(line), self.function_attr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-plan function merges as the call graph drifts.")
+    parser.add_argument("traces", help="directory the OpenTelemetry collector exports OTLP JSON into")
+    parser.add_argument("--metrics", nargs="*", default=[], help="cAdvisor InfluxDB line-protocol exports")
+    parser.add_argument("--M", type=float, required=True)
+    parser.add_argument("--C", type=float, required=True)
+    parser.add_argument("--default-m", type=float, default=None)
+    parser.add_argument("--default-c", type=float, default=None)
+    parser.add_argument("--entry", default=None)
+    parser.add_argument("--window", type=float, default=600, help="sliding window in seconds")
+    parser.add_argument("--bucket", type=float, default=60, help="window bucket in seconds")
+    parser.add_argument("--drift", type=float, default=0.2, help="relative drift that triggers a re-solve")
+    parser.add_argument("--min-improvement", type=float, default=0.05,
+                        help="relative cost improvement that is worth a rebuild")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between polls (live mode)")
+    parser.add_argument("--replay", action="store_true", help="replay the recorded traces once and exit")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve planner metrics on this port")
+    parser.add_argument("--app-dir", default=None)
+    parser.add_argument("--strategy", default=None)
+    parser.add_argument("--out", default="plans", help="each emitted plan is exported to <out>/plan-<version>")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="time budget of each solve in seconds; the best plan found so far is used")
+    args = parser.parse_args()
+
+    def emit(plan):
+        out = os.path.join(args.out, f"plan-{plan['version']:04d}")
+        export_merge_plan(plan['graph'], plan['R'], plan['assignment'], out,
+                          app_dir=args.app_dir, strategy=args.strategy)
+        print(f"Plan {plan['version']}: cost {plan['cost']} (deployed plan: {plan['deployed_cost']}) -> {out}")
+
+    resources = load_function_metrics(args.metrics) if args.metrics else {}
+    planner = Planner(args.M, args.C, resources, args.default_m, args.default_c, entry=args.entry,
+                      window=args.window, bucket=args.bucket, drift_threshold=args.drift,
+                      min_improvement=args.min_improvement, on_plan=emit,
+                      solver_args={'deadline': args.deadline} if args.deadline else None)
+    if args.metrics_port:
+        serve_metrics(planner.metrics, args.metrics_port)
+
+    if args.replay:
+        planner.replay(iter_otlp_spans([args.traces]))
+        print(json.dumps(planner.metrics.as_dict(), indent=2, default=str))
+    else:
+        tailer = DirectoryTailer(args.traces)
+        while True:
+            for span in tailer.poll():
+                planner.add(span)
+            if args.metrics:
+                planner.update_resources(load_function_metrics(args.metrics))
+            planner.check()
+            time.sleep(args.interval)
@@ -2,6 +2,10 @@ import networkx as nx
 import collections
 import random
 
+import numpy as np
+
+from workflow_graph import WorkflowGraph
+
 def find_root(graph):
     """
     Finds the single root node of a Directed Acyclic Graph (DAG).
@@ -169,3 +173,150 @@ def generate_sync_rdag(num_nodes, extra_edge_factor=1.0):
 def generate_async_rdag(num_nodes, extra_edge_factor=1.0, async_prob=0.2):
     """Generates a random rDAG with a mix of synchronous and asynchronous edges."""
     return _generate_base_rdag(num_nodes, extra_edge_factor, async_prob=async_prob)
+
+# Topology families of `generate_rdag`, modelled on the DeathStarBench workflows.
+RDAG_FAMILIES = ('random', 'chain', 'fanout', 'diamond')
+
+def generate_rdag(num_nodes, rng, family='random', extra_edge_factor=1.0, async_prob=0.2, as_networkx=True):
+    """
+    Generates a random rDAG with array operations, from an explicit random generator.
+
+    `_generate_base_rdag` adds nodes and edges one at a time and draws from the global
+    `random` module. This builds the spanning tree, the extra edges and the attributes
+    as NumPy arrays and the graph with one bulk call, so that 100k-node graphs take a
+    fraction of a second and each graph is reproducible from its own generator (e.g.
+    one `np.random.default_rng(seed)` per worker).
+
+    Every family starts from a spanning tree rooted at node 0 and adds
+    `extra_edge_factor * num_nodes` extra edges that go from a node to a deeper one, so
+    the graph stays a DAG. Attributes are drawn like in `_generate_base_rdag`: `m` and
+    `c` in [5, 50], `weight` in [1, 10], and edges are `async` with `async_prob`.
+
+    - `random`: each node calls a uniformly random earlier node, like `_generate_base_rdag`.
+    - `chain`: deep synchronous call chains (e.g. `compose-post` -> `text-service` ->
+      `url-shorten-service` in the social network): each node is called by the previous
+      node with probability 0.9. Tree edges are sync.
+    - `fanout`: wide asynchronous fan-outs (e.g. the `nearby-cinema-parallel-*` calls of
+      the hotel reservation app): about `sqrt(num_nodes)` hub functions each call many
+      leaves, and those calls are async.
+    - `diamond`: shared services (e.g. `user-service` or `social-graph-service`, called by
+      many front-end functions): the last 5% of the nodes are services that the extra
+      edges call from anywhere else, closing many diamonds.
+
+    Args:
+        num_nodes (int): The number of nodes.
+        rng (np.random.Generator or int): The random generator, or a seed for one.
+        family (str): One of `RDAG_FAMILIES`.
+        extra_edge_factor (float): Extra edges per node, besides the spanning tree.
+        async_prob (float): Probability that an edge is async (for the edges whose type
+                            the family does not fix).
+        as_networkx (bool): Return an `nx.DiGraph` like the other generators. With False,
+                            return a `WorkflowGraph` and skip building the networkx graph.
+
+    Returns:
+        nx.DiGraph or WorkflowGraph: The graph, with nodes `0..num_nodes - 1` and root 0.
+
+    Raises:
+        ValueError: If `family` is unknown.
+    """
+    if family not in RDAG_FAMILIES:
+        raise ValueError(f"Unknown rDAG family {family!r}; expected one of {RDAG_FAMILIES}.")
+    rng = np.random.default_rng(rng)
+    n = max(num_nodes, 0)
+
+    parent, fixed_type, shared = _spanning_tree(n, rng, family)
+    depth = _tree_depths(parent)
+    if shared:
+        # Shared services sit below everything else, so any node may call them.
+        depth[n - shared:] = depth.max() + 1
+
+    ids = np.arange(1, n)
+    tree_src, tree_dst = parent[1:], ids
+    extra_src, extra_dst = _extra_edges(n, int(n * extra_edge_factor), depth, tree_src, tree_dst, shared, rng)
+    src = np.concatenate([tree_src, extra_src])
+    dst = np.concatenate([tree_dst, extra_dst])
+
+    m = rng.integers(5, 51, n)
+    c = rng.integers(5, 51, n)
+    weight = rng.integers(1, 11, len(src))
+    is_async = rng.random(len(src)) < async_prob
+    if fixed_type is not None:
+        typed = fixed_type >= 0
+        is_async[:n - 1][typed] = fixed_type[typed] == 1
+
+    if not as_networkx:
+        return WorkflowGraph(range(n), m, c, src, dst, weight, is_async)
+    G = nx.DiGraph(name=f"RandomRDAG_{family}_{n}")
+    G.add_nodes_from((i, {'m': mi, 'c': ci}) for i, mi, ci in zip(range(n), m.tolist(), c.tolist()))
+    G.add_edges_from((u, v, {'weight': w, 'type': 'async' if a else 'sync'})
+                     for u, v, w, a in zip(src.tolist(), dst.tolist(), weight.tolist(), is_async.tolist()))
+    return G
+
+def _spanning_tree(n, rng, family):
+    """
+    Draws the parent of every node (`parent[0] = -1`, `parent[i] < i`).
+
+    Returns:
+        tuple: `(parent, fixed_type, shared)`: the parents, the type of each tree edge
+               where the family fixes it (1 async, 0 sync, -1 free; None if no edge is
+               fixed) and the number of shared services at the end of the node range.
+    """
+    parent = np.full(n, -1, dtype=np.int64)
+    if n <= 1:
+        return parent, None, 0
+    ids = np.arange(1, n)
+    # A uniformly random earlier node for each node.
+    parent[1:] = (rng.random(n - 1) * ids).astype(np.int64)
+    fixed_type, shared = None, 0
+
+    if family == 'chain':
+        parent[1:] = np.where(rng.random(n - 1) < 0.9, ids - 1, parent[1:])
+        fixed_type = np.zeros(n - 1, dtype=np.int8)
+    elif family == 'fanout':
+        hubs = max(1, int(np.sqrt(n)))
+        leaves = ids >= hubs
+        parent[1:][leaves] = rng.integers(0, hubs, leaves.sum())
+        fixed_type = np.where(leaves, 1, -1).astype(np.int8)
+    elif family == 'diamond':
+        shared = min(max(1, n // 20), n - 1)
+        services = ids >= n - shared
+        parent[1:][services] = rng.integers(0, n - shared, services.sum())
+    return parent, fixed_type, shared
+
+def _tree_depths(parent):
+    """Depth of every node of a tree given by `parent` (-1 at the root), by pointer jumping."""
+    depth = (parent >= 0).astype(np.int64)
+    ancestor = parent.copy()
+    while (ancestor >= 0).any():
+        jump = ancestor >= 0
+        depth[jump] += depth[ancestor[jump]]
+        ancestor[jump] = ancestor[ancestor[jump]]
+    return depth
+
+def _extra_edges(n, count, depth, tree_src, tree_dst, shared, rng):
+    """
+    Draws up to `count` distinct edges that go to a deeper node and are not tree edges.
+    Like `_generate_base_rdag`, it gives up after `20 * count` candidate pairs.
+    """
+    if n < 2 or count <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    taken = np.sort(tree_src * n + tree_dst)
+    keys = np.empty(0, dtype=np.int64)
+    attempts = 0
+    while len(keys) < count and attempts < 20 * count:
+        batch = 2 * (count - len(keys)) + 16
+        attempts += batch
+        if shared:
+            u = rng.integers(0, n - shared, batch)
+            v = rng.integers(n - shared, n, batch)
+        else:
+            u = rng.integers(0, n, batch)
+            v = rng.integers(0, n, batch)
+        candidates = (u * n + v)[depth[u] < depth[v]]
+        found = np.minimum(np.searchsorted(taken, candidates), len(taken) - 1)
+        keys = np.concatenate([keys, candidates[taken[found] != candidates]])
+        # Keep the first draw of each pair, in the order drawn.
+        _, first = np.unique(keys, return_index=True)
+        keys = keys[np.sort(first)]
+    keys = keys[:count]
+    return keys // n, keys % n
@@ -1,11 +1,19 @@
 import networkx as nx
 import math
 import itertools
+import multiprocessing
 import collections
 import gurobipy as gp
 import random
+import queue
+import threading
+import time
+import numpy as np
 from ilp import solve_subgraph_construction
-from concurrent.futures import ProcessPoolExecutor
+from shared_graph import SharedGraph, attach
+from workflow_graph import as_workflow_graph
+from telemetry import SolverTrace, span
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
 
 # The way the current code works is as follows.
 # There are two modes of operation.
@@ -30,14 +38,18 @@ worker_full_reachable_from = {}
 worker_ilp_time_limit = None
 worker_ilp_mip_gap = 0.0
 worker_ilp_mip_focus = 0
+worker_shm = None
+worker_trace_enabled = False
+worker_ilp_objective = {}
 
-def init_worker(graph, M, C, N, all_nodes, predecessors, full_reachable_from, ilp_time_limit, ilp_mip_gap, ilp_mip_focus):
+def init_worker(graph, M, C, N, all_nodes, predecessors, full_reachable_from, ilp_time_limit, ilp_mip_gap, ilp_mip_focus,
+                trace_enabled=False, ilp_objective=None):
     """
     Initializer function for each worker process in the ProcessPoolExecutor.
     It sets the global variables for the worker's lifetime. Pruning is always enabled.
     """
     global worker_graph, worker_M, worker_C, worker_N, worker_all_nodes, worker_predecessors, worker_full_reachable_from
-    global worker_ilp_time_limit, worker_ilp_mip_gap, worker_ilp_mip_focus
+    global worker_ilp_time_limit, worker_ilp_mip_gap, worker_ilp_mip_focus, worker_trace_enabled, worker_ilp_objective
 
     worker_graph = graph
     worker_M = M
@@ -49,6 +61,19 @@ def init_worker(graph, M, C, N, all_nodes, predecessors, full_reachable_from, il
     worker_ilp_time_limit = ilp_time_limit
     worker_ilp_mip_gap = ilp_mip_gap
     worker_ilp_mip_focus = ilp_mip_focus
+    worker_trace_enabled = trace_enabled
+    worker_ilp_objective = ilp_objective or {}
+
+def init_worker_shared(handle, M, C, N, ilp_time_limit, ilp_mip_gap, ilp_mip_focus, trace_enabled=False,
+                       ilp_objective=None):
+    """
+    Like `init_worker`, but attaches to a `SharedGraph` instead of receiving its own
+    copy of the graph, the predecessors and the reachability sets.
+    """
+    global worker_shm
+    worker_shm, graph, all_nodes, predecessors, full_reachable_from = attach(handle)
+    init_worker(graph, M, C, N, all_nodes, predecessors, full_reachable_from,
+                ilp_time_limit, ilp_mip_gap, ilp_mip_focus, trace_enabled, ilp_objective)
 
 def _run_aggressive_prune_check(graph, R_set, M, C, N):
     """
@@ -59,56 +84,116 @@ def _run_aggressive_prune_check(graph, R_set, M, C, N):
     direction) must be placed in a single subgraph. It then checks if any such
     group violates resource constraints.
 
-    The flaw is using `nx.weakly_connected_components`, which can group nodes that
+    The flaw is grouping by weakly connected components, which can group nodes that
     the ILP could have legally separated. This means the check may return True
     for a root set that is actually feasible. It should only be used as a
     fast-fail mechanism in heuristic strategies.
+
+    Args:
+        graph (WorkflowGraph): The workflow's call graph, with `alpha` computed for N.
     """
-    non_root_nodes = set(graph.nodes()) - R_set
-    if not non_root_nodes:
+    non_root = ~graph.mask(r for r in R_set if r in graph)
+    if not non_root.any():
         return False
 
-    # Find all groups of nodes that are connected and do not contain a root.
-    subgraph_of_non_roots = graph.subgraph(non_root_nodes)
-    for group in nx.weakly_connected_components(subgraph_of_non_roots):
-        # Calculate the total base and async-inflated resource usage for this group.
-        base_m = sum(graph.nodes[node]['m'] for node in group)
-        base_c = sum(graph.nodes[node]['c'] for node in group)
-
-        if base_m > M or base_c > C:
-            return True # The base requirements alone are too high.
-
-        async_penalty_m, async_penalty_c = 0, 0
-        for u, v, data in graph.edges(data=True):
-            if u in group and v in group and data.get('type') == 'async':
-                alpha_uv = math.ceil(data.get('weight', 0) / N)
-                if alpha_uv > 1:
-                    async_penalty_m += graph.nodes[v]['m'] * (alpha_uv - 1)
-                    async_penalty_c += graph.nodes[v]['c'] * (alpha_uv - 1)
-
-        # If the total resources for this mandatory group exceed limits, the root set is likely infeasible.
-        if (base_m + async_penalty_m) > M or (base_c + async_penalty_c) > C:
-            return True
-
-    return False
-
-def evaluate_r_tuple_worker(r_tuple):
+    # Find all groups of nodes that are connected and do not contain a root, by
+    # propagating the smallest node id along the edges between non-root nodes.
+    internal = non_root[graph.src] & non_root[graph.dst]
+    u, v = graph.src[internal], graph.dst[internal]
+    group = np.arange(len(graph))
+    while True:
+        low = np.minimum(group[u], group[v])
+        updated = group.copy()
+        np.minimum.at(updated, u, low)
+        np.minimum.at(updated, v, low)
+        updated = updated[updated]
+        if np.array_equal(updated, group):
+            break
+        group = updated
+
+    # Calculate the total base and async-inflated resource usage for each group.
+    # If the total resources for a mandatory group exceed limits, the root set is likely infeasible.
+    members = np.flatnonzero(non_root)
+    V = len(graph)
+    m = np.bincount(group[members], weights=graph.m[members], minlength=V)
+    c = np.bincount(group[members], weights=graph.c[members], minlength=V)
+    penalized = internal & graph.is_async & (graph.alpha > 1)
+    callees = graph.dst[penalized]
+    extra = graph.alpha[penalized] - 1
+    m += np.bincount(group[callees], weights=graph.m[callees] * extra, minlength=V)
+    c += np.bincount(group[callees], weights=graph.c[callees] * extra, minlength=V)
+    return bool((m > M).any() or (c > C).any())
+
+# The smallest time limit given to an ILP whose budget is almost spent.
+MIN_ILP_TIME_LIMIT = 0.01
+
+def evaluate_r_tuple_worker(r_tuple, deadline_at=None):
     """
     The core function executed by each parallel worker. It takes a single tuple of
-    candidate roots and solves ILP.
+    candidate roots and solves ILP. If tracing is enabled, the ILP's telemetry events
+    are returned with the result so that the parent can merge them into its trace.
+
+    `deadline_at` is the end of the run's time budget (time.time()). The ILP's time
+    limit is cut to the remaining budget, and a task that starts after the deadline
+    returns without solving (status None).
     """
+    if deadline_at is not None and time.time() >= deadline_at:
+        return r_tuple, None, None, None, None, None
+    time_limit = _remaining_time_limit(worker_ilp_time_limit, deadline_at)
+
+    trace = SolverTrace() if worker_trace_enabled else None
+    info = {}
     # run the full ILP solver.
     status, cost, assignment = solve_subgraph_construction(
         worker_graph, set(r_tuple), worker_M, worker_C, worker_N,
         worker_all_nodes, worker_predecessors, worker_full_reachable_from,
-        time_limit=worker_ilp_time_limit, mip_gap=worker_ilp_mip_gap,
-        mip_focus=worker_ilp_mip_focus, num_threads=1 # Each worker is single-threaded
+        time_limit=time_limit, mip_gap=worker_ilp_mip_gap,
+        mip_focus=worker_ilp_mip_focus, num_threads=1, # Each worker is single-threaded
+        trace=trace, info=info, **worker_ilp_objective
     )
-    return r_tuple, status, cost, assignment
+    return r_tuple, status, cost, assignment, info.get('bound'), trace.events if trace else None
+
+def _remaining_time_limit(ilp_time_limit, deadline_at):
+    """
+    The ILP time limit, cut to what is left of the run's budget. None means no limit.
+
+    Gurobi rejects negative limits, so the result is at least MIN_ILP_TIME_LIMIT; callers
+    check that the budget is not spent before they solve.
+    """
+    if deadline_at is None:
+        return ilp_time_limit
+    remaining = max(deadline_at - time.time(), MIN_ILP_TIME_LIMIT)
+    return remaining if ilp_time_limit is None else min(ilp_time_limit, remaining)
+
+def _take_until_timeout(results_iterator):
+    """Yields the results of `executor.map` until it times out (the map then cancels the rest)."""
+    try:
+        for result in results_iterator:
+            yield result
+    except FuturesTimeoutError:
+        return
+
+# A solution reported to `on_incumbent` as the search improves. `bound` is the lower bound
+# proven by the ILP for this root set (equal to `cost` unless its time limit was hit);
+# `elapsed` is the time since the start of the run in seconds.
+Incumbent = collections.namedtuple('Incumbent', ['cost', 'R', 'assignment', 'bound', 'elapsed'])
+
+
+class RootSelection(collections.namedtuple('RootSelection', ['cost', 'R', 'assignment', 'limit_hit'])):
+    """
+    The result of `run_root_selection_strategy`. It unpacks as `(cost, R, assignment, limit_hit)`;
+    `bound` is the lower bound proven by the ILP for the returned root set (equal to `cost` unless
+    its time limit was hit), or None when no feasible solution was found.
+    """
+
+    def __new__(cls, cost, R, assignment, limit_hit, bound=None):
+        self = super().__new__(cls, cost, R, assignment, limit_hit)
+        self.bound = bound
+        return self
 
 def run_root_selection_strategy(
     strategy_name: str,
-    graph: nx.DiGraph, M: float, C: float, N: int,
+    graph, M: float, C: float, N: int,
     root_node, all_nodes: list, predecessors: dict, full_reachable_from: dict,
     max_k: int,
     candidate_selector_fn=None,
@@ -118,7 +203,16 @@ def run_root_selection_strategy(
     ilp_time_limit: float = None,
     ilp_mip_gap: float = 0.0,
     ilp_mip_focus: int = 0,
-    num_threads: int = 1
+    num_threads: int = 1,
+    initial_R: set = None,
+    initial_assignment: dict = None,
+    use_shared_memory: bool = None,
+    trace: SolverTrace = None,
+    deadline: float = None,
+    on_incumbent=None,
+    objective_weights: dict = None,
+    objective: str = 'calls',
+    rpc_latency: float = 1.0
     ):
     """
     Main orchestration function for finding the best set of roots to merge.
@@ -126,7 +220,9 @@ def run_root_selection_strategy(
 
     Args:
         strategy_name (str): The name for logging purposes (e.g., "Optimal", "Downstream Impact").
-        graph, M, C, N: The graph and resource constraints.
+        graph, M, C, N: The graph (nx.DiGraph or WorkflowGraph) and resource constraints. The graph
+                        is converted to a WorkflowGraph once, and the candidate selector, the
+                        ILPs and the worker processes all receive the WorkflowGraph.
         root_node, all_nodes, predecessors, full_reachable_from: Pre-processed graph data.
         max_k (int): The maximum number of subgraphs (roots) to consider.
         candidate_selector_fn: The function to use for selecting a pool of promising root candidates
@@ -139,21 +235,98 @@ def run_root_selection_strategy(
                              'greedy_refine': Find one good solution and iteratively improve it. For large graphs.
         ilp_time_limit, ilp_mip_gap, ilp_mip_focus: Parameters for the Gurobi ILP solver.
         num_threads (int): Number of parallel processes to use for solving ILPs.
+        initial_R, initial_assignment: A previous solution (e.g., from an earlier re-plan) used as a
+                                       warm start. It is re-evaluated on the current graph as the
+                                       initial incumbent, and its roots join the candidate pool.
+        use_shared_memory (bool): Publish the graph to the worker processes once through shared
+                                  memory (see `shared_graph.py`) instead of copying it into each worker.
+                                  Defaults to True unless the start method is `fork`, whose workers
+                                  already share the parent's pages copy-on-write.
+        trace (SolverTrace, optional): Records the time of each phase, every ILP solve (including
+                                       those in worker processes), prune counts and worker
+                                       utilization (see `telemetry.py`).
+        deadline (float): A time budget in seconds for the whole run. Each ILP's time limit is cut to
+                          the remaining budget, and when it runs out the search stops, pending root
+                          sets are cancelled and the best solution so far is returned with
+                          `limit_hit` set. Candidate selection itself is not interrupted.
+        on_incumbent (callable): Called with an `Incumbent` each time the best solution improves.
+                                 The last one is the returned solution, with its proven bound.
+                                 See also `iter_incumbents`.
+        objective_weights (dict): Charges for deployed resources added to every ILP's objective:
+                                  `memory_weight`, `size_weight` and `cold_start_weight` (see
+                                  `solve_subgraph_construction`). Costs then include the charges.
+        objective (str): What the ILPs minimize: 'calls', the weight of cross-container calls, or
+                         'latency', the expected end-to-end latency of an invocation, where remote
+                         hops add up along sync call chains and concurrent async branches count as
+                         their longest (see `ilp.build_subgraph_model`). Costs are then latencies.
+        rpc_latency (float): For the latency objective, the RPC overhead of a remote call whose edge
+                             has no measured `rpc_latency` (see `trace_ingest.py`).
+
+    Returns:
+        RootSelection: `(cost, R, assignment, limit_hit)`, or `(None, None, None, limit_hit)` if no
+                       feasible solution was found, with the proven bound of the solution as `bound`.
+                       `limit_hit` is True if the combination threshold or the deadline stopped the
+                       search early.
     """
     best_cost = float('inf')
     best_R = None
     best_assignment = None
     limit_hit = False
+    threshold_hit = False # Whether the combination threshold, rather than the deadline, set limit_hit.
+    graph = as_workflow_graph(graph, N)
+    ilp_objective = dict(objective_weights or {}, objective=objective, rpc_latency=rpc_latency)
+
+    # --- Time Budget ---
+    run_start = time.time()
+    deadline_at = run_start + deadline if deadline is not None else None
+
+    def time_left():
+        return deadline_at is None or time.time() < deadline_at
+
+    def ilp_time_limit_now():
+        return _remaining_time_limit(ilp_time_limit, deadline_at)
+
+    best_bound = None
+
+    def report(cost, R, assignment, bound):
+        nonlocal best_bound
+        best_bound = bound
+        if on_incumbent is not None:
+            on_incumbent(Incumbent(cost, set(R), assignment, bound, time.time() - run_start))
 
     # --- Initial Feasibility Check ---
     # If any single function requires more resources than available, no solution is possible.
-    is_default_feasible = all(graph.nodes[i].get('m', 0) <= M and graph.nodes[i].get('c', 0) <= C for i in all_nodes)
+    node_ids = graph.ids(all_nodes)
+    is_default_feasible = bool(np.all(graph.m[node_ids] <= M) and np.all(graph.c[node_ids] <= C))
     if not is_default_feasible:
         print(f"[{strategy_name}] WARNING: A single function's requirements exceed container capacity. Problem is infeasible.")
-        return None, None, None, False
+        return RootSelection(None, None, None, False)
 
     print(f"\n=== Starting Root Selection ({strategy_name}) using {num_threads} parallel worker processes ===")
 
+    # --- Warm Start ---
+    # Re-evaluate the previous root set on the current graph so that the search starts
+    # from its cost. This is a single ILP, seeded with the previous assignment.
+    warm_roots = set()
+    if initial_R and not time_left():
+        print(f"[{strategy_name}] Deadline reached before the warm start.")
+        limit_hit = True
+    elif initial_R:
+        warm_R = {r for r in initial_R if r in graph} | {root_node}
+        warm_roots = warm_R - {root_node}
+        info = {}
+        status, cost, assignment = solve_subgraph_construction(
+            graph, warm_R, M, C, N, all_nodes, predecessors, full_reachable_from,
+            time_limit=ilp_time_limit_now(), mip_gap=ilp_mip_gap, mip_focus=ilp_mip_focus, num_threads=num_threads,
+            warm_start=initial_assignment, trace=trace, info=info, **ilp_objective
+        )
+        if cost is not None:
+            best_cost, best_R, best_assignment = cost, warm_R, assignment
+            report(cost, warm_R, assignment, info['bound'])
+            print(f"[{strategy_name}] Warm start: previous R={warm_R} costs {cost:.4f} on the current graph.")
+        else:
+            print(f"[{strategy_name}] Warm start: previous R={warm_R} is infeasible on the current graph.")
+
     # --- Candidate Selection & Retry Logic ---
     additional_candidate_pool = None
     all_scores = None # Stores the full list of scores for the greedy refinement phase.
@@ -161,12 +334,16 @@ def run_root_selection_strategy(
     initial_num_candidates = local_selector_args.get('num_candidates', 0)
 
     # Define retry parameters internally for simplicity.
-    max_retries = len(graph.nodes())
+    max_retries = len(graph)
     candidate_increment_on_retry = 1
 
     # This loop allows the candidate selection to retry if it produces an infeasible set.
     # This is particularly useful with GRASP, as a different random choice might yield a feasible set.
     for attempt in range(max_retries):
+        if not time_left():
+            print(f"[{strategy_name}] Deadline reached during candidate selection.")
+            limit_hit = True
+            break
         if candidate_selector_fn:
             if attempt > 0:
                 print(f"--- Retrying candidate selection (Attempt {attempt + 1}/{max_retries}) ---")
@@ -174,11 +351,14 @@ def run_root_selection_strategy(
                 print(f"Increasing candidate set size to {local_selector_args['num_candidates']}")
 
             # Select a pool of promising candidates using the provided heuristic function.
-            result = candidate_selector_fn(graph, root_node, **local_selector_args)
-            if isinstance(result, tuple):
-                current_pool, all_scores = result
-            else:
-                current_pool = result
+            with span(trace, 'candidate_selection', attempt=attempt) as info:
+                result = candidate_selector_fn(graph, root_node, **local_selector_args)
+                if isinstance(result, tuple):
+                    current_pool, all_scores = result
+                else:
+                    current_pool = result
+                info['pool_size'] = len(current_pool)
+            current_pool = set(current_pool) | warm_roots
 
             if 0 < len(current_pool):
                 # PRE-CHECK: Before doing a full combinatorial search, solve the ILP once with the *entire*
@@ -186,14 +366,26 @@ def run_root_selection_strategy(
                 print(f"[{strategy_name}] Pre-checking feasibility with full heuristic candidate pool (size {len(current_pool)})...")
                 full_heuristic_R_set = current_pool | {root_node}
 
-                if _run_aggressive_prune_check(graph, full_heuristic_R_set, M, C, N):
+                with span(trace, 'prune_check'):
+                    pruned = _run_aggressive_prune_check(graph, full_heuristic_R_set, M, C, N)
+                if pruned:
+                    if trace is not None:
+                        trace.count('aggressive_prune_rejections')
                     print(f"[{strategy_name}] Candidate pool failed aggressive prune check. Retrying...")
                     if attempt < max_retries - 1: continue
                     else: break
 
+                # Candidate selection may have used up the budget.
+                if not time_left():
+                    print(f"[{strategy_name}] Deadline reached during candidate selection.")
+                    limit_hit = True
+                    break
+
+                info = {}
                 status, cost, assignment = solve_subgraph_construction(
                     graph, full_heuristic_R_set, M, C, N, all_nodes, predecessors, full_reachable_from,
-                    time_limit=ilp_time_limit, mip_gap=ilp_mip_gap, mip_focus=ilp_mip_focus, num_threads=num_threads
+                    time_limit=ilp_time_limit_now(), mip_gap=ilp_mip_gap, mip_focus=ilp_mip_focus,
+                    num_threads=num_threads, trace=trace, info=info, **ilp_objective
                 )
 
                 if status == gp.GRB.INFEASIBLE:
@@ -207,6 +399,7 @@ def run_root_selection_strategy(
                     best_cost = cost
                     best_R = full_heuristic_R_set
                     best_assignment = assignment
+                    report(cost, best_R, assignment, info['bound'])
                     print(f"*** Initial Feasible Solution Found (from pre-check). R size={len(best_R)}, Cost={cost:.4f} ***")
 
                 break # Found a workable candidate pool, exit the retry loop.
@@ -216,8 +409,11 @@ def run_root_selection_strategy(
             break
 
     if additional_candidate_pool is None:
+        if best_assignment is not None:
+            # Only reachable when the deadline hit before a pool was found: keep the warm start.
+            return RootSelection(best_cost, best_R, best_assignment, limit_hit, best_bound)
         print(f"[{strategy_name}] Could not find a feasible candidate pool after {max_retries} attempts.")
-        return None, None, None, False
+        return RootSelection(None, None, None, limit_hit)
 
     # --- Explicit Strategy Execution ---
     initargs = (graph, M, C, N, all_nodes, predecessors, full_reachable_from, ilp_time_limit, ilp_mip_gap, ilp_mip_focus)
@@ -226,12 +422,13 @@ def run_root_selection_strategy(
         print(f"\n[{strategy_name}] Running in 'greedy_refine' mode.")
         if best_R is None:
              print(f"[{strategy_name}] No initial solution found to refine. Cannot proceed.")
-             return None, None, None, False
+             return RootSelection(None, None, None, limit_hit)
 
         # The refinement process starts with the best solution found so far (from the pre-check)
         # and tries to improve it by removing the "least valuable" roots.
         score_map = dict(all_scores) if all_scores is not None else {}
 
+        refine_start = time.time()
         while True:
             # Greedily try to remove the root with the lowest heuristic score first.
             removable_roots = sorted(list(best_R - {root_node}), key=lambda r: score_map.get(r, 0))
@@ -240,11 +437,16 @@ def run_root_selection_strategy(
 
             improved_in_pass = False
             for root_to_remove in removable_roots:
+                if not time_left():
+                    limit_hit = True
+                    break
                 temp_R = best_R - {root_to_remove}
 
+                info = {}
                 status, cost, assignment = solve_subgraph_construction(
                     graph, temp_R, M, C, N, all_nodes, predecessors, full_reachable_from,
-                    time_limit=ilp_time_limit, mip_gap=ilp_mip_gap, mip_focus=ilp_mip_focus, num_threads=num_threads
+                    time_limit=ilp_time_limit_now(), mip_gap=ilp_mip_gap, mip_focus=ilp_mip_focus,
+                    num_threads=num_threads, trace=trace, info=info, **ilp_objective
                 )
 
                 # If removing the root resulted in a better (lower cost) feasible solution, update the best.
@@ -253,15 +455,21 @@ def run_root_selection_strategy(
                     best_cost = cost
                     best_R = temp_R
                     best_assignment = assignment
+                    report(cost, temp_R, assignment, info['bound'])
                     improved_in_pass = True
                     break # Restart the pass with the new, smaller root set.
 
+            if limit_hit:
+                print(f"[{strategy_name}] Deadline reached. Halting refinement.")
+                break
             if not improved_in_pass:
                 print(f"[{strategy_name}] No further improvements found. Halting refinement.")
                 break
 
+        if trace is not None:
+            trace.add('greedy_refine', refine_start, time.time() - refine_start, roots=len(best_R), cost=best_cost)
         print(f"[{strategy_name}] Greedy Refinement Finished. Final |R|={len(best_R)}, Cost={best_cost:.4f}")
-        return best_cost, best_R, best_assignment, limit_hit
+        return RootSelection(best_cost, best_R, best_assignment, limit_hit, best_bound)
 
     elif strategy_mode == 'combinatorial':
         print(f"\n[{strategy_name}] Running in 'combinatorial' mode.")
@@ -269,60 +477,145 @@ def run_root_selection_strategy(
         tried_R_configs = set()
         pruned_count = 0
 
-        with ProcessPoolExecutor(max_workers=num_threads, initializer=init_worker, initargs=initargs) as executor:
-            # Iterate through k (the number of roots), from 1 to max_k.
-            for k in range(1, max_k + 1):
-                if limit_hit: break
-                if len(additional_candidate_pool) < k - 1: continue
-
-                # Generate all combinations of (k-1) additional roots from the candidate pool.
-                if k == 1:
-                    candidate_R_tuples_for_k = [(root_node,)] if root_node in graph else []
-                else:
-                    available_candidates = list(additional_candidate_pool)
-                    n_pool, k_minus_1 = len(available_candidates), k - 1
-                    if k_minus_1 <= 0 or k_minus_1 > n_pool: continue
-
-                    num_combinations = math.comb(n_pool, k_minus_1)
-
-                    # For the Optimal strategy, cap the number of combinations to avoid excessive runtimes.
-                    if not candidate_selector_fn and max_combinations_threshold and num_combinations > max_combinations_threshold:
-                        print(f"[{strategy_name}] Stopping at k={k} due to high number of combinations ({num_combinations}).")
+        shared = None
+        initializer = init_worker
+        # get_start_method() without allow_none, like a pool without mp_context, would fix the
+        # start method for the whole process; while it is unset, use the platform default
+        # (listed first) for this pool only.
+        start_method = multiprocessing.get_start_method(allow_none=True) or multiprocessing.get_all_start_methods()[0]
+        if use_shared_memory is None:
+            use_shared_memory = start_method != 'fork'
+        if use_shared_memory:
+            shared = SharedGraph(graph, all_nodes, predecessors, full_reachable_from)
+            initializer = init_worker_shared
+            initargs = (shared.handle, M, C, N, ilp_time_limit, ilp_mip_gap, ilp_mip_focus)
+        initargs += (trace is not None, ilp_objective)
+
+        pool_start = time.time()
+        worker_busy = collections.Counter()
+        try:
+            with ProcessPoolExecutor(max_workers=num_threads, mp_context=multiprocessing.get_context(start_method),
+                                     initializer=initializer, initargs=initargs) as executor:
+                # Iterate through k (the number of roots), from 1 to max_k.
+                for k in range(1, max_k + 1):
+                    if not time_left():
+                        print(f"[{strategy_name}] Deadline reached before k={k}.")
                         limit_hit = True
-                        break
-
-                    # Each combination is added to the main graph root to form a full candidate root set.
-                    combos = itertools.combinations(available_candidates, k_minus_1)
-                    candidate_R_tuples_for_k = [(root_node,) + combo for combo in combos]
-
-                # Filter out any configurations we might have already tried (e.g., from the pre-check).
-                unique_tuples_for_k = [t for t in candidate_R_tuples_for_k if frozenset(t) not in tried_R_configs]
-                tried_R_configs.update(frozenset(t) for t in unique_tuples_for_k)
-
-                if not unique_tuples_for_k: continue
-
-                # Map the list of root tuples to the worker pool for parallel execution.
-                results_iterator = executor.map(evaluate_r_tuple_worker, unique_tuples_for_k)
-
-                # Process results as they complete.
-                for r_tuple_res, status, cost, assignment in results_iterator:
-                    if status == gp.GRB.INFEASIBLE and cost is None:
-                        pruned_count += 1
-                        continue
-
-                    if cost is not None and cost < best_cost:
-                        best_cost = cost
-                        best_R = set(r_tuple_res)
-                        best_assignment = assignment
-                        print(f"*** New Best Solution Found! R={best_R}, Cost={cost:.4f} ***")
+                    if limit_hit: break
+                    if len(additional_candidate_pool) < k - 1: continue
+
+                    # Generate all combinations of (k-1) additional roots from the candidate pool.
+                    if k == 1:
+                        candidate_R_tuples_for_k = [(root_node,)] if root_node in graph else []
+                    else:
+                        available_candidates = list(additional_candidate_pool)
+                        n_pool, k_minus_1 = len(available_candidates), k - 1
+                        if k_minus_1 <= 0 or k_minus_1 > n_pool: continue
+
+                        num_combinations = math.comb(n_pool, k_minus_1)
+
+                        # For the Optimal strategy, cap the number of combinations to avoid excessive runtimes.
+                        if not candidate_selector_fn and max_combinations_threshold and num_combinations > max_combinations_threshold:
+                            print(f"[{strategy_name}] Stopping at k={k} due to high number of combinations ({num_combinations}).")
+                            limit_hit = threshold_hit = True
+                            break
+
+                        # Each combination is added to the main graph root to form a full candidate root set.
+                        combos = itertools.combinations(available_candidates, k_minus_1)
+                        candidate_R_tuples_for_k = [(root_node,) + combo for combo in combos]
+
+                    # Filter out any configurations we might have already tried (e.g., from the pre-check).
+                    unique_tuples_for_k = [t for t in candidate_R_tuples_for_k if frozenset(t) not in tried_R_configs]
+                    tried_R_configs.update(frozenset(t) for t in unique_tuples_for_k)
+
+                    if not unique_tuples_for_k: continue
+
+                    with span(trace, 'combinatorial_k', k=k, root_sets=len(unique_tuples_for_k)):
+                        # Map the list of root tuples to the worker pool for parallel execution.
+                        # With a deadline, waiting for a result times out when the budget is
+                        # spent; the root sets that have not started yet are then cancelled.
+                        timeout = None if deadline_at is None else max(deadline_at - time.time(), 0)
+                        results_iterator = executor.map(evaluate_r_tuple_worker, unique_tuples_for_k,
+                                                        itertools.repeat(deadline_at), timeout=timeout)
+
+                        # Process results as they complete.
+                        results = list(_take_until_timeout(results_iterator))
+                        if len(results) < len(unique_tuples_for_k) or any(r[1] is None for r in results):
+                            print(f"[{strategy_name}] Deadline reached at k={k}; cancelled the remaining root sets.")
+                            limit_hit = True
+
+                        for r_tuple_res, status, cost, assignment, bound, events in results:
+                            if trace is not None and events:
+                                trace.extend(events)
+                                for e in events:
+                                    if e['cat'] == 'ilp':
+                                        worker_busy[e['pid']] += e['dur']
+
+                            if status == gp.GRB.INFEASIBLE and cost is None:
+                                pruned_count += 1
+                                if trace is not None:
+                                    trace.count('pruned_infeasible')
+                                continue
+
+                            if cost is not None and cost < best_cost:
+                                best_cost = cost
+                                best_R = set(r_tuple_res)
+                                best_assignment = assignment
+                                report(cost, best_R, assignment, bound)
+                                print(f"*** New Best Solution Found! R={best_R}, Cost={cost:.4f} ***")
+        finally:
+            if shared is not None:
+                shared.close()
+
+        if trace is not None:
+            # Utilization: the share of the pool's lifetime (including startup) that the
+            # workers spent solving ILPs.
+            pool_s = time.time() - pool_start
+            trace.add('worker_pool', pool_start, pool_s, workers=num_threads, busy_s=sum(worker_busy.values()),
+                      utilization=sum(worker_busy.values()) / (pool_s * num_threads) if pool_s > 0 else 0.0,
+                      per_worker={pid: busy / pool_s for pid, busy in worker_busy.items()} if pool_s > 0 else {})
 
         print(f"\n=== Root Selection ({strategy_name}) Finished ===")
         if pruned_count > 0:
             print(f"Pruned {pruned_count} provably infeasible root sets in parallel.")
         if limit_hit:
-            print(f"NOTE: Exploration stopped early due to combination threshold.")
+            reason = "combination threshold" if threshold_hit else "deadline"
+            print(f"NOTE: Exploration stopped early due to the {reason}.")
 
-        return (best_cost, best_R, best_assignment, limit_hit) if best_assignment else (None, None, None, limit_hit)
+        if best_assignment:
+            return RootSelection(best_cost, best_R, best_assignment, limit_hit, best_bound)
+        return RootSelection(None, None, None, limit_hit)
     else:
         raise ValueError(f"Unknown strategy_mode: {strategy_mode}")
 
+
+def iter_incumbents(*args, **kwargs):
+    """
+    Runs `run_root_selection_strategy` in a background thread and yields each
+    `Incumbent` as the search improves, e.g. to act on a good-enough plan before
+    the deadline. Takes the same arguments; the generator's return value (the
+    `StopIteration.value`) is the strategy's `RootSelection`.
+    """
+    incumbents = queue.Queue()
+    done = object()
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = run_root_selection_strategy(*args, on_incumbent=incumbents.put, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            incumbents.put(done)
+
+    thread = threading.Thread(target=run, name="root-selection", daemon=True)
+    thread.start()
+    while True:
+        item = incumbents.get()
+        if item is done:
+            break
+        yield item
+    thread.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
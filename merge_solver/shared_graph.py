@@ -0,0 +1,147 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+from workflow_graph import WorkflowGraph, as_workflow_graph
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class SharedGraph:
+    """
+    A read-only copy of the pre-processed graph in shared memory.
+
+    The ProcessPoolExecutor used by `run_root_selection_strategy` used to pass
+    the graph and the O(V^2) reachability sets through `initargs`, so every
+    worker process held its own copy. Here they are packed once into a single
+    `multiprocessing.shared_memory` block:
+
+    - the arrays of the `WorkflowGraph` (see `WorkflowGraph.ARRAYS`)
+    - `reach`: reachability bits, one row of ceil(V/8) bytes per node
+    - `has_reach`: whether `full_reachable_from` has an entry for the node
+
+    Workers receive only the small `handle` (block name, node labels, N,
+    layout) and attach to the block with `attach`, which wraps the arrays in
+    a `WorkflowGraph` without copying them.
+
+    The creating process owns the block and must call `close` (or use the
+    object as a context manager) to free it.
+    """
+
+    def __init__(self, graph, all_nodes, predecessors, full_reachable_from, N=None):
+        """
+        Args:
+            graph (nx.DiGraph or WorkflowGraph): The workflow's call graph.
+            all_nodes, predecessors, full_reachable_from: Pre-processed graph data. The
+                predecessors are not packed: workers read them from the graph's arrays.
+            N (int, optional): Invocation count for `alpha`. Defaults to the graph's own N
+                (1 for an nx.DiGraph); workers recompute `alpha` if they solve for another N.
+        """
+        if N is None:
+            N = graph.N if isinstance(graph, WorkflowGraph) else 1
+        graph = as_workflow_graph(graph, N)
+        V = len(graph)
+        index = graph.index
+
+        arrays = graph.arrays()
+        # Pack one row at a time so that the dense V x V matrix never exists.
+        reach = np.zeros((V, (V + 7) // 8), dtype=np.uint8)
+        row = np.zeros(V, dtype=bool)
+        for r, reachable in full_reachable_from.items():
+            if r not in index:
+                continue
+            row[:] = False
+            row[np.fromiter(map(index.__getitem__, reachable), dtype=np.int64, count=len(reachable))] = True
+            reach[index[r]] = np.packbits(row)
+        arrays['reach'] = reach
+        arrays['has_reach'] = np.array([n in full_reachable_from for n in graph.labels], dtype=bool)
+
+        layout = {}
+        size = 0
+        for name, arr in arrays.items():
+            size = _align(size)
+            layout[name] = (size, arr.dtype.str, arr.shape)
+            size += arr.nbytes
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, arr in arrays.items():
+            offset, dtype, shape = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)[...] = arr
+        self.handle = (self.shm.name, graph.labels, list(all_nodes), N, layout)
+        self.nbytes = size
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(handle):
+    """
+    Attaches to a `SharedGraph` from another process.
+
+    Returns:
+        tuple: `(shm, graph, all_nodes, predecessors, full_reachable_from)`, where `graph`
+               is a WorkflowGraph over the shared arrays. The views read the shared
+               arrays directly, so `shm` must be kept alive while they are in use.
+    """
+    name, labels, all_nodes, N, layout = handle
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = {}
+    for key, (offset, dtype, shape) in layout.items():
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        arr.flags.writeable = False
+        arrays[key] = arr
+    graph = WorkflowGraph.from_arrays(labels, {k: arrays[k] for k in WorkflowGraph.ARRAYS}, N)
+    return (shm, graph, list(all_nodes), PredecessorsView(graph),
+            ReachabilityView(graph, arrays['reach'], arrays['has_reach']))
+
+
+class PredecessorsView:
+    """`predecessors` as returned by `preprocess_graph`, read from the graph's CSR arrays."""
+
+    def __init__(self, graph):
+        self._g = graph
+
+    def get(self, node, default=None):
+        i = self._g.index.get(node)
+        if i is None:
+            return default
+        labels = self._g.labels
+        return [labels[j] for j in self._g.predecessors(i).tolist()]
+
+    def __getitem__(self, node):
+        if node not in self._g.index:
+            raise KeyError(node)
+        return self.get(node)
+
+
+class ReachabilityView:
+    """`full_reachable_from` as returned by `preprocess_graph`, decoded from the packed bits on access."""
+
+    def __init__(self, graph, reach, has_reach):
+        self._g = graph
+        self._reach = reach
+        self._has_reach = has_reach
+
+    def __contains__(self, node):
+        i = self._g.index.get(node)
+        return i is not None and bool(self._has_reach[i])
+
+    def get(self, node, default=None):
+        if node not in self:
+            return default
+        bits = np.unpackbits(self._reach[self._g.index[node]], count=len(self._g.labels))
+        labels = self._g.labels
+        return {labels[j] for j in np.flatnonzero(bits).tolist()}
+
+    def __getitem__(self, node):
+        if node not in self:
+            raise KeyError(node)
+        return self.get(node)
@@ -0,0 +1,103 @@
+import argparse
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import root_selector
+from rdag import generate_async_rdag, preprocess_graph
+from shared_graph import SharedGraph
+from workflow_graph import WorkflowGraph
+
+# Probes wait for each other on this barrier, so every worker in the pool runs exactly one of them.
+_barrier = None
+
+
+def _init(barrier, initializer, initargs):
+    global _barrier
+    _barrier = barrier
+    initializer(*initargs)
+
+
+def _memory_kb():
+    """RSS and USS (private pages) of the current process, from /proc/self/smaps_rollup."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return fields.get("Rss", 0), fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+
+
+def _probe(_):
+    """Touches the worker's graph data the way an ILP setup does, then reports memory."""
+    reach = root_selector.worker_full_reachable_from
+    preds = root_selector.worker_predecessors
+    total = 0
+    for r in root_selector.worker_all_nodes:
+        for _ in reach.get(r, ()):
+            total += 1
+        total += len(preds.get(r, []))
+    graph = root_selector.worker_graph
+    total += int(graph.weight.sum() + graph.m.sum() + graph.in_edges.sum())
+    memory = _memory_kb()
+    _barrier.wait()
+    return os.getpid(), memory, total
+
+
+def measure(graph, all_nodes, preds, reach, workers, use_shared_memory, start_method):
+    """
+    Starts a pool the way `run_root_selection_strategy` does and probes every worker.
+
+    Returns:
+        tuple: (publish seconds, startup seconds, mean worker RSS in MiB, mean worker USS in MiB).
+               Publish is the time to pack the graph into shared memory; startup is the time
+               from creating the pool until every worker has initialized and answered.
+    """
+    ctx = multiprocessing.get_context(start_method)
+    start = time.perf_counter()
+    shared = None
+    if use_shared_memory:
+        shared = SharedGraph(graph, all_nodes, preds, reach)
+        initializer, initargs = root_selector.init_worker_shared, (shared.handle, 0, 0, 1, None, 0.0, 0)
+    else:
+        initializer, initargs = root_selector.init_worker, (graph, 0, 0, 1, all_nodes, preds, reach, None, 0.0, 0)
+    publish = time.perf_counter() - start
+    try:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init,
+                                 initargs=(ctx.Barrier(workers), initializer, initargs)) as executor:
+            results = list(executor.map(_probe, range(workers)))
+            startup = time.perf_counter() - start
+    finally:
+        if shared is not None:
+            shared.close()
+
+    rss = sum(mem[0] for _, mem, _ in results) / len(results) / 1024
+    uss = sum(mem[1] for _, mem, _ in results) / len(results) / 1024
+    return publish, startup, rss, uss
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pool startup time and worker memory, with and without the shared graph.")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[200, 1000, 3000])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--start-methods", nargs="+", default=["fork", "spawn"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    print(f"{'nodes':>6} {'start':>6} {'mode':>7} {'publish (s)':>12} {'startup (s)':>12} "
+          f"{'RSS/worker (MiB)':>17} {'USS/worker (MiB)':>17}")
+    for num_nodes in args.nodes:
+        G = generate_async_rdag(num_nodes, 1.2, 0.1)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        G = WorkflowGraph.from_networkx(G)
+        for method in args.start_methods:
+            for use_shared in (False, True):
+                publish, startup, rss, uss = measure(G, all_nodes, preds, reach, args.workers, use_shared, method)
+                mode = "shared" if use_shared else "copied"
+                print(f"{num_nodes:>6} {method:>6} {mode:>7} {publish:>12.2f} {startup:>12.2f} "
+                      f"{rss:>17.1f} {uss:>17.1f}")
@@ -0,0 +1,330 @@
+import argparse
+import collections
+import heapq
+
+import numpy as np
+
+from workflow_graph import WorkflowGraph, _csr_ptr, as_workflow_graph
+
+# The simulated performance of a plan at one offered load. `rate` is the offered load and
+# `throughput` the completed requests per second, `mean`/`p50`/`p90`/`p99` the end-to-end latency
+# in ms of the requests after the warm-up. `bottleneck` is the root of the busiest container and
+# `utilization` the fraction of its cores' time it was busy.
+SimResult = collections.namedtuple('SimResult', ['rate', 'throughput', 'mean', 'p50', 'p90', 'p99', 'bottleneck',
+                                                 'utilization'])
+
+# The containers of a plan, laid out over the simulated visits (see `PlanSimulator._layout`).
+# The calls of visit `x` are `sync_calls[sync_ptr[x]:sync_ptr[x + 1]]` (in the order they are
+# made) and `async_calls[async_ptr[x]:async_ptr[x + 1]]`.
+_Layout = collections.namedtuple('_Layout', ['container', 'parent', 'hop', 'is_async', 'demand', 'sync_ptr',
+                                             'sync_calls', 'async_ptr', 'async_calls', 'servers', 'speed'])
+
+
+def baseline_assignment(graph):
+    """The assignment of the unmerged deployment, in which every function is its own container."""
+    labels = graph.labels if isinstance(graph, WorkflowGraph) else list(graph.nodes())
+    return {(i, i): 1 for i in labels}
+
+
+class PlanSimulator:
+    """
+    Predicts the latency and throughput of a merge plan without deploying it.
+
+    Requests arrive open-loop (Poisson) at the workflow's entry function. Each request
+    expands into a tree of function executions: an execution of `u` calls `v`
+    `weight / invocations of u` times on average (the integer part always, the fraction
+    with that probability), and takes a service time drawn from `v`'s distribution.
+
+    Under a plan, a call into a root of the plan crosses containers and starts a visit
+    to that root's container; any other call runs inside the caller's visit. A visit
+    queues for a core of its container (FCFS, spread round-robin over the container's
+    cores) and runs the service time of every function it executes locally. Then it makes
+    its remote calls: the synchronous ones one after the other, then the asynchronous
+    ones concurrently, and waits for all of them. A remote call adds its RPC overhead
+    (the edge's `rpc_latency`, or `rpc_latency` where it was not measured). Without
+    queueing this is the latency model of `WorkflowGraph.expected_latency`.
+
+    The call trees and service times are drawn once, when the simulator is built, and
+    arrivals for a rate are one sequence of exponential gaps scaled to it. Every plan and
+    rate simulated with one `PlanSimulator` therefore sees the same requests, so the
+    differences between plans are not sampling noise, and scoring many candidate plans
+    only repeats the vectorized queueing passes.
+
+    Times are in ms (the unit of the `latency`/`rpc_latency` attributes written by
+    `trace_ingest.py`) and rates in requests per second.
+    """
+
+    def __init__(self, graph, N=None, requests=5000, service_time=None, rpc_latency=1.0, entry=None, warmup=0.1,
+                 seed=0):
+        """
+        Args:
+            graph (nx.DiGraph or WorkflowGraph): The workflow's call graph.
+            N (int, optional): The number of invocations the call weights were counted over.
+                               Defaults to the graph's.
+            requests (int): The number of requests to simulate per rate.
+            service_time (dict, optional): The service time distribution of functions, by label:
+                                           a mean in ms (exponentially distributed), or a callable
+                                           `f(rng, size)` returning samples, e.g.
+                                           `lambda rng, n: rng.lognormal(np.log(2.0), 0.5, n)`.
+                                           Other functions take an exponential service time with
+                                           their `latency` as the mean.
+            rpc_latency (float): RPC overhead in ms of calls without a measured `rpc_latency`.
+            entry (optional): The entry function. Defaults to the function without callers.
+            warmup (float): The fraction of the first requests left out of the statistics.
+            seed (int): Seed of the random call trees, service times and arrivals.
+
+        Raises:
+            ValueError: If the entry is not given and the graph does not have exactly one
+                        function without callers.
+        """
+        if N is None:
+            N = graph.N if isinstance(graph, WorkflowGraph) else graph.graph.get('N') or 1
+        wg = as_workflow_graph(graph, N)
+        if entry is None:
+            sources = np.flatnonzero(np.diff(wg.in_ptr) == 0)
+            if len(sources) != 1:
+                raise ValueError(f"The graph has {len(sources)} functions without callers; pass `entry`.")
+            entry = int(sources[0])
+        else:
+            entry = wg.index[entry]
+        self.graph, self.entry, self.requests, self.warmup = wg, entry, requests, warmup
+        self.hop = wg.hop_latency(rpc_latency)
+
+        rng = np.random.default_rng(seed)
+        per_call = wg.calls_per_invocation()
+        out_ptr, dst = wg.out_ptr.tolist(), wg.dst.tolist()
+
+        # Executions are numbered in creation order, so a caller comes before its callees.
+        executions = [[] for _ in wg.labels]
+        executions[entry].append(np.arange(requests))
+        parents, edges, self._chunks = [np.full(requests, -1)], [np.full(requests, -1)], []
+        count = requests
+        for u in wg.topological_order():
+            if not executions[u]:
+                continue
+            callers = np.concatenate(executions[u])
+            for e in range(out_ptr[u], out_ptr[u + 1]):
+                whole = np.floor(per_call[e])
+                calls = (whole + (rng.random(len(callers)) < per_call[e] - whole)).astype(np.int64)
+                callees = np.arange(count, count + calls.sum())
+                self._chunks.append((count, count + len(callees), dst[e]))
+                count += len(callees)
+                executions[dst[e]].append(callees)
+                parents.append(np.repeat(callers, calls))
+                edges.append(np.full(len(callees), e))
+        self.parent, self.edge = np.concatenate(parents), np.concatenate(edges)
+
+        service_time = service_time or {}
+        self.service = np.zeros(count)
+        for v, label in enumerate(wg.labels):
+            if not executions[v]:
+                continue
+            ids = np.concatenate(executions[v])
+            dist = service_time.get(label, wg.latency[v])
+            self.service[ids] = dist(rng, len(ids)) if callable(dist) else rng.exponential(dist, len(ids))
+        # Arrival times at a rate of one request per ms.
+        self._gaps = np.cumsum(rng.exponential(1.0, requests))
+
+    # --- Plan ---
+
+    def _layout(self, assignment, cores):
+        """
+        Splits the executions into visits to the plan's containers.
+
+        Raises:
+            ValueError: If the entry is not a root of the plan, or a function is called
+                        from a container it is not assigned to.
+        """
+        wg = self.graph
+        V = len(wg.labels)
+        members = np.zeros((V, V), dtype=bool)
+        for (i, r), assigned in assignment.items():
+            if assigned == 1:
+                members[wg.index[r], wg.index[i]] = True
+        roots = members.diagonal().copy()
+        if not roots[self.entry]:
+            raise ValueError(f"The entry {wg.labels[self.entry]} is not a root of the plan.")
+
+        n = self.requests
+        container = np.full(len(self.parent), self.entry)
+        visit = np.arange(len(self.parent))
+        for start, end, v in self._chunks:
+            parents = self.parent[start:end]
+            if roots[v]:
+                container[start:end] = v
+            else:
+                inside = container[parents]
+                if not members[inside, v].all():
+                    outside = wg.labels[inside[~members[inside, v]][0]]
+                    raise ValueError(f"{wg.labels[v]} is called from the container of {outside} "
+                                     f"but is not assigned to it.")
+                container[start:end] = inside
+                visit[start:end] = visit[parents]
+
+        starts = np.flatnonzero(visit == np.arange(len(visit)))
+        index = np.full(len(visit), -1)
+        index[starts] = np.arange(len(starts))
+        demand = np.bincount(index[visit], weights=self.service, minlength=len(starts))
+
+        parent = np.full(len(starts), -1)
+        parent[n:] = index[visit[self.parent[starts[n:]]]]
+        edge = self.edge[starts[n:]]
+        hop = np.zeros(len(starts))
+        hop[n:] = self.hop[edge]
+        is_async = np.zeros(len(starts), dtype=bool)
+        is_async[n:] = wg.is_async[edge]
+
+        # Calls of a visit are made in order of visit ids.
+        calls = np.flatnonzero(parent >= 0)
+        calls = calls[np.argsort(parent[calls], kind='stable')]
+        sync_calls, async_calls = calls[~is_async[calls]], calls[is_async[calls]]
+        sync_ptr = _csr_ptr(parent[sync_calls], len(starts))
+        async_ptr = _csr_ptr(parent[async_calls], len(starts))
+
+        cores = np.array([cores.get(label, 1.0) if isinstance(cores, dict) else cores for label in wg.labels],
+                         dtype=np.float64)
+        servers = np.maximum(np.floor(cores), 1).astype(np.int64)
+        speed = cores / servers
+        return _Layout(container[starts], parent, hop, is_async, demand, sync_ptr, sync_calls, async_ptr,
+                       async_calls, servers, speed)
+
+    # --- Simulation ---
+
+    def simulate(self, assignment=None, rate=100.0, cores=1.0, layout=None):
+        """
+        Simulates the plan at one offered load.
+
+        Visits are processed in order of their arrival at their container, from one event
+        queue. Arriving in order, a visit's start and end of service follow from its
+        container's cores at once (FCFS, on the core that frees up first), and so does
+        every event that its end of service leads to: its next call, or, if it makes no
+        more calls, the return to its caller and whatever the caller does next. None of
+        these is earlier than the arrival being processed, so one pass is exact.
+
+        Args:
+            assignment (dict, optional): The solver assignment `{(i, r): 1}` of the plan.
+                                         Defaults to the unmerged deployment.
+            rate (float): Offered load in requests per second.
+            cores (float or dict): CPU limit of the containers in cores, or the limit of each
+                                   container by root (1 for roots missing from the dict). A
+                                   fractional limit slows down the container's cores.
+            layout: Internal: the plan's precomputed layout (see `curve`).
+
+        Returns:
+            SimResult
+        """
+        if layout is None:
+            layout = self._layout(assignment or baseline_assignment(self.graph), cores)
+        service = layout.demand / layout.speed[layout.container]
+        arrival = self._gaps * (1000.0 / rate)
+        done = _run(layout, service, arrival)
+
+        n, skip = self.requests, int(self.requests * self.warmup)
+        latency = done[skip:n] - arrival[skip:]
+        span = done[skip:n].max() - arrival[skip]
+        throughput = len(latency) / span * 1000.0 if span > 0 else 0.0
+        p50, p90, p99 = np.percentile(latency, [50, 90, 99])
+
+        busy = np.bincount(layout.container, weights=service, minlength=len(self.graph.labels)) / layout.servers
+        busiest = int(np.argmax(busy))
+        utilization = busy[busiest] / (done[:n].max() - arrival[0]) if n > 1 else 0.0
+        return SimResult(rate, float(throughput), float(latency.mean()), float(p50), float(p90), float(p99),
+                         self.graph.labels[busiest], float(min(utilization, 1.0)))
+
+    def curve(self, assignment=None, rates=(), cores=1.0):
+        """
+        Simulates the plan at each offered load, like one wrk2 run per rate.
+
+        Returns:
+            list: A `SimResult` per rate.
+        """
+        layout = self._layout(assignment or baseline_assignment(self.graph), cores)
+        return [self.simulate(rate=rate, layout=layout) for rate in rates]
+
+
+def _run(layout, service, arrival):
+    """
+    Runs the event queue of a plan and returns the time every visit completes, calls included.
+
+    Args:
+        layout (_Layout): The plan's visits.
+        service (np.ndarray): Service time of every visit, in ms.
+        arrival (np.ndarray): Arrival time of every request, in ms (the first visits, in order).
+    """
+    container, parent, hop, is_async = (layout.container.tolist(), layout.parent.tolist(), layout.hop.tolist(),
+                                        layout.is_async.tolist())
+    sync_ptr, sync_calls = layout.sync_ptr.tolist(), layout.sync_calls.tolist()
+    async_ptr, async_calls = layout.async_ptr.tolist(), layout.async_calls.tolist()
+    service = service.tolist()
+    next_sync = sync_ptr[:-1]
+    pending = [0] * len(service)
+    done = [0.0] * len(service)
+    cores = {v: [0.0] * int(layout.servers[v]) for v in set(container)}
+
+    # Requests arrive in time order, so the list of first visits is already a heap.
+    events = list(zip(arrival.tolist(), range(len(arrival))))
+    while events:
+        t, x = heapq.heappop(events)
+        free = cores[container[x]]
+        t = max(t, free[0]) + service[x]
+        heapq.heapreplace(free, t)
+
+        # Make x's next call, or complete x and continue with its caller, until a call is made.
+        while True:
+            if next_sync[x] < sync_ptr[x + 1]:
+                call = sync_calls[next_sync[x]]
+                next_sync[x] += 1
+                heapq.heappush(events, (t + hop[call], call))
+                break
+            if pending[x] == 0 and async_ptr[x] < async_ptr[x + 1]:
+                pending[x] = async_ptr[x + 1] - async_ptr[x]
+                for call in async_calls[async_ptr[x]:async_ptr[x + 1]]:
+                    heapq.heappush(events, (t + hop[call], call))
+                break
+            done[x] = t
+            p = parent[x]
+            if p < 0:
+                break
+            if is_async[x]:
+                # The caller goes on when the last of its concurrent calls returns.
+                done[p] = max(done[p], t)
+                pending[p] -= 1
+                if pending[p] > 0:
+                    break
+                t = done[p]
+                pending[p] = -1
+            x = p
+    return np.array(done)
+
+
+if __name__ == "__main__":
+    from export_plan import load_graph, load_merge_plan
+
+    parser = argparse.ArgumentParser(description="Predict the throughput-latency curve of a merge plan.")
+    parser.add_argument("graph", help="call graph in networkx node-link JSON, with 'latency' (ms) on the nodes")
+    parser.add_argument("--plan", default=None, help="manifest.json of a plan written by export_plan.py")
+    parser.add_argument("--rates", type=float, nargs="+", required=True, help="offered loads in requests per second")
+    parser.add_argument("--cores", type=float, default=1.0, help="CPU limit of every container in cores")
+    parser.add_argument("--requests", type=int, default=5000, help="requests simulated per rate")
+    parser.add_argument("--rpc-latency", type=float, default=1.0,
+                        help="RPC overhead in ms of calls without a measured 'rpc_latency'")
+    parser.add_argument("--default-latency", type=float, default=0.0,
+                        help="mean service time in ms of functions without a 'latency'")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    G, N = load_graph(args.graph)
+    defaults = {n: args.default_latency for n, d in G.nodes(data=True) if not d.get('latency')}
+    sim = PlanSimulator(G, N, requests=args.requests, service_time=defaults, rpc_latency=args.rpc_latency,
+                        seed=args.seed)
+    plans = {'baseline': baseline_assignment(G)}
+    if args.plan:
+        # funcTree files name functions as strings.
+        label = {str(n): n for n in G}
+        plans['merged'] = {(label[i], label[r]): x for (i, r), x in load_merge_plan(args.plan).items()}
+
+    print(f"{'plan':>10} {'rate':>10} {'tput':>10} {'p50':>10} {'p90':>10} {'p99':>10}  bottleneck")
+    for name, assignment in plans.items():
+        for r in sim.curve(assignment, args.rates, args.cores):
+            print(f"{name:>10} {r.rate:>10g} {r.throughput:>10.1f} {r.p50:>10.3f} {r.p90:>10.3f} {r.p99:>10.3f}  "
+                  f"{r.bottleneck} ({r.utilization:.0%})")
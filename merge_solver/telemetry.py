@@ -0,0 +1,166 @@
+import collections
+import contextlib
+import json
+import os
+import time
+
+
+class SolverTrace:
+    """
+    Collects phase timings and solver statistics of a root selection run.
+
+    Pass an instance as `trace=` to `run_root_selection_strategy` (and
+    `experiment.run_comparison`) and it records:
+
+    - phases (`preprocess`, `candidate_selection`, `greedy_refine`, `combinatorial_k`, ...)
+    - one `ilp` event per `solve_subgraph_construction` call, with the model build
+      time (and Gurobi environment start), Gurobi presolve and solve time, node count, MIP gap and the runtime and
+      objective of every new incumbent (from a Gurobi callback)
+    - counters (e.g. root sets pruned as infeasible) and worker utilization of the
+      process pool
+
+    Every event is a dict with `name`, `cat`, `ts` (wall-clock start, seconds since
+    the epoch, so that events from worker processes line up), `dur` (seconds, for
+    spans), `pid` and `args`. Events recorded in pool workers are sent back with
+    their results and merged with `extend`.
+
+    Export with `write_jsonl` (one event per line) or `write_chrome_trace` (load in
+    chrome://tracing or https://ui.perfetto.dev; each worker process gets its own lane).
+    """
+
+    def __init__(self):
+        self.events = []
+        self.counters = collections.Counter()
+
+    def add(self, name, start, duration=None, cat='phase', **args):
+        """Records an event that started at `start` (time.time()); a span if `duration` is given."""
+        event = {'name': name, 'cat': cat, 'ts': start, 'pid': os.getpid(), 'args': args}
+        if duration is not None:
+            event['dur'] = duration
+        self.events.append(event)
+        return event
+
+    @contextlib.contextmanager
+    def span(self, name, cat='phase', **args):
+        """
+        Times the enclosed block. Yields the span's `args` dict, so the block can
+        attach results (e.g. `info['pool_size'] = 12`).
+        """
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.add(name, start, time.time() - start, cat, **args)
+
+    def count(self, name, n=1):
+        """Increments a counter. Counter values are also recorded as events, for the trace timeline."""
+        self.counters[name] += n
+        self.add(name, time.time(), cat='counter', value=self.counters[name])
+
+    def extend(self, events):
+        """Merges events recorded by another process (see `root_selector.evaluate_r_tuple_worker`)."""
+        self.events.extend(events or ())
+
+    # --- Summaries ---
+
+    def ilps(self):
+        """The `ilp` events, in the order they were recorded."""
+        return [e for e in self.events if e['cat'] == 'ilp']
+
+    def summary(self):
+        """
+        Totals per phase and over all ILPs.
+
+        Returns:
+            dict: `phases` (name -> total seconds and count), `ilp` (count, total environment, build,
+                  presolve and solve seconds, nodes explored, incumbents found) and `counters`.
+        """
+        phases = collections.defaultdict(lambda: {'seconds': 0.0, 'count': 0})
+        for e in self.events:
+            if e['cat'] == 'phase' and 'dur' in e:
+                phases[e['name']]['seconds'] += e['dur']
+                phases[e['name']]['count'] += 1
+
+        ilps = self.ilps()
+        ilp = {
+            'count': len(ilps),
+            'env_seconds': sum(e['args']['env_s'] for e in ilps),
+            'build_seconds': sum(e['args']['build_s'] for e in ilps),
+            'presolve_seconds': sum(e['args']['presolve_s'] for e in ilps),
+            'solve_seconds': sum(e['args']['solve_s'] for e in ilps),
+            'nodes': sum(e['args']['node_count'] for e in ilps),
+            'incumbents': sum(len(e['args']['incumbents']) for e in ilps),
+        }
+        return {'phases': dict(phases), 'ilp': ilp, 'counters': dict(self.counters)}
+
+    # --- Export ---
+
+    def write_jsonl(self, path):
+        """Writes one JSON event per line, sorted by start time."""
+        with open(path, 'w') as f:
+            for e in sorted(self.events, key=lambda e: e['ts']):
+                f.write(json.dumps(_jsonable(e)) + '\n')
+
+    def chrome_trace(self):
+        """
+        The events in Chrome trace event format. ILPs are split into `env`, `build`,
+        `presolve` and `solve` slices with an instant event for each incumbent.
+        """
+        t0 = min((e['ts'] for e in self.events), default=0.0)
+        us = lambda t: round((t - t0) * 1e6, 1)
+        out = []
+        for e in self.events:
+            base = {'name': e['name'], 'cat': e['cat'], 'pid': e['pid'], 'tid': e['pid'], 'ts': us(e['ts'])}
+            if e['cat'] == 'counter':
+                out.append(dict(base, ph='C', args={e['name']: e['args']['value']}))
+            elif 'dur' in e:
+                out.append(dict(base, ph='X', dur=round(e['dur'] * 1e6, 1), args=_jsonable(e['args'])))
+            else:
+                out.append(dict(base, ph='i', s='p', args=_jsonable(e['args'])))
+
+            if e['cat'] == 'ilp':
+                a = e['args']
+                optimize_start = e['ts'] + a['env_s'] + a['build_s']
+                for name, start, dur in (('env', e['ts'], a['env_s']),
+                                         ('build', e['ts'] + a['env_s'], a['build_s']),
+                                         ('presolve', optimize_start, a['presolve_s']),
+                                         ('solve', optimize_start + a['presolve_s'], a['solve_s'])):
+                    out.append(dict(base, name=name, ph='X', ts=us(start), dur=round(dur * 1e6, 1), args={}))
+                for inc in a['incumbents']:
+                    out.append(dict(base, name='incumbent', ph='i', s='t', ts=us(optimize_start + inc['t']),
+                                    args=_jsonable(inc)))
+
+        # Name the lanes: the parent process first, then the workers.
+        pids = sorted({e['pid'] for e in self.events}, key=lambda p: (p != os.getpid(), p))
+        for n, pid in enumerate(pids):
+            label = 'solver' if pid == os.getpid() else f'worker {n}'
+            out.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': pid, 'args': {'name': label}})
+        return {'traceEvents': out, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def write(self, path):
+        """Writes JSONL if `path` ends in `.jsonl`, otherwise Chrome trace JSON."""
+        if path.endswith('.jsonl'):
+            self.write_jsonl(path)
+        else:
+            self.write_chrome_trace(path)
+
+
+def span(trace, name, cat='phase', **args):
+    """`trace.span(...)`, or a no-op context manager if `trace` is None."""
+    if trace is None:
+        return contextlib.nullcontext(args)
+    return trace.span(name, cat, **args)
+
+
+def _jsonable(value):
+    if isinstance(value, (set, frozenset, tuple, list)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
@@ -1,11 +1,31 @@
 import unittest
+import numpy as np
 import networkx as nx
 import math
+import os
+import json
+import tempfile
+import time
+import random
+import multiprocessing
+import io
+import contextlib
 from unittest.mock import patch
 from ilp import solve_subgraph_construction
-from root_selector import run_root_selection_strategy
+from root_selector import run_root_selection_strategy, iter_incumbents
 from rdag import preprocess_graph, find_root, generate_sync_rdag
 from downstream_impact import select_downstream_candidate_roots
+from export_plan import export_merge_plan, subgraph_edges, load_merge_plan
+from trace_ingest import iter_otlp_spans, load_function_metrics, build_workflow_graph, CallGraphBuilder, Reservoir
+from planner import Planner, plan_cost, SlidingWindowGraph
+from ilp import print_solution_details
+from shared_graph import SharedGraph, attach
+from rdag import generate_async_rdag, generate_rdag, RDAG_FAMILIES
+from workflow_graph import WorkflowGraph
+from telemetry import SolverTrace
+from capacity_sweep import capacity_sweep, pareto_front
+from multi_workflow import Workflow, solve_workflows, solve_separately, union_graph
+from simulator import PlanSimulator
 
 import gurobipy as gp
 
@@ -604,8 +624,655 @@ class TestFunctionMerging(unittest.TestCase):
         self.assertEqual(len(candidates), 1)
         self.assertIn(3, candidates)
 
+    def test_export_merge_plan_with_clone(self):
+        """
+        Tests that a solver result becomes one funcTree per root, with a cloned
+        function merged into every subgraph that contains it.
+        """
+        print("\n--- Running Export Test: funcTrees with Cloned Function ---")
+        nodes = {'entry': {'m': 1, 'c': 1}, 'left': {'m': 20, 'c': 20},
+                 'right': {'m': 20, 'c': 20}, 'shared': {'m': 1, 'c': 1}}
+        edges = [('entry', 'left', {'weight': 5}), ('entry', 'right', {'weight': 5}),
+                 ('left', 'shared', {'weight': 100}), ('right', 'shared', {'weight': 100})]
+        G = self._create_graph(nodes, edges)
+        M, C, N = 25, 25, 1
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        _, R, assignment, _ = run_root_selection_strategy("Optimal", G, M, C, N, root, all_nodes, preds, reach, max_k=3)
+
+        with tempfile.TemporaryDirectory() as out:
+            manifest = export_merge_plan(G, R, assignment, out, strategy='sync')
+            with open(os.path.join(out, 'manifest.json')) as f:
+                self.assertEqual(json.load(f), manifest)
+
+            trees = {}
+            for wf in manifest['workflows']:
+                with open(os.path.join(out, wf['funcTree'])) as f:
+                    trees[wf['caller']] = [tuple(line.split()) for line in f.read().splitlines()]
+
+        # 'shared' is cloned into both subgraphs, and each tree starts at its root.
+        self.assertEqual(set(trees), set(R))
+        for r, tree in trees.items():
+            self.assertEqual(tree[0][0], r)
+            self.assertIn('shared', [callee for _, callee in tree])
+        self.assertEqual(manifest['standalone'], [])
+        self.assertTrue(all(wf['cloned'] == ['shared'] for wf in manifest['workflows']))
+
+    def test_subgraph_edges_order(self):
+        """Tests that funcTree edges start at the root and list every caller before its callees."""
+        print("\n--- Running Export Test: funcTree Edge Order ---")
+        nodes = {n: {'m': 1, 'c': 1} for n in 'abcd'}
+        edges = [('a', 'b', {'weight': 1}), ('a', 'c', {'weight': 1}),
+                 ('b', 'd', {'weight': 1}), ('c', 'd', {'weight': 1})]
+        G = self._create_graph(nodes, edges)
+        self.assertEqual(subgraph_edges(G, 'a', set('abcd')),
+                         [('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd')])
+        with self.assertRaises(ValueError):
+            subgraph_edges(G, 'a', {'a', 'd'})
+
+
+    def _otlp_request(self, spans):
+        """Wraps (trace, span, parent, function, kind, start, end) tuples into one OTLP JSON request."""
+        by_service = {}
+        for trace, span, parent, func, kind, start, end in spans:
+            by_service.setdefault(func, []).append({
+                'traceId': trace, 'spanId': span, 'parentSpanId': parent or '', 'kind': kind,
+                'startTimeUnixNano': str(start), 'endTimeUnixNano': str(end)})
+        return {'resourceSpans': [
+            {'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': func}}]},
+             'scopeSpans': [{'spans': spans}]} for func, spans in by_service.items()]}
+
+    def test_trace_ingestion(self):
+        """
+        Tests that spans become call counts, that concurrent calls are typed async,
+        and that cAdvisor metrics become node resources.
+        """
+        print("\n--- Running Ingestion Test: OTLP Spans and cAdvisor Metrics ---")
+        requests = []
+        for t in range(4):
+            tid = f't{t}'
+            # compose-post calls text-service through a CLIENT span, then calls
+            # store-post and write-timeline concurrently.
+            requests.append(self._otlp_request([
+                (tid, 'a', None, 'compose-post', 2, 0, 100),
+                (tid, 'b', 'a', 'compose-post', 3, 10, 30),
+                (tid, 'c', 'b', 'text-service', 2, 12, 28),
+                (tid, 'd', 'a', 'store-post', 2, 40, 80),
+                (tid, 'e', 'a', 'write-timeline', 2, 45, 90),
+            ]))
+        # Split a trace across two lines: the child arrives before its parent.
+        requests.append(self._otlp_request([('t9', 'y', 'x', 'text-service', 2, 5, 6)]))
+        requests.append(self._otlp_request([('t9', 'x', None, 'compose-post', 2, 0, 10)]))
+
+        metrics_lines = []
+        for i, func in enumerate(['compose-post', 'text-service', 'store-post', 'write-timeline']):
+            for k in range(5):
+                metrics_lines.append(f'memory_working_set,container_name={func},machine=n1 value={(i + 1) * 2**20}i {k * 10**9}')
+                metrics_lines.append(f'cpu_usage_total,container_name={func},machine=n1 value={k * (i + 1) * 10**8}i {k * 10**9}')
+
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'traces.json'), 'w') as f:
+                f.write(''.join(json.dumps(r) + '\n' for r in requests))
+            with open(os.path.join(d, 'cadvisor.lp'), 'w') as f:
+                f.write('\n'.join(metrics_lines))
+            metrics = load_function_metrics([os.path.join(d, 'cadvisor.lp')])
+            # Only one trace buffered at a time: the split trace must still be joined.
+            G = build_workflow_graph(iter_otlp_spans([d]), metrics, max_open_traces=1)
+
+        self.assertEqual(G.graph['entry'], 'compose-post')
+        self.assertEqual(G.graph['N'], 5)
+        self.assertEqual(G.edges['compose-post', 'text-service']['weight'], 5)
+        self.assertEqual(G.edges['compose-post', 'text-service']['type'], 'sync')
+        self.assertEqual(G.edges['compose-post', 'store-post']['type'], 'async')
+        self.assertEqual(G.edges['compose-post', 'write-timeline']['type'], 'async')
+        self.assertAlmostEqual(G.nodes['text-service']['m'], 2.0)
+        self.assertAlmostEqual(G.nodes['text-service']['c'], 200.0)
+        # Median RPC overhead (client minus server span, in ms) and self time outside calls.
+        self.assertAlmostEqual(G.edges['compose-post', 'text-service']['rpc_latency'], 4e-6)
+        self.assertAlmostEqual(G.nodes['compose-post']['latency'], 30e-6)
+        self.assertAlmostEqual(G.nodes['text-service']['latency'], 16e-6)
+
+        # The graph can be handed to the solver directly.
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        self.assertEqual(root, 'compose-post')
+
+    def test_trace_ingestion_missing_metrics(self):
+        print("\n--- Running Ingestion Test: Missing Metrics ---")
+        request = self._otlp_request([('t', 'a', None, 'f', 2, 0, 10), ('t', 'b', 'a', 'g', 2, 1, 2)])
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'traces.json'), 'w') as f:
+                json.dump(request, f, indent=2)
+            spans = list(iter_otlp_spans([d]))
+        self.assertEqual(len(spans), 2)
+        with self.assertRaises(ValueError):
+            build_workflow_graph(spans, {'f': {'m': 1, 'c': 1}})
+        G = build_workflow_graph(spans, {'f': {'m': 1, 'c': 1}}, default_m=5, default_c=5)
+        self.assertEqual(G.nodes['g']['m'], 5)
+        with self.assertRaisesRegex(ValueError, r"Entry 'g' .*\['f'\]"):
+            build_workflow_graph(spans, {'f': {'m': 1, 'c': 1}}, entry='g', default_m=5, default_c=5)
+
+    def test_trace_ingestion_nested_overlap(self):
+        """
+        Tests that a call overlapping an earlier, non-adjacent call is typed async: `h` starts
+        after `g` ends but while `f` still runs. `k` runs after all of them and stays sync.
+        """
+        print("\n--- Running Ingestion Test: Overlap With a Non-Adjacent Call ---")
+        request = self._otlp_request([('t', 'a', None, 'e', 2, 0, 100), ('t', 'b', 'a', 'f', 2, 0, 10),
+                                      ('t', 'c', 'a', 'g', 2, 1, 2), ('t', 'd', 'a', 'h', 2, 3, 4),
+                                      ('t', 'x', 'a', 'k', 2, 20, 30)])
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'traces.json'), 'w') as f:
+                json.dump(request, f)
+            G = build_workflow_graph(iter_otlp_spans([d]), {}, default_m=1, default_c=1)
+        self.assertEqual({v: G.edges['e', v]['type'] for v in G.successors('e')},
+                         {'f': 'async', 'g': 'async', 'h': 'async', 'k': 'sync'})
+
+    def test_planner_replays_drift(self):
+        """
+        Tests that the planner re-solves when call weights drift, emits a plan only when
+        it improves on the deployed one, and does not re-solve while the weights are stable.
+        """
+        print("\n--- Running Planner Test: Replay Recorded Traces ---")
+        sec = 10**9
+
+        def invocation(t, x_calls, y_calls):
+            # e calls x sequentially, and the first x calls y sequentially.
+            tid, start = f't{t}', t * sec
+            spans = [(tid, 'e', None, 'e', 2, start, start + sec // 2)]
+            for k in range(x_calls):
+                spans.append((tid, f'x{k}', 'e', 'x', 2, start + k * 1000, start + k * 1000 + 900))
+            for k in range(y_calls):
+                spans.append((tid, f'y{k}', 'x0', 'y', 2, start + k * 100, start + k * 100 + 50))
+            return self._otlp_request(spans)
+
+        # First e->x is rare and x->y is hot, then the other way around.
+        requests = [invocation(t, 1, 5) for t in range(200)] + [invocation(t, 10, 1) for t in range(200, 400)]
+        resources = {f: {'m': 10, 'c': 10} for f in 'exy'}
+        emitted = []
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'recorded.json'), 'w') as f:
+                f.write(''.join(json.dumps(r) + '\n' for r in requests))
+            planner = Planner(25, 25, resources, window=100, bucket=10, drift_threshold=0.2,
+                              min_improvement=0.05, on_plan=emitted.append)
+            plans = planner.replay(iter_otlp_spans([d]))
+            # `x` roots no trace, so there is nothing to plan for it.
+            unrooted = Planner(25, 25, resources, window=100, bucket=10, entry='x').replay(iter_otlp_spans([d]))
+
+        self.assertEqual(plans, emitted)
+        self.assertEqual(unrooted, [])
+        self.assertEqual(plans[0]['R'], {'e', 'x'})
+        self.assertEqual(plans[-1]['R'], {'e', 'y'})
+        # The deployed plan was re-costed on the drifted graph before being replaced.
+        self.assertGreater(plans[-1]['deployed_cost'], plans[-1]['cost'])
+        metrics = planner.metrics.as_dict()
+        self.assertLess(metrics['solves'], metrics['checks'])
+        self.assertLessEqual(metrics['plans_emitted'], metrics['solves'])
+        self.assertGreater(metrics['total_plan_latency'], 0)
+        self.assertIn('quilt_planner_solves', planner.metrics.as_prometheus())
+
+    def test_plan_cost_of_deployed_plan(self):
+        print("\n--- Running Planner Test: Cost of a Deployed Plan ---")
+        nodes = {0: {'m': 10, 'c': 10}, 1: {'m': 10, 'c': 10}, 2: {'m': 10, 'c': 10}}
+        edges = [(0, 1, {'weight': 3}), (1, 2, {'weight': 7})]
+        G = self._create_graph(nodes, edges)
+        assignment = {(0, 0): 1, (1, 1): 1, (2, 1): 1}
+        self.assertEqual(plan_cost(G, {0, 1}, assignment, 25, 25, 1), 3)
+        # Too small containers, or a function the plan does not know about.
+        self.assertIsNone(plan_cost(G, {0, 1}, assignment, 15, 25, 1))
+        G.add_edge(2, 3, weight=1, type='sync')
+        G.nodes[3].update(m=1, c=1)
+        self.assertIsNone(plan_cost(G, {0, 1}, assignment, 25, 25, 1))
+
+    def test_sliding_window_latency(self):
+        """
+        Tests that the window's graph carries the self time and RPC overhead of all its
+        buckets, like a single builder over the same spans.
+        """
+        print("\n--- Running Planner Test: Latency Across Window Buckets ---")
+        sec = 10**9
+        requests = []
+        for t in range(9):
+            # e calls x through a CLIENT span; both durations grow with t.
+            tid, start = f't{t}', t * sec
+            requests.append(self._otlp_request([(tid, 'a', None, 'e', 2, start, start + 100 + t * 1000),
+                                                (tid, 'b', 'a', 'e', 3, start + 10, start + 60 + t * 10),
+                                                (tid, 'c', 'b', 'x', 2, start + 12, start + 40)]))
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'recorded.json'), 'w') as f:
+                f.write(''.join(json.dumps(r) + '\n' for r in requests))
+            spans = list(iter_otlp_spans([d]))
+        window = SlidingWindowGraph(window=100, bucket=1)
+        for span in spans:
+            window.add(span)
+        window.finish()
+        self.assertEqual(len(window.buckets), 9)
+        G, expected = window.graph(), CallGraphBuilder().add_all(spans).graph()
+        self.assertAlmostEqual(G.nodes['e']['latency'], expected.nodes['e']['latency'])
+        self.assertAlmostEqual(G.edges['e', 'x']['rpc_latency'], expected.edges['e', 'x']['rpc_latency'])
+
+        # Merged full reservoirs sample each stream in proportion to its length.
+        a, b = Reservoir(100), Reservoir(100)
+        for _ in range(1000):
+            a.add(0)
+        for _ in range(3000):
+            b.add(1)
+        merged = a.merge(b)
+        self.assertEqual((merged.count, len(merged.values), merged.values.count(0)), (4000, 100, 25))
+
+    def test_shared_graph_matches_networkx(self):
+        """
+        Tests that the graph attached from shared memory holds the same data as networkx,
+        and that the ILP gives the same result on either.
+        """
+        print("\n--- Running Shared Graph Test: Attached Graph Matches networkx ---")
+        random.seed(7)
+        G = generate_async_rdag(15, 1.2, 0.3)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        with SharedGraph(G, all_nodes, preds, reach) as shared:
+            shm, view, v_nodes, v_preds, v_reach = attach(shared.handle)
+            try:
+                self.assertEqual(v_nodes, all_nodes)
+                H = view.to_networkx()
+                self.assertEqual(sorted(H.edges(data=True)), sorted(G.edges(data=True)))
+                for n in all_nodes:
+                    self.assertEqual(H.nodes[n], {'m': G.nodes[n]['m'], 'c': G.nodes[n]['c']})
+                    self.assertEqual(sorted(v_preds.get(n, [])), sorted(preds[n]))
+                    self.assertEqual(v_reach.get(n, set()), reach[n])
+                    self.assertIn(n, view)
+
+                M, C, N = 120, 120, 2
+                for R in [{root}, {root, 3, 7}, {root, 1, 2, 5, 9}]:
+                    expected = solve_subgraph_construction(G, R, M, C, N, all_nodes, preds, reach)
+                    actual = solve_subgraph_construction(view, R, M, C, N, v_nodes, v_preds, v_reach)
+                    self.assertEqual(actual[0], expected[0])
+                    if expected[1] is None:
+                        self.assertIsNone(actual[1])
+                    else:
+                        self.assertAlmostEqual(actual[1], expected[1])
+            finally:
+                del view, v_preds, v_reach
+                shm.close()
+
+    def test_workflow_graph(self):
+        """
+        Tests the WorkflowGraph arrays against networkx, the round trip, and that the
+        heuristics and the ILP give the same results on either representation.
+        """
+        print("\n--- Running WorkflowGraph Test: Arrays Match networkx ---")
+        random.seed(11)
+        G = generate_async_rdag(12, 1.5, 0.4)
+        wg = WorkflowGraph.from_networkx(G, N=2)
+
+        self.assertEqual(len(wg), G.number_of_nodes())
+        self.assertEqual(wg.num_edges, G.number_of_edges())
+        self.assertEqual(sorted(wg.to_networkx().edges(data=True)), sorted(G.edges(data=True)))
+        for n in G.nodes():
+            i = wg.index[n]
+            self.assertEqual(sorted(wg.labels[j] for j in wg.predecessors(i)), sorted(G.predecessors(n)))
+            self.assertEqual(sorted(wg.labels[j] for j in wg.successors(i)), sorted(G.successors(n)))
+            self.assertEqual(wg.in_weight()[i], sum(G.edges[u, n]['weight'] for u in G.predecessors(n)))
+        for e in range(wg.num_edges):
+            self.assertEqual(wg.alpha[e], math.ceil(wg.weight[e] / 2))
+        order = [wg.labels[i] for i in wg.topological_order()]
+        self.assertTrue(all(order.index(u) < order.index(v) for u, v in G.edges()))
+
+        # Immutable: neither attributes nor arrays can be changed.
+        with self.assertRaises(AttributeError):
+            wg.N = 3
+        with self.assertRaises(ValueError):
+            wg.m[0] = 1
+        self.assertEqual(wg.with_N(4).alpha.tolist(), [math.ceil(w / 4) for w in wg.weight])
+
+        # `m`, `c` and `weight` are required; the error names what lacks them.
+        for strip in [lambda H: H.nodes[3].pop('m'), lambda H: H.nodes[3].pop('c')]:
+            H = G.copy()
+            strip(H)
+            with self.assertRaisesRegex(ValueError, "Node 3 "):
+                WorkflowGraph.from_networkx(H)
+        H = G.copy()
+        u, v = next(iter(H.edges()))
+        del H.edges[u, v]['weight']
+        with self.assertRaisesRegex(ValueError, rf"Edge \({u}, {v}\)"):
+            WorkflowGraph.from_networkx(H)
+
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        args = dict(M=150, C=150, N=2, beta=0.3, gamma=0.35, delta=0.35)
+        self.assertEqual(select_downstream_candidate_roots(G, root, 3, **args)[1],
+                         select_downstream_candidate_roots(wg, root, 3, **args)[1])
+        for R in [{root}, {root, 4, 6}]:
+            expected = solve_subgraph_construction(G, R, 150, 150, 2, all_nodes, preds, reach)
+            actual = solve_subgraph_construction(wg, R, 150, 150, 2, all_nodes, preds, reach)
+            self.assertEqual(actual[:2], expected[:2])
+
+    def test_combinatorial_with_and_without_shared_memory(self):
+        print("\n--- Running Shared Graph Test: Same Result Through the Worker Pool ---")
+        random.seed(3)
+        G = generate_async_rdag(8, 1.0, 0.3)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        M = C = 200
+        results = [run_root_selection_strategy("Optimal", G, M, C, 2, root, all_nodes, preds, reach, max_k=3,
+                                               num_threads=2, use_shared_memory=shared)
+                   for shared in (False, True)]
+        self.assertIsNotNone(results[0][0])
+        self.assertAlmostEqual(results[0][0], results[1][0])
+
+        # Forked workers share the parent's pages anyway, so the graph is not published by default.
+        with patch('root_selector.multiprocessing.get_start_method', return_value='fork'), \
+                patch('root_selector.SharedGraph', side_effect=AssertionError("published under fork")):
+            forked = run_root_selection_strategy("Optimal", G, M, C, 2, root, all_nodes, preds, reach, max_k=3,
+                                                 num_threads=2)
+        self.assertAlmostEqual(forked[0], results[0][0])
+
+        # An unset start method is only read (it would otherwise be fixed for the whole process),
+        # and the platform default decides.
+        with patch('root_selector.multiprocessing.get_start_method', return_value=None) as get_start_method, \
+                patch('root_selector.multiprocessing.get_all_start_methods', return_value=['fork', 'spawn']), \
+                patch('root_selector.SharedGraph', side_effect=AssertionError("published under fork")):
+            run_root_selection_strategy("Optimal", G, M, C, 2, root, all_nodes, preds, reach, max_k=3, num_threads=2)
+        get_start_method.assert_called_once_with(allow_none=True)
+
+        # Nor does the worker pool fix it.
+        before = multiprocessing.get_start_method(allow_none=True)
+        run_root_selection_strategy("Optimal", G, M, C, 2, root, all_nodes, preds, reach, max_k=3, num_threads=2)
+        self.assertEqual(multiprocessing.get_start_method(allow_none=True), before)
+
+    def test_solver_trace(self):
+        """
+        Tests that a traced run records phases, every ILP (including those solved in the
+        worker pool), prune counts and worker utilization, and that both exports load.
+        """
+        print("\n--- Running Telemetry Test: Solver Trace ---")
+        random.seed(3)
+        G = generate_async_rdag(8, 1.0, 0.3)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        trace = SolverTrace()
+        cost, R, _, _ = run_root_selection_strategy("Optimal", G, 200, 200, 2, root, all_nodes, preds, reach,
+                                                    max_k=3, num_threads=2, trace=trace)
+        self.assertIsNotNone(cost)
+
+        ilps = trace.ilps()
+        self.assertEqual(len(ilps), 1 + 7 + math.comb(7, 2))
+        self.assertEqual(len({e['pid'] for e in ilps} - {os.getpid()}), len({e['pid'] for e in ilps}))
+        for e in ilps:
+            a = e['args']
+            self.assertGreater(a['build_s'], 0)
+            self.assertGreaterEqual(a['solve_s'], 0)
+            if a['objective'] is not None:
+                self.assertTrue(a['incumbents'])
+                self.assertAlmostEqual(a['incumbents'][-1]['objective'], a['objective'])
+        self.assertIn(cost, [e['args']['objective'] for e in ilps])
+
+        summary = trace.summary()
+        self.assertEqual(summary['ilp']['count'], len(ilps))
+        self.assertEqual(summary['phases']['combinatorial_k']['count'], 3)
+        self.assertEqual(summary['counters'].get('pruned_infeasible', 0),
+                         sum(e['args']['objective'] is None for e in ilps))
+        pool = [e for e in trace.events if e['name'] == 'worker_pool']
+        self.assertEqual(len(pool), 1)
+        self.assertTrue(0 < pool[0]['args']['utilization'] <= 1)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            trace.write(os.path.join(tmp, 'trace.jsonl'))
+            trace.write(os.path.join(tmp, 'trace.json'))
+            with open(os.path.join(tmp, 'trace.jsonl')) as f:
+                self.assertEqual(len([json.loads(line) for line in f]), len(trace.events))
+            with open(os.path.join(tmp, 'trace.json')) as f:
+                chrome = json.load(f)['traceEvents']
+        self.assertEqual(sum(e['name'] == 'solve' for e in chrome), len(ilps))
+        self.assertTrue(all(e['ph'] in 'XiCM' for e in chrome))
+
+    def test_deadline_returns_best_so_far(self):
+        """
+        Tests that a global deadline stops the combinatorial search, returns the best
+        solution found so far, and that incumbents are reported as they improve.
+        """
+        print("\n--- Running Deadline Test: Anytime Combinatorial Search ---")
+        random.seed(3)
+        G = generate_async_rdag(12, 1.0, 0.3)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        incumbents = []
+        start = time.time()
+        result = run_root_selection_strategy(
+            "Optimal", G, 600, 600, 2, root, all_nodes, preds, reach, max_k=5, num_threads=2,
+            deadline=0.5, on_incumbent=incumbents.append)
+        cost, R, assignment, limit_hit = result
+        self.assertLess(time.time() - start, 3.0)
+        self.assertTrue(limit_hit)
+        self.assertIsNotNone(cost)
+        self.assertTrue(incumbents)
+        self.assertEqual([i.cost for i in incumbents], sorted((i.cost for i in incumbents), reverse=True))
+        self.assertEqual((incumbents[-1].cost, incumbents[-1].R), (cost, R))
+        self.assertLessEqual(incumbents[-1].bound, cost + 1e-6)
+        self.assertEqual(result.bound, incumbents[-1].bound)
+
+        # The same incumbents through the generator, for a greedy run without a deadline.
+        args = ("Downstream Impact", G, 200, 200, 2, root, all_nodes, preds, reach, 5)
+        kwargs = dict(candidate_selector_fn=select_downstream_candidate_roots, strategy_mode='greedy_refine',
+                      selector_args={'num_candidates': 6, 'M': 200, 'C': 200, 'N': 2,
+                                     'beta': 0.3, 'gamma': 0.35, 'delta': 0.35})
+        stream = iter_incumbents(*args, **kwargs)
+        seen = []
+        while True:
+            try:
+                seen.append(next(stream))
+            except StopIteration as stop:
+                result = stop.value
+                break
+        self.assertEqual(seen[-1].cost, result[0])
+        self.assertFalse(result[3])
+
+    def test_expired_deadline(self):
+        """
+        Tests that a deadline that runs out before or during candidate selection stops the
+        search instead of handing a negative time limit to Gurobi.
+        """
+        print("\n--- Running Deadline Test: Expired Budget ---")
+        random.seed(5)
+        G = generate_async_rdag(40, 1.0, 0.3)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        selector_args = {'num_candidates': 6, 'M': 5000, 'C': 5000, 'N': 2, 'beta': 0.3, 'gamma': 0.35, 'delta': 0.35}
+
+        def slow_selector(*args, **kwargs):
+            time.sleep(0.2)
+            return select_downstream_candidate_roots(*args, **kwargs)
+
+        for deadline, selector, initial_R in [(0.1, slow_selector, None), (0.0, select_downstream_candidate_roots, {root})]:
+            cost, R, assignment, limit_hit = run_root_selection_strategy(
+                "Downstream Impact", G, 5000, 5000, 2, root, all_nodes, preds, reach, max_k=5,
+                candidate_selector_fn=selector, selector_args=selector_args, strategy_mode='greedy_refine',
+                initial_R=initial_R, deadline=deadline)
+            self.assertTrue(limit_hit)
+            self.assertIsNone(cost)
+
+        # A spent budget still gives Gurobi a positive limit.
+        from root_selector import _remaining_time_limit, MIN_ILP_TIME_LIMIT
+        self.assertEqual(_remaining_time_limit(None, time.time() - 1), MIN_ILP_TIME_LIMIT)
+        self.assertEqual(_remaining_time_limit(5.0, time.time() - 1), MIN_ILP_TIME_LIMIT)
+
+
+    def test_capacity_sweep_matches_root_selection(self):
+        print("\n--- Running Test: Capacity Sweep ---")
+        random.seed(3)
+        G = generate_async_rdag(10, 1.0, 0.3)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        capacities = [(400, 400), (100, 100), (250, 250), (550, 550), (250, 400)]
+
+        trace = SolverTrace()
+        points = capacity_sweep(G, capacities, 2, root, all_nodes, preds, reach, max_k=4, trace=trace)
+        self.assertEqual([(p.M, p.C) for p in points], capacities)
+        for p in points:
+            cost, R, assignment, _ = run_root_selection_strategy(
+                "Optimal", G, p.M, p.C, 2, root, all_nodes, preds, reach, max_k=4)
+            if cost is None:
+                self.assertIsNone(p.cost)
+                continue
+            self.assertAlmostEqual(p.cost, cost)
+            self.assertIn(root, p.R)
+            self.assertLessEqual(len(p.R), 4)
+            self.assertEqual({r for _, r in p.assignment}, p.R)
+
+        # One model build for all points, which were solved by increasing capacity.
+        self.assertEqual(len([e for e in trace.events if e['name'] == 'sweep_build']), 1)
+        self.assertEqual([(e['args']['M'], e['args']['C']) for e in trace.ilps()], sorted(capacities))
+
+        # In parallel, with each worker sweeping a run of the points.
+        parallel = capacity_sweep(G, capacities, 2, root, all_nodes, preds, reach, max_k=4, num_threads=2)
+        self.assertEqual([p.cost for p in parallel], [p.cost for p in points])
+
+        # (250, 400) costs the same as (250, 250), and (100, 100) is infeasible.
+        self.assertEqual(points[4].cost, points[2].cost)
+        self.assertEqual([(p.M, p.C) for p in pareto_front(points)], [(250, 250), (400, 400), (550, 550)])
+
+    def test_multi_workflow_shares_containers(self):
+        print("\n--- Running Test: Multi-Workflow ---")
+        def workflow(edges, N):
+            G = self._create_graph({}, [(u, v, {'weight': w}) for u, v, w in edges])
+            nx.set_node_attributes(G, 40, 'm')
+            nx.set_node_attributes(G, 40, 'c')
+            G.graph['N'] = N
+            return G
+        compose = workflow([('compose', 'text', 100), ('text', 'mention', 100), ('text', 'url', 100),
+                            ('compose', 'unique-id', 100), ('compose', 'media', 100)], 100)
+        text = workflow([('text', 'mention', 50), ('text', 'url', 50)], 50)
+        read = workflow([('read', 'storage', 100), ('read', 'url', 30)], 100)
+        workflows = [Workflow('compose', compose, 10.0), Workflow('text', text, 50.0), Workflow('read', read, 100.0)]
+
+        graph, entries = union_graph(workflows)
+        self.assertEqual(entries, {'compose': 'compose', 'text': 'text', 'read': 'read'})
+        e = graph.index['text'], graph.index['url']
+        edge = [k for k in range(graph.num_edges) if (graph.src[k], graph.dst[k]) == e][0]
+        self.assertAlmostEqual(graph.weight[edge], 10.0 + 50.0)
+
+        # Memory is free: 'text' is cloned into 'compose', so no call crosses containers.
+        plan = solve_workflows(workflows, 400, 400)
+        self.assertEqual(plan.call_cost, 0)
+        self.assertEqual(plan.R, {'compose', 'text', 'read'})
+        self.assertIn(('text', 'compose'), plan.assignment)
+
+        # Memory is expensive: compose-post calls the shared 'text' container instead.
+        plan = solve_workflows(workflows, 400, 400, memory_weight=1.0)
+        self.assertNotIn(('text', 'compose'), plan.assignment)
+        self.assertAlmostEqual(plan.call_cost, 10.0)
+        self.assertAlmostEqual(plan.workflows['compose']['calls'], 10.0)
+        self.assertAlmostEqual(plan.objective, plan.call_cost + plan.memory)
+        call_cost, memory, plans = solve_separately(workflows, 400, 400, memory_weight=1.0)
+        self.assertLess(plan.memory, memory)
+        self.assertLess(plan.objective, call_cost + memory)
+
+    def test_code_size_charge_prevents_cloning(self):
+        """
+        The graph of `test_profitable_cloning_simple`, but the shared function has a large
+        binary: charging for image size makes separate containers cheaper than the clone.
+        """
+        print("\n--- Running Cloning Test: Code Size Charge ---")
+        nodes = {
+            0: {'m': 1, 'c': 1, 'size': 1},
+            1: {'m': 20, 'c': 20, 'size': 1},
+            2: {'m': 20, 'c': 20, 'size': 1},
+            3: {'m': 1, 'c': 1, 'size': 300, 'cold_start': 0.5}
+        }
+        edges = [(0, 1, {'weight': 5}), (0, 2, {'weight': 5}), (1, 3, {'weight': 100}), (2, 3, {'weight': 100})]
+        G = self._create_graph(nodes, edges)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+        weights = {'size_weight': 1.0, 'cold_start_weight': 10.0}
+
+        cost, R, assignment, _ = run_root_selection_strategy(
+            "Optimal", G, 25, 25, 1, root, all_nodes, preds, reach, 3, objective_weights=weights)
+        # Cloning 3 would cost 5 + 603 + 10; a container of its own costs 205 + 303 + 5.
+        self.assertIn(R, [{0, 1, 3}, {0, 2, 3}])
+        self.assertAlmostEqual(cost, 513)
+        self.assertEqual([r for (i, r) in assignment if i == 3], [3])
+        self.assertAlmostEqual(plan_cost(G, R, assignment, 25, 25, 1, weights), cost)
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            print_solution_details(G, 25, 25, 1, R, assignment)
+        self.assertIn("Binary size: 300.0", out.getvalue())
+        self.assertIn("Total image size: 303.0", out.getvalue())
+
+    def test_latency_objective(self):
+        """
+        One function must leave the root's container. By call weight the sync call is
+        cheapest to make remote; by latency the short async branch is, because it runs
+        concurrently with a longer one.
+        """
+        print("\n--- Running Test: Latency Objective ---")
+        nodes = {0: {'m': 10, 'c': 10, 'latency': 1}, 1: {'m': 10, 'c': 10, 'latency': 1},
+                 2: {'m': 10, 'c': 10, 'latency': 10}, 3: {'m': 10, 'c': 10, 'latency': 1}}
+        edges = [(0, 1, {'weight': 2}), (0, 2, {'weight': 4, 'type': 'async'}), (0, 3, {'weight': 4, 'type': 'async'})]
+        G = self._create_graph(nodes, edges)
+        root, all_nodes, preds, reach = preprocess_graph(G)
+
+        cost, R, _, _ = run_root_selection_strategy("Optimal", G, 30, 30, 4, root, all_nodes, preds, reach, 2)
+        self.assertEqual((cost, R), (2, {0, 1}))
+
+        cost, R, assignment, _ = run_root_selection_strategy(
+            "Optimal", G, 30, 30, 4, root, all_nodes, preds, reach, 2, objective='latency', rpc_latency=1.0)
+        # 1 + 0.5 * 1 (sync call, local) + max(10, 1 + 1) (async branches, 3 is remote)
+        self.assertEqual(R, {0, 3})
+        self.assertAlmostEqual(cost, 11.5)
+        self.assertAlmostEqual(plan_cost(G, R, assignment, 30, 30, 4, objective='latency'), cost)
+        # Making the sync call remote instead: 1 + 0.5 * (1 + 1) + 10.
+        wg = WorkflowGraph.from_networkx(G, 4)
+        self.assertAlmostEqual(wg.expected_latency(wg.mask({0, 1}))[wg.index[0]], 12.0)
+
+    def test_generate_rdag(self):
+        """Every family yields a reproducible rDAG rooted at 0, with the shape it is named after."""
+        print("\n--- Running Test: Vectorized rDAG Generator ---")
+        graphs = {}
+        for family in RDAG_FAMILIES:
+            G = generate_rdag(2000, np.random.default_rng(11), family, extra_edge_factor=1.0, async_prob=0.1)
+            self.assertTrue(nx.is_directed_acyclic_graph(G))
+            self.assertEqual(find_root(G), 0)
+            self.assertEqual(G.number_of_edges(), 3999)
+            self.assertEqual(sorted(G.edges(data=True)),
+                             sorted(generate_rdag(2000, 11, family, async_prob=0.1).edges(data=True)))
+            wg = generate_rdag(2000, 11, family, async_prob=0.1, as_networkx=False)
+            self.assertEqual(wg.num_edges, 3999)
+            graphs[family] = G
+
+        depth = {f: nx.dag_longest_path_length(G) for f, G in graphs.items()}
+        self.assertGreater(depth['chain'], 5 * depth['random'])
+        async_share = {f: np.mean([d['type'] == 'async' for _, _, d in G.edges(data=True)]) for f, G in graphs.items()}
+        self.assertGreater(async_share['fanout'], 0.4)
+        self.assertLess(async_share['random'], 0.15)
+        shared = graphs['diamond']
+        self.assertGreater(min(shared.in_degree(n) for n in range(1900, 2000)), 5)
+
+        with self.assertRaises(ValueError):
+            generate_rdag(10, 0, 'ring')
+
+    def test_simulator(self):
+        """
+        Without load, a simulated request takes the latency of `expected_latency`; a
+        single function under Poisson load queues like an M/M/1 server.
+        """
+        print("\n--- Running Test: Plan Simulator ---")
+        nodes = {n: {'m': 1, 'c': 1, 'latency': t} for n, t in [('a', 1), ('b', 2), ('c', 3), ('d', 1), ('e', 2)]}
+        edges = [('a', 'b', {'weight': 2}), ('a', 'c', {'weight': 1, 'type': 'async'}),
+                 ('a', 'd', {'weight': 1, 'type': 'async'}), ('b', 'e', {'weight': 4, 'rpc_latency': 0.5})]
+        G = self._create_graph(nodes, edges)
+        wg = WorkflowGraph.from_networkx(G)
+        fixed = {n: (lambda t: lambda rng, size: [t] * size)(d['latency']) for n, d in G.nodes(data=True)}
+        sim = PlanSimulator(G, requests=100, service_time=fixed)
+
+        merged = {('a', 'a'): 1, ('b', 'a'): 1, ('e', 'a'): 1, ('c', 'c'): 1, ('d', 'd'): 1}
+        with tempfile.TemporaryDirectory() as out:
+            export_merge_plan(G, {'a', 'c', 'd'}, merged, out)
+            self.assertEqual(load_merge_plan(os.path.join(out, 'manifest.json')), merged)
+        for assignment, R in [(None, set(G)), (merged, {'a', 'c', 'd'})]:
+            result = sim.simulate(assignment, rate=0.01)
+            self.assertAlmostEqual(result.p99, wg.expected_latency(wg.mask(R))[wg.index['a']])
+        self.assertLess(sim.simulate(merged, rate=0.01).mean, sim.simulate(None, rate=0.01).mean)
 
+        with self.assertRaises(ValueError):
+            sim.simulate({('a', 'a'): 1, ('c', 'c'): 1, ('d', 'd'): 1, ('e', 'e'): 1}, rate=1)
 
+        single = nx.DiGraph()
+        single.add_node('f', m=1, c=1, latency=1.0)
+        curve = PlanSimulator(single, requests=40000).curve(rates=[500, 800])
+        for result, expected in zip(curve, [2.0, 5.0]):
+            self.assertAlmostEqual(result.mean / expected, 1.0, delta=0.1)
+            self.assertEqual(result.bottleneck, 'f')
 
 if __name__ == '__main__':
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
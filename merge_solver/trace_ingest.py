@@ -0,0 +1,549 @@
+import argparse
+import collections
+import glob
+import gzip
+import json
+import math
+import os
+import random
+import re
+import urllib.request
+
+import networkx as nx
+
+# OTLP span kinds, as integers (protobuf JSON) and as enum names.
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+_KIND_NAMES = {"SPAN_KIND_INTERNAL": 1, "SPAN_KIND_SERVER": 2, "SPAN_KIND_CLIENT": 3,
+               "SPAN_KIND_PRODUCER": 4, "SPAN_KIND_CONSUMER": 5}
+
+# cAdvisor series (InfluxDB storage driver) used for the node resources.
+MEMORY_SERIES = "memory_working_set"
+CPU_SERIES = "cpu_usage_total"
+
+
+# --- Span sources ---
+
+class Span:
+    """The fields of an OTLP span that the call graph needs."""
+    __slots__ = ("trace_id", "span_id", "parent_id", "function", "kind", "start", "end")
+
+    def __init__(self, trace_id, span_id, parent_id, function, kind, start, end):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.function = function
+        self.kind = kind
+        self.start = start
+        self.end = end
+
+
+def _attributes(attrs):
+    """Flattens OTLP JSON attributes (`[{key, value: {stringValue: ...}}]`) into a dict."""
+    out = {}
+    for attr in attrs or []:
+        value = attr.get("value", {})
+        for v in value.values():
+            out[attr["key"]] = v
+            break
+    return out
+
+
+def spans_from_request(request, function_attr):
+    """
+    Yields the spans of one OTLP `ExportTraceServiceRequest` (or Tempo trace) object.
+
+    The function a span belongs to is its `function_attr` attribute (the OTel
+    FaaS convention `faas.name` by default), falling back to the resource's
+    `service.name`.
+    """
+    # The collector's file exporter writes 'resourceSpans'; the Tempo API returns 'batches'.
+    for rs in request.get("resourceSpans", request.get("batches", [])):
+        service = _attributes(rs.get("resource", {}).get("attributes")).get("service.name")
+        for ss in rs.get("scopeSpans", rs.get("instrumentationLibrarySpans", [])):
+            for s in ss.get("spans", []):
+                attrs = _attributes(s.get("attributes"))
+                kind = s.get("kind", 0)
+                yield Span(s.get("traceId"), s.get("spanId"), s.get("parentSpanId") or None,
+                           attrs.get(function_attr, service),
+                           _KIND_NAMES.get(kind, 0) if isinstance(kind, str) else kind,
+                           int(s.get("startTimeUnixNano", 0)), int(s.get("endTimeUnixNano", 0)))
+
+
+def _open(path):
+    return gzip.open(path, "rt") if path.endswith(".gz") else open(path, "r")
+
+
+def iter_otlp_spans(paths, function_attr="faas.name"):
+    """
+    Streams spans from OTLP JSON exports.
+
+    Each file holds one JSON request per line (the format of the OpenTelemetry
+    collector's file exporter), or a single JSON document such as a trace saved
+    from the Tempo API. Files may be gzipped. Only one line is held in memory at
+    a time.
+
+    Args:
+        paths (list): Files, directories (all `*.json*` files inside) or glob patterns.
+        function_attr (str): Span attribute that names the function.
+    """
+    for path in _expand(paths):
+        with _open(path) as f:
+            first = f.readline()
+            try:
+                request = json.loads(first) if first.strip() else None
+            except json.JSONDecodeError:
+                # A pretty-printed document rather than one request per line.
+                f.seek(0)
+                yield from spans_from_request(json.load(f), function_attr)
+                continue
+            if request is not None:
+                yield from spans_from_request(request, function_attr)
+            for line in f:
+                if line.strip():
+                    yield from spans_from_request(json.loads(line), function_attr)
+
+
+def iter_tempo_spans(source, tags=None, limit=1000, start=None, end=None, function_attr="faas.name"):
+    """
+    Streams spans from Tempo.
+
+    `source` is either the Tempo query frontend (e.g. `http://localhost:8082`,
+    the port forward set up by `setup/serverless_runtime/grafana_tempo/install.sh`)
+    or a local directory of traces previously saved from `/api/traces/<id>`,
+    which stands in for the API when the cluster is not available.
+
+    Args:
+        tags (str, optional): Tempo search tags, e.g. 'service.name=compose-post'.
+        limit (int): Maximum number of traces to fetch.
+        start, end (int, optional): Search window in Unix seconds.
+    """
+    if not source.startswith(("http://", "https://")):
+        yield from iter_otlp_spans([source], function_attr)
+        return
+
+    params = [f"limit={limit}"]
+    if tags:
+        params.append("tags=" + urllib.request.quote(tags))
+    if start is not None and end is not None:
+        params += [f"start={int(start)}", f"end={int(end)}"]
+    with urllib.request.urlopen(f"{source}/api/search?{'&'.join(params)}") as resp:
+        trace_ids = [t["traceID"] for t in json.load(resp).get("traces", [])]
+    for trace_id in trace_ids:
+        with urllib.request.urlopen(f"{source}/api/traces/{trace_id}") as resp:
+            yield from spans_from_request(json.load(resp), function_attr)
+
+
+def _expand(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, "*.json*")))
+        elif any(ch in path for ch in "*?["):
+            yield from sorted(glob.glob(path))
+        else:
+            yield path
+
+
+# --- Call graph aggregation ---
+
+class CallGraphBuilder:
+    """
+    Aggregates spans into caller -> callee call counts with bounded memory.
+
+    Spans are buffered per trace, because a child can arrive before its parent.
+    At most `max_open_traces` traces are buffered; when a new trace would
+    exceed that, the least recently updated trace is assumed complete and is
+    folded into the counts. Memory therefore depends on the size and the
+    interleaving of traces, not on the number of spans in the input.
+
+    An edge is a parent span and a child span that belong to different
+    functions. A call counts as asynchronous when it is a PRODUCER/CONSUMER
+    pair, when the child outlives its parent, or when it overlaps another call
+    made by the same invocation of the caller (the caller did not wait for it). An edge is
+    typed 'async' when the majority of its calls are.
+
+    For the latency objective, it also samples (in bounded reservoirs) the time each
+    invocation spends outside the calls it makes, and the RPC overhead of each call
+    made through a CLIENT span: the client span's duration minus the callee's span's.
+
+    Args:
+        max_open_traces (int): Number of traces buffered before the oldest is flushed.
+    """
+
+    def __init__(self, max_open_traces=10000):
+        self.max_open_traces = max_open_traces
+        self._open = collections.OrderedDict()
+        self.calls = collections.Counter()
+        self.async_calls = collections.Counter()
+        self.entries = collections.Counter()
+        self.self_time = collections.defaultdict(Reservoir)
+        self.rpc_time = collections.defaultdict(Reservoir)
+        self.num_spans = 0
+        self.num_traces = 0
+        self.orphans = 0
+
+    def add(self, span):
+        self.num_spans += 1
+        spans = self._open.get(span.trace_id)
+        if spans is None:
+            if len(self._open) >= self.max_open_traces:
+                self._flush(self._open.popitem(last=False)[1])
+            spans = self._open[span.trace_id] = []
+        else:
+            self._open.move_to_end(span.trace_id)
+        spans.append(span)
+
+    def is_open(self, trace_id):
+        return trace_id in self._open
+
+    def add_all(self, spans):
+        for span in spans:
+            self.add(span)
+        return self
+
+    def finish(self):
+        while self._open:
+            self._flush(self._open.popitem(last=False)[1])
+
+    def _flush(self, spans):
+        self.num_traces += 1
+        by_id = {s.span_id: s for s in spans}
+        children = collections.defaultdict(list)
+        for s in spans:
+            if s.parent_id is None:
+                if s.function:
+                    self.entries[s.function] += 1
+            elif s.parent_id in by_id:
+                children[s.parent_id].append(s)
+            else:
+                self.orphans += 1
+
+        # The invocation a span belongs to is its topmost ancestor in the same function,
+        # e.g. the SERVER span around the CLIENT spans of the RPCs a function makes.
+        invocation = {}
+
+        def invocation_of(span):
+            chain = []
+            while span.span_id not in invocation:
+                chain.append(span)
+                parent = by_id.get(span.parent_id)
+                if parent is None or parent.function != span.function:
+                    invocation[span.span_id] = span
+                    break
+                span = parent
+            top = invocation[span.span_id]
+            for s in chain:
+                invocation[s.span_id] = top
+            return top
+
+        calls = collections.defaultdict(list)
+        for parent_id, kids in children.items():
+            parent = by_id[parent_id]
+            for child in kids:
+                if child.function and parent.function and child.function != parent.function:
+                    calls[invocation_of(parent).span_id].append((parent, child))
+
+        for inv_id, made in calls.items():
+            inv = invocation[inv_id]
+            made.sort(key=lambda pc: pc[1].start)
+            # A call overlaps another if it starts before an earlier call ends (the running
+            # max of their ends), or if the next call starts before it ends.
+            reach = -math.inf
+            for idx, (parent, child) in enumerate(made):
+                edge = (parent.function, child.function)
+                self.calls[edge] += 1
+                overlaps = reach > child.start or (idx + 1 < len(made) and made[idx + 1][1].start < child.end)
+                reach = max(reach, child.end)
+                if (overlaps or child.end > inv.end
+                        or parent.kind == SPAN_KIND_PRODUCER or child.kind == SPAN_KIND_CONSUMER):
+                    self.async_calls[edge] += 1
+                if parent.kind == SPAN_KIND_CLIENT and parent is not inv:
+                    self.rpc_time[edge].add(max((parent.end - parent.start) - (child.end - child.start), 0))
+
+        # Self time: the part of each invocation not covered by the calls it makes (the
+        # CLIENT span of a call, or the callee's span if the call has none).
+        for s in spans:
+            if not s.function or invocation_of(s) is not s:
+                continue
+            intervals = sorted((max(p.start, s.start), min(p.end, s.end)) if p is not s else
+                               (max(c.start, s.start), min(c.end, s.end))
+                               for p, c in calls.get(s.span_id, ()))
+            covered, reach = 0, s.start
+            for start, end in intervals:
+                start = max(start, reach)
+                if end > start:
+                    covered += end - start
+                    reach = end
+            self.self_time[s.function].add(max(s.end - s.start - covered, 0))
+
+    def graph(self, entry=None):
+        """
+        Returns the aggregated call graph (see `call_graph`).
+
+        Args:
+            entry (str, optional): Keep only the functions reachable from this entry
+                                   function, which the solver requires to be the single root.
+                                   Defaults to the most frequent trace root.
+        """
+        self.finish()
+        return call_graph(self.calls, self.async_calls, self.entries, entry=entry,
+                          latency=median_ms(self.self_time), rpc_latency=median_ms(self.rpc_time))
+
+
+def median_ms(reservoirs):
+    """Medians in ms of reservoirs of nanosecond durations, by key."""
+    return {key: r.percentile(50) / 1e6 for key, r in reservoirs.items() if r.values}
+
+
+def call_graph(calls, async_calls, entries, entry=None, latency=None, rpc_latency=None):
+    """
+    Builds a call graph from aggregated counts.
+
+    Args:
+        calls (Counter): (caller, callee) -> number of calls.
+        async_calls (Counter): (caller, callee) -> number of those calls that were asynchronous.
+        entries (Counter): function -> number of traces rooted at it.
+        entry (str, optional): Entry function; defaults to the most frequent trace root.
+        latency (dict, optional): function -> median time (ms) of an invocation outside its calls.
+        rpc_latency (dict, optional): (caller, callee) -> median RPC overhead (ms) of a call.
+
+    Returns:
+        nx.DiGraph: Edges with `weight`, `type` and (if measured) `rpc_latency`, restricted to
+                    the functions reachable from the entry; nodes with `latency` if measured.
+                    `graph.graph['N']` is the number of entry invocations.
+
+    Raises:
+        ValueError: If `entry` is not the root of any trace.
+    """
+    latency = latency or {}
+    rpc_latency = rpc_latency or {}
+    G = nx.DiGraph()
+    for (u, v), count in calls.items():
+        is_async = async_calls[(u, v)] * 2 > count
+        G.add_edge(u, v, weight=count, type='async' if is_async else 'sync')
+        if (u, v) in rpc_latency:
+            G.edges[u, v]['rpc_latency'] = rpc_latency[u, v]
+    if entry is None and entries:
+        entry = entries.most_common(1)[0][0]
+    if entry is not None:
+        if not entries.get(entry):
+            raise ValueError(f"Entry {entry!r} is not the root of any trace; trace roots: {sorted(entries)}")
+        if entry not in G:
+            G.add_node(entry)
+        G = G.subgraph(nx.descendants(G, entry) | {entry}).copy()
+        G.graph['entry'] = entry
+        G.graph['N'] = entries.get(entry, 0)
+    for func, ms in latency.items():
+        if func in G:
+            G.nodes[func]['latency'] = ms
+    return G
+
+
+# --- Container metrics ---
+
+_LP_SPLIT = re.compile(r'(?<!\\) ')
+_LP_COMMA = re.compile(r'(?<!\\),')
+
+
+def parse_line_protocol(line):
+    """
+    Parses one InfluxDB line-protocol line.
+
+    Returns:
+        tuple: `(measurement, tags, fields, timestamp)`, or None for comments and blank lines.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    parts = _LP_SPLIT.split(line)
+    if len(parts) < 2:
+        raise ValueError(f"Malformed line-protocol line: {line!r}")
+    key = _LP_COMMA.split(parts[0])
+    measurement = key[0].replace("\\", "")
+    tags = dict(t.replace("\\", "").split("=", 1) for t in key[1:])
+    fields = {}
+    for field in _LP_COMMA.split(parts[1]):
+        name, value = field.split("=", 1)
+        if value.endswith("i"):
+            value = value[:-1]
+        try:
+            fields[name] = float(value)
+        except ValueError:
+            fields[name] = value.strip('"')
+    timestamp = int(parts[2]) if len(parts) > 2 else None
+    return measurement, tags, fields, timestamp
+
+
+class Reservoir:
+    """A fixed-size uniform sample of a stream (Algorithm R), for percentiles in bounded memory."""
+
+    def __init__(self, size=4096, seed=0):
+        self.size = size
+        self.count = 0
+        self.values = []
+        self._rng = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            j = self._rng.randrange(self.count)
+            if j < self.size:
+                self.values[j] = value
+
+    def merge(self, other):
+        """
+        Returns a reservoir of the two streams combined: each contributes samples in
+        proportion to its number of values, so the result is still (nearly) uniform.
+        """
+        merged = Reservoir(self.size)
+        merged.count = self.count + other.count
+        if len(self.values) + len(other.values) <= self.size:
+            merged.values = self.values + other.values
+            return merged
+        take = min(len(self.values), max(self.size - len(other.values),
+                                         round(self.size * self.count / merged.count)))
+        merged.values = (self._rng.sample(self.values, take) +
+                         self._rng.sample(other.values, min(self.size - take, len(other.values))))
+        return merged
+
+    def percentile(self, q):
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+def load_function_metrics(paths, percentile=95, function_tag="container_name", function_of=None,
+                          reservoir_size=4096):
+    """
+    Computes per-function memory and CPU percentiles from cAdvisor InfluxDB exports.
+
+    cAdvisor (see `setup/serverless_runtime/cadvisor`) writes one series per
+    container. Memory is `memory_working_set` in bytes; CPU is the cumulative
+    `cpu_usage_total` in nanoseconds, turned into a rate between consecutive
+    samples. Files are read line by line and every function keeps a bounded
+    reservoir, so the exports can be arbitrarily large.
+
+    Args:
+        paths (list): Line-protocol files (optionally gzipped), directories or globs.
+        percentile (float): Percentile used for `m` and `c`.
+        function_tag (str): Tag that identifies the function's container.
+        function_of (callable, optional): Maps a tag value to a function name (or None to skip it).
+
+    Returns:
+        dict: function -> {'m': MiB, 'c': millicores}.
+    """
+    memory = collections.defaultdict(lambda: Reservoir(reservoir_size))
+    cpu = collections.defaultdict(lambda: Reservoir(reservoir_size))
+    last_cpu = {}
+
+    for path in _expand(paths):
+        with _open(path) as f:
+            for line in f:
+                point = parse_line_protocol(line)
+                if point is None:
+                    continue
+                measurement, tags, fields, ts = point
+                if measurement not in (MEMORY_SERIES, CPU_SERIES) or function_tag not in tags:
+                    continue
+                func = function_of(tags[function_tag]) if function_of else tags[function_tag]
+                value = fields.get("value")
+                if func is None or not isinstance(value, float):
+                    continue
+
+                if measurement == MEMORY_SERIES:
+                    memory[func].add(value / 2**20)
+                else:
+                    # Per container instance, since several replicas report the same function.
+                    series = (func, tags.get("machine"), tags.get("container_id", tags.get("pod_name")))
+                    prev = last_cpu.get(series)
+                    last_cpu[series] = (ts, value)
+                    if prev and ts and ts > prev[0] and value >= prev[1]:
+                        cpu[func].add((value - prev[1]) / (ts - prev[0]) * 1000)
+
+    metrics = {}
+    for func in set(memory) | set(cpu):
+        metrics[func] = {'m': memory[func].percentile(percentile) or 0.0,
+                         'c': cpu[func].percentile(percentile) or 0.0}
+    return metrics
+
+
+def build_workflow_graph(spans, metrics=None, entry=None, default_m=None, default_c=None,
+                         max_open_traces=10000):
+    """
+    Builds the call graph the solver expects from spans and container metrics.
+
+    Edges carry `weight` (number of calls) and `type` ('sync' or 'async');
+    nodes carry `m` and `c`. `graph.graph['N']` is the number of invocations of
+    the entry function, i.e. the `N` of the async penalty.
+
+    Raises:
+        ValueError: If a function has no metrics and no default is given.
+    """
+    builder = CallGraphBuilder(max_open_traces=max_open_traces).add_all(spans)
+    G = builder.graph(entry=entry)
+    assign_resources(G, metrics, default_m, default_c)
+    G.graph['spans'] = builder.num_spans
+    G.graph['traces'] = builder.num_traces
+    return G
+
+
+def assign_resources(G, metrics, default_m=None, default_c=None):
+    """
+    Sets `m` and `c` on every node from per-function metrics.
+
+    Raises:
+        ValueError: If a function has no metrics and no default is given.
+    """
+    metrics = metrics or {}
+    missing = []
+    for node in G.nodes():
+        res = metrics.get(node)
+        if res is None and (default_m is None or default_c is None):
+            missing.append(node)
+            continue
+        G.nodes[node]['m'] = res['m'] if res else default_m
+        G.nodes[node]['c'] = res['c'] if res else default_c
+    if missing:
+        raise ValueError(f"No memory/CPU metrics for functions: {sorted(missing)}")
+
+
+def write_node_link(graph, path):
+    """Writes the graph in the node-link JSON read by `export_plan.py`."""
+    data = {
+        "graph": dict(graph.graph),
+        "nodes": [dict(id=n, **d) for n, d in graph.nodes(data=True)],
+        "links": [dict(source=u, target=v, **d) for u, v, d in graph.edges(data=True)],
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a solver call graph from traces and cAdvisor metrics.")
+    parser.add_argument("traces", help="OTLP JSON file/directory/glob, or a Tempo URL")
+    parser.add_argument("--metrics", nargs="*", default=[], help="InfluxDB line-protocol exports")
+    parser.add_argument("--entry", default=None, help="entry function (default: most frequent trace root)")
+    parser.add_argument("--tags", default=None, help="Tempo search tags (Tempo URL only)")
+    parser.add_argument("--limit", type=int, default=1000, help="number of traces to fetch (Tempo URL only)")
+    parser.add_argument("--percentile", type=float, default=95)
+    parser.add_argument("--default-m", type=float, default=None)
+    parser.add_argument("--default-c", type=float, default=None)
+    parser.add_argument("--max-open-traces", type=int, default=10000)
+    parser.add_argument("-o", "--out", default="graph.json")
+    args = parser.parse_args()
+
+    if args.traces.startswith(("http://", "https://")):
+        spans = iter_tempo_spans(args.traces, tags=args.tags, limit=args.limit)
+    else:
+        spans = iter_otlp_spans([args.traces])
+    metrics = load_function_metrics(args.metrics, percentile=args.percentile) if args.metrics else {}
+    G = build_workflow_graph(spans, metrics, entry=args.entry, default_m=args.default_m,
+                             default_c=args.default_c, max_open_traces=args.max_open_traces)
+    write_node_link(G, args.out)
+    print(f"{G.graph['spans']} spans in {G.graph['traces']} traces -> {G.number_of_nodes()} functions, "
+          f"{G.number_of_edges()} edges, N={G.graph.get('N')} ({args.out})")
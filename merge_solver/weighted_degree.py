@@ -1,5 +1,5 @@
-import collections
 import random
+from workflow_graph import as_workflow_graph
 
 def select_weighted_degree_candidates(graph, root_node, num_candidates, rcl_size=1, **kwargs):
     """
@@ -15,7 +15,7 @@ def select_weighted_degree_candidates(graph, root_node, num_candidates, rcl_size
     subgraph reachable from a node.
 
     Args:
-        graph (nx.DiGraph): The workflow's call graph.
+        graph (nx.DiGraph or WorkflowGraph): The workflow's call graph.
         root_node: The main root of the graph, which is excluded from candidacy.
         num_candidates (int): The number of top candidates to select.
         rcl_size (int): The size of the Restricted Candidate List for GRASP selection.
@@ -27,18 +27,16 @@ def select_weighted_degree_candidates(graph, root_node, num_candidates, rcl_size
     if num_candidates <= 0:
         return set(), []
 
-    weighted_in_degrees = collections.defaultdict(float)
-    nodes_to_consider = [n for n in graph.nodes() if n != root_node]
+    graph = as_workflow_graph(graph, kwargs.get('N', 1))
 
-    # Calculate the weighted in-degree for every node in the graph.
-    for node in nodes_to_consider:
-        # Correctly sum the weights of incoming edges (from predecessors 'u' to the current 'node')
-        w_in = sum(graph.edges[u, node].get('weight', 1.0) for u in graph.predecessors(node))
-        weighted_in_degrees[node] = w_in
+    # Calculate the weighted in-degree (the sum of the weights of the incoming edges)
+    # for every node in the graph.
+    w_in = graph.in_weight().tolist()
+    weighted_in_degrees = [(node, w) for node, w in zip(graph.labels, w_in) if node != root_node]
 
     # Sort the nodes in descending order based on their calculated score.
     scores = sorted(
-        weighted_in_degrees.items(),
+        weighted_in_degrees,
         key=lambda item: item[1],
         reverse=True
     )
@@ -0,0 +1,341 @@
+import math
+
+import numpy as np
+import networkx as nx
+
+
+class WorkflowGraph:
+    """
+    An immutable, array-backed call graph for the solver's inner loops.
+
+    The solver used to read `graph.nodes[i]['m']`, `graph.edges[u, v]['weight']`
+    and `graph.predecessors(n)` from an `nx.DiGraph` inside every ILP build and
+    heuristic score, each of which is a dict-of-dicts lookup. Here the graph is
+    stored once as NumPy arrays over integer node ids `0..V-1`:
+
+    - `m`, `c`: node resources (float64)
+    - `size`, `cold_start`: code size and cold-start cost of each function (float64), for
+      the objective terms that charge for image bytes and startup latency
+    - `latency`: the time an invocation of each function spends outside its calls (float64)
+    - `src`, `dst`, `weight`, `is_async`: edges, sorted by `(src, dst)`
+    - `rpc_latency`: the measured overhead of a call when it crosses containers (float64,
+      NaN where it was not measured)
+    - `alpha`: ceil(weight / N), the peak number of concurrent instances of the callee
+    - `out_ptr`: edges leaving node `i` are `out_ptr[i]:out_ptr[i + 1]` (CSR)
+    - `in_ptr`, `in_edges`: ids of the edges entering node `i` are
+      `in_edges[in_ptr[i]:in_ptr[i + 1]]`
+
+    Node labels (the names used by callers and in solver results) map to ids
+    through `labels` and `index`. The arrays are read-only, and `alpha` is fixed
+    at construction: use `with_N` for a different invocation count.
+
+    `from_networkx` requires `m` and `c` on every node and `weight` on every edge,
+    and raises ValueError when one is missing. The other attributes default like
+    the solver code did: `size`, `cold_start` and `latency` to 0 and the edge type
+    to `sync`.
+    """
+
+    __slots__ = ('labels', 'index', 'N', 'm', 'c', 'size', 'cold_start', 'latency', 'src', 'dst', 'weight', 'is_async',
+                 'rpc_latency', 'alpha', 'out_ptr', 'in_ptr', 'in_edges')
+
+    # The arrays that define the graph, in the order `arrays()` returns them.
+    ARRAYS = ('m', 'c', 'size', 'cold_start', 'latency', 'src', 'dst', 'weight', 'is_async', 'rpc_latency', 'alpha', 'out_ptr', 'in_ptr', 'in_edges')
+
+    def __init__(self, labels, m, c, src, dst, weight, is_async, N=1, size=None, cold_start=None,
+                 latency=None, rpc_latency=None):
+        """
+        Args:
+            labels (iterable): Node labels; node id `i` is `labels[i]`.
+            m, c (array-like): Memory and CPU of each node, by id.
+            src, dst (array-like): Edge endpoints as node ids, in any order.
+            weight (array-like): Call weight of each edge.
+            is_async (array-like): Whether each edge is an asynchronous call.
+            N (int): The number of workflow invocations the weights were counted over.
+            size, cold_start (array-like, optional): Code size and cold-start cost of each
+                node, by id. Default to 0.
+            latency (array-like, optional): Time of each node outside its calls, by id. Defaults to 0.
+            rpc_latency (array-like, optional): Measured RPC overhead of each edge. Defaults to NaN.
+        """
+        labels = tuple(labels)
+        V = len(labels)
+        src = np.asarray(src, dtype=np.int32)
+        dst = np.asarray(dst, dtype=np.int32)
+        if len(src) and (src.min() < 0 or dst.min() < 0 or max(src.max(), dst.max()) >= V):
+            raise ValueError(f"Edge endpoints must be node ids in [0, {V}).")
+
+        order = np.lexsort((dst, src))
+        src, dst = src[order], dst[order]
+        weight = np.asarray(weight, dtype=np.float64)[order]
+        in_edges = np.argsort(dst, kind='stable').astype(np.int32)
+
+        arrays = {
+            'm': np.array(m, dtype=np.float64),
+            'c': np.array(c, dtype=np.float64),
+            'size': np.zeros(V) if size is None else np.array(size, dtype=np.float64),
+            'cold_start': np.zeros(V) if cold_start is None else np.array(cold_start, dtype=np.float64),
+            'latency': np.zeros(V) if latency is None else np.array(latency, dtype=np.float64),
+            'src': src,
+            'dst': dst,
+            'weight': weight,
+            'is_async': np.asarray(is_async, dtype=bool)[order],
+            'rpc_latency': (np.full(len(src), np.nan) if rpc_latency is None
+                            else np.asarray(rpc_latency, dtype=np.float64)[order]),
+            'alpha': _alpha(weight, N),
+            'out_ptr': _csr_ptr(src, V),
+            'in_ptr': _csr_ptr(dst, V),
+            'in_edges': in_edges,
+        }
+        self._init(labels, arrays, N)
+
+    def _init(self, labels, arrays, N, index=None):
+        set_ = object.__setattr__
+        set_(self, 'labels', labels)
+        set_(self, 'index', index if index is not None else {n: i for i, n in enumerate(labels)})
+        set_(self, 'N', N)
+        for name in self.ARRAYS:
+            arr = arrays[name]
+            arr.flags.writeable = False
+            set_(self, name, arr)
+
+    @classmethod
+    def from_arrays(cls, labels, arrays, N):
+        """
+        Wraps arrays that are already in the layout of `arrays()` without copying
+        them, e.g. arrays that live in shared memory (see `shared_graph.py`).
+        """
+        graph = cls.__new__(cls)
+        graph._init(tuple(labels), dict(arrays), N)
+        return graph
+
+    def arrays(self):
+        """The graph's arrays by name (see `ARRAYS`)."""
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __setattr__(self, name, value):
+        raise AttributeError("WorkflowGraph is immutable")
+
+    def __reduce__(self):
+        return (WorkflowGraph.from_arrays, (self.labels, self.arrays(), self.N))
+
+    # --- Conversion ---
+
+    @classmethod
+    def from_networkx(cls, graph, N=1):
+        """
+        Builds a WorkflowGraph from an `nx.DiGraph` with node attributes `m`/`c` (and
+        optionally `size`/`cold_start`/`latency`) and edge attributes `weight`/`type`
+        (and optionally `rpc_latency`). Node ids follow `graph.nodes()` order.
+
+        Raises:
+            ValueError: If a node has no `m` or `c`, or an edge has no `weight`.
+        """
+        labels = list(graph.nodes())
+        index = {n: i for i, n in enumerate(labels)}
+        node_data = graph.nodes
+        E = graph.number_of_edges()
+        src = np.empty(E, dtype=np.int32)
+        dst = np.empty(E, dtype=np.int32)
+        weight = np.empty(E, dtype=np.float64)
+        is_async = np.empty(E, dtype=bool)
+        rpc_latency = np.empty(E, dtype=np.float64)
+        for e, (u, v, d) in enumerate(graph.edges(data=True)):
+            src[e], dst[e] = index[u], index[v]
+            if 'weight' not in d:
+                raise ValueError(f"Edge ({u}, {v}) has no 'weight' attribute.")
+            weight[e] = d['weight']
+            is_async[e] = d.get('type') == 'async'
+            rpc_latency[e] = d.get('rpc_latency', np.nan)
+        for n in labels:
+            for attr in ('m', 'c'):
+                if attr not in node_data[n]:
+                    raise ValueError(f"Node {n} has no '{attr}' attribute.")
+        return cls(labels,
+                   [node_data[n]['m'] for n in labels],
+                   [node_data[n]['c'] for n in labels],
+                   src, dst, weight, is_async, N,
+                   size=[node_data[n].get('size', 0) for n in labels],
+                   cold_start=[node_data[n].get('cold_start', 0) for n in labels],
+                   latency=[node_data[n].get('latency', 0) for n in labels],
+                   rpc_latency=rpc_latency)
+
+    def to_networkx(self):
+        """
+        Converts back to an `nx.DiGraph` with the same node and edge attributes.
+        `size`, `cold_start` and `latency` are only set on nodes where they are not 0,
+        and `rpc_latency` only on edges where it was measured.
+        """
+        G = nx.DiGraph()
+        G.graph['N'] = self.N
+        labels = self.labels
+        for i, n in enumerate(labels):
+            G.add_node(n, m=float(self.m[i]), c=float(self.c[i]))
+            if self.size[i]:
+                G.nodes[n]['size'] = float(self.size[i])
+            if self.cold_start[i]:
+                G.nodes[n]['cold_start'] = float(self.cold_start[i])
+            if self.latency[i]:
+                G.nodes[n]['latency'] = float(self.latency[i])
+        for u, v, w, a, rpc in zip(self.src.tolist(), self.dst.tolist(), self.weight.tolist(), self.is_async.tolist(),
+                                   self.rpc_latency.tolist()):
+            G.add_edge(labels[u], labels[v], weight=w, type='async' if a else 'sync')
+            if not math.isnan(rpc):
+                G.edges[labels[u], labels[v]]['rpc_latency'] = rpc
+        return G
+
+    def with_N(self, N):
+        """The same graph with `alpha` recomputed for `N` invocations. The other arrays are shared."""
+        if N == self.N:
+            return self
+        arrays = self.arrays()
+        arrays['alpha'] = _alpha(self.weight, N)
+        graph = WorkflowGraph.__new__(WorkflowGraph)
+        graph._init(self.labels, arrays, N, self.index)
+        return graph
+
+    # --- Structure ---
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self.index
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    @property
+    def num_edges(self):
+        return len(self.src)
+
+    def ids(self, labels):
+        """Node ids of `labels` as an int array."""
+        index = self.index
+        return np.fromiter((index[n] for n in labels), dtype=np.int64)
+
+    def mask(self, labels):
+        """Boolean membership array over node ids for the given labels."""
+        mask = np.zeros(len(self.labels), dtype=bool)
+        mask[self.ids(labels)] = True
+        return mask
+
+    def successors(self, i):
+        """Node ids called by node id `i`."""
+        return self.dst[self.out_ptr[i]:self.out_ptr[i + 1]]
+
+    def predecessors(self, i):
+        """Node ids that call node id `i`."""
+        return self.src[self.in_edges[self.in_ptr[i]:self.in_ptr[i + 1]]]
+
+    def in_weight(self):
+        """Weighted in-degree of every node (sum of the weights of its incoming calls)."""
+        return np.bincount(self.dst, weights=self.weight, minlength=len(self.labels))
+
+    def topological_order(self):
+        """
+        Node ids in topological order (Kahn's algorithm).
+
+        Raises:
+            ValueError: If the graph has a cycle.
+        """
+        V = len(self.labels)
+        indegree = np.diff(self.in_ptr).tolist()
+        out_ptr, dst = self.out_ptr.tolist(), self.dst.tolist()
+        order = [i for i in range(V) if indegree[i] == 0]
+        for u in order:
+            for v in dst[out_ptr[u]:out_ptr[u + 1]]:
+                indegree[v] -= 1
+                if indegree[v] == 0:
+                    order.append(v)
+        if len(order) < V:
+            raise ValueError("Graph is not a DAG.")
+        return order
+
+    # --- Latency ---
+
+    def calls_per_invocation(self):
+        """
+        The expected number of times each edge is called per invocation of its caller:
+        its weight divided by the caller's invocations (its weighted in-degree, or N for
+        a function without callers).
+        """
+        invocations = self.in_weight()
+        invocations[invocations == 0] = self.N
+        return self.weight / invocations[self.src]
+
+    def hop_latency(self, default):
+        """`rpc_latency` of each edge, with `default` where it was not measured."""
+        return np.where(np.isnan(self.rpc_latency), default, self.rpc_latency)
+
+    def expected_latency(self, remote, default_rpc_latency=1.0):
+        """
+        The expected latency of an invocation of each function, including its calls.
+
+        A function takes its own `latency`, plus each synchronous call (its callee's latency,
+        plus the RPC overhead if the call is remote) times the calls per invocation, plus the
+        longest of its asynchronous calls, which run concurrently. This mirrors the latency
+        objective of `ilp.build_subgraph_model`.
+
+        Args:
+            remote (np.ndarray): Boolean array over node ids: calls into these nodes cross containers.
+            default_rpc_latency (float): RPC overhead of calls without a measured `rpc_latency`.
+
+        Returns:
+            np.ndarray: Latency by node id.
+        """
+        hop = np.where(remote[self.dst], self.hop_latency(default_rpc_latency), 0.0)
+        per_call = self.calls_per_invocation()
+        out_ptr, dst, is_async = self.out_ptr.tolist(), self.dst.tolist(), self.is_async.tolist()
+        hop, per_call = hop.tolist(), per_call.tolist()
+        L = self.latency.tolist()
+        for u in reversed(self.topological_order()):
+            longest_async = 0.0
+            for e in range(out_ptr[u], out_ptr[u + 1]):
+                if is_async[e]:
+                    longest_async = max(longest_async, L[dst[e]] + hop[e])
+                else:
+                    L[u] += per_call[e] * (L[dst[e]] + hop[e])
+            L[u] += longest_async
+        return np.array(L)
+
+    # --- Resources ---
+
+    def resource_usage(self, mask):
+        """
+        Memory and CPU of a merged subgraph, as in the ILP capacity constraints.
+
+        This is the sum of the members' `m`/`c` plus, for each internal async
+        edge (u, v), `alpha_uv - 1` extra instances of v.
+
+        Args:
+            mask (np.ndarray): Boolean membership array over node ids.
+
+        Returns:
+            tuple: `(memory, cpu)`.
+        """
+        penalized = self.is_async & (self.alpha > 1) & mask[self.src] & mask[self.dst]
+        extra = (self.alpha[penalized] - 1).astype(np.float64)
+        callees = self.dst[penalized]
+        return (float(self.m[mask].sum() + (self.m[callees] * extra).sum()),
+                float(self.c[mask].sum() + (self.c[callees] * extra).sum()))
+
+
+def as_workflow_graph(graph, N=1):
+    """
+    Returns `graph` as a WorkflowGraph with `alpha` computed for `N` invocations.
+    An `nx.DiGraph` is converted; a WorkflowGraph is reused.
+    """
+    if isinstance(graph, WorkflowGraph):
+        return graph.with_N(N)
+    return WorkflowGraph.from_networkx(graph, N)
+
+
+def _alpha(weight, N):
+    if N <= 0:
+        raise ValueError(f"N must be positive, got {N}.")
+    return np.ceil(weight / N).astype(np.int64)
+
+
+def _csr_ptr(keys, V):
+    ptr = np.zeros(V + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=V), out=ptr[1:])
+    return ptr
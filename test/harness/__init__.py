@@ -0,0 +1,16 @@
+"""
+Load-testing harness for Quilt workflows.
+
+Drives wrk2 (or a Python load generator) against the Fission router instead of
+the fixed connection lists of the `figure*.sh` scripts, and collects the results.
+"""
+from .histogram import Histogram
+from .wrk2 import Wrk2Result, Wrk2Runner, Snapshot, parse_output, format_output
+from .sweep import Level, SweepController, SweepResult
+from .results import ResultsTable, parse_log, log_parameters
+from .compare import Curve, CurveComparison, compare, load_curves
+from .templates import TEMPLATES, RequestGenerator
+from .loadgen import LoadGenerator
+from .distributed import DistributedLoad, Node, local_nodes, ssh_nodes
+from .router import FunctionPool, Router, find_functions
+from .storage import KeyDBClient, MemcachedClient, StorageError, StorageReset
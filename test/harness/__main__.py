@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from .compare import REGRESSION, compare, load_curves, write_report
+from .distributed import DEFAULT_REMOTE_DIR, DistributedLoad, local_nodes, run_worker, ssh_nodes
+from .loadgen import DEFAULT_TIMEOUT, LoadGenerator
+from .results import ResultsTable
+from .router import Router, find_functions
+from .storage import DEFAULT_PASSWORD, StorageReset
+from .sweep import FIXED_RATE, SweepController
+from .wrk2 import DEFAULT_WRK, Wrk2Runner, format_output, parse_duration
+
+
+def duration(text):
+    """Seconds, or a wrk2 duration such as `30s` or `8m`."""
+    try:
+        return float(text)
+    except ValueError:
+        return parse_duration(text)
+
+
+def nodes(args):
+    if args.machines:
+        return ssh_nodes(args.machines, roles=args.role, names=args.node, user=args.user, remote_dir=args.remote_dir)
+    return local_nodes(args.nodes)
+
+
+def add_node_arguments(p):
+    p.add_argument("--nodes", type=int, default=2, help="local load-generating processes (without --machines)")
+    p.add_argument("--machines", default=None,
+                   help="generate load from machines over SSH, e.g. ../setup/serverless_runtime/machine.json")
+    p.add_argument("--role", action="append", default=None, help="only use machines with this role")
+    p.add_argument("--node", action="append", default=None, help="only use the machine with this name")
+    p.add_argument("--user", default=None, help="SSH user (default: $USER)")
+    p.add_argument("--remote-dir", default=DEFAULT_REMOTE_DIR, help="this `test` directory on the machines")
+
+
+def add_storage_arguments(p):
+    p.add_argument("--keydb", default=None, help="host:port of the KeyDB master, e.g. 127.0.0.1:6379 (port-forwarded)")
+    p.add_argument("--memcached", action="append", default=[], help="host:port of a memcached instance")
+    p.add_argument("--password", default=DEFAULT_PASSWORD, help="KeyDB password")
+    p.add_argument("--storage-timeout", type=float, default=60.0, help="seconds the stores have to become ready")
+
+
+def storage(args, directory):
+    return StorageReset(directory, keydb=args.keydb, memcached=args.memcached, password=args.password,
+                        timeout=args.storage_timeout, log=print)
+
+
+def run_sweep(args):
+    if args.generator == "python":
+        runner = LoadGenerator(args.url, args.script, processes=args.processes, interval=args.interval)
+    elif args.generator == "distributed":
+        runner = DistributedLoad(args.url, args.script, nodes(args), processes=args.processes, interval=args.interval)
+    else:
+        runner = Wrk2Runner(args.url, args.script, wrk=args.wrk, threads=args.threads, segment=args.segment)
+
+    restore = storage(args, args.restore) if args.restore else None
+
+    def reset(rate, connections):
+        if args.reset_cmd:
+            subprocess.run(args.reset_cmd, shell=True, check=True)
+        if restore is not None:
+            restore()
+        time.sleep(args.settle)
+
+    controller = SweepController(
+        runner, axis=args.axis, low=args.low, high=args.high, rate=args.rate, connections=args.connections,
+        min_duration=args.min_duration, max_duration=args.max_duration, percentiles=args.percentiles,
+        rel_tol=args.rel_tol, confidence=args.confidence, knee_factor=args.knee_factor,
+        dense_points=args.dense_points, reset=reset if args.reset_cmd or args.restore or args.settle else None, log=print)
+    result = controller.sweep()
+    result.write(args.out)
+
+    print(f"\n{'='*25} Sweep Summary {'='*25}")
+    for load, throughput, latency in result.curve():
+        print(f"{load:>8} {throughput:>10.1f} req/s  " + "  ".join(f"p{p:g} {ms:.3f} ms" for p, ms in latency.items()))
+    if result.above is None:
+        print(f"No knee below {args.axis} {args.high}.")
+    else:
+        print(f"Knee between {args.axis} {result.below} and {result.above}.")
+    print(f"{len(result.levels)} levels in {result.duration:.0f}s of load "
+          f"(the fixed list takes {result.fixed_duration()}s); results in {args.out}")
+    return 0
+
+
+def run_load(args):
+    generator = LoadGenerator(args.url, args.script, processes=args.processes, timeout=args.timeout, seed=args.seed)
+    snapshot = generator.measure(args.rate, args.connections, args.duration)
+    stats = generator.stats
+    sys.stdout.write(format_output(args.url, args.processes, args.connections, snapshot.elapsed, snapshot.requests,
+                                   snapshot.histogram, snapshot.uncorrected, errors=stats, non_2xx=stats["non_2xx"],
+                                   bytes_read=stats["bytes"]))
+    return 0
+
+
+def run_distributed(args):
+    load = DistributedLoad(args.url, args.script, nodes(args), processes=args.processes, interval=args.interval,
+                           timeout=args.timeout, seed=args.seed, startup=args.startup)
+    snapshot = load.measure(args.rate, args.connections, args.duration)
+    stats = load.stats
+    sys.stdout.write(format_output(args.url, len(load.nodes) * args.processes, args.connections, snapshot.elapsed,
+                                   snapshot.requests, snapshot.histogram, snapshot.uncorrected, errors=stats,
+                                   non_2xx=stats["non_2xx"], bytes_read=stats["bytes"]))
+    sys.stderr.write("Clock offsets: " + "  ".join(f"{name} {offset * 1000:+.1f} ms"
+                                                   for name, offset in load.offsets.items()) + "\n")
+    return 0
+
+
+def run_worker_node(args):
+    generator = LoadGenerator(args.url, args.script, processes=args.processes, interval=args.interval,
+                              timeout=args.timeout, seed=args.seed)
+    run_worker(generator, args.rate, args.connections, args.duration)
+    return 0
+
+
+def run_storage(args):
+    reset = storage(args, args.dir)
+    if args.action == "snapshot":
+        reset.snapshot()
+    elif args.action == "restore":
+        reset.restore()
+    else:
+        reset.wait_ready()
+        print("Ready.")
+    return 0
+
+
+def conditions(pairs):
+    """`column=value` arguments as `ResultsTable.select` conditions."""
+    selected = {}
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        selected[name] = int(value) if name in ("connections", "threads") else value
+    return selected
+
+
+def run_compare(args):
+    baseline = load_curves(args.baseline, by=tuple(args.by), select=conditions(args.baseline_select),
+                           corrected=args.corrected)
+    candidate = load_curves(args.candidate, by=tuple(args.by), select=conditions(args.candidate_select),
+                            corrected=args.corrected)
+    comparisons = compare(baseline, candidate, percentiles=tuple(args.percentiles), resamples=args.resamples,
+                          confidence=args.confidence, min_effect=args.min_effect, tput_tol=args.tput_tol,
+                          knee_factor=args.knee_factor, knee_tol=args.knee_tol, align_tol=args.align_tol)
+    if not comparisons:
+        print("No curves in common.")
+        return 1
+    if args.out:
+        write_report(comparisons, args.out)
+
+    regressed = 0
+    for key, comparison in comparisons.items():
+        print(f"\n{'='*25} {'/'.join(map(str, key))} {'='*25}")
+        print(f"{'load':>8} {'pct':>6} {'baseline':>10} {'candidate':>10} {'ratio':>6} {'CI':>12}  verdict")
+        for s in comparison.shifts:
+            print(f"{s.baseline_load:>8g} {'p%g' % s.percentile:>6} {s.baseline:>10.3f} {s.candidate:>10.3f} "
+                  f"{s.ratio:>6.2f} {s.low:>5.2f}-{s.high:<6.2f}  {s.verdict}")
+        print(f"peak throughput {comparison.baseline_peak:.1f} -> {comparison.candidate_peak:.1f} req/s "
+              f"({comparison.throughput}); knee {comparison.baseline_knee} -> {comparison.candidate_knee} "
+              f"({comparison.knee})")
+        if comparison.unaligned:
+            print(f"no candidate level for baseline loads {comparison.unaligned}")
+        for regression in comparison.regressions:
+            print(f"REGRESSION: {regression}")
+        regressed += bool(comparison.regressions)
+    print(f"\n{regressed} of {len(comparisons)} curves regressed.")
+    return 1 if regressed else 0
+
+
+def run_parse(args):
+    table = ResultsTable.from_logs(args.logs, workers=args.jobs).sort("app", "workflow", "mode", "connections")
+    if len(table) == 0:
+        print("No wrk2 logs found.")
+        return 1
+    table.save(args.out)
+    if args.csv:
+        table.to_csv(args.csv)
+
+    print(f"{'workflow':<40} {'mode':<6} {'conns':>5} {'req/s':>10} {'p50':>9} {'p90':>9} {'p99':>9} {'p99.9':>9}")
+    for row in table.rows():
+        name = f"{row['app']}/{row['workflow']}"
+        print(f"{name:<40} {row['mode']:<6} {row['connections']:>5} {row['throughput']:>10.1f} "
+              f"{row[args.latency + 'p50']:>9.3f} {row[args.latency + 'p90']:>9.3f} "
+              f"{row[args.latency + 'p99']:>9.3f} {row[args.latency + 'p999']:>9.3f}")
+    print(f"{len(table)} runs written to {args.out} (latencies in ms)")
+    return 0
+
+
+def run_router(args):
+    functions = {}
+    for directory in args.functions:
+        functions.update(find_functions(directory))
+    for spec in args.function:
+        name, _, path = spec.partition("=")
+        functions[name] = path
+    if not functions:
+        print("No functions found.")
+        return 1
+    host, _, port = args.listen.rpartition(":")
+    router = Router(functions, host=host or "127.0.0.1", port=int(port), router_url=args.router_url,
+                    pool_size=args.pool, delay=args.delay_ms / 1000.0)
+
+    async def serve():
+        await router.start()
+        print(f"Serving {router.url} ({len(functions)} functions: {' '.join(sorted(functions))})", flush=True)
+        await router.server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+    summary = router.stats.summary()
+    if args.stats_out:
+        with open(args.stats_out, "w") as f:
+            json.dump(summary, f, indent=2)
+    print(f"\n{'caller':<30} {'callee':<30} {'count':>8} {'errors':>6} {'p50':>9} {'p99':>9} {'run p50':>9}")
+    for row in summary:
+        print(f"{row['caller']:<30} {row['callee']:<30} {row['count']:>8} {row['errors']:>6} "
+              f"{row['latency']['p50']:>9.3f} {row['latency']['p99']:>9.3f} {row['run']['p50']:>9.3f}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m harness", description="Load-test Quilt workflows with wrk2.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("sweep", help="find the throughput-latency knee of a workflow adaptively")
+    p.add_argument("url", help="router URL, e.g. http://$IP:$PORT")
+    p.add_argument("script", help="wrk2 Lua script, e.g. wrk2_fission/social_network/lua_files/compose-post.lua")
+    p.add_argument("--axis", choices=["connections", "rate"], default="connections",
+                   help="sweep the connection count at a fixed rate (figure8ab.sh) or the offered rate")
+    p.add_argument("--low", type=float, default=1)
+    p.add_argument("--high", type=float, default=350)
+    p.add_argument("--rate", type=float, default=FIXED_RATE, help="offered rate when sweeping connections")
+    p.add_argument("--connections", type=int, default=1, help="fewest connections when sweeping the rate")
+    p.add_argument("--min-duration", type=float, default=60, help="seconds before a level may stop early")
+    p.add_argument("--max-duration", type=float, default=480, help="seconds after which a level stops")
+    p.add_argument("--segment", type=int, default=60, help="length of each wrk2 run within a level")
+    p.add_argument("--percentiles", type=float, nargs="+", default=[50, 90, 99])
+    p.add_argument("--rel-tol", type=float, default=0.05, help="relative precision of converged percentiles")
+    p.add_argument("--confidence", type=float, default=0.95)
+    p.add_argument("--knee-factor", type=float, default=2.0,
+                   help="median latency over the unloaded median past which a level is saturated")
+    p.add_argument("--dense-points", type=int, default=4, help="extra levels measured around the knee")
+    p.add_argument("--reset-cmd", default=None, help="shell command run before every level (e.g. reinstall the databases)")
+    p.add_argument("--restore", default=None, help="restore this storage snapshot before every level (see `storage`)")
+    p.add_argument("--settle", type=float, default=0, help="seconds to wait before every level")
+    p.add_argument("--generator", choices=["wrk2", "python", "distributed"], default="wrk2",
+                   help="generate load with wrk2, the Python load generator (see `load`) or several of them "
+                        "(see `distributed`)")
+    p.add_argument("--wrk", default=DEFAULT_WRK)
+    p.add_argument("-t", "--threads", type=int, default=1)
+    p.add_argument("-p", "--processes", type=int, default=1, help="worker processes of the Python load generator")
+    p.add_argument("--interval", type=float, default=5.0, help="seconds between snapshots of the Python load generator")
+    p.add_argument("--out", default="sweep.json")
+    add_node_arguments(p)
+    add_storage_arguments(p)
+    p.set_defaults(func=run_sweep)
+
+    p = sub.add_parser("load", help="generate open-loop load in Python and print a wrk2-style report")
+    p.add_argument("url", help="router URL, e.g. http://127.0.0.1:8888")
+    p.add_argument("script", help="wrk2 Lua script or template name, e.g. compose-post")
+    p.add_argument("-R", "--rate", type=float, required=True, help="requests per second")
+    p.add_argument("-c", "--connections", type=int, default=10)
+    p.add_argument("-d", "--duration", type=duration, default=10.0)
+    p.add_argument("-p", "--processes", type=int, default=1, help="worker processes (one event loop each)")
+    p.add_argument("--timeout", type=duration, default=DEFAULT_TIMEOUT)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=run_load)
+
+    p = sub.add_parser("distributed", help="generate open-loop load from several processes or machines at once")
+    p.add_argument("url", help="router URL as seen from the load generators")
+    p.add_argument("script", help="wrk2 Lua script or template name, e.g. compose-post")
+    p.add_argument("-R", "--rate", type=float, required=True, help="total requests per second")
+    p.add_argument("-c", "--connections", type=int, default=10, help="total connections")
+    p.add_argument("-d", "--duration", type=duration, default=10.0)
+    p.add_argument("-p", "--processes", type=int, default=1, help="worker processes per node")
+    p.add_argument("--interval", type=float, default=1.0, help="seconds between reports of the nodes")
+    p.add_argument("--timeout", type=duration, default=DEFAULT_TIMEOUT)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--startup", type=float, default=1.0, help="seconds between the nodes being ready and the start")
+    add_node_arguments(p)
+    p.set_defaults(func=run_distributed)
+
+    p = sub.add_parser("worker", help="one node of `distributed` (started by it, speaks JSON lines on stdin/stdout)")
+    p.add_argument("url")
+    p.add_argument("script")
+    p.add_argument("-R", "--rate", type=float, required=True)
+    p.add_argument("-c", "--connections", type=int, required=True)
+    p.add_argument("-d", "--duration", type=duration, required=True)
+    p.add_argument("-p", "--processes", type=int, default=1)
+    p.add_argument("--interval", type=float, default=1.0)
+    p.add_argument("--timeout", type=duration, default=DEFAULT_TIMEOUT)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=run_worker_node)
+
+    p = sub.add_parser("storage", help="snapshot KeyDB/memcached, restore the snapshot or wait until they are ready")
+    p.add_argument("action", choices=["snapshot", "restore", "probe"])
+    p.add_argument("dir", nargs="?", default="snapshot", help="snapshot directory")
+    add_storage_arguments(p)
+    p.set_defaults(func=run_storage)
+
+    p = sub.add_parser("compare", help="flag latency, throughput and knee regressions of a candidate against a baseline")
+    p.add_argument("baseline", help="results table (.npz from `parse`), sweep (.json) or wrk2 log directory")
+    p.add_argument("candidate", help="the same for the candidate runs")
+    p.add_argument("--by", nargs="+", default=["app", "workflow", "mode"], help="columns that identify a curve")
+    p.add_argument("--baseline-select", nargs="+", default=[], metavar="COLUMN=VALUE",
+                   help="only the baseline runs with these values, e.g. mode=sync")
+    p.add_argument("--candidate-select", nargs="+", default=[], metavar="COLUMN=VALUE",
+                   help="only the candidate runs with these values, e.g. mode=merged")
+    p.add_argument("--percentiles", type=float, nargs="+", default=[50, 99])
+    p.add_argument("--resamples", type=int, default=1000, help="bootstrap resamples per histogram")
+    p.add_argument("--confidence", type=float, default=0.95)
+    p.add_argument("--min-effect", type=float, default=0.05, help="relative latency shift that counts as a change")
+    p.add_argument("--tput-tol", type=float, default=0.05, help="relative peak throughput drop that counts as a change")
+    p.add_argument("--knee-factor", type=float, default=2.0,
+                   help="median latency over the unloaded median past which a level is past the knee")
+    p.add_argument("--knee-tol", type=float, default=0.25,
+                   help="relative knee move that counts as a change without a significant median shift")
+    p.add_argument("--align-tol", type=float, default=0.1, help="relative load difference of levels that are aligned")
+    p.add_argument("--uncorrected", dest="corrected", action="store_false",
+                   help="compare the uncorrected latencies (what getlattput.py reports)")
+    p.add_argument("--out", default=None, help="also write the comparison as JSON")
+    p.set_defaults(func=run_compare)
+
+    p = sub.add_parser("parse", help="parse wrk2 logs (-L/-U) into a columnar results table")
+    p.add_argument("logs", nargs="+", help="wrk2 logs or directories of them, e.g. wrk2_fission/social_network")
+    p.add_argument("--out", default="results.npz")
+    p.add_argument("--csv", default=None, help="also write the columns (without histograms) as CSV")
+    p.add_argument("-j", "--jobs", type=int, default=None, help="parsing processes (default: one per CPU)")
+    p.add_argument("--uncorrected", dest="latency", action="store_const", const="u_", default="",
+                   help="print the uncorrected latencies (what getlattput.py reports)")
+    p.set_defaults(func=run_parse)
+
+    p = sub.add_parser("router", help="serve function binaries locally like the Fission router")
+    p.add_argument("--functions", action="append", default=[],
+                   help="directory of function executables (<name>, <name>/function or <name>/userfunc)")
+    p.add_argument("--function", action="append", default=[], metavar="NAME=PATH",
+                   help="serve one executable, e.g. compose-post-merged=merged/compose-post/function")
+    p.add_argument("--listen", default="127.0.0.1:8888")
+    p.add_argument("--router-url", default=None, help="URL the functions call the router at (default: --listen)")
+    p.add_argument("--pool", type=int, default=4, help="warm processes per function (0 starts one per request)")
+    p.add_argument("--delay-ms", type=float, default=0, help="latency added to every hop")
+    p.add_argument("--stats-out", default=None, help="write the per-hop statistics here as JSON on exit")
+    p.set_defaults(func=run_router)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+import collections
+import json
+import os
+
+import numpy as np
+
+from .histogram import _normal_quantile
+from .results import ResultsTable
+from .sweep import SweepResult
+
+Curve = collections.namedtuple("Curve", ["loads", "throughput", "durations", "histograms"])
+Curve.__doc__ = "One throughput-latency curve: per offered load, the throughput, the run length and the histogram."
+
+LevelShift = collections.namedtuple("LevelShift", ["baseline_load", "candidate_load", "percentile", "baseline",
+                                                   "candidate", "ratio", "low", "high", "verdict"])
+LevelShift.__doc__ = ("The shift of one latency percentile at one aligned load: both values in ms, the candidate "
+                      "over baseline ratio and its bootstrap confidence interval.")
+
+REGRESSION, IMPROVEMENT, UNCHANGED = "regression", "improvement", "unchanged"
+
+
+def load_curves(path, by=("app", "workflow", "mode"), select=None, corrected=True):
+    """
+    Reads stored results as curves.
+
+    Args:
+        path (str): A `ResultsTable` (`.npz`), a `SweepResult` (`.json`), or wrk2 logs (a
+                    `.log` file or a directory of them).
+        by (tuple): Columns of a table that identify a curve; its rows are its levels.
+        select (dict, optional): Only the rows of a table with these column values.
+        corrected (bool): Use the corrected (`-L`) or uncorrected (`-U`) latencies.
+
+    Returns:
+        dict: Curve key (a tuple of the `by` values, or the file name of a sweep) -> `Curve`.
+    """
+    if path.endswith(".json"):
+        result = SweepResult.read(path)
+        loads = sorted(result.levels)
+        levels = [result.levels[load] for load in loads]
+        return {(os.path.basename(path),): Curve(np.array(loads, dtype=np.float64),
+                                                 np.array([level.throughput for level in levels]),
+                                                 np.array([level.duration for level in levels]),
+                                                 [level.histogram for level in levels])}
+
+    table = ResultsTable.load(path) if path.endswith(".npz") else ResultsTable.from_logs([path])
+    if select:
+        table = table.select(**select)
+    # Warm-up runs have no connection count in their name (0) and are not levels of a curve.
+    levels = sorted(set(table["connections"].tolist()) - {0})
+    curves = {}
+    for key in sorted({tuple(row[name] for name in by) for row in table.rows()}):
+        rows = table.select(connections=levels, **dict(zip(by, key))).sort("connections")
+        if len(rows):
+            curves[key] = Curve(rows["connections"].astype(np.float64), rows["throughput"], rows["duration"],
+                                rows.histograms if corrected else rows.uncorrected)
+    return curves
+
+
+def bootstrap_percentiles(h, percentiles, resamples=1000, rng=None):
+    """
+    Percentiles of `resamples` bootstrap resamples of a histogram.
+
+    The p-th percentile of a resample is its w-th smallest value, the empirical quantile
+    function at the w-th smallest of n uniforms, which is Beta(w, n - w + 1) distributed. So
+    each resampled percentile is drawn directly (the same distribution as redrawing all the
+    bucket counts from a multinomial, without the cost).
+
+    Returns:
+        np.ndarray: `(resamples, len(percentiles))` latencies in microseconds.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    values, counts = h.buckets()
+    total = int(counts.sum())
+    wanted = np.maximum((np.asarray(percentiles, dtype=np.float64) / 100.0 * total + 0.5).astype(np.int64), 1)
+    wanted = np.minimum(wanted, total)
+    uniform = rng.beta(wanted, total - wanted + 1, size=(resamples, len(wanted)))
+    index = np.searchsorted(np.cumsum(counts) / total, uniform)
+    return values[np.minimum(index, len(values) - 1)]
+
+
+def knee(curve, knee_factor=2.0):
+    """
+    The lowest load past the knee: where the median latency exceeds `knee_factor` times the
+    median at the lowest load (the criterion of `SweepController.saturated`), or None.
+    """
+    levels = [(load, h) for load, h in zip(curve.loads, curve.histograms) if h is not None and h.total]
+    if not levels:
+        return None
+    baseline = levels[0][1].value_at_percentile(50)
+    for load, h in levels:
+        if h.value_at_percentile(50) > knee_factor * baseline:
+            return float(load)
+    return None
+
+
+def align(baseline, candidate, tolerance=0.1):
+    """
+    Pairs the levels of two curves by offered load: each baseline level with the candidate
+    level of the nearest load, if it is within `tolerance` (relative).
+
+    Returns:
+        list: `(i, j)` index pairs into the baseline and the candidate.
+    """
+    pairs = []
+    if len(candidate.loads) == 0:
+        return pairs
+    for i, load in enumerate(baseline.loads):
+        j = int(np.argmin(np.abs(candidate.loads - load)))
+        if abs(candidate.loads[j] - load) <= tolerance * load:
+            pairs.append((i, j))
+    return pairs
+
+
+class CurveComparison:
+    """
+    Compares a candidate curve against a baseline.
+
+    At every aligned load, the ratio of each latency percentile (candidate over baseline)
+    gets a confidence interval from independent bootstrap resamples of both histograms. A
+    shift is significant when the interval excludes 1, and it only counts as a regression
+    (or improvement) when the interval also clears `min_effect`: the samples of a run are
+    not independent, so the intervals are too narrow for long runs, and a small effect
+    threshold keeps them from flagging noise. The peak throughput regresses when it drops
+    by more than `tput_tol` and more than its Poisson noise. The knee regresses when it
+    moves to a lower load and that move is real: the median regressed significantly at one
+    of the levels between the two knees, or the knee moved by more than `knee_tol` of its
+    baseline load (a one-level move of a coarse curve is often noise).
+    """
+
+    def __init__(self, baseline, candidate, percentiles=(50, 99), resamples=1000, confidence=0.95,
+                 min_effect=0.05, tput_tol=0.05, knee_factor=2.0, knee_tol=0.25, align_tol=0.1, seed=0):
+        """
+        Args:
+            baseline, candidate (Curve): The curves to compare.
+            percentiles (tuple): Latency percentiles compared at every load.
+            resamples (int): Bootstrap resamples per histogram.
+            confidence (float): Confidence of the intervals.
+            min_effect (float): Relative latency shift below which nothing is flagged.
+            tput_tol (float): Relative peak throughput drop below which nothing is flagged.
+            knee_factor (float): See `knee`.
+            knee_tol (float): Relative knee move that counts as a change without a significant
+                              median shift between the two knees.
+            align_tol (float): See `align`.
+            seed (int): Seed of the bootstrap.
+        """
+        rng = np.random.default_rng(seed)
+        tail = (1 - confidence) / 2 * 100
+        self.shifts = []
+        self.unaligned = [float(load) for load in baseline.loads]
+        # The knee is defined by the median, so its shift is tested even when p50 is not compared.
+        tested = list(percentiles) + ([50] if 50 not in percentiles else [])
+        medians = {}
+        for i, j in align(baseline, candidate, align_tol):
+            self.unaligned.remove(float(baseline.loads[i]))
+            base, cand = baseline.histograms[i], candidate.histograms[j]
+            if base is None or cand is None or base.total == 0 or cand.total == 0:
+                continue
+            ratios = (bootstrap_percentiles(cand, tested, resamples, rng)
+                      / np.maximum(bootstrap_percentiles(base, tested, resamples, rng), 1))
+            lows, highs = np.percentile(ratios, [tail, 100 - tail], axis=0)
+            for k, p in enumerate(tested):
+                b, c = base.value_at_percentile(p), cand.value_at_percentile(p)
+                verdict = (REGRESSION if lows[k] > 1 + min_effect else
+                           IMPROVEMENT if highs[k] < 1 - min_effect else UNCHANGED)
+                if p == 50:
+                    medians[float(baseline.loads[i])] = verdict
+                if k < len(percentiles):
+                    self.shifts.append(LevelShift(float(baseline.loads[i]), float(candidate.loads[j]), p, b / 1000.0,
+                                                  c / 1000.0, c / max(b, 1), float(lows[k]), float(highs[k]),
+                                                  verdict))
+
+        z = _normal_quantile(0.5 + confidence / 2)
+        (self.baseline_peak, base_noise), (self.candidate_peak, cand_noise) = _peak(baseline), _peak(candidate)
+        drop = self.baseline_peak - self.candidate_peak
+        significant = abs(drop) > z * np.hypot(base_noise, cand_noise)
+        self.throughput = (REGRESSION if significant and drop > tput_tol * self.baseline_peak else
+                           IMPROVEMENT if significant and -drop > tput_tol * self.baseline_peak else UNCHANGED)
+
+        self.baseline_knee, self.candidate_knee = knee(baseline, knee_factor), knee(candidate, knee_factor)
+        inf = float("inf")
+        b, c = self.baseline_knee or inf, self.candidate_knee or inf
+        shift = REGRESSION if c < b else IMPROVEMENT if c > b else UNCHANGED
+        # The median only differs between the two knees: past the lower one but not the higher one.
+        bracketed = any(verdict == shift for load, verdict in medians.items() if min(b, c) <= load < max(b, c))
+        moved = b < inf and c < inf and abs(c - b) > knee_tol * b
+        self.knee = shift if bracketed or moved else UNCHANGED
+
+    @property
+    def regressions(self):
+        """Descriptions of everything that regressed."""
+        found = [f"p{s.percentile:g} at load {s.baseline_load:g}: {s.baseline:.3f} -> {s.candidate:.3f} ms "
+                 f"(x{s.ratio:.2f}, CI {s.low:.2f}-{s.high:.2f})" for s in self.shifts if s.verdict == REGRESSION]
+        if self.throughput == REGRESSION:
+            found.append(f"peak throughput {self.baseline_peak:.1f} -> {self.candidate_peak:.1f} req/s")
+        if self.knee == REGRESSION:
+            found.append(f"knee moved from load {self.baseline_knee} to {self.candidate_knee}")
+        return found
+
+    def to_dict(self):
+        return {
+            "shifts": [s._asdict() for s in self.shifts],
+            "unaligned": self.unaligned,
+            "throughput": {"baseline": self.baseline_peak, "candidate": self.candidate_peak, "verdict": self.throughput},
+            "knee": {"baseline": self.baseline_knee, "candidate": self.candidate_knee, "verdict": self.knee},
+            "regressions": self.regressions,
+        }
+
+
+def _peak(curve):
+    """The peak throughput of a curve and its Poisson standard error."""
+    if len(curve.throughput) == 0:
+        return 0.0, 0.0
+    i = int(np.argmax(curve.throughput))
+    duration = curve.durations[i] if curve.durations[i] > 0 else 1.0
+    return float(curve.throughput[i]), float(np.sqrt(max(curve.throughput[i], 0) * duration) / duration)
+
+
+def compare(baseline, candidate, **kwargs):
+    """
+    Compares the curves of two result sets that have the same key.
+
+    Args:
+        baseline, candidate (dict): Curves, see `load_curves`. With a single curve on each
+                                    side, the two are compared whatever their keys.
+        **kwargs: See `CurveComparison`.
+
+    Returns:
+        dict: Curve key -> `CurveComparison`.
+    """
+    if len(baseline) == 1 and len(candidate) == 1:
+        (key, base), (_, cand) = next(iter(baseline.items())), next(iter(candidate.items()))
+        return {key: CurveComparison(base, cand, **kwargs)}
+    return {key: CurveComparison(curve, candidate[key], **kwargs) for key, curve in baseline.items() if key in candidate}
+
+
+def write_report(comparisons, path):
+    with open(path, "w") as f:
+        json.dump([dict(key=list(key), **comparison.to_dict()) for key, comparison in comparisons.items()], f,
+                  indent=2, default=float)
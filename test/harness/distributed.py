@@ -0,0 +1,278 @@
+import collections
+import json
+import os
+import queue as queue_module
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+from .histogram import Histogram
+from .loadgen import DEFAULT_TIMEOUT, ERROR_KINDS, LoadGenerator
+from .wrk2 import Snapshot
+
+HARNESS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Where the `test` directory of this repository is on the load-generating machines.
+DEFAULT_REMOTE_DIR = "quilt/test"
+# Clock offset probes per node; the one with the shortest round trip is used.
+PINGS = 5
+
+Node = collections.namedtuple("Node", ["name", "command"])
+Node.__doc__ = "A load-generating machine: the command prefix that runs `python3 -m harness` there."
+
+
+def local_nodes(count):
+    """`count` nodes that are processes on this machine."""
+    return [Node(f"local{i}", [sys.executable, "-m", "harness"]) for i in range(count)]
+
+
+def ssh_nodes(machine_info, roles=None, names=None, user=None, remote_dir=DEFAULT_REMOTE_DIR, python="python3",
+              ssh_options=()):
+    """
+    Nodes reached over SSH, from `setup/serverless_runtime/machine.json`.
+
+    Args:
+        machine_info (str): Path of the machine list (`hostname`, `ip`, `name`, `role` per machine).
+        roles (list, optional): Only use machines with these roles.
+        names (list, optional): Only use machines with these names.
+        user (str, optional): SSH user (default: `$USER`, like `install.sh`).
+        remote_dir (str): The `test` directory of this repository on the machines.
+        python (str): The Python interpreter on the machines.
+        ssh_options (list): Extra `ssh` arguments.
+    """
+    with open(machine_info) as f:
+        machines = json.load(f)
+    user = user or os.environ.get("USER")
+    nodes = []
+    for machine in machines:
+        if roles and machine.get("role") not in roles or names and machine.get("name") not in names:
+            continue
+        target = f"{user}@{machine['hostname']}" if user else machine["hostname"]
+        remote = f"cd {shlex.quote(remote_dir)} && exec {shlex.quote(python)} -m harness"
+        nodes.append(Node(machine.get("name", machine["hostname"]), ["ssh", "-q", *ssh_options, target, "--", remote]))
+    if not nodes:
+        raise ValueError(f"No machines in {machine_info} match roles {roles} and names {names}.")
+    return nodes
+
+
+def _send(stream, message):
+    stream.write(json.dumps(message) + "\n")
+    stream.flush()
+
+
+def _snapshot_message(snapshot, stats):
+    return {"elapsed": snapshot.elapsed, "histogram": snapshot.histogram.to_dict(),
+            "uncorrected": snapshot.uncorrected.to_dict(), "stats": stats}
+
+
+def run_worker(generator, rate, connections, duration, stdin=sys.stdin, stdout=sys.stdout):
+    """
+    Runs one node of a `DistributedLoad` (`python3 -m harness worker`).
+
+    The node speaks JSON lines with the coordinator: it reports that it is ready, answers
+    clock probes with its wall-clock time, and starts at the time it is given (on its own
+    clock). It then sends its cumulative histograms and counts at every snapshot of
+    `generator` and stops early when its input is closed.
+
+    Args:
+        generator (LoadGenerator): The load generator of this node.
+        rate, connections, duration: This node's share of the level.
+    """
+    _send(stdout, {"ready": True})
+    for line in iter(stdin.readline, ""):
+        message = json.loads(line)
+        if "ping" in message:
+            _send(stdout, {"pong": message["ping"], "time": time.time()})
+        elif "start_at" in message:
+            start_at = message["start_at"]
+            break
+    else:
+        return
+
+    closed = threading.Event()
+
+    def watch():
+        # Reads the descriptor itself: forked workers close `sys.stdin`, which needs its lock.
+        while os.read(stdin.fileno(), 4096):
+            pass
+        closed.set()
+
+    threading.Thread(target=watch, daemon=True).start()
+    for snapshot in generator.run(rate, connections, duration, start_at=start_at):
+        _send(stdout, _snapshot_message(snapshot, generator.stats))
+        if closed.is_set():
+            break
+    _send(stdout, {"done": True})
+
+
+class DistributedLoad:
+    """
+    Open-loop load from several machines at once.
+
+    Every node runs a `LoadGenerator` (`python3 -m harness worker`), locally or over SSH, with
+    its share of the connections and of the rate. The coordinator estimates each node's clock
+    offset once all of them are ready, so they start at the same instant even without
+    synchronized clocks, and merges their histograms losslessly into one cumulative
+    `Snapshot` per interval. `run` has the interface of `LoadGenerator.run`, so a
+    `SweepController` can drive it.
+    """
+
+    def __init__(self, url, script, nodes, processes=1, interval=1.0, timeout=DEFAULT_TIMEOUT, seed=0, startup=1.0):
+        """
+        Args:
+            url (str): The router URL, as seen from the nodes.
+            script (str): A template name or wrk2 Lua script (see `templates.RequestGenerator`).
+            nodes (list): `Node`s, see `local_nodes` and `ssh_nodes`.
+            processes (int): Worker processes per node.
+            interval (float): Seconds between snapshots.
+            timeout (float): Seconds after which a request fails with a timeout error.
+            seed (int): Seed of the request generators (node `i` starts at `seed + i * processes`).
+            startup (float): Seconds between the last node becoming ready and the start.
+        """
+        self.url = url
+        self.script = script
+        self.nodes = list(nodes)
+        self.processes = processes
+        self.interval = interval
+        self.timeout = timeout
+        self.seed = seed
+        self.startup = startup
+        self.stats = {}
+        self.offsets = {}
+
+    def _split(self, rate, connections):
+        """Connections and rate of each node, so that every connection gets the same rate."""
+        count = max(min(len(self.nodes), connections), 1)
+        shares = [connections // count + (i < connections % count) for i in range(count)]
+        return [(rate * share / connections, share) for share in shares]
+
+    def _command(self, i, node, rate, connections, duration):
+        return node.command + ["worker", self.url, self.script, "-R", repr(rate), "-c", str(connections),
+                               "-d", repr(duration), "-p", str(self.processes), "--interval", repr(self.interval),
+                               "--timeout", repr(self.timeout), "--seed", str(self.seed + i * self.processes)]
+
+    def _read(self, i, proc, messages):
+        for line in proc.stdout:
+            messages.put((i, json.loads(line)))
+        messages.put((i, None))
+
+    def _receive(self, messages, procs, key, timeout):
+        """Waits for the next message of each node that has `key`."""
+        replies = {}
+        deadline = time.time() + timeout
+        while len(replies) < len(procs):
+            try:
+                i, message = messages.get(timeout=max(deadline - time.time(), 0))
+            except queue_module.Empty:
+                missing = [self.nodes[i].name for i in range(len(procs)) if i not in replies]
+                raise RuntimeError(f"No {key!r} from nodes {missing} within {timeout}s.")
+            if message is None:
+                raise RuntimeError(f"Node {self.nodes[i].name} exited (status {procs[i].wait()}).")
+            if key in message:
+                replies[i] = message
+        return replies
+
+    def _synchronize(self, messages, procs):
+        """Estimates each node's clock offset from the round trip of `PINGS` probes."""
+        best = {}
+        for _ in range(PINGS):
+            sent = {}
+            for i, proc in enumerate(procs):
+                sent[i] = time.time()
+                _send(proc.stdin, {"ping": sent[i]})
+            for i, reply in self._receive(messages, procs, "pong", self.timeout).items():
+                received = time.time()
+                rtt = received - sent[i]
+                if i not in best or rtt < best[i][0]:
+                    best[i] = (rtt, reply["time"] - (sent[i] + received) / 2)
+        self.offsets = {self.nodes[i].name: offset for i, (rtt, offset) in best.items()}
+        return [best[i][1] for i in range(len(procs))]
+
+    def run(self, rate, connections, max_duration, start_at=None, ready_timeout=60.0):
+        """
+        Generates load at one level from all nodes, yielding a merged cumulative `Snapshot`
+        every `interval` seconds and a last one when the level ends. `stats` holds the
+        level's request, error and byte counts so far.
+
+        Args:
+            rate (float): Total offered load in requests per second.
+            connections (int): Total open connections.
+            max_duration (float): Length of the level in seconds.
+            start_at (float, optional): Wall-clock time (on this machine) at which to start
+                                        (default: `startup` seconds after all nodes are ready).
+            ready_timeout (float): Seconds the nodes have to start.
+        """
+        split = self._split(rate, connections)
+        messages = queue_module.Queue()
+        procs = []
+        try:
+            for i, (node_rate, node_connections) in enumerate(split):
+                proc = subprocess.Popen(self._command(i, self.nodes[i], node_rate, node_connections, max_duration),
+                                        cwd=HARNESS_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                procs.append(proc)
+                threading.Thread(target=self._read, args=(i, proc, messages), daemon=True).start()
+            self._receive(messages, procs, "ready", ready_timeout)
+            offsets = self._synchronize(messages, procs)
+            start_at = start_at if start_at is not None else time.time() + self.startup
+            for proc, offset in zip(procs, offsets):
+                _send(proc.stdin, {"start_at": start_at + offset})
+
+            latest = [None] * len(procs)
+            ticks = [0] * len(procs)
+            yielded = 0
+            while min(ticks) != float("inf"):
+                try:
+                    i, message = messages.get(timeout=max(start_at - time.time(), 0) + self.interval + self.timeout + 10)
+                except queue_module.Empty:
+                    raise RuntimeError("The load generator nodes stopped reporting.")
+                if message is None:
+                    if ticks[i] != float("inf"):
+                        raise RuntimeError(f"Node {self.nodes[i].name} exited (status {procs[i].wait()}).")
+                    continue
+                if "done" in message:
+                    ticks[i] = float("inf")
+                else:
+                    latest[i] = message
+                    ticks[i] += 1
+                if yielded < min(ticks) < float("inf"):
+                    yielded = min(ticks)
+                    yield self._merge(latest)
+            yield self._merge(latest)
+        finally:
+            for proc in procs:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+            for proc in procs:
+                try:
+                    proc.wait(timeout=self.interval + self.timeout + 5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+                proc.stdout.close()
+
+    def _merge(self, latest):
+        """Adds up the latest cumulative reports of all nodes."""
+        histogram, uncorrected = Histogram(), Histogram()
+        self.stats = dict({kind: 0 for kind in ERROR_KINDS}, requests=0, non_2xx=0, bytes=0)
+        elapsed = 0.0
+        for message in latest:
+            if message is None:
+                continue
+            histogram.add(Histogram.from_dict(message["histogram"]))
+            uncorrected.add(Histogram.from_dict(message["uncorrected"]))
+            for key, count in message["stats"].items():
+                self.stats[key] += count
+            elapsed = max(elapsed, message["elapsed"])
+        errors = sum(self.stats[kind] for kind in ERROR_KINDS) + self.stats["non_2xx"]
+        return Snapshot(elapsed, histogram, uncorrected, self.stats["requests"],
+                        self.stats["requests"] / elapsed if elapsed > 0 else 0.0, errors)
+
+    def measure(self, rate, connections, duration):
+        """Generates load for `duration` seconds and returns the final merged `Snapshot`."""
+        snapshot = None
+        for snapshot in self.run(rate, connections, duration):
+            pass
+        return snapshot
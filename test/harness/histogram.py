@@ -0,0 +1,228 @@
+import math
+
+import numpy as np
+
+# wrk2 records latencies in microseconds with 3 significant figures (`hdr_init(1, MAX_LATENCY, 3)`).
+SIGNIFICANT_FIGURES = 3
+# One hour, in microseconds.
+HIGHEST_TRACKABLE = 3_600_000_000
+
+
+class Histogram:
+    """
+    An HdrHistogram of latencies in microseconds, in NumPy.
+
+    The bucket layout is HdrHistogram's (lowest discernible value 1, `significant_figures`
+    decimal digits of precision), the one wrk2 records with, so counts parsed from wrk2
+    output land in the buckets wrk2 counted them in, and histograms with the same
+    layout add losslessly. Values are recorded in batches with array operations.
+    """
+
+    def __init__(self, highest=HIGHEST_TRACKABLE, significant_figures=SIGNIFICANT_FIGURES):
+        """
+        Args:
+            highest (int): The highest value to track, in microseconds. Larger values are
+                           recorded as `highest`.
+            significant_figures (int): Decimal digits of precision (1 to 5).
+        """
+        if not 1 <= significant_figures <= 5:
+            raise ValueError(f"significant_figures must be in [1, 5], got {significant_figures}.")
+        self.highest = int(highest)
+        self.significant_figures = significant_figures
+        # The layout of `hdr_init` with lowest discernible value 1 (so unit magnitude 0).
+        self._sub_bucket_half_magnitude = math.ceil(math.log2(2 * 10 ** significant_figures)) - 1
+        self._sub_bucket_half = 1 << self._sub_bucket_half_magnitude
+        self._sub_bucket_mask = 2 * self._sub_bucket_half - 1
+        buckets, untrackable = 1, 2 * self._sub_bucket_half
+        while untrackable <= self.highest:
+            untrackable <<= 1
+            buckets += 1
+        self.bucket_count, self.sub_bucket_count = buckets, 2 * self._sub_bucket_half
+        self.counts = np.zeros((buckets + 1) * self._sub_bucket_half, dtype=np.int64)
+        self.min, self.max = None, None
+
+    # --- Layout ---
+
+    def _index(self, values):
+        """Counts index of each value."""
+        values = np.asarray(values, dtype=np.int64)
+        # The bit length of `v | mask`; exact through float64 for values below 2**53.
+        magnitude = np.frexp((values | self._sub_bucket_mask).astype(np.float64))[1]
+        bucket = magnitude - (self._sub_bucket_half_magnitude + 1)
+        sub_bucket = values >> bucket
+        return ((bucket + 1) << self._sub_bucket_half_magnitude) + (sub_bucket - self._sub_bucket_half)
+
+    def _lowest(self, index):
+        """The lowest value of each counts index."""
+        index = np.asarray(index, dtype=np.int64)
+        bucket = (index >> self._sub_bucket_half_magnitude) - 1
+        sub_bucket = (index & (self._sub_bucket_half - 1)) + self._sub_bucket_half
+        first = bucket < 0
+        sub_bucket = np.where(first, sub_bucket - self._sub_bucket_half, sub_bucket)
+        return sub_bucket << np.maximum(bucket, 0)
+
+    def _range(self, index):
+        """The number of values that share each counts index."""
+        bucket = np.maximum((np.asarray(index, dtype=np.int64) >> self._sub_bucket_half_magnitude) - 1, 0)
+        return np.int64(1) << bucket
+
+    def highest_equivalent(self, values):
+        """The largest value in the bucket of each value (what wrk2 prints for a percentile)."""
+        index = self._index(values)
+        return self._lowest(index) + self._range(index) - 1
+
+    def same_layout(self, other):
+        return self.significant_figures == other.significant_figures and len(self.counts) == len(other.counts)
+
+    # --- Recording ---
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def record(self, values, counts=1):
+        """Records latencies in microseconds (a value or an array), each `counts` times."""
+        values = np.clip(np.atleast_1d(np.asarray(values, dtype=np.int64)), 0, self.highest)
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.int64), values.shape)
+        recorded = counts > 0
+        if not recorded.any():
+            return
+        values, counts = values[recorded], counts[recorded]
+        self.counts += np.bincount(self._index(values), weights=counts, minlength=len(self.counts)).astype(np.int64)
+        low, high = int(values.min()), int(values.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def add(self, other):
+        """
+        Adds the counts of another histogram. With the same layout this is exact; otherwise
+        each of `other`'s buckets is recorded at its lowest value.
+        """
+        if other.total == 0:
+            return self
+        if self.same_layout(other):
+            self.counts += other.counts
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        else:
+            index = np.flatnonzero(other.counts)
+            self.record(other._lowest(index), other.counts[index])
+        return self
+
+    def copy(self):
+        h = Histogram(self.highest, self.significant_figures)
+        return h.add(self)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.min, self.max = None, None
+
+    def buckets(self):
+        """
+        Returns:
+            tuple: The highest equivalent value and the count of every non-empty bucket, as arrays.
+        """
+        index = np.flatnonzero(self.counts)
+        return self._lowest(index) + self._range(index) - 1, self.counts[index]
+
+    # --- Statistics ---
+
+    def value_at_percentile(self, percentile):
+        """
+        The latency at a percentile (0 to 100), as HdrHistogram reports it: the highest value
+        equivalent to the first value whose cumulative count reaches the percentile.
+        """
+        return int(self.values_at_percentiles([percentile])[0])
+
+    def values_at_percentiles(self, percentiles):
+        """`value_at_percentile` for each of `percentiles`, as an int array."""
+        total = self.total
+        if total == 0:
+            return np.zeros(len(percentiles), dtype=np.int64)
+        wanted = np.maximum((np.minimum(np.asarray(percentiles, dtype=np.float64), 100.0) / 100.0 * total + 0.5)
+                            .astype(np.int64), 1)
+        index = np.searchsorted(np.cumsum(self.counts), wanted)
+        values = self._lowest(index) + self._range(index) - 1
+        # Like HdrHistogram, never past the largest recorded value.
+        return np.minimum(values, self.highest_equivalent([self.max])[0])
+
+    def mean(self):
+        index = np.flatnonzero(self.counts)
+        if len(index) == 0:
+            return 0.0
+        middle = self._lowest(index) + (self._range(index) >> 1)
+        return float(np.dot(middle, self.counts[index]) / self.counts[index].sum())
+
+    def stddev(self):
+        index = np.flatnonzero(self.counts)
+        if len(index) == 0:
+            return 0.0
+        middle = self._lowest(index) + (self._range(index) >> 1)
+        weights = self.counts[index]
+        mean = np.dot(middle, weights) / weights.sum()
+        return float(np.sqrt(np.dot((middle - mean) ** 2, weights) / weights.sum()))
+
+    def percentile_bounds(self, percentile, confidence=0.95):
+        """
+        A distribution-free confidence interval for a percentile: the values at the ranks
+        that bound the percentile's rank with probability `confidence` (normal approximation
+        of the binomial distribution of the number of samples below it).
+
+        Returns:
+            tuple: `(low, high)` in microseconds.
+        """
+        n = self.total
+        if n == 0:
+            return 0, 0
+        q = percentile / 100.0
+        z = _normal_quantile(0.5 + confidence / 2)
+        spread = z * math.sqrt(q * (1 - q) / n)
+        low, high = self.values_at_percentiles([max(q - spread, 0.0) * 100, min(q + spread, 1.0) * 100])
+        return int(low), int(high)
+
+    # --- Serialization ---
+
+    def __getstate__(self):
+        # Sparse, so histograms are cheap to send between processes.
+        index = np.flatnonzero(self.counts)
+        return {'highest': self.highest, 'significant_figures': self.significant_figures,
+                'index': index, 'counts': self.counts[index], 'min': self.min, 'max': self.max}
+
+    def __setstate__(self, state):
+        self.__init__(state['highest'], state['significant_figures'])
+        self.counts[state['index']] = state['counts']
+        self.min, self.max = state['min'], state['max']
+
+    def to_dict(self):
+        """A sparse, JSON-serializable form of the histogram (see `from_dict`)."""
+        index = np.flatnonzero(self.counts)
+        return {'significant_figures': self.significant_figures, 'highest': self.highest,
+                'index': index.tolist(), 'counts': self.counts[index].tolist(), 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        h = cls(data['highest'], data['significant_figures'])
+        h.counts[np.asarray(data['index'], dtype=np.int64)] = data['counts']
+        h.min, h.max = data['min'], data['max']
+        return h
+
+    @classmethod
+    def from_spectrum(cls, values, total_counts, **kwargs):
+        """
+        Rebuilds a histogram from a printed percentile spectrum (e.g. wrk2's "Detailed
+        Percentile spectrum"): each row's value gets the samples its cumulative count adds.
+
+        Args:
+            values (array-like): The row values in microseconds, increasing.
+            total_counts (array-like): The cumulative count of each row.
+        """
+        h = cls(**kwargs)
+        counts = np.diff(np.asarray(total_counts, dtype=np.int64), prepend=0)
+        h.record(values, counts)
+        return h
+
+
+def _normal_quantile(p):
+    """The quantile function of the standard normal distribution."""
+    from statistics import NormalDist
+    return NormalDist().inv_cdf(p)
@@ -0,0 +1,345 @@
+import asyncio
+import collections
+import multiprocessing
+import queue as queue_module
+import sys
+import time
+import urllib.parse
+from array import array
+
+import numpy as np
+
+from .histogram import Histogram
+from .templates import RequestGenerator
+from .wrk2 import Snapshot
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# wrk2's default socket timeout.
+DEFAULT_TIMEOUT = 2.0
+ERROR_KINDS = ("connect", "read", "write", "timeout")
+
+
+class _HttpConnection(asyncio.Protocol):
+    """A keep-alive HTTP/1.1 client connection with one request in flight at a time."""
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.transport = None
+        self.buffer = bytearray()
+        self.waiter = None
+        self.sent_at = 0.0
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(ConnectionError("connection closed"))
+
+    def data_received(self, data):
+        self.worker.received += len(data)
+        self.buffer += data
+        if self.waiter is not None and not self.waiter.done():
+            self._parse()
+
+    def request(self, payload, loop):
+        self.waiter = loop.create_future()
+        self.sent_at = loop.time()
+        self.transport.write(payload)
+        return self.waiter
+
+    def _parse(self):
+        """Resolves the waiter with `(status, close)` once a full response is buffered."""
+        buf = self.buffer
+        end = buf.find(b"\r\n\r\n")
+        if end < 0:
+            return
+        lines = bytes(buf[:end]).decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        length, chunked, close = 0, False, False
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "transfer-encoding":
+                chunked = "chunked" in value.lower()
+            elif name == "connection":
+                close = value.strip().lower() == "close"
+        pos = end + 4
+        if chunked:
+            while True:
+                line_end = buf.find(b"\r\n", pos)
+                if line_end < 0:
+                    return
+                size = int(bytes(buf[pos:line_end]).split(b";")[0], 16)
+                if size == 0:
+                    # The last chunk, optional trailers and an empty line.
+                    trailer_end = buf.find(b"\r\n\r\n", line_end)
+                    if trailer_end < 0:
+                        return
+                    pos = trailer_end + 4
+                    break
+                pos = line_end + 2 + size + 2
+                if pos > len(buf):
+                    return
+        else:
+            pos += length
+            if pos > len(buf):
+                return
+        del buf[:pos]
+        self.waiter.set_result((status, close))
+
+
+class _Worker:
+    """
+    The open-loop load of one process: `connections` connections, each sending requests on
+    its own constant-rate schedule.
+
+    Like wrk2, a connection sends its next request when the schedule says so, or as soon as
+    the previous response arrives if it is behind. The corrected latency is measured from
+    the scheduled send time (so a stalled server is charged for the requests it delayed,
+    avoiding coordinated omission), the uncorrected one from the actual send time.
+    """
+
+    def __init__(self, host, port, script, seed, rate, connections, timeout):
+        self.host, self.port = host, port
+        self.generator = RequestGenerator(script, f"{host}:{port}", seed=seed)
+        self.rate = rate
+        self.connections = connections
+        self.timeout = timeout
+        self.corrected, self.uncorrected = array("q"), array("q")
+        self.requests, self.non_2xx, self.received = 0, 0, 0
+        self.errors = collections.Counter()
+        self.active = set()
+
+    def flush(self):
+        """The latencies, requests and errors recorded since the last flush."""
+        corrected, uncorrected = Histogram(), Histogram()
+        corrected.record(np.frombuffer(self.corrected, dtype=np.int64))
+        uncorrected.record(np.frombuffer(self.uncorrected, dtype=np.int64))
+        self.corrected, self.uncorrected = array("q"), array("q")
+        delta = (corrected, uncorrected, self.requests, dict(self.errors), self.non_2xx, self.received)
+        self.requests, self.non_2xx, self.received = 0, 0, 0
+        self.errors.clear()
+        return delta
+
+    async def _connection(self, index, start, stop):
+        loop = asyncio.get_running_loop()
+        interval = self.connections / self.rate
+        # Stagger the connections across one interval.
+        intended = start + interval * index / self.connections
+        conn = None
+        # Like wrk2, stop at the end of the run even if behind schedule.
+        while intended < stop and loop.time() < stop:
+            now = loop.time()
+            if intended > now:
+                await asyncio.sleep(intended - now)
+            if conn is None or conn.closed:
+                if conn is not None:
+                    self.active.discard(conn)
+                try:
+                    _, conn = await loop.create_connection(lambda: _HttpConnection(self), self.host, self.port)
+                    self.active.add(conn)
+                except OSError:
+                    self.errors["connect"] += 1
+                    conn = None
+                    intended += interval
+                    continue
+            try:
+                status, close = await conn.request(next(self.generator), loop)
+            except asyncio.TimeoutError:
+                self.errors["timeout"] += 1
+                intended += interval
+                continue
+            except (ConnectionError, OSError):
+                self.errors["read"] += 1
+                intended += interval
+                continue
+            done = loop.time()
+            self.corrected.append(int((done - intended) * 1e6))
+            self.uncorrected.append(int((done - conn.sent_at) * 1e6))
+            self.requests += 1
+            if status > 399:
+                self.non_2xx += 1
+            if close:
+                conn.transport.close()
+            intended += interval
+        if conn is not None:
+            self.active.discard(conn)
+            conn.transport.close()
+
+    async def _watchdog(self):
+        """Fails requests that take longer than the timeout (and drops their connection)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(min(self.timeout / 10, 0.1))
+            now = loop.time()
+            for conn in list(self.active):
+                if conn.waiter is not None and not conn.waiter.done() and now - conn.sent_at > self.timeout:
+                    conn.waiter.set_exception(asyncio.TimeoutError())
+                    conn.transport.abort()
+
+    async def run(self, start_at, duration, interval, report, stop):
+        """
+        Generates load from wall-clock time `start_at` for `duration` seconds, calling
+        `report(tick, delta)` every `interval` seconds and once more at the end.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time() + (start_at - time.time())
+        end = start + duration
+        tasks = [asyncio.ensure_future(self._connection(i, start, end)) for i in range(self.connections)]
+        watchdog = asyncio.ensure_future(self._watchdog())
+        tick = 0
+        finished = asyncio.gather(*tasks)
+        try:
+            while not finished.done():
+                tick += 1
+                deadline = start + tick * interval
+                await asyncio.wait([finished], timeout=max(deadline - loop.time(), 0))
+                if stop():
+                    break
+                if not finished.done():
+                    report(tick, self.flush())
+        finally:
+            for task in tasks:
+                task.cancel()
+            watchdog.cancel()
+            await asyncio.gather(*tasks, watchdog, return_exceptions=True)
+        report(None, self.flush())
+
+
+def _worker_main(host, port, script, seed, rate, connections, timeout, start_at, duration, interval, index,
+                 queue, stop):
+    """Process entry point of a `LoadGenerator` worker."""
+    worker = _Worker(host, port, script, seed, rate, connections, timeout)
+    run = worker.run(start_at, duration, interval, lambda tick, delta: queue.put((index, tick, delta)), stop.is_set)
+    if uvloop is not None:
+        uvloop.install()
+    asyncio.run(run)
+
+
+class LoadGenerator:
+    """
+    An open-loop HTTP load generator in Python, a stand-in for wrk2.
+
+    The load is split over `processes` worker processes, each running an asyncio event loop
+    (uvloop if installed) with its share of the connections and of the rate. Requests come
+    from the native `templates` of the wrk2 Lua scripts, and latencies are recorded in
+    HdrHistograms that the workers send back every `interval` seconds and that are merged
+    losslessly. `run` has the interface of `wrk2.Wrk2Runner.run`, so a `SweepController` can
+    drive either; unlike wrk2 there is no calibration period.
+    """
+
+    def __init__(self, url, script, processes=1, interval=1.0, timeout=DEFAULT_TIMEOUT, seed=0, startup=1.0):
+        """
+        Args:
+            url (str): The router URL, e.g. `http://127.0.0.1:8888`.
+            script (str): A template name or wrk2 Lua script (see `templates.RequestGenerator`).
+            processes (int): Worker processes.
+            interval (float): Seconds between snapshots.
+            timeout (float): Seconds after which a request fails with a timeout error.
+            seed (int): Seed of the request generators (worker `i` uses `seed + i`).
+            startup (float): Seconds given to the workers to start before the synchronized start.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "http" or not parsed.hostname:
+            raise ValueError(f"Only http:// URLs are supported, got {url!r}.")
+        self.url = url
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.script = script
+        self.processes = processes
+        self.interval = interval
+        self.timeout = timeout
+        self.seed = seed
+        self.startup = startup
+        self.stats = {}
+        # Checks the script has a template before any process starts.
+        RequestGenerator(script, self.host)
+
+    def _split(self, rate, connections):
+        """Connections and rate of each worker, so that every connection gets the same rate."""
+        workers = max(min(self.processes, connections), 1)
+        shares = [connections // workers + (i < connections % workers) for i in range(workers)]
+        return [(rate * share / connections, share) for share in shares]
+
+    def run(self, rate, connections, max_duration, start_at=None):
+        """
+        Generates load at one level, yielding a cumulative `Snapshot` every `interval` seconds
+        and a last one when the level ends. `stats` holds the level's request, error and byte
+        counts so far.
+
+        The caller stops the level early by not asking for the next snapshot.
+
+        Args:
+            rate (float): Offered load in requests per second.
+            connections (int): Open connections.
+            max_duration (float): Length of the level in seconds.
+            start_at (float, optional): Wall-clock time at which to start (default: after `startup`).
+        """
+        ctx = multiprocessing.get_context("fork" if sys.platform == "linux" else "spawn")
+        queue, stop = ctx.Queue(), ctx.Event()
+        start_at = start_at if start_at is not None else time.time() + self.startup
+        workers = [ctx.Process(target=_worker_main, daemon=True,
+                               args=(self.host, self.port, self.script, self.seed + i, worker_rate, worker_connections,
+                                     self.timeout, start_at, max_duration, self.interval, i, queue, stop))
+                   for i, (worker_rate, worker_connections) in enumerate(self._split(rate, connections))]
+        for worker in workers:
+            worker.start()
+        histogram, uncorrected = Histogram(), Histogram()
+        self.stats = dict({kind: 0 for kind in ERROR_KINDS}, requests=0, non_2xx=0, bytes=0)
+        ticks = [0] * len(workers)
+        yielded = 0
+        try:
+            while min(ticks) != float("inf"):
+                try:
+                    index, tick, (corrected, uncorr, requests, errors, non_2xx, received) = queue.get(
+                        timeout=self.interval + self.startup + self.timeout)
+                except queue_module.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        raise RuntimeError("The load generator workers exited without reporting.")
+                    continue
+                histogram.add(corrected)
+                uncorrected.add(uncorr)
+                for kind, count in errors.items():
+                    self.stats[kind] += count
+                self.stats["requests"] += requests
+                self.stats["non_2xx"] += non_2xx
+                self.stats["bytes"] += received
+                ticks[index] = float("inf") if tick is None else tick
+                if yielded < min(ticks) < float("inf"):
+                    yielded = min(ticks)
+                    yield self._snapshot(yielded * self.interval, histogram, uncorrected)
+            elapsed = min(max(time.time() - start_at, yielded * self.interval), max_duration)
+            yield self._snapshot(elapsed, histogram, uncorrected)
+        finally:
+            stop.set()
+            # Workers only exit once their last report is read.
+            deadline = time.time() + self.timeout + self.interval + 1
+            while any(worker.is_alive() for worker in workers) and time.time() < deadline:
+                try:
+                    queue.get(timeout=0.1)
+                except queue_module.Empty:
+                    pass
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+    def _snapshot(self, elapsed, histogram, uncorrected):
+        errors = sum(self.stats[kind] for kind in ERROR_KINDS) + self.stats["non_2xx"]
+        return Snapshot(elapsed, histogram, uncorrected, self.stats["requests"],
+                        self.stats["requests"] / elapsed if elapsed > 0 else 0.0, errors)
+
+    def measure(self, rate, connections, duration):
+        """Generates load for `duration` seconds and returns the final `Snapshot`."""
+        snapshot = None
+        for snapshot in self.run(rate, connections, duration):
+            pass
+        return snapshot
@@ -0,0 +1,246 @@
+import csv
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .histogram import Histogram
+from .wrk2 import parse_output
+
+# Percentiles stored as columns, and their column names (`p999` is the 99.9th).
+PERCENTILES = (50, 75, 90, 99, 99.9, 99.99)
+PERCENTILE_COLUMNS = tuple("p" + f"{p:g}".replace(".", "") for p in PERCENTILES)
+
+# `output_<workflow>-<mode>_<connections>.log` (figure7/8ab/8c/9a.sh), `output_<workflow>_<connections>.log`
+# (figure8ab_cm.sh) and `output_<workflow>.log` (the warm-up runs).
+_LOG_NAME = re.compile(r"output_(?P<workflow>.+?)(?:-(?P<mode>sync|async|merged|-))?(?:_(?P<connections>\d+))?\.log")
+
+PARAMETER_COLUMNS = ("path", "app", "workflow", "mode", "connections", "threads", "duration")
+MEASURE_COLUMNS = (("requests", "throughput", "errors", "non_2xx")
+                   + PERCENTILE_COLUMNS + ("mean", "stddev", "max")
+                   + tuple(f"u_{c}" for c in PERCENTILE_COLUMNS) + ("u_mean", "u_stddev", "u_max"))
+_STRING_COLUMNS = ("path", "app", "workflow", "mode")
+
+
+def log_parameters(path):
+    """
+    The run parameters encoded in the path of a wrk2 log written by the figure scripts.
+
+    Returns:
+        dict: `app` (the directory of the log, e.g. `social_network`), `workflow`, `mode`
+              (`sync`, `async`, `merged` or ''), and `connections` (0 if not in the name).
+    """
+    name = os.path.basename(path)
+    match = _LOG_NAME.fullmatch(name)
+    if match is None:
+        return {"app": os.path.basename(os.path.dirname(os.path.abspath(path))),
+                "workflow": os.path.splitext(name)[0], "mode": "", "connections": 0}
+    mode = match.group("mode") or ""
+    return {"app": os.path.basename(os.path.dirname(os.path.abspath(path))), "workflow": match.group("workflow"),
+            "mode": "" if mode == "-" else mode, "connections": int(match.group("connections") or 0)}
+
+
+def _summary(h, prefix=""):
+    """The distribution columns of a histogram, in ms."""
+    if h is None or h.total == 0:
+        return {f"{prefix}{c}": np.nan for c in PERCENTILE_COLUMNS + ("mean", "stddev", "max")}
+    row = {f"{prefix}{c}": v / 1000.0 for c, v in zip(PERCENTILE_COLUMNS, h.values_at_percentiles(PERCENTILES))}
+    row[f"{prefix}mean"] = h.mean() / 1000.0
+    row[f"{prefix}stddev"] = h.stddev() / 1000.0
+    row[f"{prefix}max"] = h.max / 1000.0
+    return row
+
+
+def parse_log(path):
+    """
+    Streams one wrk2 log into a results row.
+
+    Returns:
+        tuple: `(row, corrected, uncorrected)`, the column values of the run and its
+               histograms (None for a spectrum the run did not print).
+    """
+    with open(path) as f:
+        result = parse_output(f)
+    # The connection count comes from the name, which is what makes a run a level of a curve:
+    # the warm-up runs have none in theirs (0), whatever their `-c` was.
+    row = {"path": path, **log_parameters(path)}
+    row.update(threads=result.threads, duration=result.duration, requests=result.requests,
+               throughput=result.throughput, errors=sum(result.errors.values()), non_2xx=result.non_2xx)
+    row.update(_summary(result.corrected))
+    row.update(_summary(result.uncorrected, "u_"))
+    return row, result.corrected, result.uncorrected
+
+
+def find_logs(paths):
+    """Expands directories to the `*.log` files in them (recursively), keeping files as they are."""
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            logs += sorted(glob.glob(os.path.join(path, "**", "*.log"), recursive=True))
+        else:
+            logs.append(path)
+    return logs
+
+
+class ResultsTable:
+    """
+    A columnar table of load-test runs: one row per run, one NumPy array per column.
+
+    The columns are the run parameters (`PARAMETER_COLUMNS`), and the throughput and the
+    corrected (`p50`, ..., `max`) and uncorrected (`u_p50`, ...) latency distribution in ms
+    (`MEASURE_COLUMNS`). The full histograms are kept alongside in CSR form (`ptr`, bucket
+    `index`, `counts`), so any other percentile can be computed later. Tables are saved
+    as `.npz` files and are queried with `select`.
+    """
+
+    def __init__(self, columns, histograms=None, uncorrected=None):
+        """
+        Args:
+            columns (dict): Column name -> array, all of the same length.
+            histograms, uncorrected (list, optional): The corrected and uncorrected
+                                                      `Histogram` of each row.
+        """
+        self.columns = {name: np.asarray(values) for name, values in columns.items()}
+        lengths = {len(values) for values in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        n = lengths.pop() if lengths else 0
+        self.histograms = list(histograms) if histograms is not None else [None] * n
+        self.uncorrected = list(uncorrected) if uncorrected is not None else [None] * n
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Builds a table from `(row, corrected, uncorrected)` tuples (see `parse_log`)."""
+        rows = list(rows)
+        columns = {}
+        for name in PARAMETER_COLUMNS + MEASURE_COLUMNS:
+            values = [row[name] for row, _, _ in rows]
+            columns[name] = np.array(values, dtype=str if name in _STRING_COLUMNS else
+                                     np.int64 if name in ("connections", "threads", "requests", "errors", "non_2xx")
+                                     else np.float64)
+        return cls(columns, [c for _, c, _ in rows], [u for _, _, u in rows])
+
+    @classmethod
+    def from_logs(cls, paths, workers=None):
+        """
+        Parses wrk2 logs in parallel into a table.
+
+        Args:
+            paths (list): Log files or directories of logs.
+            workers (int, optional): Parsing processes (default: one per CPU).
+        """
+        logs = find_logs(paths)
+        if workers == 1 or len(logs) <= 1:
+            return cls.from_rows(map(parse_log, logs))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return cls.from_rows(pool.map(parse_log, logs))
+
+    def __len__(self):
+        return len(self.histograms)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _take(self, index):
+        index = np.asarray(index, dtype=np.int64)
+        return ResultsTable({name: values[index] for name, values in self.columns.items()},
+                            [self.histograms[i] for i in index], [self.uncorrected[i] for i in index])
+
+    def select(self, **conditions):
+        """
+        The rows whose columns equal the given values, e.g. `select(workflow='compose-post', mode='async')`.
+        A list or tuple value matches any of its elements.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        for name, value in conditions.items():
+            column = self.columns[name]
+            keep &= np.isin(column, value) if isinstance(value, (list, tuple, set)) else column == value
+        return self._take(np.flatnonzero(keep))
+
+    def sort(self, *names):
+        """The rows ordered by the given columns (the first is the primary key)."""
+        if len(self) == 0:
+            return self
+        return self._take(np.lexsort([self.columns[name] for name in reversed(names)]))
+
+    def concat(self, other):
+        return ResultsTable({name: np.concatenate([values, other.columns[name]]) for name, values in self.columns.items()},
+                            self.histograms + other.histograms, self.uncorrected + other.uncorrected)
+
+    def rows(self):
+        """Yields every row as a dict."""
+        for i in range(len(self)):
+            yield {name: values[i].item() for name, values in self.columns.items()}
+
+    def histogram(self, i, corrected=True):
+        """The full corrected (or uncorrected) latency histogram of row `i`."""
+        return (self.histograms if corrected else self.uncorrected)[i]
+
+    def percentile(self, p, corrected=True):
+        """Any percentile of every row in ms, from the stored histograms (NaN where missing)."""
+        return np.array([h.value_at_percentile(p) / 1000.0 if h is not None and h.total else np.nan
+                         for h in (self.histograms if corrected else self.uncorrected)])
+
+    def curve(self, latency="p50"):
+        """
+        Returns:
+            tuple: `(throughput, latency)` arrays ordered by connections, for plotting one curve.
+        """
+        ordered = self.sort("connections")
+        return ordered["throughput"], ordered[latency]
+
+    # --- Storage ---
+
+    @staticmethod
+    def _pack(histograms):
+        sizes, index, counts = [], [], []
+        for h in histograms:
+            nonzero = np.flatnonzero(h.counts) if h is not None else np.zeros(0, dtype=np.int64)
+            sizes.append(len(nonzero))
+            index.append(nonzero)
+            counts.append(h.counts[nonzero] if h is not None else np.zeros(0, dtype=np.int64))
+        present = np.array([h is not None for h in histograms], dtype=bool)
+        ptr = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        extremes = np.array([(h.min, h.max) if h is not None and h.total else (0, 0) for h in histograms],
+                            dtype=np.int64).reshape(-1, 2)
+        return ptr, np.concatenate(index or [np.zeros(0, dtype=np.int64)]), \
+            np.concatenate(counts or [np.zeros(0, dtype=np.int64)]), present, extremes
+
+    @staticmethod
+    def _unpack(ptr, index, counts, present, extremes):
+        histograms = []
+        for i in range(len(present)):
+            if not present[i]:
+                histograms.append(None)
+                continue
+            h = Histogram()
+            h.counts[index[ptr[i]:ptr[i + 1]]] = counts[ptr[i]:ptr[i + 1]]
+            if h.total:
+                h.min, h.max = int(extremes[i, 0]), int(extremes[i, 1])
+            histograms.append(h)
+        return histograms
+
+    def save(self, path):
+        """Writes the table to an `.npz` file (columns plus the CSR histograms)."""
+        arrays = {f"col_{name}": values for name, values in self.columns.items()}
+        for prefix, histograms in (("hist", self.histograms), ("uhist", self.uncorrected)):
+            for key, value in zip(("ptr", "index", "counts", "present", "extremes"), self._pack(histograms)):
+                arrays[f"{prefix}_{key}"] = value
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            columns = {key[len("col_"):]: data[key] for key in data.files if key.startswith("col_")}
+            histograms = [cls._unpack(*(data[f"{prefix}_{key}"] for key in ("ptr", "index", "counts", "present", "extremes")))
+                          for prefix in ("hist", "uhist")]
+        return cls(columns, *histograms)
+
+    def to_csv(self, path):
+        """Writes the columns (without the histograms) as CSV."""
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            writer.writerows(zip(*(values.tolist() for values in self.columns.values())))
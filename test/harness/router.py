@@ -0,0 +1,265 @@
+import asyncio
+import collections
+import json
+import os
+
+from .histogram import Histogram
+
+# Caller recorded for requests that do not come from an emulated function.
+CLIENT = "client"
+# Functions call `<router-url><callee>`; each process gets `<router>/_from/<caller>/` so hops are attributed.
+_FROM = "_from"
+
+
+def find_functions(directory):
+    """
+    Finds function executables in a directory: `<name>` itself, or `<name>/function` or
+    `<name>/userfunc` (what the Fission binary builds and the merge pipeline produce).
+
+    Returns:
+        dict: function name -> executable path.
+    """
+    functions = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        for candidate in (path, os.path.join(path, "function"), os.path.join(path, "userfunc")):
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                functions[name] = candidate
+                break
+    return functions
+
+
+class FunctionPool:
+    """
+    Warm processes of one function executable.
+
+    Like the Fission binary environment, every invocation runs in a fresh process that
+    gets the request body on stdin and whose stdout is the response. The processes are
+    started ahead of time: `size` of them wait for their input, and one is started
+    in the background every time one is used. With `size` 0 processes are started on
+    demand, as Fission does.
+    """
+
+    def __init__(self, name, command, size, env):
+        """
+        Args:
+            name (str): The function name (the route).
+            command (list): The executable and its arguments.
+            size (int): Warm processes kept ready.
+            env (dict): Environment of the processes.
+        """
+        self.name = name
+        self.command = list(command)
+        self.size = size
+        self.env = env
+        self.idle = asyncio.Queue()
+        self.pending = set()
+
+    async def _spawn(self):
+        return await asyncio.create_subprocess_exec(*self.command, stdin=asyncio.subprocess.PIPE,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE, env=self.env)
+
+    def _replenish(self):
+        task = asyncio.ensure_future(self._spawn())
+        self.pending.add(task)
+        task.add_done_callback(self._spawned)
+
+    def _spawned(self, task):
+        self.pending.discard(task)
+        if not task.cancelled() and task.exception() is None:
+            self.idle.put_nowait(task.result())
+
+    def start(self):
+        for _ in range(self.size):
+            self._replenish()
+
+    async def invoke(self, body):
+        """
+        Runs the function on `body`.
+
+        Returns:
+            tuple: `(returncode, stdout, stderr, wait, run)`, with the seconds spent waiting
+                   for a process and running it.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if self.size:
+            proc = await self.idle.get()
+            self._replenish()
+        else:
+            proc = await self._spawn()
+        started = loop.time()
+        stdout, stderr = await proc.communicate(body)
+        return proc.returncode, stdout, stderr, started - start, loop.time() - started
+
+    async def close(self):
+        for task in self.pending:
+            task.cancel()
+        await asyncio.gather(*self.pending, return_exceptions=True)
+        while not self.idle.empty():
+            proc = self.idle.get_nowait()
+            proc.kill()
+            await proc.wait()
+
+
+class HopStats:
+    """Latency histograms (in microseconds) of every `(caller, callee)` hop through the router."""
+
+    def __init__(self):
+        self.latency = collections.defaultdict(Histogram)
+        self.wait = collections.defaultdict(Histogram)
+        self.run = collections.defaultdict(Histogram)
+        self.errors = collections.Counter()
+
+    def record(self, hop, latency, wait, run, ok):
+        self.latency[hop].record(int(latency * 1e6))
+        self.wait[hop].record(int(wait * 1e6))
+        self.run[hop].record(int(run * 1e6))
+        if not ok:
+            self.errors[hop] += 1
+
+    def summary(self):
+        """
+        Returns:
+            list: One dict per hop with its count, errors, and latency / process wait /
+                  process run time percentiles in ms.
+        """
+        rows = []
+        for (caller, callee), h in sorted(self.latency.items()):
+            row = {"caller": caller, "callee": callee, "count": h.total, "errors": self.errors[caller, callee]}
+            for name, hist in (("latency", h), ("wait", self.wait[caller, callee]), ("run", self.run[caller, callee])):
+                p50, p90, p99 = hist.values_at_percentiles([50, 90, 99]) / 1000.0
+                row[name] = {"mean": hist.mean() / 1000.0, "p50": p50, "p90": p90, "p99": p99}
+            rows.append(row)
+        return rows
+
+
+class Router:
+    """
+    A local stand-in for the Fission router and the function pods behind it.
+
+    `POST /<function>` runs the function's executable (through its `FunctionPool`) with the
+    request body on stdin and answers with its stdout, 500 if it fails and 404 for unknown
+    functions. The processes get the environment of Fission's binary environment plus
+    `router-url`, which `FissionRPC::make_rpc` uses instead of the in-cluster router, so
+    calls between functions come back through this router and every hop is recorded in
+    `stats`. `GET /_stats` returns the per-hop summary as JSON and `POST /_reset` clears it.
+    """
+
+    def __init__(self, functions, host="127.0.0.1", port=8888, router_url=None, pool_size=4, delay=0.0, env=None):
+        """
+        Args:
+            functions (dict): Function name -> executable path (or command list).
+            host, port: Where the router listens (port 0 picks a free port).
+            router_url (str, optional): URL the functions call the router at (default: the
+                                        listening address).
+            pool_size (int): Warm processes per function (0 starts one per request).
+            delay (float): Seconds added to every hop, to emulate network latency.
+            env (dict, optional): Extra environment of the function processes.
+        """
+        self.functions = {name: [command] if isinstance(command, str) else list(command)
+                          for name, command in functions.items()}
+        self.host, self.port = host, port
+        self.router_url = router_url
+        self.pool_size = pool_size
+        self.delay = delay
+        self.env = dict(env or {})
+        self.pools = {}
+        self.stats = HopStats()
+        self.server = None
+
+    @property
+    def url(self):
+        return self.router_url or f"http://{self.host}:{self.port}/"
+
+    def _process_env(self, name):
+        env = {"PATH": os.environ.get("PATH", ""), "REQUEST_METHOD": "POST", "REQUEST_URI": f"/{name}",
+               # `FissionRPC::get_env` prints to stdout when this is missing.
+               "ingress-enable": "false",
+               "router-url": f"{self.url.rstrip('/')}/{_FROM}/{name}/"}
+        env.update(self.env)
+        return env
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        for name, command in self.functions.items():
+            pool = FunctionPool(name, command, self.pool_size, self._process_env(name))
+            pool.start()
+            self.pools[name] = pool
+        return self
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await asyncio.gather(*(pool.close() for pool in self.pools.values()))
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                method, target = lines[0].split(" ")[:2]
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, reply = await self.route(method, target, body)
+                close = headers.get("connection", "").lower() == "close"
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n%s"
+                             % (status, _REASONS.get(status, b"Error"), len(reply),
+                                b"Connection: close\r\n" if close else b"", reply))
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, target, body):
+        """
+        Handles one request.
+
+        Returns:
+            tuple: `(status, body)` of the response.
+        """
+        parts = target.split("?")[0].strip("/").split("/")
+        if parts == ["_stats"]:
+            return 200, json.dumps(self.stats.summary()).encode()
+        if parts == ["_reset"]:
+            self.stats = HopStats()
+            return 200, b"{}"
+        caller = CLIENT
+        if len(parts) == 3 and parts[0] == _FROM:
+            caller, parts = parts[1], parts[2:]
+        pool = self.pools.get(parts[0]) if len(parts) == 1 else None
+        if pool is None:
+            return 404, f"function {'/'.join(parts)} not found".encode()
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        returncode, stdout, stderr, wait, run = await pool.invoke(body)
+        ok = returncode == 0
+        self.stats.record((caller, pool.name), loop.time() - start, wait, run, ok)
+        if not ok:
+            return 500, (stderr or f"exit status {returncode}".encode())
+        return 200, stdout
+
+
+_REASONS = {200: b"OK", 404: b"Not Found", 500: b"Internal Server Error"}
@@ -0,0 +1,403 @@
+import json
+import os
+import socket
+import threading
+import time
+import urllib.parse
+
+# `auth.password` of the KeyDB chart in `setup/serverless_runtime/redis_memcached/install.sh`.
+DEFAULT_PASSWORD = "keydb"
+SNAPSHOT_NAME = "snapshot.json"
+# Keys per SCAN / DUMP round trip, and per memcached `get`.
+BATCH = 1000
+GET_BATCH = 100
+
+
+class StorageError(Exception):
+    """An error reply from KeyDB or memcached, or a store that did not become ready."""
+
+
+def _address(text, port):
+    host, _, p = text.rpartition(":")
+    return (host, int(p)) if host else (text, port)
+
+
+class _Connection:
+    """A buffered TCP connection."""
+
+    def __init__(self, address, timeout):
+        self.sock = socket.create_connection(address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def _fill(self):
+        data = self.sock.recv(1 << 16)
+        if not data:
+            raise ConnectionError("Connection closed by the server.")
+        self.buffer += data
+
+    def readline(self):
+        while True:
+            end = self.buffer.find(b"\r\n")
+            if end >= 0:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 2]
+                return line
+            self._fill()
+
+    def read(self, n):
+        """Reads `n` bytes and the CRLF after them."""
+        while len(self.buffer) < n + 2:
+            self._fill()
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n + 2]
+        return data
+
+    def close(self):
+        self.sock.close()
+
+
+def encode_command(*args):
+    """A command in the RESP wire format (what `redis-cli --pipe` reads)."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        arg = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+class KeyDBClient:
+    """A minimal RESP client for KeyDB (or Redis), with pipelining."""
+
+    def __init__(self, address="127.0.0.1:6379", password=DEFAULT_PASSWORD, timeout=10.0):
+        self.address = _address(address, 6379)
+        self.conn = _Connection(self.address, timeout)
+        if password:
+            self.execute("AUTH", password)
+
+    def _reply(self):
+        line = self.conn.readline()
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return StorageError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            return None if int(rest) < 0 else self.conn.read(int(rest))
+        if kind == b"*":
+            return None if int(rest) < 0 else [self._reply() for _ in range(int(rest))]
+        raise StorageError(f"Unexpected reply {line!r}.")
+
+    def execute(self, *args):
+        self.conn.send(encode_command(*args))
+        reply = self._reply()
+        if isinstance(reply, StorageError):
+            raise reply
+        return reply
+
+    def pipeline(self, commands):
+        """Sends encoded commands at once and returns their replies (errors are returned, not raised)."""
+        self.conn.send(b"".join(commands))
+        return [self._reply() for _ in commands]
+
+    def info(self, section):
+        """`INFO <section>` as a dict."""
+        text = self.execute("INFO", section).decode()
+        return dict(line.split(":", 1) for line in text.splitlines() if ":" in line and not line.startswith("#"))
+
+    def databases(self):
+        """The databases that hold keys, e.g. `{0: 1200}`."""
+        return {int(db[2:]): int(dict(kv.split("=") for kv in value.split(","))["keys"])
+                for db, value in self.info("keyspace").items() if db.startswith("db")}
+
+    def close(self):
+        self.conn.close()
+
+
+class MemcachedClient:
+    """A minimal client of the memcached text protocol."""
+
+    def __init__(self, address="127.0.0.1:11211", timeout=10.0):
+        self.address = _address(address, 11211)
+        self.conn = _Connection(self.address, timeout)
+
+    def execute(self, line):
+        """Sends a command line and returns the first line of the reply."""
+        self.conn.send(line.encode() + b"\r\n")
+        reply = self.conn.readline()
+        if reply.startswith((b"ERROR", b"CLIENT_ERROR", b"SERVER_ERROR")):
+            raise StorageError(f"{line}: {reply.decode()}")
+        return reply.decode()
+
+    def version(self):
+        return self.execute("version").split(" ", 1)[1]
+
+    def stats(self):
+        """`stats` as a dict."""
+        self.conn.send(b"stats\r\n")
+        stats = {}
+        while True:
+            line = self.conn.readline().decode()
+            if line == "END":
+                return stats
+            _, name, value = line.split(" ", 2)
+            stats[name] = value
+
+    def keys(self):
+        """Lists the keys and their expiry times (`exp=-1` never expires) with the LRU crawler."""
+        reply = self.execute("lru_crawler metadump all")
+        keys = []
+        while reply != "END":
+            fields = dict(field.split("=", 1) for field in reply.split(" "))
+            keys.append((urllib.parse.unquote(fields["key"]), int(fields["exp"])))
+            reply = self.conn.readline().decode()
+        return keys
+
+    def get_many(self, keys):
+        """Returns `{key: (flags, value)}` of the keys that are still stored."""
+        self.conn.send(b"get " + " ".join(keys).encode() + b"\r\n")
+        values = {}
+        while True:
+            line = self.conn.readline()
+            if line == b"END":
+                return values
+            _, key, flags, size = line.split(b" ")[:4]
+            values[key.decode()] = (int(flags), self.conn.read(int(size)))
+
+    def close(self):
+        self.conn.close()
+
+
+def snapshot_keydb(client, path):
+    """
+    Saves every key of every database as `RESTORE` commands (`DUMP` payloads and TTLs) in
+    RESP, the format of `redis-cli --pipe`.
+
+    Returns:
+        tuple: `(commands, databases)`, the number of commands written and the key count of
+               each database.
+    """
+    databases = client.databases()
+    commands = 0
+    with open(path, "wb") as f:
+        for db in sorted(databases):
+            client.execute("SELECT", db)
+            f.write(encode_command("SELECT", db))
+            commands += 1
+            cursor = b"0"
+            while True:
+                cursor, keys = client.execute("SCAN", cursor, "COUNT", BATCH)
+                replies = client.pipeline([c for key in keys for c in (encode_command("PTTL", key),
+                                                                       encode_command("DUMP", key))])
+                for key, ttl, payload in zip(keys, replies[::2], replies[1::2]):
+                    # Keys that expired or were deleted since the SCAN have no payload.
+                    if payload is not None and not isinstance(payload, StorageError):
+                        f.write(encode_command("RESTORE", key, max(ttl, 0), payload, "REPLACE"))
+                        commands += 1
+                if cursor == b"0":
+                    break
+    client.execute("SELECT", 0)
+    return commands, databases
+
+
+def restore_keydb(client, path, commands, databases, chunk=1 << 20):
+    """
+    Replaces the data of KeyDB with a snapshot: `FLUSHALL`, then the snapshot's `commands`
+    streamed in chunks while a thread reads their replies, so that neither side blocks on a
+    full socket buffer.
+    """
+    client.execute("FLUSHALL")
+    errors = []
+
+    def read_replies():
+        try:
+            for _ in range(commands):
+                reply = client._reply()
+                if isinstance(reply, StorageError):
+                    errors.append(reply)
+        except OSError as e:
+            errors.append(e)
+
+    reader = threading.Thread(target=read_replies, daemon=True)
+    reader.start()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk)
+            if not data:
+                break
+            client.conn.send(data)
+    reader.join()
+    client.execute("SELECT", 0)
+    if errors:
+        raise StorageError(f"{len(errors)} commands of {path} failed, e.g. {errors[0]}")
+    restored = client.databases()
+    if restored != databases:
+        raise StorageError(f"Restored {restored} keys instead of {databases}.")
+
+
+def snapshot_memcached(client, path):
+    """
+    Saves every item as a `set ... noreply` command of the text protocol.
+
+    Returns:
+        int: The number of items.
+    """
+    now = time.time()
+    keys = client.keys()
+    count = 0
+    with open(path, "wb") as f:
+        for start in range(0, len(keys), GET_BATCH):
+            batch = dict(keys[start:start + GET_BATCH])
+            for key, (flags, value) in client.get_many(list(batch)).items():
+                expiry = batch[key]
+                ttl = 0 if expiry < 0 else max(int(expiry - now), 1)
+                f.write(b"set %s %d %d %d noreply\r\n%s\r\n" % (key.encode(), flags, ttl, len(value), value))
+                count += 1
+    return count
+
+
+def restore_memcached(client, path, count):
+    """Replaces the items of memcached with a snapshot; `version` afterwards waits for the pipeline."""
+    client.execute("flush_all")
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            client.conn.send(data)
+    client.version()
+    items = int(client.stats()["curr_items"])
+    if items < count:
+        raise StorageError(f"memcached {client.address} holds {items} items instead of {count}.")
+
+
+class StorageReset:
+    """
+    Resets KeyDB and memcached to a snapshot between load levels.
+
+    `figure*.sh` reinstall both stores before every level, repopulate them with `init` and
+    sleep. Instead, `snapshot` saves their data once (after `init`) and `restore` flushes
+    them and streams the saved data back in pipelined batches, so every level starts from
+    identical data in seconds. Readiness comes from probes rather than sleeps: KeyDB must
+    answer, not be loading, and have its replicas acknowledge the writes (`WAIT`), and
+    memcached must answer `version`. An instance can be passed as the `reset` of a
+    `SweepController`.
+    """
+
+    def __init__(self, directory, keydb=None, memcached=(), password=DEFAULT_PASSWORD, timeout=60.0, log=None):
+        """
+        Args:
+            directory (str): Where the snapshot is written and read.
+            keydb (str, optional): `host:port` of the KeyDB master (e.g. a `kubectl port-forward`).
+            memcached (list): `host:port` of each memcached instance.
+            password (str): KeyDB password.
+            timeout (float): Seconds the stores have to become ready.
+            log (callable, optional): Called with progress messages.
+        """
+        self.directory = directory
+        self.keydb = keydb
+        self.memcached = list(memcached)
+        self.password = password
+        self.timeout = timeout
+        self.log = log or (lambda message: None)
+
+    def _keydb(self):
+        return KeyDBClient(self.keydb, self.password, timeout=self.timeout)
+
+    def wait_ready(self):
+        """Waits until every store answers and KeyDB has finished loading and syncing its replicas."""
+        deadline = time.time() + self.timeout
+        pending = ([("keydb", self.keydb)] if self.keydb else []) + [("memcached", m) for m in self.memcached]
+        while pending:
+            kind, address = pending[0]
+            try:
+                if kind == "keydb":
+                    client = self._keydb()
+                    try:
+                        ready = (client.execute("PING") == "PONG" and client.info("persistence").get("loading") == "0"
+                                 and self._replicas_synced(client))
+                    finally:
+                        client.close()
+                else:
+                    client = MemcachedClient(address, timeout=self.timeout)
+                    try:
+                        client.version()
+                        ready = True
+                    finally:
+                        client.close()
+            except (OSError, StorageError) as e:
+                ready = False
+                if time.time() > deadline:
+                    raise StorageError(f"{kind} at {address} is not ready: {e}") from e
+            if ready:
+                pending.pop(0)
+            elif time.time() > deadline:
+                raise StorageError(f"{kind} at {address} did not become ready within {self.timeout}s.")
+            else:
+                time.sleep(0.1)
+
+    def _replicas_synced(self, client):
+        replicas = int(client.info("replication").get("connected_slaves", 0))
+        return replicas == 0 or client.execute("WAIT", replicas, 1000) >= replicas
+
+    def snapshot(self):
+        """Saves the data of all stores to `directory`; returns the snapshot description."""
+        self.wait_ready()
+        os.makedirs(self.directory, exist_ok=True)
+        description = {"time": time.time()}
+        if self.keydb:
+            client = self._keydb()
+            try:
+                commands, databases = snapshot_keydb(client, os.path.join(self.directory, "keydb.resp"))
+            finally:
+                client.close()
+            description["keydb"] = {"file": "keydb.resp", "commands": commands,
+                                    "databases": {str(db): n for db, n in databases.items()}}
+            self.log(f"keydb {self.keydb}: {sum(databases.values())} keys")
+        description["memcached"] = []
+        for i, address in enumerate(self.memcached):
+            client = MemcachedClient(address, timeout=self.timeout)
+            try:
+                count = snapshot_memcached(client, os.path.join(self.directory, f"memcached{i}.txt"))
+            finally:
+                client.close()
+            description["memcached"].append({"file": f"memcached{i}.txt", "items": count})
+            self.log(f"memcached {address}: {count} items")
+        with open(os.path.join(self.directory, SNAPSHOT_NAME), "w") as f:
+            json.dump(description, f, indent=2)
+        return description
+
+    def restore(self):
+        """Restores the snapshot in `directory` and waits for the stores to be ready; returns the seconds taken."""
+        start = time.time()
+        with open(os.path.join(self.directory, SNAPSHOT_NAME)) as f:
+            description = json.load(f)
+        self.wait_ready()
+        if self.keydb and "keydb" in description:
+            client = self._keydb()
+            try:
+                restore_keydb(client, os.path.join(self.directory, description["keydb"]["file"]),
+                              description["keydb"]["commands"], {int(db): n for db, n in description["keydb"]["databases"].items()})
+            finally:
+                client.close()
+        if len(description["memcached"]) != len(self.memcached):
+            raise StorageError(f"The snapshot has {len(description['memcached'])} memcached instances, "
+                               f"not {len(self.memcached)}.")
+        for address, saved in zip(self.memcached, description["memcached"]):
+            client = MemcachedClient(address, timeout=self.timeout)
+            try:
+                restore_memcached(client, os.path.join(self.directory, saved["file"]), saved["items"])
+            finally:
+                client.close()
+        self.wait_ready()
+        elapsed = time.time() - start
+        self.log(f"Restored {self.directory} in {elapsed:.2f}s")
+        return elapsed
+
+    def __call__(self, rate=None, connections=None):
+        self.restore()
@@ -0,0 +1,305 @@
+import collections
+import json
+import math
+
+from .histogram import Histogram
+
+# `figure8ab.sh`: 22 connection counts, 480 s each, at `-R 100000`.
+FIXED_CONNECTIONS = (1, 3, 5, 7, 9, 13, 18, 25, 32, 39, 50, 70, 90, 110, 130, 150, 180, 210, 240, 270, 300, 350)
+FIXED_DURATION = 480
+FIXED_RATE = 100000
+
+Level = collections.namedtuple(
+    "Level", "rate connections throughput latency duration converged saturated histogram")
+Level.__doc__ = """
+One measured point of a throughput-latency curve.
+
+rate (float): Offered load in requests per second.
+connections (int): Open connections.
+throughput (float): Achieved requests per second.
+latency (dict): percentile -> latency in ms.
+duration (float): Seconds of load spent on the level.
+converged (bool): Whether the level stopped early because its percentiles converged.
+saturated (bool): Whether the level is past the knee.
+histogram (Histogram): The latencies of the level in microseconds.
+"""
+
+
+class SweepController:
+    """
+    Finds the saturation knee of a throughput-latency curve adaptively.
+
+    A fixed list of load levels spends the same time on every level, most of them far
+    from the knee. This controller instead:
+
+    1. measures the lowest load, which gives the unloaded latency;
+    2. ramps the load up geometrically until a level is past the knee;
+    3. bisects between the last level below the knee and the first one past it;
+    4. adds `dense_points` levels across the bend of the curve below it.
+
+    A level is past the knee when its median latency exceeds `knee_factor` times the
+    unloaded median, or, when sweeping the offered rate, when the system completes less
+    than `1 - tput_tol` of it.
+
+    Each level stops as soon as its percentiles converge: the distribution-free
+    `confidence` interval of every percentile is within `rel_tol` of its estimate, and the
+    estimate moved less than `rel_tol` since the previous snapshot. A level that is
+    clearly overloaded (its latency keeps growing) stops after `min_duration`.
+
+    The load is either the connection count at a fixed, unreachable offered rate (what
+    `figure8ab.sh` sweeps) or the offered rate, with enough connections to sustain it
+    by Little's law. At an unreachable rate the corrected latency only measures how far
+    behind schedule the load generator is, so the connections axis uses the uncorrected
+    latencies (the ones `getlattput.py` reports) and the rate axis the corrected ones.
+    """
+
+    def __init__(self, runner, axis="connections", low=1, high=350, rate=FIXED_RATE, connections=1,
+                 min_duration=60, max_duration=FIXED_DURATION, percentiles=(50, 90, 99), rel_tol=0.05,
+                 confidence=0.95, knee_factor=2.0, tput_tol=0.05, growth=2.0, resolution=0.1,
+                 dense_points=4, reset=None, log=None):
+        """
+        Args:
+            runner: Generates load; `runner.run(rate, connections, max_duration)` yields
+                    cumulative snapshots (see `wrk2.Wrk2Runner`).
+            axis (str): `connections` or `rate`.
+            low, high (float): Range of the swept load.
+            rate (float): Offered rate when sweeping connections.
+            connections (int): Lowest connection count when sweeping the rate.
+            min_duration, max_duration (float): Bounds on the seconds spent on a level.
+            percentiles (tuple): Percentiles that must converge before a level stops.
+            rel_tol (float): Relative width of the confidence interval, and relative change
+                             between snapshots, at which a percentile has converged.
+            confidence (float): Confidence level of the percentile intervals.
+            knee_factor (float): Median latency, relative to the unloaded median, past which
+                                 a level is saturated.
+            tput_tol (float): Fraction of the offered rate that may go unserved before a
+                              level is saturated (rate axis).
+            growth (float): Factor between the levels of the ramp.
+            resolution (float): Bisection stops when the knee is bracketed within this
+                                fraction of the load.
+            dense_points (int): Extra levels measured around the knee.
+            reset (callable, optional): Called before every level with `(rate, connections)`,
+                                        e.g. to reinstall the databases.
+            log (callable, optional): Called with a message for every finished level.
+        """
+        if axis not in ("connections", "rate"):
+            raise ValueError(f"axis must be 'connections' or 'rate', got {axis!r}.")
+        if not 0 < low < high:
+            raise ValueError(f"Invalid load range [{low}, {high}].")
+        self.runner = runner
+        self.axis = axis
+        self.low, self.high = low, high
+        self.rate = rate
+        self.connections = connections
+        self.min_duration, self.max_duration = min_duration, max_duration
+        self.percentiles = tuple(percentiles)
+        self.rel_tol = rel_tol
+        self.confidence = confidence
+        self.knee_factor = knee_factor
+        self.tput_tol = tput_tol
+        self.growth = growth
+        self.resolution = resolution
+        self.dense_points = dense_points
+        self.reset = reset
+        self.log = log
+        self.levels = {}
+
+    # --- Levels ---
+
+    def _round(self, load):
+        return int(min(max(round(load), self.low), self.high))
+
+    def _connections_for(self, rate):
+        """Connections for an offered rate: twice the concurrency of Little's law at the last p99."""
+        if not self.levels:
+            return self.connections
+        last = self.levels[max(self.levels)]
+        tail = last.latency[max(last.latency)] / 1000.0
+        return max(self.connections, math.ceil(2 * rate * tail))
+
+    def latencies(self, snapshot):
+        """The histogram of a snapshot that the sweep uses (see the class docstring)."""
+        if self.axis == "connections" and snapshot.uncorrected is not None and snapshot.uncorrected.total:
+            return snapshot.uncorrected
+        return snapshot.histogram
+
+    def converged(self, h, previous):
+        """
+        Whether every percentile of a level has converged (see the class docstring).
+
+        Args:
+            h (Histogram): The latencies of the level so far.
+            previous (Histogram): The latencies at the previous snapshot.
+        """
+        if h.total == 0 or previous is None or previous.total == 0:
+            return False
+        now = h.values_at_percentiles(self.percentiles)
+        before = previous.values_at_percentiles(self.percentiles)
+        for p, estimate, last in zip(self.percentiles, now, before):
+            low, high = h.percentile_bounds(p, self.confidence)
+            if high - low > self.rel_tol * estimate or abs(estimate - last) > self.rel_tol * estimate:
+                return False
+        return True
+
+    def _baseline(self):
+        """The unloaded median latency in microseconds, or None before the first level."""
+        if not self.levels:
+            return None
+        return self.levels[min(self.levels)].histogram.value_at_percentile(50)
+
+    def saturated(self, snapshot, rate):
+        """Whether a level is past the knee."""
+        if self.axis == "rate" and snapshot.throughput < (1 - self.tput_tol) * rate:
+            return True
+        baseline = self._baseline()
+        return baseline is not None and self.latencies(snapshot).value_at_percentile(50) > self.knee_factor * baseline
+
+    def measure(self, load):
+        """
+        Measures one load level, stopping when it converges, and records it.
+
+        Returns:
+            Level: The measured level.
+        """
+        load = self._round(load)
+        if load in self.levels:
+            return self.levels[load]
+        if self.axis == "connections":
+            rate, connections = self.rate, load
+        else:
+            rate, connections = load, self._connections_for(load)
+        if self.reset is not None:
+            self.reset(rate, connections)
+
+        previous, snapshot, converged = None, None, False
+        growing = 0
+        for snapshot in self.runner.run(rate, connections, self.max_duration):
+            h = self.latencies(snapshot)
+            if snapshot.elapsed >= self.min_duration:
+                if self.converged(h, previous):
+                    converged = True
+                    break
+                # Past the knee the latency grows with the queue and never converges.
+                if previous is not None and previous.total and self.saturated(snapshot, rate):
+                    p99 = h.value_at_percentile(99)
+                    growing = growing + 1 if p99 > (1 + self.rel_tol) * previous.value_at_percentile(99) else 0
+                    if growing >= 2:
+                        break
+            # The runner keeps adding to the same histogram.
+            previous = h.copy()
+        if snapshot is None:
+            raise RuntimeError(f"The load generator produced no measurement at {load} {self.axis}.")
+
+        h = self.latencies(snapshot).copy()
+        values = h.values_at_percentiles(self.percentiles)
+        level = Level(rate, connections, snapshot.throughput,
+                      {p: v / 1000.0 for p, v in zip(self.percentiles, values)}, snapshot.elapsed,
+                      converged, self.saturated(snapshot, rate), h)
+        self.levels[load] = level
+        if self.log is not None:
+            latency = ", ".join(f"p{p:g} {ms:.3f} ms" for p, ms in level.latency.items())
+            self.log(f"{self.axis} {load}: {level.throughput:.1f} req/s, {latency} in {level.duration:.0f}s"
+                     f"{' (converged)' if converged else ''}{' (saturated)' if level.saturated else ''}")
+        return level
+
+    # --- Search ---
+
+    def _close(self, a, b):
+        return b - a <= max(self.resolution * b, 1)
+
+    def sweep(self):
+        """
+        Runs the sweep.
+
+        Returns:
+            SweepResult: The measured levels and the knee.
+        """
+        below = self.low
+        self.measure(below)
+        above = None
+        load = below
+        while load < self.high:
+            load = self._round(max(load * self.growth, load + 1))
+            if self.measure(load).saturated:
+                above = load
+                break
+            below = load
+
+        if above is not None:
+            while not self._close(below, above):
+                middle = self._round(math.sqrt(below * above) if below > 0 else (below + above) / 2)
+                if middle in (below, above):
+                    break
+                if self.measure(middle).saturated:
+                    above = middle
+                else:
+                    below = middle
+            self._densify(above)
+        return SweepResult(self.axis, self.levels, below if above is not None else None, above)
+
+    def _densify(self, above):
+        """
+        Measures `dense_points` more levels across the bend of the curve: from the last level
+        whose median is within `sqrt(knee_factor)` of the unloaded one up to `above`.
+        """
+        baseline = self._baseline()
+        onset = max((load for load, level in self.levels.items()
+                     if load < above and level.histogram.value_at_percentile(50) <= math.sqrt(self.knee_factor) * baseline),
+                    default=self.low)
+        for k in range(self.dense_points):
+            load = self._round(onset * (above / onset) ** ((k + 1) / (self.dense_points + 1)))
+            if all(abs(load - done) > self.resolution * load for done in self.levels):
+                self.measure(load)
+
+
+class SweepResult:
+    """The levels of a sweep, ordered by load, and the knee they bracket."""
+
+    def __init__(self, axis, levels, below, above):
+        self.axis = axis
+        self.levels = dict(sorted(levels.items()))
+        # The highest load below the knee and the lowest one past it (None if never saturated).
+        self.below, self.above = below, above
+
+    @property
+    def duration(self):
+        """Seconds of load generated over the whole sweep."""
+        return sum(level.duration for level in self.levels.values())
+
+    @staticmethod
+    def fixed_duration():
+        """Seconds of load that `figure8ab.sh` generates for one curve."""
+        return len(FIXED_CONNECTIONS) * FIXED_DURATION
+
+    def curve(self):
+        """
+        Returns:
+            list: `(load, throughput, latency)` per level, with latency a percentile -> ms dict.
+        """
+        return [(load, level.throughput, level.latency) for load, level in self.levels.items()]
+
+    def to_dict(self):
+        return {
+            "axis": self.axis,
+            "knee": {"below": self.below, "above": self.above},
+            "duration": self.duration,
+            "levels": [dict(level._asdict(), load=load, histogram=level.histogram.to_dict(),
+                            latency={str(p): ms for p, ms in level.latency.items()})
+                       for load, level in self.levels.items()],
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def read(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        levels = {}
+        for entry in data["levels"]:
+            load = entry.pop("load")
+            entry["histogram"] = Histogram.from_dict(entry["histogram"])
+            entry["latency"] = {float(p): ms for p, ms in entry["latency"].items()}
+            levels[load] = Level(**entry)
+        return cls(data["axis"], levels, data["knee"]["below"], data["knee"]["above"])
@@ -0,0 +1,363 @@
+import datetime
+import functools
+import os
+import random
+
+# `charset` and `decset` of the Lua scripts. `decRandom` draws from all but the last digit.
+CHARSET = "qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM1234567890"
+DECSET = "123456789"
+
+
+def _string(rng, length):
+    """`stringRandom(length)`."""
+    return "".join(rng.choices(CHARSET, k=length))
+
+
+def _decimal(rng, length):
+    """`decRandom(length)`."""
+    return "".join(rng.choices(DECSET, k=length))
+
+
+def _float(rng, low, high):
+    """`random_float(low, high)`, printed the way Lua converts numbers to strings."""
+    return f"{low + (high - low) * rng.random():.14g}"
+
+
+def _date(rng, start, end):
+    """`os.date("%Y-%m-%d", math.random(os.time(start), os.time(end)))` (`os.time` defaults to noon)."""
+    start, end = datetime.datetime(*start, 12), datetime.datetime(*end, 12)
+    seconds = rng.randint(0, int((end - start).total_seconds()))
+    return (start + datetime.timedelta(seconds=seconds)).strftime("%Y-%m-%d")
+
+
+# --- social_network ---
+
+def _post_text(rng, user_index):
+    """The text of `compose-post.lua`: 256 characters, then user mentions and URLs."""
+    parts = [_string(rng, 256)]
+    for _ in range(rng.randint(0, 5) + 1):
+        mention = rng.randint(1, 962)
+        while mention == user_index:
+            mention = rng.randint(1, 962)
+        parts.append(f" @username_{mention}")
+    for _ in range(rng.randint(0, 5) + 1):
+        parts.append(" http://" + _string(rng, 64))
+    return "".join(parts)
+
+
+def compose_post(rng, state, max_user=999):
+    user_index = rng.randint(1, max_user)
+    text = _post_text(rng, user_index)
+    media = rng.randint(0, 4) + 1
+    media_ids = ",".join(_decimal(rng, 10) for _ in range(media))
+    media_types = ",".join('"png"' for _ in range(media))
+    return (f'{{"username":"username_{user_index}","user_id":{user_index},"text":"{text}",'
+            f'"media_ids":[{media_ids}],"media_types":[{media_types}],"post_type":"POST"}}')
+
+
+def text_service(rng, state):
+    return f'{{"text":"{_post_text(rng, rng.randint(1, 962))}"}}'
+
+
+def empty_message(rng, state):
+    return '{"msg":"", "err":""}'
+
+
+def read_timeline(rng, state):
+    return f'{{"user_id":{rng.randint(1, 999)},"start":0,"stop":1}}'
+
+
+def register_user(rng, state, with_id=False):
+    state["counter"] += 1
+    user_index = state["counter"] % 1000
+    body = (f'{{"first_name":"{_string(rng, 8)}","last_name":"{_string(rng, 8)}",'
+            f'"username":"username_{user_index}","password":"123456"')
+    return body + (f',"user_id":{user_index}}}' if with_id else "}")
+
+
+def social_graph_follow(rng, state, with_username=False):
+    user, followee = rng.randint(1, 999), rng.randint(1, 999)
+    if with_username:
+        return f'{{"user_name":"username_{user}","followee_name":"username_{followee}"}}'
+    return f'{{"user_id":{user},"followee_id":{followee}}}'
+
+
+def social_graph_get_followers(rng, state):
+    return f'{{"user_id":{rng.randint(1, 65535)}}}'
+
+
+def url_shorten(rng, state):
+    urls = ",".join(f'"http://{_string(rng, 64)}"' for _ in range(rng.randint(1, 4) + 1))
+    return f'{{"urls":[{urls}]}}'
+
+
+def user_mention(rng, state):
+    # The script builds `{"usernames": [...]}` but then sends the bare array.
+    return "[" + ",".join(f'"username_{rng.randint(1, 962)}"' for _ in range(rng.randint(1, 4) + 1)) + "]"
+
+
+def write_home_timeline(rng, state):
+    post_id, user_id, timestamp = rng.randint(1, 65535), rng.randint(1, 962), rng.randint(1, 100000000)
+    mentions = ",".join(str(rng.randint(1, 962)) for _ in range(rng.randint(0, 5) + 1))
+    return f'{{"post_id":{post_id},"user_id":{user_id},"timestamp":{timestamp},"user_mentions_id":[{mentions}]}}'
+
+
+# --- hotel_reservation ---
+
+def nearby_cinema(rng, state, hotels=500):
+    return f'{{"hotel_id":"hotel_{rng.randint(0, hotels - 1)}"}}'
+
+
+def nearby_cinema_top(rng, state):
+    return '{"num":300000}'
+
+
+def register_hotel_user(rng, state):
+    state["counter"] += 1
+    return f'{{"username":"username_{state["counter"] % 1000}","password":"123456"}}'
+
+
+def reservation_handler(rng, state):
+    hotel, user, rooms = rng.randint(1, 99), rng.randint(1, 999), rng.randint(1, 5)
+    in_date, out_date = _date(rng, (2024, 11, 1), (2024, 11, 30)), _date(rng, (2024, 12, 1), (2024, 12, 31))
+    return (f'{{"customer_name":"{_string(rng, 15)}","username":"username_{user}","password":"123456",'
+            f'"hotel_id":"hotel_{hotel}","in_date":"{in_date}","out_date":"{out_date}","room_number":{rooms}}}')
+
+
+def search_handler(rng, state):
+    lat, lon = _float(rng, 32, 35), _float(rng, 116, 119)
+    in_date, out_date = _date(rng, (2024, 11, 5), (2024, 11, 10)), _date(rng, (2024, 11, 11), (2024, 11, 15))
+    return f'{{"latitude":{lat},"longitude":{lon},"in_date":"{in_date}","out_date":"{out_date}"}}'
+
+
+def set_capacity(rng, state):
+    state["counter"] += 1
+    return f'{{"hotel_id":"hotel_{state["counter"] % 1000}","capacity":{rng.randint(200, 300)}}}'
+
+
+def set_cinema(rng, state):
+    state["counter"] += 1
+    lat, lon = _float(rng, 32, 35), _float(rng, 116, 119)
+    return (f'{{"latitude":{lat},"longitude":{lon},"cinema_id":"cinema_{state["counter"] % 500}",'
+            f'"cinema_name":"{_string(rng, 10)}","cinema_type":"{_string(rng, 5)}"}}')
+
+
+def set_hotel_point(rng, state):
+    state["counter"] += 1
+    lat, lon = _float(rng, 32, 35), _float(rng, 116, 119)
+    return f'{{"latitude":{lat},"longitude":{lon},"id":"hotel_{state["counter"] % 100}"}}'
+
+
+def set_profile(rng, state):
+    state["counter"] += 1
+    hotel = state["counter"] % 100
+    name, phone, description = _string(rng, 15), _string(rng, 12), _string(rng, 20)
+    lat, lon = _float(rng, 32, 35), _float(rng, 116, 119)
+    images = ",".join(f'{{"url":"http://{_string(rng, 10)}.png","default":false}}'
+                      for _ in range(rng.randint(0, 4) + 1))
+    address = (f'{{"street_number":"{_string(rng, 5)}","street_name":"{_string(rng, 8)}",'
+               f'"city":"{_string(rng, 10)}","state":"{_string(rng, 2)}","country":"{_string(rng, 10)}",'
+               f'"postal_code":"{_string(rng, 6)}","latitude":{lat},"longitude":{lon}}}')
+    return (f'{{"hotel_id":"hotel_{hotel}","name":"{name}","phone_number":"{phone}",'
+            f'"description":"{description}","address":{address},"images":[{images}]}}')
+
+
+def set_rate(rng, state):
+    state["counter"] += 1
+    total_rate = _float(rng, 200, 600)
+    room_type = (f'{{"bookable_rate":{_float(rng, 100, 500)},"total_rate":{_float(rng, 200, 600)},'
+                 f'"total_rate_inclusive":{total_rate},"code":"{_string(rng, 8)}",'
+                 f'"currency":"{_string(rng, 3)}","room_description":"{_string(rng, 20)}"}}')
+    return (f'{{"hotel_id":"hotel_{state["counter"] % 100}","code":"{_string(rng, 5)}",'
+            f'"in_date":"2023-01-01","out_date":"2025-12-31","room_type":{room_type}}}')
+
+
+# --- media_microservice ---
+
+def compose_review(rng, state, user_id=False):
+    state["counter"] += 1
+    user, title, rating = rng.randint(1, 999), rng.randint(1, 999), rng.randint(1, 5)
+    who = f'"user_id":{user}' if user_id else f'"username":"username_{user}"'
+    return (f'{{"req_id":{state["counter"]},"title":"movie_{title}","rating":{rating},{who},'
+            f'"password":"123456","text":"{_string(rng, 100)}"}}')
+
+
+def page_service(rng, state):
+    return f'{{"movie_id":"tt{rng.randint(1, 999) + 5999000}","review_start":0,"review_stop":1}}'
+
+
+def register_movie_id(rng, state):
+    state["counter"] += 1
+    index = state["counter"] % 1000
+    return f'{{"movie_id":"tt{index + 5999000}","title":"movie_{index}"}}'
+
+
+def register_media_user(rng, state, with_id=False):
+    state["counter"] += 1
+    user_index = state["counter"] % 1000
+    names = f'"first_name":"{_string(rng, 8)}","last_name":"{_string(rng, 8)}","password":"123456"}}'
+    if with_id:
+        return f'{{"user_id":{user_index},"username":"user_{user_index}",' + names
+    return f'{{"username":"username_{user_index}",' + names
+
+
+def write_cast_info(rng, state):
+    state["counter"] += 1
+    return (f'{{"cast_info_id":{state["counter"] % 1000},"name":"{_string(rng, 15)}","gender":true,'
+            f'"intro":"{_string(rng, 50)}"}}')
+
+
+def write_movie_info(rng, state):
+    state["counter"] += 1
+    index = state["counter"] % 1000
+    plot_id, avg_rating, num_rating = rng.randint(1, 999), _float(rng, 0, 5), rng.randint(20, 99999)
+    casts_n, thumbnails_n, photos_n, videos_n = (rng.randint(1, 10), rng.randint(1, 4),
+                                                 rng.randint(1, 4), rng.randint(1, 4))
+    casts = ",".join(f'{{"cast_id":{rng.randint(1, 999)},"character":"{_string(rng, 10)}",'
+                     f'"cast_info_id":{rng.randint(1, 999)}}}' for _ in range(casts_n + 1))
+    thumbnails = ",".join(f'"{_string(rng, 10)}"' for _ in range(thumbnails_n + 1))
+    photos = ",".join(f'"{_string(rng, 8)}"' for _ in range(photos_n + 1))
+    videos = ",".join(f'"{_string(rng, 8)}"' for _ in range(videos_n + 1))
+    return (f'{{"movie_id":"tt{index + 5999000}","title":"movie_{index}","plot_id":{plot_id},'
+            f'"avg_rating":"{avg_rating}","num_rating":{num_rating},"casts":[{casts}],'
+            f'"thumbnail_ids":[{thumbnails}],"photo_ids":[{photos}],"video_ids":[{videos}]}}')
+
+
+def write_plot(rng, state):
+    state["counter"] += 1
+    return f'{{"plot_id":{state["counter"] % 1000},"plot":"{_string(rng, 256)}"}}'
+
+
+def compose_and_upload(rng, state, suffix=""):
+    """Cycles through the four functions of compose-review, one `req_id` per round."""
+    user, text, rating, title = rng.randint(1, 999), _string(rng, 256), rng.randint(0, 5), rng.randint(1, 999)
+    state["count"] += 1
+    req_id = state["request_id"]
+    step = state["count"] % 4
+    if step == 1:
+        return f"/unique-id-service{suffix}", str(req_id)
+    if step == 2:
+        return f"/text-service{suffix}", f'{{"req_id":{req_id},"text":"{text}"}}'
+    if step == 3:
+        return f"/upload-user-with-username{suffix}", f'{{"username":"username_{user}","req_id":{req_id}}}'
+    state["request_id"] += 1
+    return f"/upload-movie-id{suffix}", f'{{"title":"movie_{title}","rating":{rating},"req_id":{req_id}}}'
+
+
+# Script name (`lua_files/<name>.lua`) -> (body function, initial script state). A body
+# function returns the JSON body for the path `/<name>`, or a `(path, body)` tuple.
+TEMPLATES = {
+    # social_network
+    "compose-post": (compose_post, {}),
+    "compose-post-2": (compose_post, {}),
+    "container-merge-compose-post": (compose_post, {}),
+    "compose-post-merged": (functools.partial(compose_post, max_user=962), {}),
+    "text-service": (text_service, {}),
+    "text-service-merged": (text_service, {}),
+    "noop": (empty_message, {}),
+    "unique-id-service": (empty_message, {}),
+    "read-home-timeline": (read_timeline, {}),
+    "read-home-timeline-merged": (read_timeline, {}),
+    "register-user": (register_user, {"counter": 0}),
+    "register-user-with-id": (functools.partial(register_user, with_id=True), {"counter": 0}),
+    "social-graph-follow": (social_graph_follow, {}),
+    "social-graph-follow-with-username": (functools.partial(social_graph_follow, with_username=True), {}),
+    "social-graph-follow-with-username-merged": (functools.partial(social_graph_follow, with_username=True), {}),
+    "social-graph-get-followers": (social_graph_get_followers, {}),
+    "url-shorten-service": (url_shorten, {}),
+    "user-mention-service": (user_mention, {}),
+    "write-home-timeline": (write_home_timeline, {}),
+    "write-home-timeline-merged": (write_home_timeline, {}),
+    # hotel_reservation
+    "nearby-cinema": (functools.partial(nearby_cinema, hotels=100), {}),
+    "nearby-cinema-merged": (functools.partial(nearby_cinema, hotels=100), {}),
+    "nearby-cinema-parallel": (nearby_cinema, {}),
+    "nearby-cinema-parallel-merged": (nearby_cinema, {}),
+    "nearby-cinema-serial": (nearby_cinema, {}),
+    "nearby-cinema-serial-merged": (nearby_cinema, {}),
+    "nearby-cinema-top": (nearby_cinema_top, {}),
+    "nearby-cinema-top-2": (nearby_cinema_top, {}),
+    "nearby-cinema-top-merged": (nearby_cinema_top, {}),
+    "hotel_reservation/register-user": (register_hotel_user, {"counter": 0}),
+    "reservation-handler": (reservation_handler, {}),
+    "reservation-handler-merged": (reservation_handler, {}),
+    "search-handler": (search_handler, {}),
+    "search-handler-merged": (search_handler, {}),
+    "set-capacity": (set_capacity, {"counter": 0}),
+    "set-cinema": (set_cinema, {"counter": 0}),
+    "set-hotel-point": (set_hotel_point, {"counter": 0}),
+    "set-profile": (set_profile, {"counter": 0}),
+    "set-rate": (set_rate, {"counter": 0}),
+    # media_microservice
+    "compose-review": (compose_review, {"counter": 21000}),
+    "wisefuse-compose-review": (compose_review, {"counter": 21000}),
+    "compose-review-merged": (compose_review, {"counter": 199000}),
+    "compose-review-user-id": (functools.partial(compose_review, user_id=True), {"counter": 2000}),
+    "compose-review-user-id-merged": (functools.partial(compose_review, user_id=True), {"counter": 2000}),
+    "page-service": (page_service, {}),
+    "page-service-merged": (page_service, {}),
+    "read-user-review": (read_timeline, {}),
+    "read-user-review-merged": (read_timeline, {}),
+    "register-movie-id": (register_movie_id, {"counter": 0}),
+    "media_microservice/register-user": (register_media_user, {"counter": 0}),
+    "media_microservice/register-user-with-id": (functools.partial(register_media_user, with_id=True), {"counter": 0}),
+    "write-cast-info": (write_cast_info, {"counter": 0}),
+    "write-movie-info": (write_movie_info, {"counter": 0}),
+    "write-plot": (write_plot, {"counter": 0}),
+    "compose-and-upload": (compose_and_upload, {"count": 0, "request_id": 77891}),
+    "compose-and-upload-merged": (functools.partial(compose_and_upload, suffix="-merged"),
+                                  {"count": 0, "request_id": 77891}),
+}
+
+
+def template_name(script):
+    """
+    The `TEMPLATES` key of a wrk2 script path or name. Scripts whose name is used by more
+    than one app (e.g. `register-user`) are keyed by `<app>/<name>`.
+    """
+    name = os.path.splitext(os.path.basename(script))[0]
+    app = os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(script))))
+    if f"{app}/{name}" in TEMPLATES:
+        return f"{app}/{name}"
+    if name not in TEMPLATES:
+        raise KeyError(f"No request template for {script!r}.")
+    return name
+
+
+class RequestGenerator:
+    """
+    Generates the HTTP requests of a wrk2 Lua script natively.
+
+    Requests are formatted like `wrk.format`: `POST <path> HTTP/1.1` with `Host`,
+    `Content-Type: application/json`, a random 32-digit hex `Req-Id` (as the Quilt wrk2 fork
+    passes to `request(req_id)`) and `Content-Length`. Script state such as `counter` is
+    per generator, like the per-thread Lua state of wrk2.
+    """
+
+    def __init__(self, script, host, seed=None):
+        """
+        Args:
+            script (str): A `TEMPLATES` name or a path to one of the `lua_files`.
+            host (str): The `Host` header, e.g. `127.0.0.1:8888`.
+            seed (int, optional): Seed of the generator's random numbers.
+        """
+        self.name = script if script in TEMPLATES else template_name(script)
+        self.body, state = TEMPLATES[self.name]
+        self.state = dict(state)
+        self.path = "/" + self.name.split("/")[-1]
+        self.host = host
+        self.rng = random.Random(seed)
+
+    def next_body(self):
+        """Returns `(path, body)` of the next request."""
+        body = self.body(self.rng, self.state)
+        return body if isinstance(body, tuple) else (self.path, body)
+
+    def __next__(self):
+        path, body = self.next_body()
+        body = body.encode()
+        return (f"POST {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                f"Req-Id: {self.rng.getrandbits(128):032x}\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+
+    def __iter__(self):
+        return self
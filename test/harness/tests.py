@@ -0,0 +1,496 @@
+import asyncio
+import collections
+import contextlib
+import glob
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+from harness import (Curve, CurveComparison, DistributedLoad, Histogram, KeyDBClient, LoadGenerator, MemcachedClient,
+                     RequestGenerator, ResultsTable, StorageReset, SweepController, TEMPLATES, find_functions,
+                     format_output, local_nodes, parse_output)
+from harness.__main__ import main
+from harness.wrk2 import Snapshot
+
+HARNESS = os.path.dirname(os.path.abspath(__file__))
+LUA_FILES = os.path.join(HARNESS, os.pardir, "wrk2_fission", "*", "lua_files", "*.lua")
+
+
+class StandIn:
+    """A local HTTP server that answers every request with a RetMsg after `delay` seconds."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._serve, args=(ready,), daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def _serve(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = int(next(line.split(b":")[1] for line in head.split(b"\r\n")
+                                  if line.lower().startswith(b"content-length")))
+                body = await reader.readexactly(length)
+                self.requests.append((head.split(b" ")[1].decode(), body))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                reply = b'{"msg":"ok","err":""}'
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s"
+                             % (len(reply), reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class FakeRunner:
+    """A closed system with `capacity` requests per second and `base` µs of latency."""
+
+    def __init__(self, capacity, base=2000, seed=0):
+        self.capacity, self.base = capacity, base
+        self.rng = np.random.default_rng(seed)
+
+    def run(self, rate, connections, max_duration):
+        throughput = min(connections / (self.base / 1e6), self.capacity, rate)
+        latency = max(self.base, connections / self.capacity * 1e6)
+        histogram, uncorrected = Histogram(), Histogram()
+        elapsed = 0
+        while elapsed < max_duration:
+            elapsed += 30
+            samples = self.rng.exponential(latency, int(throughput * 30)).astype(int) + 1
+            histogram.record(samples)
+            uncorrected.record(samples)
+            yield Snapshot(elapsed, histogram, uncorrected, histogram.total, throughput, 0)
+
+
+class StoreStandIn:
+    """In-memory KeyDB (RESP) and memcached (text protocol) servers with the commands `StorageReset` uses."""
+
+    def __init__(self):
+        self.keydb = collections.defaultdict(dict)
+        self.memcached = {}
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._serve, args=(ready,), daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def _serve(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.servers = [self.loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", 0))
+                        for handle in (self._resp, self._text)]
+        self.keydb_address, self.memcached_address = (
+            "127.0.0.1:%d" % server.sockets[0].getsockname()[1] for server in self.servers)
+        ready.set()
+        self.loop.run_forever()
+
+    async def _resp(self, reader, writer):
+        db = 0
+        try:
+            while True:
+                args = []
+                for _ in range(int((await reader.readline())[1:])):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                command, args = args[0].upper().decode(), args[1:]
+                data = self.keydb[db]
+                if command in ("AUTH", "FLUSHALL", "SET", "RESTORE", "SELECT"):
+                    if command == "FLUSHALL":
+                        self.keydb.clear()
+                    elif command == "SET":
+                        data[args[0]] = args[1]
+                    elif command == "RESTORE":
+                        data[args[0]] = args[2][len(b"dump:"):]
+                    elif command == "SELECT":
+                        db = int(args[0])
+                    writer.write(b"+OK\r\n")
+                elif command == "PING":
+                    writer.write(b"+PONG\r\n")
+                elif command in ("PTTL", "DEL"):
+                    writer.write(b":%d\r\n" % (-1 if command == "PTTL" else int(data.pop(args[0], None) is not None)))
+                elif command in ("GET", "DUMP", "INFO"):
+                    if command == "INFO" and args[0] == b"keyspace":
+                        value = "".join(f"db{i}:keys={len(keys)},expires=0\r\n" for i, keys in self.keydb.items() if keys)
+                        value = ("# Keyspace\r\n" + value).encode()
+                    elif command == "INFO":
+                        value = b"loading:0\r\nconnected_slaves:0\r\n"
+                    else:
+                        value = data.get(args[0])
+                        value = value and (b"dump:" + value if command == "DUMP" else value)
+                    writer.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+                elif command == "SCAN":
+                    writer.write(b"*2\r\n$1\r\n0\r\n*%d\r\n" % len(data)
+                                 + b"".join(b"$%d\r\n%s\r\n" % (len(key), key) for key in data))
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        # `close` cancels the handlers; one that ends cancelled makes asyncio log a traceback.
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ValueError, ConnectionError):
+            writer.close()
+
+    async def _text(self, reader, writer):
+        try:
+            while True:
+                command, *args = (await reader.readuntil(b"\r\n"))[:-2].decode().split(" ")
+                if command == "set":
+                    self.memcached[args[0]] = (int(args[1]), (await reader.readexactly(int(args[3]) + 2))[:-2])
+                    if args[-1] != "noreply":
+                        writer.write(b"STORED\r\n")
+                elif command == "get":
+                    for key in args:
+                        if key in self.memcached:
+                            flags, value = self.memcached[key]
+                            writer.write(b"VALUE %s %d %d\r\n%s\r\n" % (key.encode(), flags, len(value), value))
+                    writer.write(b"END\r\n")
+                elif command == "lru_crawler":
+                    writer.write(b"".join(b"key=%s exp=-1 la=0 cas=0 fetch=no cls=1 size=1\r\n"
+                                          % urllib.parse.quote(key).encode() for key in self.memcached) + b"END\r\n")
+                elif command == "flush_all":
+                    self.memcached.clear()
+                    writer.write(b"OK\r\n")
+                elif command == "stats":
+                    writer.write(b"STAT curr_items %d\r\nEND\r\n" % len(self.memcached))
+                elif command == "version":
+                    writer.write(b"VERSION 1.6.0\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            writer.close()
+
+    def close(self):
+        async def shutdown():
+            for server in self.servers:
+                server.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+# A function in the Fission binary environment: the argument on stdin, a RetMsg on stdout. It calls
+# `callee` (if any) through the router the way `FissionRPC::make_rpc` does.
+FUNCTION = """#!{python}
+import json, os, sys, urllib.request
+arg = sys.stdin.readline()
+msg = "{name}(" + json.loads(arg)["text"] + ")"
+if "{callee}":
+    req = urllib.request.Request(os.environ["router-url"] + "{callee}", json.dumps({{"text": msg}}).encode())
+    msg = json.loads(urllib.request.urlopen(req).read())["msg"]
+print(json.dumps({{"msg": msg, "err": ""}}))
+sys.exit({status})
+"""
+
+
+def write_function(directory, name, callee="", status=0):
+    os.makedirs(os.path.join(directory, name))
+    path = os.path.join(directory, name, "function")
+    with open(path, "w") as f:
+        f.write(FUNCTION.format(python=sys.executable, name=name, callee=callee, status=status))
+    os.chmod(path, 0o755)
+
+
+class RouterProcess:
+    """Runs `python3 -m harness router` on a free port (in its own process, so that forked load
+    generator workers do not hold the pipes of its function processes open)."""
+
+    def __init__(self, *args):
+        self.proc = subprocess.Popen([sys.executable, "-m", "harness", "router", "--listen", "127.0.0.1:0", *args],
+                                     cwd=os.path.dirname(HARNESS), stdout=subprocess.PIPE, text=True)
+        self.url = self.proc.stdout.readline().split()[1]
+
+    def stats(self):
+        return json.loads(urllib.request.urlopen(self.url + "_stats").read())
+
+    def close(self):
+        self.proc.send_signal(signal.SIGINT)
+        return self.proc.communicate()[0]
+
+
+class TestHarness(unittest.TestCase):
+
+    def test_histogram(self):
+        """Percentiles match NumPy within the 3-digit precision, and merging is lossless."""
+        rng = np.random.default_rng(0)
+        values = rng.exponential(5000, 100000).astype(np.int64) + 1
+        h = Histogram()
+        h.record(values)
+        self.assertEqual(h.total, len(values))
+        for p in (50, 90, 99, 99.9):
+            self.assertAlmostEqual(h.value_at_percentile(p), np.percentile(values, p), delta=np.percentile(values, p) * 1e-3 + 1)
+        self.assertAlmostEqual(h.mean(), values.mean(), delta=values.mean() * 1e-3)
+
+        low, high = Histogram(), Histogram()
+        low.record(values[:50000])
+        high.record(values[50000:])
+        low.add(high)
+        np.testing.assert_array_equal(low.counts, h.counts)
+        self.assertEqual((low.min, low.max), (h.min, h.max))
+        np.testing.assert_array_equal(Histogram.from_dict(json.loads(json.dumps(h.to_dict()))).counts, h.counts)
+        lo, hi = h.percentile_bounds(99)
+        self.assertLess(lo, h.value_at_percentile(99) + 1)
+        self.assertGreater(hi, h.value_at_percentile(99) - 1)
+
+    def test_wrk2_output_round_trip(self):
+        """A report in wrk2's format parses back to the same histograms and counts."""
+        rng = np.random.default_rng(1)
+        corrected, uncorrected = Histogram(), Histogram()
+        corrected.record(rng.exponential(8000, 20000).astype(np.int64) + 100)
+        uncorrected.record(rng.exponential(3000, 20000).astype(np.int64) + 100)
+        report = format_output("http://127.0.0.1:8888", 1, 25, 480.0, 20000, corrected, uncorrected,
+                               errors={"read": 2, "timeout": 1}, non_2xx=3, bytes_read=5 << 20)
+        result = parse_output(report.splitlines())
+        np.testing.assert_array_equal(result.corrected.counts, corrected.counts)
+        np.testing.assert_array_equal(result.uncorrected.counts, uncorrected.counts)
+        self.assertEqual((result.requests, result.duration, result.connections), (20000, 480.0, 25))
+        self.assertEqual((result.errors["read"], result.errors["timeout"], result.non_2xx), (2, 1, 3))
+        self.assertEqual(result.bytes, 5 << 20)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            app = os.path.join(tmp, "social_network")
+            os.makedirs(app)
+            for connections in (5, 1):
+                with open(os.path.join(app, f"output_compose-post-async_{connections}.log"), "w") as f:
+                    f.write(report.replace("and 25 connections", f"and {connections} connections"))
+            table = ResultsTable.from_logs([tmp], workers=2)
+            table.save(os.path.join(tmp, "results.npz"))
+            table = ResultsTable.load(os.path.join(tmp, "results.npz")).select(mode="async").sort("connections")
+        self.assertEqual(table["connections"].tolist(), [1, 5])
+        self.assertEqual(table["workflow"].tolist(), ["compose-post"] * 2)
+        self.assertAlmostEqual(table["p99"][0], corrected.value_at_percentile(99) / 1000.0)
+        self.assertAlmostEqual(table.percentile(99.5, corrected=False)[1], uncorrected.value_at_percentile(99.5) / 1000.0)
+
+    def test_templates(self):
+        """Every wrk2 script has a native template producing valid JSON for its path."""
+        scripts = sorted(glob.glob(LUA_FILES))
+        self.assertEqual(len(scripts), len(TEMPLATES))
+        for script in scripts:
+            generator = RequestGenerator(script, "127.0.0.1:8888", seed=0)
+            for _ in range(5):
+                path, body = generator.next_body()
+                json.loads(body)
+            if "compose-and-upload" not in script:
+                self.assertEqual(path, "/" + os.path.splitext(os.path.basename(script))[0])
+        request = next(RequestGenerator("register-user-with-id", "127.0.0.1:8888", seed=0)).decode()
+        head, body = request.split("\r\n\r\n")
+        self.assertIn("POST /register-user-with-id HTTP/1.1", head)
+        self.assertIn(f"Content-Length: {len(body)}", head)
+        self.assertEqual(json.loads(body)["user_id"], 1)
+
+    def test_compare_flags_regressions(self):
+        """A candidate whose latency grows sooner is flagged; a rerun of the baseline is not."""
+        def write_runs(directory, mode, knee, seed):
+            rng = np.random.default_rng(seed)
+            os.makedirs(directory, exist_ok=True)
+            for connections in (1, 5, 10, 20, 40):
+                # The median doubles past the knee, and throughput stops growing there.
+                median = 2000 * (1 + max(connections - knee, 0) / 5)
+                h = Histogram()
+                h.record(rng.lognormal(np.log(median), 0.3, 20000).astype(np.int64))
+                throughput = 1000 * min(connections, knee)
+                with open(os.path.join(directory, f"output_compose-post-{mode}_{connections}.log"), "w") as f:
+                    f.write(format_output("http://127.0.0.1:8888", 1, connections, 60.0, throughput * 60, h, h))
+            # The warm-up run, with one connection and no level in its name.
+            with open(os.path.join(directory, "output_compose-post.log"), "w") as f:
+                f.write(format_output("http://127.0.0.1:8888", 1, 1, 60.0, 60000, h, h))
+
+        with tempfile.TemporaryDirectory() as d:
+            base, rerun, merged = (os.path.join(d, name, "social_network") for name in ("base", "rerun", "merged"))
+            write_runs(base, "sync", knee=10, seed=0)
+            write_runs(rerun, "sync", knee=10, seed=1)
+            write_runs(merged, "merged", knee=4, seed=2)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(main(["compare", base, rerun]), 0)
+                self.assertEqual(main(["compare", base, merged, "--out", os.path.join(d, "report.json")]), 1)
+            with open(os.path.join(d, "report.json")) as f:
+                report, = json.load(f)
+            self.assertEqual(report["knee"], {"baseline": 20.0, "candidate": 10.0, "verdict": "regression"})
+            self.assertEqual(report["throughput"]["verdict"], "regression")
+            verdicts = {(s["baseline_load"], s["percentile"]): s["verdict"] for s in report["shifts"]}
+            self.assertEqual(verdicts[1.0, 50], "unchanged")
+            self.assertEqual(verdicts[10.0, 50], "regression")
+            self.assertEqual(verdicts[40.0, 99], "regression")
+
+    def test_compare_knee_needs_significant_move(self):
+        """A knee that moves by one close level is a regression only if the median shifted there."""
+        def curve(medians, seed):
+            rng = np.random.default_rng(seed)
+            histograms = []
+            for median in medians:
+                h = Histogram()
+                h.record(rng.lognormal(np.log(median), 0.3, 20000).astype(np.int64))
+                histograms.append(h)
+            loads = np.arange(10.0, 10.0 + len(medians))
+            return Curve(loads, 1000 * loads, np.full(len(medians), 60.0), histograms)
+
+        # Loads 10-13: the baseline is past its knee at 12, and just below twice the unloaded median at 11.
+        baseline = curve([2000, 3960, 4200, 5000], seed=0)
+        noise = CurveComparison(baseline, curve([2000, 4040, 4200, 5000], seed=1))
+        self.assertEqual((noise.baseline_knee, noise.candidate_knee), (12.0, 11.0))
+        self.assertEqual(noise.knee, "unchanged")
+        self.assertEqual(CurveComparison(baseline, curve([2000, 4040, 4200, 5000], seed=1), knee_tol=0.0).knee,
+                         "regression")
+        # Without p50 among the compared percentiles, the median shift still confirms the knee.
+        real = CurveComparison(baseline, curve([2000, 5000, 5000, 5000], seed=1), percentiles=(99,))
+        self.assertEqual((real.candidate_knee, real.knee), (11.0, "regression"))
+        self.assertEqual({s.percentile for s in real.shifts}, {99})
+
+    def test_sweep_finds_knee(self):
+        """The sweep brackets the knee of a system that saturates at 60k requests/s."""
+        controller = SweepController(FakeRunner(60000), low=1, high=350, min_duration=60)
+        result = controller.sweep()
+        # Latency doubles at 2 x capacity x base latency = 240 connections.
+        self.assertLessEqual(result.below, 240)
+        self.assertGreater(result.above, 240)
+        self.assertLess(result.above - result.below, 0.1 * result.above + 1)
+        self.assertLess(result.duration, result.fixed_duration() / 5)
+        self.assertTrue(all(level.converged for level in result.levels.values()))
+
+    def test_load_generator(self):
+        """The Python load generator offers a constant rate and corrects for coordinated omission."""
+        server = StandIn(delay=0.005)
+        try:
+            generator = LoadGenerator(server.url, "compose-post", processes=2, interval=0.5, startup=0.5)
+            snapshots = list(generator.run(200, 4, 2.0))
+            last = snapshots[-1]
+            self.assertGreater(len(snapshots), 2)
+            self.assertAlmostEqual(last.requests, 400, delta=40)
+            self.assertEqual(last.errors, 0)
+            self.assertGreaterEqual(last.uncorrected.value_at_percentile(50), 5000)
+            path, body = server.requests[0]
+            self.assertEqual(path, "/compose-post")
+            self.assertIn("username_", json.loads(body)["username"])
+
+            # 1 connection with 50 ms of service time can only do 20 of the 100 requests/s it is asked for:
+            # the corrected latency keeps growing with the backlog, the uncorrected one does not.
+            server.delay = 0.05
+            last = LoadGenerator(server.url, "noop", startup=0.5).measure(100, 1, 2.0)
+            self.assertLess(last.uncorrected.value_at_percentile(50), 80000)
+            self.assertGreater(last.histogram.value_at_percentile(90), 1000000)
+        finally:
+            server.close()
+
+    def test_distributed_load(self):
+        """Local nodes start together, share the rate and their histograms add up to one report."""
+        server = StandIn(delay=0.002)
+        try:
+            load = DistributedLoad(server.url, "compose-post", local_nodes(3), interval=0.5, startup=0.5)
+            snapshots = list(load.run(300, 5, 2.0))
+            last = snapshots[-1]
+            self.assertGreater(len(snapshots), 2)
+            self.assertAlmostEqual(last.requests, 600, delta=60)
+            self.assertEqual(last.histogram.total, last.requests)
+            self.assertEqual(last.errors, 0)
+            self.assertEqual(len(server.requests), last.requests)
+            self.assertEqual(sorted(load.offsets), ["local0", "local1", "local2"])
+            self.assertTrue(all(abs(offset) < 0.05 for offset in load.offsets.values()))
+            # The nodes use different seeds, so their requests differ.
+            self.assertEqual(len({body for _, body in server.requests}), len(server.requests))
+        finally:
+            server.close()
+
+    def test_storage_reset(self):
+        """A snapshot of KeyDB and memcached is restored exactly, whatever the load level changed."""
+        stores = StoreStandIn()
+        try:
+            keydb = KeyDBClient(stores.keydb_address)
+            for i in range(2500):
+                keydb.execute("SET", f"user:{i}", f"payload {i}")
+            # A DUMP payload may contain anything, including what looks like the start of a RESP command.
+            keydb.execute("SET", "binary", b"\r\n*3\r\n$3\r\n\x00\xff")
+            memcached = MemcachedClient(stores.memcached_address)
+            memcached.execute("set post:1 7 0 5\r\nhello")
+            memcached.execute("set post:2 0 0 3\r\nbye")
+            saved = {db: dict(keys) for db, keys in stores.keydb.items()}, dict(stores.memcached)
+
+            with tempfile.TemporaryDirectory() as d:
+                reset = StorageReset(d, keydb=stores.keydb_address, memcached=[stores.memcached_address])
+                description = reset.snapshot()
+                self.assertEqual(description["keydb"]["databases"], {"0": 2501})
+                self.assertEqual(description["memcached"][0]["items"], 2)
+
+                keydb.execute("SET", "user:1", "changed")
+                keydb.execute("DEL", "user:2")
+                keydb.execute("SET", "new", "key")
+                memcached.execute("flush_all")
+                reset.restore()
+                self.assertEqual(({db: dict(keys) for db, keys in stores.keydb.items() if keys},
+                                  dict(stores.memcached)), saved)
+            keydb.close()
+            memcached.close()
+        finally:
+            stores.close()
+
+    def test_router(self):
+        """The router runs function binaries, routes their nested calls back through itself and times every hop."""
+        with tempfile.TemporaryDirectory() as d:
+            write_function(d, "compose-post", callee="text-service")
+            write_function(d, "text-service")
+            write_function(d, "broken", status=1)
+            self.assertEqual(sorted(find_functions(d)), ["broken", "compose-post", "text-service"])
+
+            router = RouterProcess("--functions", d, "--pool", "2")
+            try:
+                reply = urllib.request.urlopen(urllib.request.Request(router.url + "compose-post", b'{"text": "hi"}\n'))
+                self.assertEqual(json.loads(reply.read()), {"msg": "text-service(compose-post(hi))", "err": ""})
+                for name, status in (("broken", 500), ("missing", 404)):
+                    with self.assertRaises(urllib.error.HTTPError) as cm:
+                        urllib.request.urlopen(urllib.request.Request(router.url + name, b"{}"))
+                    self.assertEqual(cm.exception.code, status)
+
+                stats = {(row["caller"], row["callee"]): row for row in router.stats()}
+                self.assertEqual(sorted(stats), [("client", "broken"), ("client", "compose-post"),
+                                                 ("compose-post", "text-service")])
+                self.assertEqual(stats["client", "broken"]["errors"], 1)
+                outer, inner = stats["client", "compose-post"], stats["compose-post", "text-service"]
+                self.assertGreater(outer["latency"]["p50"], inner["latency"]["p50"])
+
+                # The Python load generator drives the emulated functions end to end.
+                urllib.request.urlopen(urllib.request.Request(router.url + "_reset", b""))
+                last = LoadGenerator(router.url, "text-service", startup=0.5).measure(10, 2, 1.0)
+                self.assertAlmostEqual(last.requests, 10, delta=2)
+                self.assertEqual(last.errors, 0)
+                self.assertEqual([(row["callee"], row["count"]) for row in router.stats()],
+                                 [("text-service", last.requests)])
+            finally:
+                output = router.close()
+            self.assertIn("text-service", output.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
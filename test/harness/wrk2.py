@@ -0,0 +1,253 @@
+import collections
+import os
+import re
+import subprocess
+
+from .histogram import Histogram
+
+# wrk2 binary built by `test/wrk2_fission/Makefile`.
+DEFAULT_WRK = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "wrk2_fission", "wrk")
+# wrk2 spends the first 10 seconds of a run calibrating (CALIBRATE_DELAY_MS) and does not record them.
+CALIBRATION = 10.0
+
+_DURATION_UNITS = {"us": 1e-6, "ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0}
+_SIZE_UNITS = {"B": 1, "KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30, "TB": 1 << 40}
+
+Wrk2Result = collections.namedtuple(
+    "Wrk2Result", "corrected uncorrected requests duration throughput errors non_2xx bytes threads connections")
+Wrk2Result.__doc__ = """
+The result of one wrk2 run.
+
+corrected / uncorrected (Histogram): Latencies in microseconds, from the percentile spectra
+    printed with `-L` and `-U` (None if the run was not started with the flag).
+requests (int): Completed requests.
+duration (float): Length of the run in seconds, calibration included.
+throughput (float): `Requests/sec`.
+errors (dict): Socket errors (`connect`, `read`, `write`, `timeout`).
+non_2xx (int): Non-2xx or 3xx responses.
+bytes (int): Bytes read.
+threads / connections (int): wrk2's `-t` and `-c` (0 if the header is missing).
+"""
+
+Snapshot = collections.namedtuple("Snapshot", "elapsed histogram uncorrected requests throughput errors")
+Snapshot.__doc__ = """
+The cumulative measurement of a load level so far (see `Wrk2Runner.run`).
+
+elapsed (float): Seconds of load generated, calibration included.
+histogram (Histogram): Corrected latencies in microseconds recorded so far.
+uncorrected (Histogram): Uncorrected latencies, if recorded.
+requests (int): Requests completed so far.
+throughput (float): Requests per second over the recorded time.
+errors (int): Socket errors and non-2xx/3xx responses so far.
+"""
+
+
+def parse_duration(text):
+    """Parses a wrk2 duration such as `30.01s`, `8.00m` or `512.00us` into seconds."""
+    match = re.fullmatch(r"([\d.]+)(us|ms|s|m|h)", text.strip())
+    if match is None:
+        raise ValueError(f"Invalid wrk2 duration: {text!r}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def parse_size(text):
+    """Parses a wrk2 byte count such as `19.81MB` into bytes."""
+    match = re.fullmatch(r"([\d.]+)([KMGT]?B)", text.strip())
+    if match is None:
+        raise ValueError(f"Invalid wrk2 size: {text!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def parse_output(lines):
+    """
+    Parses the output of a wrk2 run.
+
+    The latency histograms are rebuilt from the "Detailed Percentile spectrum" sections
+    that `-L` (corrected) and `-U` (uncorrected) print: every row is a distinct value in
+    milliseconds with the cumulative count of samples up to it, so the counts between rows
+    are recorded at the row value. Without the flags the histograms are None.
+
+    Args:
+        lines (iterable): Lines of wrk2's standard output (a file object works).
+
+    Returns:
+        Wrk2Result: The parsed run.
+    """
+    spectra = {}
+    section, rows = None, None
+    requests, duration, throughput, read = 0, 0.0, 0.0, 0
+    errors, non_2xx = {}, 0
+    threads, connections = 0, 0
+    for line in lines:
+        stripped = line.strip()
+        if rows is None and stripped.endswith(" connections") and " threads and " in stripped:
+            match = re.match(r"(\d+) threads and (\d+) connections", stripped)
+            if match:
+                threads, connections = int(match.group(1)), int(match.group(2))
+        elif stripped.startswith("Latency Distribution (HdrHistogram"):
+            section = "uncorrected" if "Uncorrected" in stripped else "corrected"
+            rows = None
+        elif stripped.startswith("Detailed Percentile spectrum"):
+            rows = spectra.setdefault(section, [])
+        elif rows is not None:
+            fields = stripped.split()
+            if stripped.startswith("#[") or stripped.startswith("-"):
+                if stripped.startswith("-"):
+                    rows = None
+            elif len(fields) == 4 and fields[0] != "Value":
+                rows.append((float(fields[0]), int(fields[2])))
+        elif " requests in " in stripped:
+            match = re.match(r"(\d+) requests in ([\d.]+\w+), ([\d.]+\w+) read", stripped)
+            if match:
+                requests, duration, read = int(match.group(1)), parse_duration(match.group(2)), parse_size(match.group(3))
+        elif stripped.startswith("Socket errors:"):
+            errors = {key: int(value) for key, value in re.findall(r"(\w+) (\d+)", stripped[len("Socket errors:"):])}
+        elif stripped.startswith("Non-2xx or 3xx responses:"):
+            non_2xx = int(stripped.split(":")[1])
+        elif stripped.startswith("Requests/sec:"):
+            throughput = float(stripped.split(":")[1])
+
+    histograms = {}
+    for name, spectrum in spectra.items():
+        values = [round(ms * 1000) for ms, _ in spectrum]
+        histograms[name] = Histogram.from_spectrum(values, [count for _, count in spectrum])
+    return Wrk2Result(histograms.get("corrected"), histograms.get("uncorrected"), requests, duration,
+                      throughput, errors, non_2xx, read, threads, connections)
+
+
+def _format_latency(us):
+    """`format_time_us` of wrk."""
+    for unit, scale in (("us", 1), ("ms", 1e3)):
+        if us < scale * 1000:
+            return f"{us / scale:.2f}{unit}"
+    return f"{us / 1e6:.2f}s"
+
+
+def _format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.2f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.2f}m"
+    return f"{seconds / 3600:.2f}h"
+
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.2f}{unit}"
+        size /= 1024
+
+
+def format_output(url, threads, connections, duration, requests, corrected, uncorrected=None, errors=None,
+                  non_2xx=0, bytes_read=0):
+    """
+    Formats a run the way wrk2 prints it with `-L -U`, so `parse_output` (and the results
+    tables) read it like a wrk2 log. Every non-empty bucket is a row of the percentile
+    spectrum, so the histograms read back are the same.
+
+    Returns:
+        str: The report.
+    """
+    lines = [f"Running {_format_duration(duration)} test @ {url}", f"  {threads} threads and {connections} connections"]
+    for title, h in (("Recorded Latency", corrected),
+                     ("Uncorrected Latency (measured without taking delayed starts into account)", uncorrected)):
+        if h is None:
+            continue
+        lines.append(f"  Latency Distribution (HdrHistogram - {title})")
+        for p in (50, 75, 90, 99, 99.9, 99.99, 99.999, 100):
+            lines.append(f" {p:7.3f}% {_format_latency(h.value_at_percentile(p)):>9}")
+        lines += ["", "  Detailed Percentile spectrum:", "       Value   Percentile   TotalCount 1/(1-Percentile)", ""]
+        values, counts = h.buckets()
+        cumulative = counts.cumsum()
+        for value, total in zip(values, cumulative):
+            q = total / cumulative[-1]
+            inverse = f"{1 / (1 - q):14.2f}" if q < 1 else f"{'inf':>14}"
+            lines.append(f"{value / 1000:12.3f} {q:12.6f} {total:10d} {inverse}")
+        lines += [f"#[Mean    = {h.mean() / 1000:12.3f}, StdDeviation   = {h.stddev() / 1000:12.3f}]",
+                  f"#[Max     = {(h.max or 0) / 1000:12.3f}, Total count    = {h.total:12d}]",
+                  f"#[Buckets = {h.bucket_count:12d}, SubBuckets     = {h.sub_bucket_count:12d}]",
+                  "-" * 58]
+    lines.append(f"  {requests} requests in {_format_duration(duration)}, {_format_size(bytes_read)} read")
+    kinds = ("connect", "read", "write", "timeout")
+    if errors and any(errors.get(kind, 0) for kind in kinds):
+        lines.append("  Socket errors: " + ", ".join(f"{kind} {errors.get(kind, 0)}" for kind in kinds))
+    if non_2xx:
+        lines.append(f"  Non-2xx or 3xx responses: {non_2xx}")
+    lines.append(f"Requests/sec: {requests / duration if duration else 0.0:10.2f}")
+    lines.append(f"Transfer/sec: {_format_size(bytes_read / duration if duration else 0.0):>10}")
+    return "\n".join(lines) + "\n"
+
+
+class Wrk2Runner:
+    """
+    Generates load with wrk2 and reports interim measurements.
+
+    wrk2 only prints its histograms when a run ends, so a load level is run as a series of
+    `segment`-second wrk2 runs at the same rate and connection count. Each segment's
+    histogram is added to the level's, and `run` yields the cumulative measurement after
+    every segment. Because wrk2 skips its 10 s calibration period, a segment contributes
+    `segment - 10` seconds of samples.
+    """
+
+    def __init__(self, url, script, wrk=DEFAULT_WRK, threads=1, segment=60, timeout=None, extra_args=()):
+        """
+        Args:
+            url (str): The router URL, e.g. `http://10.0.0.1:31314`.
+            script (str): The wrk2 Lua script of the workflow (`lua_files/<func>.lua`).
+            wrk (str): Path of the wrk2 binary.
+            threads (int): wrk2 threads (`-t`). The figure scripts use 1.
+            segment (int): Length in seconds of each wrk2 run.
+            timeout (int, optional): wrk2 socket timeout in seconds (`--timeout`).
+            extra_args (tuple): More wrk2 arguments.
+        """
+        if segment <= CALIBRATION:
+            raise ValueError(f"A segment must be longer than wrk2's {CALIBRATION:.0f} s calibration, got {segment}.")
+        self.url = url
+        self.script = script
+        self.wrk = wrk
+        self.threads = threads
+        self.segment = segment
+        self.timeout = timeout
+        self.extra_args = tuple(extra_args)
+
+    def command(self, rate, connections, duration):
+        cmd = [self.wrk, "-t", str(self.threads), "-c", str(max(connections, self.threads)),
+               "-d", f"{int(duration)}s", "-L", "-U", "-s", self.script]
+        if self.timeout is not None:
+            cmd += ["--timeout", f"{self.timeout}s"]
+        return cmd + list(self.extra_args) + [self.url, "-R", str(int(rate))]
+
+    def run_once(self, rate, connections, duration):
+        """Runs wrk2 once and returns its parsed output (a `Wrk2Result`)."""
+        proc = subprocess.run(self.command(rate, connections, duration), stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"wrk2 exited with {proc.returncode}: {' '.join(self.command(rate, connections, duration))}")
+        return parse_output(proc.stdout.splitlines())
+
+    def run(self, rate, connections, max_duration):
+        """
+        Generates load at one level, yielding a `Snapshot` after every segment.
+
+        The caller stops the level early by not asking for the next snapshot.
+
+        Args:
+            rate (float): Offered load in requests per second (`-R`).
+            connections (int): Open connections (`-c`).
+            max_duration (float): Upper bound on the length of the level in seconds.
+        """
+        histogram, uncorrected = Histogram(), Histogram()
+        elapsed, recorded, requests, errors = 0.0, 0.0, 0, 0
+        while elapsed < max_duration:
+            duration = max(min(self.segment, max_duration - elapsed), CALIBRATION + 1)
+            result = self.run_once(rate, connections, duration)
+            if result.corrected is not None:
+                histogram.add(result.corrected)
+            if result.uncorrected is not None:
+                uncorrected.add(result.uncorrected)
+            elapsed += result.duration or duration
+            recorded += max((result.duration or duration) - CALIBRATION, 0.0)
+            requests += result.requests
+            errors += sum(result.errors.values()) + result.non_2xx
+            yield Snapshot(elapsed, histogram, uncorrected, requests,
+                           histogram.total / recorded if recorded else 0.0, errors)